@@ -38,8 +38,11 @@ import tkColorChooser
 from tkFileDialog import *
 from objects.field import Field
 from objects.grideditor import GridEditorWidget
+import objects.vibfreq
+import objects.wavefunction
 from interfaces.dl_poly import Dl_PolyHISTORYReader
 from viewer.debug import deb
+from viewer.defaults import defaults
 
 VDW_RADII = 10
 COV_RADII = 11
@@ -738,7 +741,25 @@ class Visualiser:
         if self.show_2d:
             self.graph.window2d.show()
         self.graph.update()
-        
+
+    def Update(self,coords_only=0):
+        """Redraw the images after the object has been edited.
+        Visualisers that can move their existing images when only the
+        atomic positions have changed provide _update_coords (see
+        VtkMoleculeVisualiser), which returns 0 if the images have to
+        be rebuilt. Callers that know that the atoms and bonds are
+        unchanged (eg animations) set coords_only to save the check.
+        """
+        if self.status == BUILT and hasattr(self,'_update_coords'):
+            if self.dialog:
+                self.read_widgets()
+            if self._update_coords(coords_only=coords_only):
+                self._show()
+                self.is_showing=1
+                self.graph.update()
+                return
+        self.Build()
+
     def Show(self,object=None,update=1):
         if self.status == NULL:
             self._build(object=object)
@@ -1173,18 +1194,25 @@ class VibrationVisualiser(MoleculeVisualiser):
             else:
                 mol = obj.reference
 
-        # take 2 copies of reference mol
+        # take a copy of reference mol to displace, keeping the
+        # reference coordinates
         mol = copy.deepcopy(mol)
         self.molecule = mol
-        self.mol2 = copy.deepcopy(mol)
+        self.reference = [ [a.coord[0],a.coord[1],a.coord[2]]
+                           for a in mol.atom[:mol.get_nondum()] ]
         try:
             scale=graph.conn_scale
             toler=graph.conn_toler
             mol.connect(scale=scale, toler=toler)
-            self.mol2.connect(scale=scale, toler=toler)
         except AttributeError:
             mol.connect()
-            self.mol2.connect()
+
+        # The displaced coordinates of each frame, computed once for
+        # each mode, amplitude and number of frames
+        if objects.vibfreq.isAvailable():
+            self.frame_cache = objects.vibfreq.VibFrameCache(self.reference)
+        else:
+            self.frame_cache = None
 
         # derived classes will run their moleculevisualiser methods
         # after this 
@@ -1301,7 +1329,7 @@ class VibrationVisualiser(MoleculeVisualiser):
 
     def start_ani(self):
         self.animate=1
-        self.angle = 0.0
+        self.frame = 0
         self.nextframe()
 
     def stop_ani(self):
@@ -1317,24 +1345,25 @@ class VibrationVisualiser(MoleculeVisualiser):
         if self.choose_mode:
             self.vib = self.vs.vibs[self.mode]
 
-        self.angle_increment = 2.0*math.pi / self.frames
-        self.angle = self.angle +  self.angle_increment
-        fac = self.scale * math.sin(self.angle)
-        #print 'Displacement angle,scale = ',self.angle,fac
-        for i in range(self.molecule.get_nondum()):
-            a = self.molecule.atom[i]
-            r = self.mol2.atom[i]
-            d = self.vib.displacement[i]
-            a.coord[0] = r.coord[0] + fac*d[0]
-            a.coord[1] = r.coord[1] + fac*d[1]
-            a.coord[2] = r.coord[2] + fac*d[2]
-
-        # remake images
-        self._delete()
-        self._build()
-        self._show()
-        # update image
-        self.graph.update()
+        self.frame = self.frame % self.frames + 1
+        if self.frame_cache:
+            coords = self.frame_cache.get(self.vib,self.frames,self.scale)[self.frame-1].tolist()
+        else:
+            fac = self.scale * math.sin(2.0*math.pi*self.frame/self.frames)
+            coords = []
+            for r,d in zip(self.reference,self.vib.displacement):
+                coords.append([ r[0] + fac*d[0], r[1] + fac*d[1], r[2] + fac*d[2] ])
+
+        atom = self.molecule.atom
+        for i in range(len(coords)):
+            c = atom[i].coord
+            x,y,z = coords[i]
+            c[0] = x
+            c[1] = y
+            c[2] = z
+
+        # move the images (the bonds stay the same)
+        self.Update(coords_only=1)
         # schedule next frame
         self.dialog.after(self.frame_delay, self.nextframe)
 
@@ -1386,12 +1415,17 @@ class TrajectoryVisualiser(MoleculeVisualiser):
             self.reader = Dl_PolyHISTORYReader()
             self.reader.open(obj.filename)
             self.reader.scan1()
-            #####self.reader.close()
             self.molecule = self.reader.lastframe
             self.molecule.connect()
-            self.nframes = 9999
+            self.nframes = self.reader.nframes
+            # Read the following frames while the current one is drawn
+            self.reader.start_prefetch()
 
         self.current_frame = 0
+        # Number of frames to move on by when stepping or playing
+        self.stride = 1
+        # Delay (ms) between frames when playing
+        self.frame_delay = 10
 
         #copy.deepcopy(obj.frames[0])
         #VtkMoleculeVisualiser is run next from vtkgraph
@@ -1438,16 +1472,56 @@ class TrajectoryVisualiser(MoleculeVisualiser):
         self.frame_label.configure(text="Frame %d of %d" % (self.current_frame+1,self.nframes))
         self.frame_label.pack(side='left')
 
+        self.w_stride = Pmw.Counter(
+            bar2,
+            labelpos = 'w',
+            label_text = 'Stride',
+            entryfield_value = self.stride,
+            entryfield_entry_width = 4,
+            datatype = {'counter' : 'integer' },
+            entryfield_validate = { 'validator' : 'integer', 'min' : 1 })
+        self.w_stride.pack(side='left',padx=5)
+
         self.ani_frame.pack(side='top',fill='x')
 
+    def read_widgets(self):
+
+        MoleculeVisualiser.read_widgets(self)
+
+        # keep the current value if the field holds rubbish
+        if hasattr(self,"w_stride"):
+            try:
+                self.stride = max(1,int(self.w_stride.get()))
+            except ValueError:
+                pass
+
+    def Show(self,object=None,update=1):
+        MoleculeVisualiser.Show(self,object=object,update=update)
+        if self.traj_type == DLPOLY_HISTORY and self.reader:
+            self.reader.start_prefetch()
+
+    def Hide(self):
+        # No point reading ahead while nothing is being shown
+        self.ani_stop = 1
+        if self.traj_type == DLPOLY_HISTORY and self.reader:
+            self.reader.stop_prefetch()
+        MoleculeVisualiser.Hide(self)
+
+    def Delete(self):
+        self.ani_stop = 1
+        MoleculeVisualiser.Delete(self)
+        self.close_reader()
+
+    def close_reader(self):
+        """Stop the prefetch thread and close the HISTORY file"""
+        if self.traj_type == DLPOLY_HISTORY and self.reader:
+            self.reader.close()
+            self.reader = None
+
     def rew(self):
         """ Go to the first frame of the trajectory and display the image
         """
         self.current_frame = 0
-        if self.traj_type == DLPOLY_HISTORY:
-            self.reader.close()
-            self.reader.open(self.traj_file.filename)
-
         self.show_frame()
         
     def end(self):
@@ -1459,15 +1533,15 @@ class TrajectoryVisualiser(MoleculeVisualiser):
     def bak(self):
         """ Step back a single frame in the animation
         """
-        self.current_frame -= 1
-        if self.current_frame == -1:
+        self.current_frame -= self.stride
+        if self.current_frame < 0:
             self.current_frame = 0
         self.show_frame()
 
     def fwd(self):
         """ Step forward a single frame in the animation
         """
-        self.current_frame += 1
+        self.current_frame += self.stride
         if self.current_frame >= self.nframes:
             print 'END OF SEQUENCE'
             self.current_frame = self.nframes - 1
@@ -1489,25 +1563,19 @@ class TrajectoryVisualiser(MoleculeVisualiser):
             self.current_frame = 0
 
         self.ani_stop = 0
-        self.ani_stop = 0
-
-        while 1:
-            print 'Trajectory Frame:',self.current_frame
-            #self.interior().update()
-            if self.ani_stop:
-                return
-            self.show_frame()
+        self.nextframe()
 
-            self.current_frame += 1
-            if self.ani_stop:
-                return
-            time.sleep(0.3)
-            if self.ani_stop:
-                return
+    def nextframe(self):
+        """Show the current frame and schedule the next one"""
+        if self.ani_stop:
+            return
+        # the end?
+        if self.current_frame >= self.nframes:
+            return
 
-            # the end?
-            if self.current_frame == self.nframes:
-                return
+        self.show_frame()
+        self.current_frame += self.stride
+        self.dialog.after(self.frame_delay, self.nextframe)
 
     def show_frame(self):
         """Update the working molecule with a set of coordinates and display
@@ -1518,18 +1586,22 @@ class TrajectoryVisualiser(MoleculeVisualiser):
         if self.traj_type == STRUCTURE_SEQ:
 
             print 'SHOWING FRAME #',self.current_frame
-            frame = self.sequence.frames[self.current_frame]
+            # Update the coordinates in place, without making a molecule
+            # for the frame if the sequence has compact storage
+            coords = self.sequence.frame_coordinates(self.current_frame)
             for i in range(len(self.molecule.atom)):
                 a = self.molecule.atom[i]
-                atom = frame.atom[i]
-                a.coord[0] = atom.coord[0]
-                a.coord[1] = atom.coord[1]
-                a.coord[2] = atom.coord[2]
+                c = coords[i]
+                a.coord[0] = float(c[0])
+                a.coord[1] = float(c[1])
+                a.coord[2] = float(c[2])
 
         elif self.traj_type == DLPOLY_HISTORY:
             
             print 'SHOWING FRAME #',self.current_frame
 
+            self.reader.seek_frame(self.current_frame)
+            self.reader.stride = self.stride
             iret = self.reader.scan1()
 
             if iret == -1:
@@ -1550,17 +1622,10 @@ class TrajectoryVisualiser(MoleculeVisualiser):
             print "MMTK trajectory"
 
         #self.molecule.list()
-        # remake images
-        self._delete()
-        self._build()
-        self._show()
+        # move the images (the atoms and bonds are those of the first frame)
+        self.Update(coords_only=1)
         self.frame_label.configure(text="Frame %d of %d" % (self.current_frame+1,self.nframes))
-        self.dialog.update()
-        # update image
-        self.graph.update()
-
-        # schedule next frame
-        #self.dialog.after(self.frame_delay, self.nextframe)
+        self.dialog.update_idletasks()
 
 class OutlineVisualiser:
     """To add outline to the volume widgets"""
@@ -3085,9 +3150,24 @@ class MoldenWfnVisualiser(OrbitalVisualiser,Visualiser):
         self.title = "MolDen Visualiser for " + obj.name
         #self.height = 0.05
 
-        # MOLDEN control object
-        from interfaces.molden import MoldenDriver
-        self.driver=MoldenDriver(obj.filename)
+        # Compute the grids here if the file holds the basis and
+        # orbitals, otherwise run MOLDEN
+        self.evaluator = None
+        self.driver = None
+        if objects.wavefunction.isAvailable():
+            from interfaces.filemolden import read_wavefunction
+            try:
+                wfn = read_wavefunction(obj.filename)
+            except Exception,e:
+                print 'Cannot read the wavefunction from',obj.filename,e
+                wfn = None
+            if wfn:
+                processes = defaults.get_value('wavefunction_processes') or 1
+                self.evaluator = objects.wavefunction.OrbitalEvaluator(wfn,processes=processes)
+        if not self.evaluator:
+            # MOLDEN control object
+            from interfaces.molden import MoldenDriver
+            self.driver=MoldenDriver(obj.filename)
 
         # default molden settings
         self.mo = 0
@@ -3107,6 +3187,8 @@ class MoldenWfnVisualiser(OrbitalVisualiser,Visualiser):
         value = self.mo
         mini = 0
         maxi = 100
+        if self.evaluator:
+            maxi = self.evaluator.wavefunction.nmo()
         # Will need a callback here to change the variable value
         if mini and maxi:
             v = {'validator' : 'integer' , 'min' : mini , 'max' : maxi}
@@ -3167,11 +3249,15 @@ class MoldenWfnVisualiser(OrbitalVisualiser,Visualiser):
         OrbitalVisualiser._make_dialog(self, **kw)
 
     def compute_grid(self):
-        """ Compute the data via a call to Molden """
+        """ Compute the data, via a call to Molden if we can't do it here """
         retcode=0
         if self.mo != self.last_mo or self.edge != self.last_edge or self.npts != self.last_npts:
-            self.driver.ComputePlot((1,2,3),mo=self.mo,npts=self.npts,edge=self.edge)
-            self.field = self.driver.field
+            if self.evaluator:
+                grid = self.evaluator.molecule_grid(self.npts,edge=self.edge)
+                self.field = self.evaluator.get_field(self.mo,grid)
+            else:
+                self.driver.ComputePlot((1,2,3),mo=self.mo,npts=self.npts,edge=self.edge)
+                self.field = self.driver.field
             retcode=1
         self.last_mo = self.mo
         self.last_edge = self.edge
@@ -3186,6 +3272,15 @@ class MoldenWfnVisualiser(OrbitalVisualiser,Visualiser):
         self.edge = float(self.w_edge.get())
         OrbitalVisualiser.read_widgets(self)
 
+    def Delete(self):
+        OrbitalVisualiser.Delete(self)
+        self.close_evaluator()
+
+    def close_evaluator(self):
+        """Stop any worker processes of the OrbitalEvaluator"""
+        if self.evaluator:
+            self.evaluator.close()
+
 if __name__ == "__main__":
 
     import sys
@@ -0,0 +1,566 @@
+#
+#    This file is part of the CCP1 Graphical User Interface (ccp1gui)
+#
+#   (C) 2002-2007 CCLRC Daresbury Laboratory
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+"""Run a series of calculations generated from one template calculation
+
+A BatchCalc holds a template Calc (e.g. a GAMESSUKCalc set up in its
+editor) and a list of points. Each point is either a set of values or a
+structure to substitute into a copy of the template:
+
+ batch = BatchCalc(calc,manager)
+ batch.add_grid(oh=[0.9,1.0,1.1],basis=['6-31G','cc-pVDZ'])
+ batch.add_structures(conformers)
+ batch.run()
+ batch.wait()
+ batch.collect()
+ batch.write_table(sys.stdout)
+
+A value whose name matches a z-matrix variable of the molecule changes
+that variable (for bond length and angle scans). Any other name is set
+as a parameter of the calculation.
+
+Inputs are written with the calculation's WriteInput method and jobs
+built with its makejob method, as for a single run from the editor.
+The jobs then go through the job manager, so local runs share the
+cores. When a job ends its tidy function (endjob) is run to read the
+results, and Calc.get_energy supplies the value for the table.
+
+After a point has finished, a small <name>.batch file holds a checksum
+of its input. If the input and the results are still there when the
+batch is run again, the point is not recalculated.
+
+Jobs also go through the result cache (jobmanager.resultcache), so a
+point whose input was run before, in any directory, is restored rather
+than run. Points in one batch with the same input are only run once;
+the others are filled from the cache when the first has finished.
+"""
+import os
+import sys
+import copy
+import string
+import hashlib
+import traceback
+import unittest
+
+import jobmanager
+import jobmanager.resultcache
+import interfaces.calc
+
+POINT_NEW     = 'New'
+POINT_RUNNING = 'Submitted'
+POINT_SKIPPED = 'Skipped'
+POINT_DONE    = 'Done'
+POINT_FAILED  = 'Failed'
+
+def has_energy_parser(calc):
+    """Return true if the calculation overrides Calc.get_energy
+
+    Points of other calculations are judged on the job status alone and
+    tabulated with no energy.
+    """
+    return calc.__class__.get_energy.im_func is not interfaces.calc.Calc.get_energy.im_func
+
+class BatchPoint:
+    """One calculation in a batch"""
+
+    def __init__(self,label,values,mol=None):
+        self.label = label
+        self.values = values
+        self.mol = mol
+        self.calc = None
+        self.job = None
+        self.checksum = None
+        self.status = POINT_NEW
+        self.energy = None
+        self.msg = ''
+        # cache key, and the point that runs the same input if not this one
+        self.key = None
+        self.duplicate_of = None
+
+class BatchCalc:
+    """Generate, run and tabulate calculations from a template"""
+
+    def __init__(self,calc,manager=None,skip_existing=1,cache=None,debug=None):
+        self.template = calc
+        if not manager:
+            manager = jobmanager.JobManager()
+        self.manager = manager
+        if not cache:
+            cache = jobmanager.resultcache.get_cache()
+        self.cache = cache
+        self.skip_existing = skip_existing
+        self.debug = debug
+        self.points = []
+        # The names of the values in the order they were first seen
+        self.keys = []
+
+    def add_point(self,label=None,mol=None,**values):
+        """Add a single calculation with the given values and/or structure"""
+        for key in values.keys():
+            if key not in self.keys:
+                self.keys.append(key)
+        if not label:
+            label = self.make_label(values,len(self.points))
+        point = BatchPoint(label,values,mol=mol)
+        self.points.append(point)
+        return point
+
+    def add_grid(self,**grid):
+        """Add a calculation for every combination of the given lists of values"""
+        keys = grid.keys()
+        keys.sort()
+        combinations = [{}]
+        for key in keys:
+            new = []
+            for values in combinations:
+                for value in grid[key]:
+                    d = values.copy()
+                    d[key] = value
+                    new.append(d)
+            combinations = new
+        return [self.add_point(**values) for values in combinations]
+
+    def add_structures(self,mols,labels=None):
+        """Add one calculation per structure"""
+        points = []
+        for i in range(len(mols)):
+            if labels:
+                label = labels[i]
+            else:
+                label = 's%d' % (len(self.points)+1)
+            points.append(self.add_point(label=label,mol=mols[i]))
+        return points
+
+    def make_label(self,values,index):
+        if not values:
+            return 'p%d' % (index+1)
+        keys = values.keys()
+        keys.sort()
+        label = string.join(['%s%s' % (key,values[key]) for key in keys],'_')
+        # Keep the label usable as part of a filename
+        safe = string.letters + string.digits + '.-_'
+        return string.join([c in safe and c or '-' for c in label],'')
+
+    def prepare(self,point):
+        """Copy the template for a point and write its input and job"""
+
+        # The job holds threads so can't be copied; each point gets its own
+        job = self.template.job
+        self.template.job = None
+        try:
+            calc = copy.deepcopy(self.template)
+        finally:
+            self.template.job = job
+        calc.results = []
+        calc.set_name('%s_%s' % (self.template.get_name(),point.label))
+
+        if point.mol:
+            mol = copy.deepcopy(point.mol)
+        else:
+            mol = calc.get_input("mol_obj")
+        moved = 0
+        for key,value in point.values.items():
+            var = None
+            if mol and hasattr(mol,'find_var'):
+                var = mol.find_var(key)
+            if var:
+                var.value = value
+                moved = 1
+            else:
+                calc.set_parameter(key,value)
+        if moved:
+            mol.calculate_coordinates()
+        if point.mol:
+            calc.set_input("mol_obj",mol)
+            calc.set_input("mol_name",mol.name)
+
+        calc.WriteInput()
+        job = calc.makejob(writeinput=0)
+        if not job:
+            raise interfaces.calc.CalcError("No job for point %s" % point.label)
+
+        point.calc = calc
+        point.job = job
+        inputf = calc.get_input("input_file")
+        if inputf:
+            point.checksum = hashlib.md5(string.join(inputf,'')).hexdigest()
+        return job
+
+    def stamp_file(self,point):
+        return point.calc.get_parameter("directory")+os.sep+point.calc.get_name()+'.batch'
+
+    def have_results(self,point):
+        """See if a point was finished by an earlier run with the same input"""
+        if not point.checksum:
+            return 0
+        try:
+            f = open(self.stamp_file(point),'r')
+            checksum = f.read().strip()
+            f.close()
+        except IOError:
+            return 0
+        if checksum != point.checksum:
+            return 0
+        if not has_energy_parser(point.calc):
+            return 1
+        return point.calc.get_energy() is not None
+
+    def run(self):
+        """Write the inputs and start all the jobs that need running"""
+        keys = {}
+        for point in self.points:
+            if point.key:
+                keys[point.key] = point
+        for point in self.points:
+            if point.status != POINT_NEW:
+                continue
+            try:
+                job = self.prepare(point)
+            except Exception,e:
+                traceback.print_exc()
+                point.status = POINT_FAILED
+                point.msg = str(e)
+                continue
+            if self.skip_existing and self.have_results(point):
+                if self.debug:
+                    print 'BatchCalc: results for %s already present' % point.label
+                point.status = POINT_SKIPPED
+                continue
+            point.status = POINT_RUNNING
+            if self.cache and point.calc.get_result_files():
+                point.key = jobmanager.resultcache.job_key(point.calc,job,self.cache)
+            if point.key and keys.has_key(point.key):
+                point.duplicate_of = keys[point.key]
+                continue
+            if point.key:
+                keys[point.key] = point
+                jobmanager.resultcache.cache_job(point.calc,job,self.cache,point.key)
+            self.manager.StartJob(job)
+
+    def get_jobs(self):
+        return [p.job for p in self.points
+                if p.status == POINT_RUNNING and not p.duplicate_of]
+
+    def wait(self,timeout=None):
+        """Wait for all the jobs to finish; returns 0 if the timeout expired"""
+        jobs = self.get_jobs()
+        if not self.manager.scheduler.wait(timeout=timeout,jobs=jobs):
+            return 0
+        # Jobs not run through the scheduler have their own threads
+        for job in jobs:
+            if job.thread:
+                job.thread.join(timeout)
+                if job.thread.isAlive():
+                    return 0
+        return 1
+
+    def collect(self):
+        """Read the results of the finished points
+
+        The job's tidy function is run here unless the job editor has
+        already done so. Returns the number of points still running.
+        """
+        running = 0
+        for point in self.points:
+            if point.status == POINT_SKIPPED and point.energy is None:
+                point.energy = point.calc.get_energy()
+                continue
+            if point.status != POINT_RUNNING or point.duplicate_of:
+                continue
+            job = point.job
+            if job.status == jobmanager.job.JOBSTATUS_DONE:
+                code = 0
+            elif job.status in [jobmanager.job.JOBSTATUS_FAILED,jobmanager.job.JOBSTATUS_KILLED]:
+                code = 1
+            else:
+                running = running + 1
+                continue
+            point.msg = job.msg
+            self.finish(point,code)
+
+        # Now the points that ran have stored their results in the cache
+        for point in self.points:
+            if point.status != POINT_RUNNING or not point.duplicate_of:
+                continue
+            first = point.duplicate_of
+            if first.status == POINT_RUNNING:
+                running = running + 1
+                continue
+            entry = None
+            if first.status == POINT_DONE:
+                entry = self.cache.lookup(point.key)
+            if not entry:
+                point.status = POINT_FAILED
+                point.msg = 'No results from %s' % first.label
+                continue
+            entry.restore(point.calc.get_parameter("directory"),point.calc.get_name())
+            self.finish(point,0)
+        return running
+
+    def finish(self,point,code):
+        """Run the tidy function of a point's job and read the energy"""
+        job = point.job
+        if job.tidy:
+            try:
+                job.tidy(code)
+            except Exception,e:
+                traceback.print_exc()
+                code = 1
+                point.msg = str(e)
+            job.tidy = None
+        point.energy = point.calc.get_energy()
+        if code or (point.energy is None and has_energy_parser(point.calc)):
+            point.status = POINT_FAILED
+            return
+        point.status = POINT_DONE
+        if point.checksum:
+            f = open(self.stamp_file(point),'w')
+            f.write(point.checksum+'\n')
+            f.close()
+
+    def table(self):
+        """Return a list of rows: label, values, energy and status"""
+        rows = []
+        for point in self.points:
+            row = [point.label]
+            for key in self.keys:
+                row.append(point.values.get(key))
+            row.append(point.energy)
+            row.append(point.status)
+            rows.append(row)
+        return rows
+
+    def write_table(self,file):
+        """Write the table as text to an open file"""
+        file.write('%-20s' % 'Point')
+        for key in self.keys:
+            file.write(' %12s' % key)
+        file.write(' %18s %s\n' % ('Energy','Status'))
+        for row in self.table():
+            file.write('%-20s' % row[0])
+            for value in row[1:-2]:
+                file.write(' %12s' % value)
+            if row[-2] is None:
+                file.write(' %18s' % '-')
+            else:
+                file.write(' %18.8f' % row[-2])
+            file.write(' %s\n' % row[-1])
+
+    def energy_curve(self,key=None):
+        """Return (value,energy) pairs sorted on the value of key
+
+        Without a key the points are numbered in order. Points with no
+        energy are left out.
+        """
+        if not key and len(self.keys) == 1:
+            key = self.keys[0]
+        curve = []
+        for i in range(len(self.points)):
+            point = self.points[i]
+            if point.energy is None:
+                continue
+            if key:
+                curve.append((point.values.get(key),point.energy))
+            else:
+                curve.append((i+1,point.energy))
+        curve.sort()
+        return curve
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+import objects.zmatrix
+
+class EchoCalc(interfaces.calc.Calc):
+    """A calculation whose 'program' writes (x-1)^2 as the energy"""
+
+    def __init__(self,**kw):
+        interfaces.calc.Calc.__init__(self,**kw)
+        self.set_program('Echo')
+        self.set_parameter('x',0.0)
+        self.runs = 0
+
+    def infile(self):
+        return self.get_parameter("directory")+os.sep+self.get_name()+'.in'
+
+    def outfile(self):
+        return self.get_parameter("directory")+os.sep+self.get_name()+'.out'
+
+    def WriteInput(self,filename=None):
+        inputf = ['x = %s\n' % self.get_parameter('x')]
+        mol = self.get_input("mol_obj")
+        if mol:
+            inputf.append('natoms = %d\n' % len(mol.atom))
+        self.set_input("input_file",inputf)
+        f = open(self.infile(),'w')
+        f.writelines(inputf)
+        f.close()
+
+    def makejob(self,writeinput=1,graph=None):
+        job = self.create_job()
+        job.name = self.get_name()
+        script = "import sys; x = float(sys.stdin.readline().split()[2]); " + \
+                 "print 'energy = %f' % ((x-1)**2)"
+        job.add_step(jobmanager.job.RUN_APP,'run echo',
+                     local_command=sys.executable,local_command_args=['-c',script],
+                     stdin_file=self.infile(),stdout_file=self.outfile())
+        job.add_tidy(self.endjob)
+        return job
+
+    def endjob(self,code):
+        self.runs = self.runs + 1
+
+    def get_energy(self):
+        if not os.access(self.outfile(),os.R_OK):
+            return None
+        return float(open(self.outfile()).readline().split()[2])
+
+    def get_result_files(self):
+        return [self.outfile()]
+
+class PlainCalc(EchoCalc):
+    """An EchoCalc without an energy parser"""
+    get_energy = interfaces.calc.Calc.get_energy.im_func
+
+class BatchCalcTestCases(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+        self.calc = EchoCalc(name='echo')
+        self.calc.set_parameter('directory',self.directory)
+        self.manager = jobmanager.JobManager(ncores=2)
+        self.cache = jobmanager.resultcache.ResultCache(os.path.join(self.directory,'cache'))
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def testGrid(self):
+        batch = BatchCalc(self.calc,self.manager,cache=self.cache)
+        batch.add_grid(x=[2.0,0.0,1.0])
+        batch.run()
+        self.assert_(batch.wait(30))
+        self.assertEqual(batch.collect(),0)
+        self.assertEqual(batch.energy_curve(),[(0.0,1.0),(1.0,0.0),(2.0,1.0)])
+        self.assertEqual(batch.table()[0],['x2.0',2.0,1.0,POINT_DONE])
+        for point in batch.points:
+            self.assertEqual(point.calc.runs,1)
+            self.assertEqual(point.calc.get_name(),'echo_'+point.label)
+
+    def testSkip(self):
+        batch = BatchCalc(self.calc,self.manager,cache=self.cache)
+        batch.add_grid(x=[0.0,1.0])
+        batch.run()
+        batch.wait(30)
+        batch.collect()
+
+        # Same inputs, so nothing to run
+        batch = BatchCalc(self.calc,self.manager,cache=self.cache)
+        batch.add_grid(x=[0.0,1.0])
+        batch.add_point(x=3.0)
+        batch.run()
+        self.assertEqual([p.status for p in batch.points],
+                         [POINT_SKIPPED,POINT_SKIPPED,POINT_RUNNING])
+        batch.wait(30)
+        batch.collect()
+        self.assertEqual(batch.energy_curve(),[(0.0,1.0),(1.0,0.0),(3.0,4.0)])
+        self.assertEqual(batch.points[0].calc.runs,0)
+
+        # A changed input is run again
+        batch = BatchCalc(self.calc,self.manager,cache=self.cache)
+        mol = objects.zmatrix.Zmatrix()
+        mol.name = 'empty'
+        batch.add_point(label='x0.0',mol=mol)
+        batch.run()
+        self.assertEqual(batch.points[0].status,POINT_RUNNING)
+        batch.wait(30)
+        batch.collect()
+        self.assertEqual(batch.points[0].status,POINT_DONE)
+
+    def testCache(self):
+        batch = BatchCalc(self.calc,self.manager,cache=self.cache)
+        batch.add_point(x=2.0)
+        batch.add_point(label='again',x=2.0)
+        batch.run()
+        self.assertEqual(batch.points[1].duplicate_of,batch.points[0])
+        self.assertEqual(batch.get_jobs(),[batch.points[0].job])
+        self.assert_(batch.wait(30))
+        self.assertEqual(batch.collect(),0)
+        self.assertEqual([p.energy for p in batch.points],[1.0,1.0])
+        self.assertEqual([p.status for p in batch.points],[POINT_DONE,POINT_DONE])
+
+        # Another template name in another batch is still a hit
+        self.calc.set_name('copy')
+        batch = BatchCalc(self.calc,self.manager,cache=self.cache)
+        batch.add_point(x=2.0)
+        batch.run()
+        self.assertEqual(batch.points[0].job.steps[0].type,jobmanager.job.PYTHON_CMD)
+        batch.wait(30)
+        batch.collect()
+        self.assertEqual(batch.points[0].energy,1.0)
+        self.assertEqual(self.cache.statistics()['hits'],2)
+
+    def testNoEnergyParser(self):
+        calc = PlainCalc(name='plain')
+        calc.set_parameter('directory',self.directory)
+        batch = BatchCalc(calc,self.manager,cache=self.cache)
+        batch.add_grid(x=[0.0,1.0])
+        batch.run()
+        batch.wait(30)
+        batch.collect()
+        self.assertEqual([(p.status,p.energy) for p in batch.points],
+                         [(POINT_DONE,None),(POINT_DONE,None)])
+
+        batch = BatchCalc(calc,self.manager,cache=self.cache)
+        batch.add_grid(x=[0.0,1.0])
+        batch.run()
+        self.assertEqual([p.status for p in batch.points],[POINT_SKIPPED,POINT_SKIPPED])
+
+    def testStructures(self):
+        mols = []
+        for n in 1,2:
+            mol = objects.zmatrix.Zmatrix()
+            mol.name = 'h%d' % n
+            for i in range(n):
+                atom = objects.zmatrix.ZAtom()
+                atom.symbol = atom.name = 'H'
+                atom.coord = [0.0,0.0,0.74*i]
+                mol.atom.append(atom)
+            mols.append(mol)
+        batch = BatchCalc(self.calc,self.manager,cache=self.cache)
+        batch.add_structures(mols)
+        batch.run()
+        batch.wait(30)
+        self.assertEqual(batch.collect(),0)
+        self.assertEqual(batch.energy_curve(),[(1,1.0),(2,1.0)])
+        self.assertEqual(batch.points[1].calc.get_input("input_file")[1],'natoms = 2\n')
+
+def testMe():
+    """Return a unittest test suite with all the testcases that should be run by the main
+    gui testing framework."""
+    return unittest.TestLoader().loadTestsFromTestCase(BatchCalcTestCases)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -147,6 +147,22 @@ of any program using or generating them. The parameters however will be
         output = file.readlines()
         self.set_output("log_file",output)
 
+    def get_energy(self):
+        """Return the final energy from the output of the last run,
+        or None if it can't be found (overload for each program)"""
+        return None
+
+    def get_result_files(self):
+        """Return the paths of the output files that endjob reads, which
+        are kept in the result cache (overload for each program)"""
+        return []
+
+    def get_version_files(self):
+        """Return the paths of files, other than the command the job
+        runs, whose size and date identify the version of the program
+        for the result cache (eg the binary that a run script starts)"""
+        return []
+
     def new(self,program="untitled",name="untitled",title="untitled"):
         """Reset the object to the empty state."""
         self.program   = program
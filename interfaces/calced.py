@@ -47,6 +47,7 @@ import objects.grideditor
 
 import jobmanager
 import jobmanager.job
+import jobmanager.resultcache
 
 from viewer.initialisetk import initialiseTk
  
@@ -408,6 +409,9 @@ class CalcEd(Pmw.MegaToplevel):
             self.Error( "No job returned by the makejob routine!" )
             return
 
+        # An identical input run before is restored from the cache
+        jobmanager.resultcache.cache_job(self.calc,job)
+
         try:
             self.start_job( job )
         except Exception,e:
@@ -279,6 +279,24 @@ class ChemShellCalc(Calc):
         if code:
             raise JobError, "No molecular structure in Punchfile - check output"
 
+    def get_energy(self):
+        """Return the energy from the "Energy from <theory> = x Hartrees"
+        line that the input written by write_energy prints"""
+        fname = self.get_parameter("directory")+os.sep+self.get_name()+'.log'
+        if not os.access( fname, os.R_OK ):
+            return None
+        energy = None
+        fp = open(fname,'r')
+        for a in fp.readlines():
+            words = string.split(a)
+            if words[:2] == ['Energy','from'] and words[-1] == 'Hartrees':
+                try:
+                    energy = float(words[-2])
+                except ValueError:
+                    pass
+        fp.close()
+        return energy
+
     def set_qm_code(self,code):
         #print code,  self.get_parameter("qmcode")
         oldcode = self.get_parameter("qmcode")
@@ -454,6 +454,20 @@ class DALTONCalc(qm.QMCalc):
             # Load the results up - will present a dialog
             code = self.store_results_to_gui()
 
+    def get_energy(self):
+        """Return the final total energy from the Dalton output"""
+        fname = self.get_parameter("directory") + os.sep + self.get_name() + ".out"
+        if not os.access( fname, os.R_OK ):
+            return None
+        d = DaltonIO(filepath=fname,debug=None)
+        try:
+            d.ReadFile()
+        except Exception,e:
+            print "Error reading energy from %s: %s" % (fname,e)
+            return None
+        # Never zero if the final energies were found
+        return d.finalTotalEnergy or None
+
 
     def __writemolfile(self,molecule):
         """ Build up the list of strings containing the molecule input file. This is
@@ -33,6 +33,7 @@ import unittest
 # Import internal modules
 from objects import zmatrix
 from fileio import FileIO
+from linedispatch import LineDispatcher, BUFSIZE
 
 # Define bohrs 2 anstrom - this really needs to be stored globally
 bohr_2_angs = 0.529177
@@ -104,19 +105,18 @@ class DaltonIO(FileIO):
         #self.manage['final_geom'] = ( re.compile('^  *Total charge of the molecule') , self._read_charge )
 
 
+        dispatcher = LineDispatcher(self.manage)
+
         # Check if we are reading a list or a file and open the file if we are using one
         if not self.list:
-            self.fd = open( self.filepath, 'r' )
+            self.fd = open( self.filepath, 'r', BUFSIZE )
         
         # Loop through the contents of the file a line at a time and parse the contents
         line = self.getline()
         while line:
             #print line
-            for k in self.manage.keys():
-                if self.manage[k][0].match(line):
-                    if self.debug: print 'Match found %s' % k
-                    self.manage[k][1](line)
-                    break
+            name = dispatcher.dispatch(line)
+            if self.debug and name: print 'Match found %s' % name
             line = self.getline()
             
         #end while
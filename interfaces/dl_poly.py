@@ -22,7 +22,14 @@ calculation editor classes
 """
 
 import os
+import re
 import string
+import mmap
+import array
+import cPickle
+import threading
+import time
+import unittest
 import tkFileDialog
 
 from mm        import *
@@ -31,6 +38,7 @@ from interfaces.tools   import *
 from objects.periodic import z_to_el
 from objects.file import File
 from interfaces.fileio import FileIO
+from objects.zmatrix import Zmatrix, ZAtom
 
 
 class Dl_PolyHISTORYFile(File):
@@ -242,8 +250,8 @@ class Dl_PolyHISTORYReader(FileIO):
         return [Dl_PolyHISTORYFile(self.filepath)]
 
 
-    def scan(self,file):
-        """ Parse HISTORY
+    def scan(self,file,stride=1):
+        """ Parse HISTORY, returning every stride'th frame
         """
 
         if self.debug:
@@ -252,10 +260,10 @@ class Dl_PolyHISTORYReader(FileIO):
         self.results = []
 
         self.open(file)
+        self.stride = stride
         
         while 1:
             iret = self.scan1()
-            print 'ret=',iret
             if iret == -1:
                 break
             else:
@@ -263,97 +271,346 @@ class Dl_PolyHISTORYReader(FileIO):
 
         self.close()
 
-        print 'returning', self.results
         return self.results
 
     def open(self,file):
-        """ open file pointer to HISTORY file
+        """ open file pointer to HISTORY file and index the frames
         """
-        self.fp = open(file)
+        self.fp = open(file,'rb')
+        self.index = HistoryIndex(file)
+        self.title = self.index.title
+        self.atom_count = self.index.natoms
+        self.nframes = len(self.index)
         self.frame_count = 0
+        self.stride = 1
+        self.prefetcher = None
+
+    def seek_frame(self,n):
+        """ Make frame n the next one that scan1 will read
+        """
+        if n < 0:
+            n = n + self.nframes
+        self.frame_count = n
 
     def scan1(self):
-        """ Parse opened HISTORY file for the next frame
+        """ Read the next frame of the opened HISTORY file into self.lastframe
+
+        Returns -1 if there are no more frames. The frame after this will be
+        self.stride frames further on.
         """
 
         if self.debug:
             print "> config reader scanning file for one configuration"
 
-        if self.frame_count == 0:
-            self.title = self.fp.readline()
-            tt = self.fp.readline().split()
-            if self.debug:
-                print 'Line 3 integers',tt[0],tt[1],tt[2]
-            self.atom_count = int(tt[2])
+        n = self.frame_count
+        if n < 0 or n >= self.nframes:
+            return -1
+
+        frame = None
+        if self.prefetcher:
+            frame = self.prefetcher.get(n,self.stride)
+        if frame is None:
+            frame = self.read_frame(n)
+        self.lastframe = frame
+        self.frame_count = n + self.stride
+        return 0
 
-        self.frame_count = self.frame_count + 1
+    def read_frame(self,n):
+        """ Read frame n and return it as a Zmatrix
+        """
+        return read_history_frame(self.fp,self.index,n)
 
-        atom_no = -1
+    def start_prefetch(self,depth=8):
+        """ Parse the next depth frames in a background thread while
+        the current one is being displayed
+        """
+        if not self.prefetcher:
+            self.prefetcher = FramePrefetcher(self.fp.name,self.index,depth)
+            self.prefetcher.start()
 
-        more=1
-        model = None
-        while more:
-            line = self.fp.readline()
+    def stop_prefetch(self):
+        if self.prefetcher:
+            self.prefetcher.stop()
+            self.prefetcher = None
 
-            #print 'line in loop',line
-            #print line
-            if line != "":
-                ###print 'CHECK',atom_no, atom_count
-                if atom_no == -1 :
-                    if self.debug:
-                        print 'timestep line',line
-                    line = self.fp.readline()
+    def close(self):
+        """ close HISTORY file
+        """
+        self.stop_prefetch()
+        self.fp.close()
 
-                t = line.split()
-                atom_no = int(t[1])
-                mass = float(t[2])
-                value = float(t[3])
 
-                if atom_no == 1 :
-                    model = Zmatrix()
-                    model.title = self.title
-                    model.name = model.title
-                    self.lastframe = model
+class HistoryIndex:
+    """The byte offsets of the frames in a DL_POLY HISTORY file
 
-                p = ZAtom()
-                p.name = t[0]
+    The offsets of the timestep lines are found in one pass over an
+    mmap of the file, and cached in filepath+'.idx', which is used
+    while the size and modification time of the file are unchanged.
+    """
 
-                # Determine the symbol from the first 2 chars of the name
-                if ( len( p.name ) == 1 ):
-                    p.symbol = p.name
-                else:
-                    # See if 2nd char is a character - if so use 1st 2 chars as symbol
-                    if re.match( '[a-zA-Z]', p.name[1] ):
-                        p.symbol = p.name[0:2]
-                    else:
-                        p.symbol = p.name[0]
-                    p.symbol = string.capitalize(p.symbol)
+    version = 1
+
+    def __init__(self,filepath,cache=1):
+        self.filepath = filepath
+        self.cachepath = filepath + '.idx'
+        self.from_cache = 0
+        st = os.stat(filepath)
+        self.key = (self.version,st.st_size,st.st_mtime)
+        self.offsets = None
+        if cache:
+            self.load()
+        if self.offsets is None:
+            self.scan()
+            if cache:
+                self.save()
+
+    def __len__(self):
+        return len(self.offsets)
 
-                ##p.symbol = z_to_el[z_num]
-                #print p.symbol,z_num
-                line = self.fp.readline()
-                t = line.split()
-                p.coord[0] = float(t[0])
-                p.coord[1] = float(t[1])
-                p.coord[2] = float(t[2])
-                model.add_atom(p)
-
-            else:
-                return -1
-                
-            #print 'atom_no atom_count',atom_no,self.atom_count
-            if atom_no == self.atom_count:
-                break;
-        
-        self.lastframe.reindex()
+    def scan(self):
+        f = open(self.filepath,'rb')
+        try:
+            self.title = f.readline().strip()
+            t = f.readline().split()
+            self.keytrj = int(t[0])
+            self.imcon = int(t[1])
+            self.natoms = int(t[2])
+            size = os.fstat(f.fileno()).st_size
+            m = mmap.mmap(f.fileno(),size,access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        offsets = array.array('l')
+        pos = m.find('timestep')
+        while pos >= 0:
+            if pos == 0 or m[pos-1] == '\n':
+                offsets.append(pos)
+            pos = m.find('\ntimestep',pos+1)
+            if pos >= 0:
+                pos = pos + 1
+        m.close()
+        self.offsets = offsets
+        self.end = size
+
+    def frame_range(self,n):
+        """ Return the start and end offsets of frame n
+        """
+        if n+1 < len(self.offsets):
+            return self.offsets[n],self.offsets[n+1]
+        return self.offsets[n],self.end
+
+    def load(self):
+        try:
+            f = open(self.cachepath,'rb')
+            try:
+                data = cPickle.load(f)
+            finally:
+                f.close()
+        except (IOError,EOFError,ValueError,cPickle.UnpicklingError):
+            return
+        if data[0] == self.key:
+            (key,self.title,self.keytrj,self.imcon,self.natoms,
+             self.end,self.offsets) = data
+            self.from_cache = 1
+
+    def save(self):
+        try:
+            f = open(self.cachepath,'wb')
+            try:
+                cPickle.dump((self.key,self.title,self.keytrj,self.imcon,self.natoms,
+                              self.end,self.offsets),f,2)
+            finally:
+                f.close()
+        except (IOError,OSError):
+            pass
+
+
+def history_symbol(name):
+    """ Guess the element symbol from a DL_POLY atom name
+    """
+    if ( len( name ) == 1 ):
+        return name
+    # See if 2nd char is a character - if so use 1st 2 chars as symbol
+    if re.match( '[a-zA-Z]', name[1] ):
+        symbol = name[0:2]
+    else:
+        symbol = name[0]
+    return string.capitalize(symbol)
+
+def read_history_frame(fp,index,n):
+    """ Read frame n of a HISTORY file from the open file fp
+    """
+    start,end = index.frame_range(n)
+    fp.seek(start)
+    lines = fp.read(end-start).split('\n')
+
+    # timestep nstep natms keytrj imcon tstep
+    t = lines[0].split()
+    natoms = int(t[2])
+    keytrj = int(t[3])
+    imcon = int(t[4])
+    i = 1
+    if imcon > 0:
+        # skip the cell vectors
+        i = 4
 
-        return 0
+    model = Zmatrix()
+    model.title = index.title
+    model.name = model.title
+
+    # name, coordinates and optionally velocities and forces for each atom
+    step = 2 + keytrj
+    for j in range(natoms):
+        p = ZAtom()
+        p.name = lines[i].split()[0]
+        p.symbol = history_symbol(p.name)
+        t = lines[i+1].split()
+        p.coord[0] = float(t[0])
+        p.coord[1] = float(t[1])
+        p.coord[2] = float(t[2])
+        model.add_atom(p)
+        i = i + step
+
+    model.reindex()
+    return model
+
+
+class FramePrefetcher(threading.Thread):
+    """ Background thread that parses the frames after the one being shown
+
+    get(n,stride) returns frame n if it has been read already (None
+    otherwise) and asks for the depth frames n+stride, n+2*stride ...
+    to be read next.
+    """
+    def __init__(self,filepath,index,depth):
+        threading.Thread.__init__(self,None,None,"HistoryPrefetch")
+        self.setDaemon(1)
+        self.fp = open(filepath,'rb')
+        self.index = index
+        self.depth = depth
+        self.frames = {}
+        self.wanted = []
+        self.cond = threading.Condition()
+        self.stopped = 0
+
+    def get(self,n,stride=1):
+        self.cond.acquire()
+        try:
+            frame = self.frames.get(n)
+            wanted = []
+            for i in range(1,self.depth+1):
+                k = n + i*stride
+                if k >= 0 and k < len(self.index):
+                    wanted.append(k)
+            self.wanted = wanted
+            # Forget frames we don't need any more
+            for k in self.frames.keys():
+                if k not in wanted:
+                    del self.frames[k]
+            self.cond.notify()
+        finally:
+            self.cond.release()
+        return frame
 
-    def close(self):
-        """ close HISTORY file
-        """
+    def run(self):
+        while 1:
+            self.cond.acquire()
+            try:
+                while not self.stopped and not self.todo():
+                    self.cond.wait()
+                if self.stopped:
+                    break
+                n = self.todo()[0]
+            finally:
+                self.cond.release()
+
+            frame = read_history_frame(self.fp,self.index,n)
+
+            self.cond.acquire()
+            try:
+                if n in self.wanted:
+                    self.frames[n] = frame
+            finally:
+                self.cond.release()
         self.fp.close()
 
+    def todo(self):
+        return [ k for k in self.wanted if not self.frames.has_key(k) ]
+
+    def stop(self):
+        self.cond.acquire()
+        self.stopped = 1
+        self.cond.notify()
+        self.cond.release()
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+class testHistory(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir,'HISTORY')
+        f = open(self.filepath,'w')
+        f.write('Water test\n')
+        f.write('         1         1         3\n')
+        for n in range(6):
+            f.write('timestep %9d         3         1         1    0.001000\n' % (n*10))
+            for v in [10.0,0.0,0.0],[0.0,10.0,0.0],[0.0,0.0,10.0]:
+                f.write('%12.6f%12.6f%12.6f\n' % tuple(v))
+            for i,name in enumerate(['O','H1','H2']):
+                f.write('%-8s%10d%12.6f%12.6f\n' % (name,i+1,16.0,-0.8))
+                f.write('%12.6f%12.6f%12.6f\n' % (n+0.1*i,1.0,2.0))
+                f.write('%12.6f%12.6f%12.6f\n' % (0.0,0.0,0.0))
+        f.close()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def testSeek(self):
+        r = Dl_PolyHISTORYReader()
+        r.open(self.filepath)
+        self.assertEqual(r.nframes,6)
+        self.assertEqual(r.title,'Water test')
+        r.seek_frame(4)
+        self.assertEqual(r.scan1(),0)
+        self.assertEqual([a.symbol for a in r.lastframe.atom],['O','H','H'])
+        self.assertAlmostEqual(r.lastframe.atom[2].coord[0],4.2)
+        r.seek_frame(-1)
+        self.assertEqual(r.scan1(),0)
+        self.assertAlmostEqual(r.lastframe.atom[0].coord[0],5.0)
+        self.assertEqual(r.scan1(),-1)
+        r.close()
+        self.assertTrue(HistoryIndex(self.filepath).from_cache)
+
+    def testStride(self):
+        frames = Dl_PolyHISTORYReader().scan(self.filepath,stride=2)
+        self.assertEqual([f.atom[0].coord[0] for f in frames],[0.0,2.0,4.0])
+
+    def testPrefetch(self):
+        r = Dl_PolyHISTORYReader()
+        r.open(self.filepath)
+        r.start_prefetch(depth=3)
+        x = []
+        while r.scan1() == 0:
+            x.append(r.lastframe.atom[0].coord[0])
+            # give the thread a chance to read ahead
+            time.sleep(0.01)
+        r.close()
+        self.assertEqual(x,[0.0,1.0,2.0,3.0,4.0,5.0])
+
+def testMe():
+    """Return a unittest test suite with all the testcases that should be run by the main 
+    gui testing framework."""
+    return  unittest.TestLoader().loadTestsFromTestCase(testHistory)
+
 if __name__ == "__main__":
 
     reader = Dl_PolyHISTORYReader()
@@ -35,10 +35,13 @@ import unittest
 
 # import internal modules
 import objects.zmatrix
+import objects.trajectory
+import objects.atomstore
 import objects.vector
 import objects.field
 from objects.periodic import z_to_el, sym2no, name_to_element
 from objects.zmatrix import Zmatrix
+from viewer.defaults import defaults
 
 openbabel=None
 
@@ -966,19 +969,25 @@ class XYZ_IO(FileIO):
         self.canWrite = [ 'Zmatrix','Indexed' ]
 
 
-    def _ReadFile(self,sequence=None):
+    def _ReadFile(self,sequence=None,frame_file=None):
         """ Read in cartesian coordinates in XMOL .xyz file format.
             The xyz format can contain multiple frames so we need to
             check if we have come to the end of one frame and need to
             start another
             The optional sequence flag indicates if we should create a
             ZmatrixSequence of the molecules in the file
+            If we have numpy, the sequence keeps the coordinates of the frames in
+            a single array (see objects/trajectory.py), which is held in frame_file
+            if this is given, and molecules with more than array_atom_count atoms
+            keep their atoms in arrays (see objects/atomstore.py).
         """
 
         fd = open( self.filepath, 'r' )
         
+        compact = None
         if sequence:
             ZmatSeq = objects.zmatrix.ZmatrixSequence()
+            compact = objects.trajectory.isAvailable()
 
         finished = 0
         line = fd.readline()
@@ -992,9 +1001,19 @@ class XYZ_IO(FileIO):
                 finished = 1
                 break
 
+            if compact and len(ZmatSeq.frames):
+                # Only the coordinates are needed after the first frame
+                line = self.read_xyz_coords(fd,natoms,ZmatSeq)
+                if not line:
+                    finished = 1
+                continue
+
             model = objects.zmatrix.Zmatrix()
             #model.title = self.
             model.name = self.name
+            if not sequence and objects.atomstore.isAvailable() and \
+                    natoms > defaults.get_value('array_atom_count'):
+                model.use_array_atoms(natoms)
 
             line = fd.readline() # First line is a comment so ignore it
             for i in range(natoms):
@@ -1018,7 +1037,7 @@ class XYZ_IO(FileIO):
                     x = float(words[1])
                     y = float(words[2])
                     z = float(words[3])
-                    a = objects.zmatrix.ZAtom()
+                    a = model.new_atom()
                     a.coord = [x,y,z]
                     a.symbol = name_to_element( words[0] )
                     #a.name = a.symbol + string.zfill(i+1,2)
@@ -1031,6 +1050,8 @@ class XYZ_IO(FileIO):
 
             if sequence:
                 ZmatSeq.add_molecule(model)
+                if compact:
+                    ZmatSeq.use_compact_storage(filename=frame_file)
             else:
                 self.molecules.append( model )
                 
@@ -1040,9 +1061,28 @@ class XYZ_IO(FileIO):
         if sequence:
             ZmatSeq.connect()
             # Name the sequence after the first molecule
-            ZmatSeq.name = ZmatSeq.frames[0].name
+            ZmatSeq.name = self.name
             self.trajectories.append( ZmatSeq )
 
+    def read_xyz_coords(self,fd,natoms,sequence):
+        """Read the coordinates of a frame into a sequence with compact storage,
+        returning the next line"""
+        line = fd.readline() # comment line
+        coords = []
+        for i in range(natoms):
+            words = fd.readline().split()
+            try:
+                coords.append([ float(words[1]), float(words[2]), float(words[3]) ])
+            except (IndexError,ValueError):
+                print "Error reading coordinates in rdxyz!"
+                print "Offending line is: %s" % " ".join(words)
+                return fd.readline()
+        try:
+            sequence.frame_coords.append(coords)
+        except ValueError,e:
+            print "Error reading frame in rdxyz: %s" % e
+        return fd.readline()
+
     def _WriteMolecule( self, molecule ):
         """ Write out the molecule as an xyz file """
 
@@ -1331,6 +1371,52 @@ class testXYZ_IO(IOTestCase):
 
         self.assertEqual( len(molecules[0].atom) , 15)
 
+    def testReadArrayAtoms(self):
+        """ large molecules are read into array storage
+        """
+        if not objects.atomstore.isAvailable():
+            return
+        count = defaults.get_value('array_atom_count')
+        defaults.set_value('array_atom_count',10)
+        try:
+            mol = self.reader.GetObjects(
+                filepath=self.egdir+'toluene.xyz',
+                otype = 'molecules'
+                )[0]
+        finally:
+            defaults.set_value('array_atom_count',count)
+
+        self.assertEqual( len(mol.atom) , 15)
+        self.assertEqual( mol.store.natoms , 15)
+        self.assertTrue( mol.atom[14]._store is mol.store )
+        self.assertEqual( mol.atom[0].symbol , 'C')
+
+    def testReadSequence(self):
+        """ read a multi-frame file as a trajectory
+        """
+        import tempfile
+        f = open(self.egdir+'toluene.xyz')
+        lines = f.readlines()
+        f.close()
+        fd,filepath = tempfile.mkstemp(suffix='.xyz')
+        f = os.fdopen(fd,'w')
+        for i in range(3):
+            f.writelines(lines[:2])
+            for line in lines[2:]:
+                w = line.split()
+                f.write("%s %f %s %s\n" % (w[0],float(w[1])+i,w[2],w[3]))
+        f.close()
+        try:
+            seq = self.reader.GetObjects( filepath=filepath, otype = 'trajectories',
+                                          sequence=1 )[0]
+        finally:
+            os.remove(filepath)
+
+        self.assertEqual( len(seq.frames) , 3)
+        self.assertEqual( len(seq.atom) , 15)
+        self.assertAlmostEqual( seq.frames[2].atom[0].coord[0] , 3.5889, 4)
+        self.assertAlmostEqual( seq.frame_coordinates(1)[0][0] , 2.5889, 4)
+
 
 class testZmatrixIO(IOTestCase):
     """Test whether we deal with Zmatrix data"""
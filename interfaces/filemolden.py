@@ -1,252 +1,572 @@
 #
 #    This file is part of the CCP1 Graphical User Interface (ccp1gui)
-# 
+#
 #   (C) 2002-2005 CCLRC Daresbury Laboratory
-# 
+#
 #   This program is free software; you can redistribute it and/or modify
 #   it under the terms of the GNU General Public License as published by
 #   the Free Software Foundation; either version 2 of the License, or
 #   (at your option) any later version.
-# 
+#
 #   This program is distributed in the hope that it will be useful,
 #   but WITHOUT ANY WARRANTY; without even the implied warranty of
 #   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 #   GNU General Public License for more details.
-# 
+#
 #   You should have received a copy of the GNU General Public License
 #   along with this program; if not, write to the Free Software
 #   Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
 #
 """Code to read molden format files
-May need further work...
+
+The file is read in a single pass, one section at a time, each
+section being handed to the reader for its header (see
+MoldenReader.readers). The numbers in a block (primitives, orbital
+coefficients, coordinates) are converted in one go.
+
+The [GTO] basis and [MO] orbitals are read into an
+objects.wavefunction.Wavefunction (see read_wavefunction), so that
+orbitals and densities can be computed without running MOLDEN. The
+steps of a geometry optimisation ([GEOMETRIES] XYZ) become a
+ZmatrixSequence with compact storage and the normal modes
+([FREQ], [FR-COORD], [FR-NORM-COORD]) a VibFreqSet.
+
+The byte offsets of the bulky sections ([MO], [GEOMETRIES] and
+[FR-NORM-COORD]) are kept in MoldenReader.offsets. For large files
+(see MoldenReader.lazy_size) these sections are skipped during the
+scan and read when the objects that hold them are first used (see
+CCP1GUI_Data.defer and SectionLoader).
 """
 
 # Import Python modules
-import math
+import os,sys
+if __name__ == "__main__":
+   # Need to add the gui directory to the python path so
+   # that all the modules can be imported
+   gui_path = os.path.split(os.path.dirname( os.path.realpath( __file__ ) ))[0]
+   sys.path.append(gui_path)
+else:
+   from viewer.paths import gui_path
+
+import unittest
 
 # Import our modules
 import objects.zmatrix
-#from chempy.brick import Brick
+import objects.vector
+import objects.vibfreq
+import objects.trajectory
+import objects.wavefunction
+
+try:
+   import numpy
+except ImportError:
+   numpy = None
+
+BOHR_TO_ANGSTROM = 0.529177249
+
+def _float(word):
+   """Convert a number that may have a Fortran D exponent"""
+   return float(word.replace('D','E').replace('d','e'))
+
+def _numbers(lines):
+   """Convert all the numbers on a list of lines"""
+   text = ' '.join(lines).replace('D','E').replace('d','e')
+   if numpy:
+      return numpy.array(text.split(),dtype=numpy.float64)
+   return map(float,text.split())
+
+def read_wavefunction(file):
+   """Return the Wavefunction held in a molden file, or None if
+   it does not have [Atoms], [GTO] and [MO] sections"""
+   p = MoldenReader()
+   p.scan(file)
+   return p.wavefunction
+
+
+class LineStream:
+   """The lines of a molden file, keeping track of the byte offset
+
+   body() returns the lines of the current section, leaving the
+   header of the next one to be read.
+   """
+
+   def __init__(self,f,offset=0):
+      self.f = f
+      self.offset = offset
+      self.pending = None
+
+   def readline(self):
+      if self.pending is not None:
+         line = self.pending
+         self.pending = None
+         return line
+      line = self.f.readline()
+      self.offset = self.offset + len(line)
+      return line
+
+   def tell(self):
+      """The offset of the next line to be read"""
+      if self.pending is not None:
+         return self.offset - len(self.pending)
+      return self.offset
+
+   def body(self):
+      """Generate the lines up to the next section header"""
+      while 1:
+         line = self.readline()
+         if not line:
+            return
+         if line.lstrip()[:1] == '[':
+            self.pending = line
+            return
+         yield line
+
+   def skip(self):
+      for line in self.body():
+         pass
+
+   def headers(self):
+      """Generate the section headers, skipping anything the caller
+      has not read between them"""
+      while 1:
+         line = self.readline()
+         if not line:
+            return
+         if line.lstrip()[:1] == '[':
+            yield line.strip()
+
+
+class SectionLoader:
+   """Read a section of a molden file into an object the first time
+   it is needed (see CCP1GUI_Data.defer).
+
+   method is the name of the MoldenReader method that reads the
+   section, it is called with a LineStream positioned at the start
+   of the section body and target (by default the object itself).
+   """
+   def __init__(self,filepath,offset,method,target=None):
+      self.filepath = filepath
+      self.offset = offset
+      self.method = method
+      self.target = target
+
+   def __call__(self,obj):
+      if os.path.getsize(self.filepath) < self.offset:
+         raise IOError("Molden file %s has been truncated since it was scanned" % self.filepath)
+      target = self.target
+      if target is None:
+         target = obj
+      f = open(self.filepath,'rb')
+      try:
+         f.seek(self.offset)
+         getattr(MoldenReader(),self.method)(LineStream(f,self.offset),target)
+      finally:
+         f.close()
 
-class VibFreq:
-   def __init__(self,index):
-      self.index=index
-      self.freq=0.0
-      self.atoms=[]
 
 class MoldenReader:
 
+   # Files bigger than this are read lazily unless scan is told otherwise
+   lazy_size = 50*1024*1024
+
    def __init__(self):
-      print "> molden.py __init__"
-      self.test=1
+      self.debug = 0
       self.objects=[]
-      self.normal = []
       self.coordinates = None
-      self.basis = None
       self.title = None
-      print "< molden.py __init__"
-
-   def scan(self,file):
-      print "> molden.py scan"
-      f = open(file)
-      punch = f.readlines()
-      f.close()
-
-      while len(punch):
-         print '---'
-         a = punch[0]
-         if   a[0:15] == '[Molden Format]':
-            punch.pop(0)
-         elif a[0:7]  == '[Atoms]':
-            if a.find('Angs',7) > 0:
-               factor = 1.0/0.529177249
-            elif a.find('AU',7) > 0:
-               factor = 1.0
-            else:
-               factor = 1.0
-            punch.pop(0)
-            self.coordinates = self.read_fragment(punch,factor)
-            self.coordinates.name = 'coordinates'
-            self.objects.append(self.coordinates)
-         elif a[0:5]  == '[GTO]':
-            punch.pop(0)
-            self.basis = self.read_basis(punch)
-            #self.basis.name = 'gtos'
-            #self.objects.append(self.basis)
-         elif a[0:5]  == '[STO]':
-            punch.pop(0)
-            self.basis = self.read_basis(punch)
-            #self.basis.name = 'stos'
-            #self.objects.append(self.basis)
-         elif a[0:4]  == '[MO]':
-            punch.pop(0)
-            self.read_skip(punch)
-         elif a[0:9]  == '[SCFCONV]':
-            punch.pop(0)
-            self.read_skip(punch)
-         elif a[0:9]  == '[GEOCONV]':
-            punch.pop(0)
-            self.read_skip(punch)
-         elif a[0:12] == '[GEOMETRIES]':
-            factor = 1.0/0.529177249
-            if a.find('XYZ',12) > 0:
-               punch.pop(0)
-               self.read_geoms(punch,factor)
-            elif a.find('ZMAT',12) > 0:
-               punch.pop(0)
-               self.read_skip(punch)
-            else:
-               punch.pop(0)
-               self.read_skip(punch)
-         elif a[0:6]  == '[FREQ]':
-            punch.pop(0)
-         elif a[0:10]  == '[FR-COORD]':
-            punch.pop(0)
-         elif a[0:15] == '[FR-NORM-COORD]':
-            punch.pop(0)
-         else:
-            print 'stray:',a
-            punch.pop(0)
-      print "< molden.py scan"
-            
-   def read_fragment(self,list,fac):
-      tt = Indexed()
-      tt.atom = []
-      cnt = 0
-      while 1:
-         subhead = list[0]
-         if(len(list) == 0):
-            return tt
-         elif subhead[0] == '[':
-            return tt
-         list.pop(0)
-         rr = subhead.split()
-         p = objects.zmatrix.Atom()
-         p.coord = [ float(rr[3])*fac , float(rr[4])*fac, float(rr[5])*fac ]
-         p.symbol = rr[0].capitalize()
-         p.name = p.symbol + str(cnt+1).zfill(c2)
-         p.index = int(rr[1])
-         cnt = cnt + 1
+      self.filepath = None
+      # the shells of the [GTO] section, see read_basis
+      self.gto = []
+      # the orbitals of the [MO] section, see read_mo
+      self.mos = []
+      # which shells are spherical ([5D], [7F] etc)
+      self.spherical = {}
+      self.wavefunction = None
+      # the geometry optimisation steps
+      self.sequence = None
+      # the normal modes
+      self.freqs = []
+      self.fr_coord = None
+      self.displacements = None
+      self.vibrations = None
+      # section name -> byte offset of the start of its body
+      self.offsets = {}
+
+      self.readers = {}
+      self.readers['TITLE'] = self.read_title
+      self.readers['ATOMS'] = self.read_atoms
+      self.readers['GTO'] = self.read_gto
+      self.readers['MO'] = self.read_mo_section
+      self.readers['5D'] = self.read_spherical
+      self.readers['5D7F'] = self.read_spherical
+      self.readers['5D10F'] = self.read_spherical
+      self.readers['7F'] = self.read_spherical
+      self.readers['9G'] = self.read_spherical
+      self.readers['GEOMETRIES'] = self.read_geometries_section
+      self.readers['FREQ'] = self.read_freq
+      self.readers['FR-COORD'] = self.read_fr_coord
+      self.readers['FR-NORM-COORD'] = self.read_normal_section
+
+   def scan(self,file,lazy=None):
+      """Read the molden file. If lazy is set (by default if the file
+      is bigger than lazy_size) the [MO], [GEOMETRIES] and [FR-NORM-COORD]
+      sections are only read when they are needed."""
+      self.filepath = file
+      if lazy is None:
+         lazy = os.path.getsize(file) > self.lazy_size
+      self.lazy = lazy
+
+      f = open(file,'rb')
+      try:
+         stream = LineStream(f)
+         for header in stream.headers():
+            words = header[1:].split(']',1) + ['']
+            name = words[0].strip().upper()
+            qualifier = words[1].strip().upper()
+            reader = self.readers.get(name)
+            if self.debug: print 'molden section',name,stream.tell()
+            if reader:
+               reader(stream,name,qualifier)
+            elif name != 'MOLDEN FORMAT':
+               if self.debug: print 'skipping molden section',header
+               stream.skip()
+      finally:
+         f.close()
+
+      if self.coordinates and self.gto and (self.mos or self.offsets.has_key('MO')):
+         self.wavefunction = self.make_wavefunction()
+      if self.freqs:
+         self.vibrations = self.make_vibrations()
+         if self.vibrations:
+            self.objects.append(self.vibrations)
+
+   def read_title(self,stream,name,qualifier):
+      lines = [ l.strip() for l in stream.body() ]
+      lines = [ l for l in lines if l ]
+      if lines:
+         self.title = ' '.join(lines)
+
+   def read_atoms(self,stream,name,qualifier):
+      # the GUI works in angstrom
+      if qualifier.find('AU') >= 0:
+         factor = BOHR_TO_ANGSTROM
+      else:
+         factor = 1.0
+      self.coordinates = self.read_fragment(stream.body(),factor,columns=6)
+      self.coordinates.name = 'coordinates'
+      if self.title:
+         self.coordinates.title = self.title
+      self.objects.append(self.coordinates)
+
+   def read_fragment(self,lines,fac,columns=4):
+      """Make a Zmatrix from lines of symbol ... x y z, the coordinates
+      being the last three of columns"""
+      tt = objects.zmatrix.Zmatrix()
+      rows = [ l.split() for l in lines ]
+      rows = [ r for r in rows if len(r) >= columns ]
+      xyz = _numbers([ ' '.join(r[columns-3:columns]) for r in rows ])
+      for i in range(len(rows)):
+         p = objects.zmatrix.ZAtom()
+         p.coord = [ xyz[3*i]*fac, xyz[3*i+1]*fac, xyz[3*i+2]*fac ]
+         p.symbol = rows[i][0].capitalize()
+         p.name = p.symbol + str(i+1).zfill(2)
+         if columns == 6:
+            p.index = int(rows[i][1])
          tt.add_atom(p)
+      return tt
 
-   def read_geoms(self,list,fac):
-      numat = self.coordinates.nAtom
-      while 1:
-         if len(list) == 0:
-            return 
-         a = list[0]
-         if a[0] == '[':
-            return 
-         assert int(a) == numat, "Number of atoms not the same [ATOMS] and [GEOMETRIES]"
-         list.pop(0)
-         list.pop(0)
-         tt = Indexed()
-         tt.atom = []
-         for i in range(0,numat):
-            q  = self.coordinates.atom[i]
-            rr = list[0].split()
-            p  = Atom()
-            p.coord  = [ float(rr[1])*fac, float(rr[2])*fac, float(rr[3])*fac]
-            p.symbol = rr[0].capitalize()
-            p.name   = q.name
-            p.index  = q.index
-            tt.add_atom(p)
-            list.pop(0)
-         self.objects.append(tt)
-
-   def read_basis(self,list):
-      tt = []
-      while 1:
-         if (len(list) == 0):
-            return tt
-         elif list[0][0] == '[':
-            return tt
-         list.pop(0)
+   def read_spherical(self,stream,name,qualifier):
+      if name in ['5D','5D7F','5D10F']:
+         self.spherical[2] = 1
+      if name in ['5D','5D7F','7F']:
+         self.spherical[3] = 1
+      if name == '9G':
+         self.spherical[4] = 1
+      stream.skip()
 
-   def read_skip(self,list):
+   def read_gto(self,stream,name,qualifier):
+      self.gto = self.read_basis(stream.body())
+
+   def read_basis(self,lines):
+      """Read the [GTO] section, returns a list of (atom, shell type,
+      exponents, coefficients) with the atoms counted from 1. An sp
+      shell gives an s and a p shell."""
       tt = []
-      while 1:
-         if (len(list) == 0):
-            return tt
-         elif list[0][0] == '[':
-            return tt
-         list.pop(0)
-            
-
-   def read_grid(self,list):
-      print 'reading brick'
-      #brik = Brick()
-      while 1:
-         if(len(list) == 0):
-            return brik
-         subhead = list[0]
-         self.parse_header(subhead)
-         print self.name , self.records
-         if self.name == 'grid_title':
-            list.pop(0)
-            brik.title = ''
-            for i in range(0,self.records):
-               r = list.pop(0)
-               brik.title = brik.title + r.rstrip()
-         elif self.name == 'grid_axes':
-            list.pop(0)
-            cnt = 0
-            brik.dim = []
-            for i in range(0,self.records):
-               rr = list.pop(0).split()
-               brik.dim.append(int(rr[0]))
-            print 'dim', brik.dim
-         elif self.name == 'grid_mapping':
-            list.pop(0)
-            brik.range = []
-            fac = 0.529177
-            for i in range(0,self.records):
-               rr = list.pop(0).split()
-               if i == 0:
-                  brik.origin = [ float(rr[0])*fac, float(rr[1])*fac, float(rr[2])*fac ]
-                  brik.range.append((float(rr[3])-float(rr[0]))*fac)
-               if i == 1:
-                  brik.range.append((float(rr[4])-float(rr[1]))*fac)
-               if i == 2:
-                  brik.range.append((float(rr[5])-float(rr[2]))*fac)
-            print 'origin', brik.origin
-            print 'range', brik.range
-            brik.grid = [ brik.range[0] / float(brik.dim[0] - 1),
-                          brik.range[1] / float(brik.dim[1] - 1),
-                          brik.range[2] / float(brik.dim[2] - 1) ]
-                          
-         elif self.name == 'grid_data':
-            list.pop(0)
-            brik.lvl = zeros(brik.dim,Float)
-            for z in range(brik.dim[2]):
-               for y in range(brik.dim[1]):
-                  for x in range(brik.dim[0]):
-                     brik.lvl[x,y,z]=float(list.pop(0))
+      atom = None
+      lines = iter(lines)
+      for line in lines:
+         words = line.split()
+         if not len(words):
+            # a blank line ends the shells of an atom
+            atom = None
+         elif atom is None:
+            atom = int(words[0])
          else:
-            print type(brik), str(brik)
-            return brik
-
-   def read_normal(self,list):
-         print self.name , self.records, self.index
-         cnt = 0
-         v = VibFreq(self.index)
-         for i in range(0,self.records):
-               p = objects.zmatrix.Atom()
-               rr = list.pop(0).split()
-               p.coord = [ float(rr[1]) , float(rr[2]), float(rr[3]) ]
-               p.symbol = rr[0].capitalize()
-               p.name = p.symbol + str(i).zfill(2)
-               p.index = cnt
-               cnt = cnt + 1
-               v.atoms.append(p)
-         self.normal.append(v)
-         return v
-
-   def read_freq(self,list):
-         print self.name , self.records, self.index
-         cnt = 0
-         tt = list.pop(0)
-         for v in self.normal:
-            if v.index == self.index:
-               v.freq = float(tt)
+            shell = words[0].lower()
+            nprim = int(words[1])
+            block = [ lines.next() for i in range(nprim) ]
+            values = _numbers(block)
+            if shell == 'sp':
+               tt.append((atom,'s',values[0::3],values[1::3]))
+               tt.append((atom,'p',values[0::3],values[2::3]))
+            else:
+               tt.append((atom,shell,values[0::2],values[1::2]))
+      return tt
+
+   def read_mo_section(self,stream,name,qualifier):
+      self.offsets['MO'] = stream.tell()
+      if self.lazy:
+         stream.skip()
+      else:
+         self.mos = self.read_mo(stream.body())
+
+   def read_mo(self,lines):
+      """Read the [MO] section, returns a list with a dictionary for
+      each orbital holding the keywords (sym, ene, spin, occup) and
+      the basis functions (counting from 1) and coefficients as
+      'index' and 'values'"""
+      mos = []
+      mo = None
+      block = []
+      for line in lines:
+         if line.find('=') >= 0:
+            if mo is None or block:
+               if block:
+                  self._set_coefficients(mo,block)
+               mo = {}
+               mos.append(mo)
+               block = []
+            key,value = line.split('=',1)
+            mo[key.strip().lower()] = value.strip()
+         elif line.strip():
+            block.append(line)
+      if block:
+         self._set_coefficients(mo,block)
+      return mos
+
+   def _set_coefficients(self,mo,block):
+      values = _numbers(block)
+      mo['index'] = [ int(i) for i in values[0::2] ]
+      mo['values'] = values[1::2]
+
+   def load_mo(self,stream,wfn):
+      """Read the orbitals of a deferred Wavefunction"""
+      self.set_orbitals(wfn,self.read_mo(stream.body()))
+
+   def set_orbitals(self,wfn,mos):
+      nbf = wfn.basis.nbf()
+      coefficients = numpy.zeros((len(mos),nbf))
+      occupations = []
+      energies = []
+      symmetries = []
+      for i in range(len(mos)):
+         mo = mos[i]
+         coefficients[i,numpy.array(mo.get('index',[]),dtype=int)-1] = mo.get('values',[])
+         occupations.append(_float(mo.get('occup','0.0')))
+         energies.append(_float(mo.get('ene','0.0')))
+         symmetries.append(mo.get('sym',''))
+      wfn.coefficients = coefficients
+      wfn.occupations = numpy.array(occupations)
+      wfn.energies = energies
+      wfn.symmetries = symmetries
+
+   def make_wavefunction(self):
+      """Build the Wavefunction from the [Atoms], [GTO] and [MO] sections"""
+      basis = objects.wavefunction.BasisSet()
+      for atom,shell,exps,coefs in self.gto:
+         l = objects.wavefunction.SHELL_TYPES.index(shell)
+         c = self.coordinates.atom[atom-1].coord
+         centre = [ x / BOHR_TO_ANGSTROM for x in c ]
+         basis.add_shell(objects.wavefunction.Shell(l,centre,exps,coefs,
+                                                    spherical=self.spherical.get(l,0)))
+      wfn = objects.wavefunction.Wavefunction(basis,[],[])
+      if self.title:
+         wfn.title = self.title
+      if self.mos:
+         self.set_orbitals(wfn,self.mos)
+      else:
+         wfn.defer(['coefficients','occupations','energies','symmetries'],
+                   SectionLoader(self.filepath,self.offsets['MO'],'load_mo'))
+      return wfn
+
+   def read_geometries_section(self,stream,name,qualifier):
+      if qualifier.find('XYZ') < 0 or not self.coordinates:
+         # z-matrix steps are not handled
+         stream.skip()
+         return
+      self.offsets['GEOMETRIES'] = stream.tell()
+      seq = objects.zmatrix.ZmatrixSequence()
+      seq.name = 'geometries'
+      seq.title = 'Optimisation steps'
+      seq.atom = []
+      for a in self.coordinates.atom:
+         b = objects.zmatrix.ZAtom()
+         b.symbol = a.symbol
+         b.name = a.name
+         b.coord = list(a.coord)
+         seq.add_atom(b)
+      if self.lazy:
+         stream.skip()
+         seq.defer(['frames','frame_coords'],
+                   SectionLoader(self.filepath,self.offsets['GEOMETRIES'],'load_geometries'))
+      else:
+         self.load_geometries(stream,seq)
+      self.sequence = seq
+      self.objects.append(seq)
+
+   def load_geometries(self,stream,seq):
+      """Read the steps of a [GEOMETRIES] XYZ section into seq"""
+      natoms = len(seq.atom)
+      frames = []
+      lines = stream.body()
+      for line in lines:
+         if not line.strip():
+            continue
+         assert int(line) == natoms, "Number of atoms not the same [ATOMS] and [GEOMETRIES]"
+         # title line
+         lines.next()
+         block = [ lines.next() for i in range(natoms) ]
+         xyz = _numbers([ ' '.join(l.split()[1:4]) for l in block ])
+         frames.append(xyz)
+
+      if objects.trajectory.isAvailable():
+         seq.frames = []
+         seq.frame_coords = None
+         seq.use_compact_storage()
+         for xyz in frames:
+            seq.frame_coords.append(numpy.reshape(xyz,(natoms,3)))
+      else:
+         seq.frames = []
+         seq.frame_coords = None
+         for xyz in frames:
+            z = objects.zmatrix.Zmatrix()
+            for i in range(natoms):
+               a = objects.zmatrix.ZAtom()
+               a.symbol = seq.atom[i].symbol
+               a.name = seq.atom[i].name
+               a.coord = [ xyz[3*i], xyz[3*i+1], xyz[3*i+2] ]
+               z.add_atom(a)
+            seq.frames.append(z)
+
+   def read_freq(self,stream,name,qualifier):
+      self.freqs = list(_numbers([ l for l in stream.body() if l.strip() ]))
+
+   def read_fr_coord(self,stream,name,qualifier):
+      # [FR-COORD] is in bohr
+      self.fr_coord = self.read_fragment(stream.body(),BOHR_TO_ANGSTROM)
+
+   def read_normal_section(self,stream,name,qualifier):
+      self.offsets['FR-NORM-COORD'] = stream.tell()
+      if self.lazy:
+         stream.skip()
+      else:
+         self.displacements = self.read_normal(stream.body())
+
+   def read_normal(self,lines):
+      """Read the [FR-NORM-COORD] section, returns a list of the
+      displacements of the atoms (lists of Vectors) for each mode"""
+      modes = []
+      block = []
+      for line in lines:
+         if line.strip().lower()[:9] == 'vibration':
+            if block:
+               modes.append(self._vectors(block))
+            block = []
+         elif line.strip():
+            block.append(line)
+      if block:
+         modes.append(self._vectors(block))
+      return modes
+
+   def _vectors(self,block):
+      d = _numbers(block)
+      return [ objects.vector.Vector([ d[i], d[i+1], d[i+2] ]) for i in range(0,len(d),3) ]
+
+   def load_normal(self,stream,vs):
+      """Read the displacements of all the modes of a deferred VibFreqSet"""
+      modes = self.read_normal(stream.body())
+      for v,disp in zip(vs.vibs,modes):
+         if v.is_deferred('displacement'):
+            del v._deferred['displacement']
+         v.displacement = disp
+
+   def make_vibrations(self):
+      """Build the VibFreqSet from the [FREQ], [FR-COORD] and [FR-NORM-COORD] sections"""
+      reference = self.fr_coord or self.coordinates
+      if not reference or not (self.displacements or self.offsets.has_key('FR-NORM-COORD')):
          return None
+      vs = objects.vibfreq.VibFreqSet()
+      vs.title = 'Normal Modes'
+      if self.title:
+         vs.title = 'Normal Modes of ' + self.title
+      vs.reference = reference
+      if self.displacements:
+         loader = None
+      else:
+         loader = SectionLoader(self.filepath,self.offsets['FR-NORM-COORD'],'load_normal',target=vs)
+      for i in range(len(self.freqs)):
+         if loader:
+            v = vs.add_vib([],self.freqs[i])
+            v.defer(['displacement'],loader)
+         else:
+            v = vs.add_vib(self.displacements[i],self.freqs[i])
+         v.reference = reference
+      return vs
+
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+class testMoldenReader(unittest.TestCase):
+   """ read the basis and orbitals from a molden file and compute the density """
+
+   def testWavefunction(self):
+      wfn = read_wavefunction(gui_path+os.sep+'examples'+os.sep+'h2_sto3g.molden')
+      self.assertEqual(wfn.nmo(),2)
+      self.assertEqual(wfn.basis.nbf(),2)
+      e = objects.wavefunction.OrbitalEvaluator(wfn)
+      grid = e.molecule_grid(41)
+      f = e.get_field(0,grid)
+      # the volume of a grid cell, in bohr
+      h = grid.axis[0][0] / (grid.dim[0] - 1) / objects.wavefunction.BOHR_TO_ANGSTROM
+      self.assertAlmostEqual(f.data.sum() * h**3,2.0,3)
+
+   def testLazy(self):
+      """ the objects read lazily are the same as those read in the scan """
+      filepath = gui_path+os.sep+'examples'+os.sep+'h2_sto3g.molden'
+      now = MoldenReader()
+      now.scan(filepath,lazy=0)
+      later = MoldenReader()
+      later.scan(filepath,lazy=1)
+      self.assertEqual(sorted(later.offsets.keys()),['FR-NORM-COORD','GEOMETRIES','MO'])
+
+      self.assertTrue(later.wavefunction.is_deferred('coefficients'))
+      self.assertEqual(later.wavefunction.coefficients.tolist(),now.wavefunction.coefficients.tolist())
+      self.assertEqual(later.wavefunction.symmetries,['1ag','1b1u'])
+
+      self.assertEqual(len(now.sequence.frames),2)
+      self.assertEqual(len(later.sequence.frames),2)
+      self.assertAlmostEqual(later.sequence.frame_coordinates(1)[1][2],0.370424,5)
+      self.assertAlmostEqual(now.sequence.frames[0].atom[0].coord[2],-0.39,5)
+
+      for reader in now,later:
+         vs = reader.vibrations
+         self.assertEqual(len(vs.vibs),1)
+         self.assertEqual(vs.vibs[0].freq,5481.2)
+         self.assertAlmostEqual(vs.vibs[0].displacement[1][2],0.7071067812)
+         self.assertAlmostEqual(vs.reference.atom[1].coord[2],0.7*BOHR_TO_ANGSTROM)
+
+
+def testMe():
+   """Return a unittest test suite with all the testcases that should be run by the main
+   gui testing framework."""
+
+   return  unittest.TestLoader().loadTestsFromTestCase(testMoldenReader)
+
+if __name__ == "__main__":
+   unittest.main()
@@ -36,6 +36,13 @@ else:
 import unittest # The testing for this file is contained within it at the bottom
 import copy
 import string
+import mmap
+import cPickle
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 import fileio
 import objects.zmatrix
@@ -164,18 +171,61 @@ class PunchIO(fileio.FileIO):
         self.subblocks['matrix'] = [
            'matrix_title','dense_real_matrix' ]
 
+        # When reading lazily these replace the readers for the bulky
+        # blocks, and arrange for them to be read on first use
+        self.lazy_readers = {}
+        self.lazy_readers['grid_data'] = self.defer_grid_data
+        self.lazy_readers['field_data'] = self.defer_grid_data
+        self.lazy_readers['normal_coordinates'] = self.defer_normal
+        self.lazy_readers['update_coordinates'] = self.defer_update_coordinates
+
+        # The PunchIndex we are reading from (only set when reading lazily)
+        self.block_index = None
+        self.block = None
+
+        # State for following a file that is being appended to (see follow)
+        self.tail_offset = 0
+        self.tail_mtime = None
+        self.tail_check = None
+        self.tail_object = None
+        self.tail_subblocks = None
+        self.composite = None
+
         self.iter = 0
         self.fragment = None
-    
-    def _ReadFile(self,**kw):
+
+    # Files bigger than this are read lazily unless the lazy keyword says otherwise
+    lazy_size = 50*1024*1024
+
+    def _ReadFile(self,lazy=None,**kw):
+        """Read all the objects from the file
+
+        If lazy is set the blocks are located using a PunchIndex, and
+        grid data, normal modes and the frames of structure sequences
+        are only read when they are first used.
+        """
 
         if self.debug:
             print "> filepunch.py ReadFile"
 
+        if lazy is None:
+            lazy = os.path.getsize(self.filepath) > self.lazy_size
+
+        readers = self.readers
+        if lazy:
+            self.block_index = PunchIndex(self.filepath)
+            self.block_cursor = 0
+            self.readers = readers.copy()
+            self.readers.update(self.lazy_readers)
+
         f = open(self.filepath)
-        while self.read_object(f) != End_of_File:
-            pass
-        f.close()
+        try:
+            while self.read_object(f) != End_of_File:
+                pass
+        finally:
+            f.close()
+            self.readers = readers
+            self.block_index = None
 
     def _WriteMolecule(self,molecule,**kw):
 
@@ -194,6 +244,114 @@ class PunchIO(fileio.FileIO):
             pass
         f.close()
 
+    def follow(self,filepath,object=None):
+        """Read all the objects from filepath, remembering where we got to so
+        that blocks appended to the file later can be read with update()"""
+        self._ParseFilepath(filepath)
+        self._ResetObjects()
+        self.tail_offset = 0
+        self.tail_mtime = None
+        self.tail_check = None
+        self.tail_object = None
+        self.update(object=object)
+        self.haveread = self.filepath
+
+    def update(self,object=None):
+        """Read any complete blocks that have been appended to the file since
+        the last call to follow or update, returning how many were read.
+
+        Only the new part of the file is read. Blocks that belong to the last
+        composite block read (eg update_coordinates blocks for a
+        fragment.sequence) are added to it. If the file has been rewritten
+        rather than appended to, it is read again from the start.
+        As for rescan, any fragment blocks are read into object if given.
+        """
+        st = os.stat(self.filepath)
+        size = st.st_size
+        if size == self.tail_offset and st.st_mtime == self.tail_mtime:
+            return 0
+
+        if not self.tail_unchanged(size):
+            if self.debug: print 'update: file has been rewritten'
+            self._ResetObjects()
+            self.tail_offset = 0
+            self.tail_check = None
+            self.tail_object = None
+
+        index = PunchIndex(self.filepath,cache=0,start=self.tail_offset)
+        blocks = index.blocks
+        # The last block may still be being written
+        f = open(self.filepath)
+        try:
+            if len(blocks) and not self.block_complete(f,blocks[-1],size):
+                blocks = blocks[:-1]
+            if not len(blocks):
+                return 0
+
+            self.block_index = index
+            self.block_cursor = 0
+            index.blocks = blocks
+            while 1:
+                if self.tail_object is not None and self.next_block_name() in self.tail_subblocks:
+                    code = self.read_object(f,object=self.tail_object,subblocks=self.tail_subblocks)
+                else:
+                    self.composite = None
+                    code = self.read_object(f,object=object)
+                    if self.composite:
+                        self.tail_object,self.tail_subblocks = self.composite
+                if code == End_of_File:
+                    break
+        finally:
+            self.block_index = None
+            f.close()
+
+        self.tail_offset = blocks[-1][2]
+        self.tail_mtime = st.st_mtime
+        start = max(0,self.tail_offset - self.tail_check_size)
+        self.tail_check = (start,self.read_bytes(start,self.tail_offset-start))
+        return len(blocks)
+
+    # The number of bytes before the end of the part of the file we have read
+    # that are checked to see if it has been rewritten
+    tail_check_size = 4096
+
+    def tail_unchanged(self,size):
+        """Check the part of the file we have read is still there"""
+        if size < self.tail_offset:
+            return 0
+        if size == self.tail_offset:
+            # Same size but modified
+            return 0
+        if self.tail_check is None:
+            return 1
+        start,data = self.tail_check
+        return self.read_bytes(start,len(data)) == data
+
+    def read_bytes(self,start,n):
+        f = open(self.filepath,'rb')
+        try:
+            f.seek(start)
+            return f.read(n)
+        finally:
+            f.close()
+
+    def block_complete(self,f,block,size):
+        """Check all the records of the block at the end of the file have been written"""
+        if block[1] > size or self.read_bytes(block[1]-1,1) != '\n':
+            return 0
+        if block[4] == 0:
+            return 1
+        f.seek(block[1])
+        return f.read(size-block[1]).count('\n') >= block[4]
+
+    def next_block_name(self):
+        """The name of the next block that read_object will read"""
+        if self.skip_parse:
+            return self.block_name
+        if self.block_cursor < len(self.block_index.blocks):
+            return self.block_index.blocks[self.block_cursor][3]
+        return None
+
     def read_object(self,f,object=None,subblocks=None):
         """Top level reading of a block and sub-blocks
         Will read the next header and all blocks it refers to
@@ -207,8 +365,6 @@ class PunchIO(fileio.FileIO):
             return Bad_Position
       
         self.iter = self.iter + 1
-        if self.iter > 10000:
-            a=x
       
         if self.debug:
             print 'read_object Obj=',object,'Subbl=',subblocks
@@ -286,6 +442,7 @@ class PunchIO(fileio.FileIO):
             tt.title=self.name+'_'+self.block_name
 
         subbl = self.subblocks[self.block_name]
+        self.composite = (tt,subbl)
 
         if self.debug: print "\n\nreading first subblock: %s\n\n" % subbl
         while self.read_object(f,object=tt,subblocks=subbl) == End_of_Block:
@@ -334,6 +491,9 @@ class PunchIO(fileio.FileIO):
             self.skip_parse=0
             return
 
+        if self.block_index is not None:
+            return self.next_indexed_header(f)
+
         # defaults
         self.records=0
         self.elements=1
@@ -429,6 +589,21 @@ class PunchIO(fileio.FileIO):
             elif t1 == 'unit':
                 self.unit = t2[0]
         return 0
+
+    def next_indexed_header(self,f):
+        """Take the next header from the PunchIndex rather than the file
+        and position f at the start of its data"""
+        if self.block_cursor >= len(self.block_index.blocks):
+            return 1
+        self.block = self.block_index.blocks[self.block_cursor]
+        self.block_cursor = self.block_cursor + 1
+        self.set_header(self.block)
+        f.seek(self.block[1])
+        return 0
+
+    def set_header(self,block):
+        """Set the header information from a PunchIndex entry"""
+        self.block_name,self.records,self.elements,self.dimensions,self.unit,self.index = block[3:9]
    
     def read_coordinates(self,f,tt):
 
@@ -513,11 +688,22 @@ class PunchIO(fileio.FileIO):
             tt.add_shell(p)
 
     def read_update_coordinates(self,f,oldtt):
+        tt = self.add_frame(f,oldtt)
+        if tt:
+            self.read_frame(f,tt)
+
+    def defer_update_coordinates(self,f,oldtt):
+        tt = self.add_frame(f,oldtt)
+        if tt:
+            tt.defer(['atom'],BlockLoader(self.filepath,self.block,'read_frame'))
+
+    def add_frame(self,f,oldtt):
+        """Add a new frame to the structure sequence oldtt"""
 
         if not oldtt:
             print '.. skipped - update_coordinates without fragment.sequence block'
             self.skip_block(f)
-            return
+            return None
       
         global frame_count
         frame_count = frame_count + 1
@@ -528,7 +714,10 @@ class PunchIO(fileio.FileIO):
             tt.title = 'Frame ' + str(frame_count)         
 
         oldtt.frames.append(tt)
+        return tt
 
+    def read_frame(self,f,tt):
+        """Read the atoms of a frame from an update_coordinates block"""
         cnt = 0
         fac = au_to_angstrom
         tt.atom = []
@@ -692,11 +881,101 @@ class PunchIO(fileio.FileIO):
             brik.axis.append(vy)
             brik.axis.append(vz)
 
+    # Number of lines of a grid_data block parsed in one go by the bulk reader
+    grid_chunk = 65536
+
+    def defer_grid_data(self,f,brik):
+        if not brik:
+            return self.read_grid_data(f,brik)
+        brik.ndd = self.elements
+        brik.defer(['data','data_min','data_max'],
+                   BlockLoader(self.filepath,self.block,'load_grid_data'))
+
+    def load_grid_data(self,f,brik):
+        brik.data_min = None
+        brik.data_max = None
+        self.read_grid_data(f,brik)
+
     def read_grid_data(self,f,brik):
         if not brik:
             print '... skipped - grid_data without data block'
             self.skip_block(f)
             return
+        if numpy is None:
+            return self.read_grid_data_lines(f,brik)
+
+        brik.ndd = self.elements
+        try:
+            # Regular grid, one line per point
+            nlines = 1
+            for n in brik.dim:
+                nlines = nlines * n
+        except AttributeError:
+            # Irregular grid (it has no dim array)
+            nlines = self.records
+
+        if self.records == 0 or nlines == 0:
+            brik.data = None
+            return
+
+        # Read the block a chunk of lines at a time and convert each chunk
+        # with a single call, only falling back to converting the values
+        # one by one for chunks that don't have exactly the right number
+        # of valid values
+        chunks = []
+        # positions of the bad values (replaced by 999)
+        bad = []
+        offset = 0
+        left = nlines
+        while left:
+            n = min(left,self.grid_chunk)
+            lines = [ f.readline() for i in xrange(n) ]
+            left = left - n
+            values = numpy.fromstring(''.join(lines),dtype=numpy.float64,sep=' ')
+            if len(values) != n*self.elements or not numpy.isfinite(values).all():
+                values = self.parse_grid_lines(lines,bad,offset)
+            chunks.append(values)
+            offset = offset + len(values)
+
+        data = numpy.concatenate(chunks)
+        brik.set_data(data,order='F')
+
+        # As for the line by line reader the range always includes zero,
+        # leaves out the bad values and is only set if the data is not
+        # all zero
+        if bad:
+            good = numpy.ones(len(data),dtype=bool)
+            good[bad] = False
+            data = data[good]
+        data_min = 0.0
+        data_max = 0.0
+        if len(data):
+            data_min = min(0.0,float(data.min()))
+            data_max = max(0.0,float(data.max()))
+        if not ( data_min == 0 and data_max == 0 ):
+            brik.data_min = data_min
+            brik.data_max = data_max
+
+    def parse_grid_lines(self,lines,bad,offset):
+        """Convert grid data line by line, replacing anything bad with 999.
+        The positions of the bad values (counting from offset) are
+        appended to bad."""
+        values = numpy.zeros(len(lines)*self.elements,dtype=numpy.float64)
+        i = 0
+        for line in lines:
+            line = line.split()
+            for e in range(self.elements):
+                try:
+                    values[i] = float(line[e])
+                except (ValueError,IndexError):
+                    print 'Warning ... Bad numeric data in punchfile, replaced with 999'
+                    values[i] = 999.0
+                    bad.append(offset + i)
+                i = i + 1
+        return values
+
+    def read_grid_data_lines(self,f,brik):
+        """Read the grid data one value at a time (used if we don't have numpy)"""
       
         brik.data = []
         brik.ndd = self.elements
@@ -881,6 +1160,26 @@ class PunchIO(fileio.FileIO):
             brik.mask.append(int(txt0))
 
     def read_normal(self,f,obj):
+        return self.add_normal(self.read_displacements(f))
+
+    def defer_normal(self,f,obj):
+        v = self.add_normal([])
+        v.defer(['displacement'],BlockLoader(self.filepath,self.block,'load_displacement'))
+        return v
+
+    def load_displacement(self,f,v):
+        v.displacement = self.read_displacements(f)
+
+    def read_displacements(self,f):
+        disp = []
+        for i in range(0,self.records):
+            rr = string.split(f.readline())
+            vec =objects.vector.Vector([ float(rr[1]) , float(rr[2]), float(rr[3]) ])
+            disp.append(vec)
+        return disp
+
+    def add_normal(self,disp):
+        """Add a normal mode with displacements disp to the current VibFreqSet"""
         if self.debug:
             print self.block_name , self.records, self.index
 
@@ -895,13 +1194,6 @@ class PunchIO(fileio.FileIO):
             self.vfs = vs
             self.objects.append(vs)
 
-        cnt = 0
-        disp = []
-        for i in range(0,self.records):
-            rr = string.split(f.readline())
-            vec =objects.vector.Vector([ float(rr[1]) , float(rr[2]), float(rr[3]) ])
-            disp.append(vec)
-
         v = self.vfs.add_vib(disp)
         v.reference = self.fragment
         v.index = self.index
@@ -1225,6 +1517,149 @@ class PunchIO(fileio.FileIO):
             junk = f.readline()
 
 
+class PunchIndex:
+    """Byte offsets of all the blocks in a punchfile, found in one pass.
+
+    blocks is a list with a tuple for each block header:
+
+      (offset, data_offset, end_offset, block_name, records, elements,
+       dimensions, unit, index, title)
+
+    where the offsets are those of the header line, the first line of
+    data and the end of the block, and title is the text of title
+    blocks (None for other blocks).
+
+    The index is cached in filepath+'.idx' and is rebuilt if the size
+    or modification time of the file changes.
+    """
+
+    version = 1
+
+    # Larger blocks are skipped by searching for the next header
+    # rather than line by line
+    scan_records = 64
+
+    def __init__(self,filepath,cache=1,start=0):
+        """Index the blocks of filepath from offset start (only
+        the index of the whole file is cached)"""
+        self.filepath = filepath
+        self.cachepath = filepath + '.idx'
+        self.from_cache = 0
+        st = os.stat(filepath)
+        self.key = (self.version,st.st_size,st.st_mtime)
+        self.blocks = None
+        if start:
+            cache = 0
+        if cache:
+            self.load()
+        if self.blocks is None:
+            self.blocks = self.scan(start)
+            if cache:
+                self.save()
+
+    def scan(self,start=0):
+        """Return the index entries for the blocks from offset start"""
+
+        f = open(self.filepath,'rb')
+        try:
+            size = os.fstat(f.fileno()).st_size
+            if size <= start:
+                return []
+            # The map stays valid after the file is closed
+            m = mmap.mmap(f.fileno(),size,access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        blocks = []
+        header = PunchIO()
+        m.seek(start)
+        while 1:
+            offset = m.tell()
+            try:
+                if header.parse_header(m):
+                    break
+            except (IndexError,ValueError):
+                # Allow for a header that is still being written
+                if m.tell() < size:
+                    raise
+                break
+            if header.block_name == "*******":
+                continue
+            data_offset = m.tell()
+            title = None
+            if header.records <= self.scan_records:
+                lines = []
+                for i in range(header.records):
+                    lines.append(m.readline().strip())
+                if header.block_name[-5:] == 'title':
+                    title = string.join(filter(None,lines))
+            else:
+                found = m.find('\nblock',data_offset-1)
+                if found < 0:
+                    m.seek(size)
+                else:
+                    m.seek(found+1)
+            blocks.append((offset,data_offset,m.tell(),header.block_name,header.records,
+                           header.elements,header.dimensions,header.unit,
+                           getattr(header,'index',None),title))
+        m.close()
+        return blocks
+
+    def load(self):
+        """Use the cached index if it is up to date"""
+        try:
+            f = open(self.cachepath,'rb')
+            try:
+                key,blocks = cPickle.load(f)
+            finally:
+                f.close()
+        except (IOError,EOFError,ValueError,cPickle.UnpicklingError):
+            return
+        if key == self.key:
+            self.blocks = blocks
+            self.from_cache = 1
+
+    def save(self):
+        """Cache the index next to the file (if we can write there)"""
+        try:
+            f = open(self.cachepath,'wb')
+            try:
+                cPickle.dump((self.key,self.blocks),f,2)
+            finally:
+                f.close()
+        except (IOError,OSError):
+            pass
+
+    def find(self,block_name):
+        """Return the index entries for all blocks called block_name"""
+        return [ b for b in self.blocks if b[3] == block_name ]
+
+
+class BlockLoader:
+    """Read a block of a punchfile into an object the first time it
+    is needed (see CCP1GUI_Data.defer).
+
+    method is the name of the PunchIO method that reads the block.
+    """
+    def __init__(self,filepath,block,method):
+        self.filepath = filepath
+        self.block = block
+        self.method = method
+
+    def __call__(self,obj):
+        if os.path.getsize(self.filepath) < self.block[2]:
+            raise IOError("Punchfile %s has been truncated since it was indexed" % self.filepath)
+        reader = PunchIO()
+        reader._ParseFilepath(self.filepath)
+        reader.set_header(self.block)
+        f = open(self.filepath)
+        try:
+            f.seek(self.block[1])
+            getattr(reader,self.method)(f,obj)
+        finally:
+            f.close()
+
+
 ##########################################################
 #
 #
@@ -1270,11 +1705,176 @@ class testPunchIO(unittest.TestCase):
         mol = p.GetObjects(filepath=gui_path+os.sep+"examples"+os.sep+"MgO.pun")[0]
         self.assertEqual(8,len(mol.shell))
 
+    def testGridData(self):
+        """The bulk grid reader gives the same data as the line by line one"""
+        filepath=gui_path+os.sep+"examples"+os.sep+"gamess_vect3d.pun"
+        fields = PunchIO().GetObjects(filepath=filepath)[1:]
+
+        p = PunchIO()
+        p.readers['grid_data'] = p.readers['field_data'] = p.read_grid_data_lines
+        ref = p.GetObjects(filepath=filepath)[1:]
+
+        for field,reffield in zip(fields,ref):
+            self.assertEqual(field.data.tolist(),list(reffield.data))
+            self.assertEqual(field.minmax(),reffield.minmax())
+
+    def testBadGridData(self):
+        """Bad values in grid data are replaced by 999, and left out of the range"""
+        import StringIO
+        p = PunchIO()
+        brik = objects.field.Field()
+        del brik.dim
+        p.records = 3
+        p.elements = 1
+        p.read_grid_data(StringIO.StringIO("1.0\n-2.0\n***\n"),brik)
+        self.assertEqual(brik.data.tolist(),[1.0,-2.0,999.0])
+        self.assertEqual((brik.data_min,brik.data_max),(-2.0,1.0))
+
+class testPunchIndex(unittest.TestCase):
+    """Lazy reading of punchfiles using a PunchIndex"""
+
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def copy_example(self,name):
+        import shutil
+        filepath = os.path.join(self.tmpdir,name)
+        shutil.copy(gui_path+os.sep+"examples"+os.sep+name,filepath)
+        return filepath
+
+    def testIndex(self):
+        """The index finds all the headers, and is cached"""
+        filepath = self.copy_example("gamess_vect3d.pun")
+        index = PunchIndex(filepath)
+        self.assertFalse(index.from_cache)
+        f = open(filepath)
+        headers = [ l for l in f.readlines() if l[:5] == 'block' ]
+        f.close()
+        self.assertEqual(len(index.blocks),len(headers))
+        self.assertEqual(len(index.find('grid_data')),2)
+        for block in index.blocks:
+            f = open(filepath)
+            f.seek(block[0])
+            self.assertEqual(f.readline().replace('=',' ').split()[1],block[3])
+            f.close()
+        self.assertTrue(PunchIndex(filepath).from_cache)
+        self.assertEqual(PunchIndex(filepath).blocks,index.blocks)
+
+    def testLazyFields(self):
+        filepath = self.copy_example("gamess_vect3d.pun")
+        fields = PunchIO().GetObjects(filepath=filepath,otype='fields',lazy=0)
+        lazy = PunchIO().GetObjects(filepath=filepath,otype='fields',lazy=1)
+        self.assertEqual(len(lazy),len(fields))
+        for field,reffield in zip(lazy,fields):
+            self.assertTrue(field.is_deferred('data'))
+            self.assertEqual(field.dim,reffield.dim)
+            self.assertEqual(field.minmax(),reffield.minmax())
+            self.assertFalse(field.is_deferred('data'))
+            self.assertEqual(list(field.data),list(reffield.data))
+
+    def testLazyNormal(self):
+        filepath = self.copy_example("ethane_vib.pun")
+        vibs = PunchIO().GetObjects(filepath=filepath,otype='objects',lazy=0)[0]
+        lazy = PunchIO().GetObjects(filepath=filepath,otype='objects',lazy=1)[0]
+        self.assertEqual(len(lazy.vibs),len(vibs.vibs))
+        for v,refv in zip(lazy.vibs,vibs.vibs):
+            self.assertTrue(v.is_deferred('displacement'))
+            self.assertEqual(v.freq,refv.freq)
+            self.assertEqual(str(v.displacement),str(refv.displacement))
+
+    def testLazyFrames(self):
+        """Frames of a structure sequence are read when they are used"""
+        filepath = os.path.join(self.tmpdir,"sequence.pun")
+        f = open(filepath,'w')
+        f.write("block = fragment.sequence records = 0\n")
+        for name in ['coordinates','update_coordinates','update_coordinates']:
+            f.write("block = %s records = 3 unit = au\n" % name)
+            f.write("o  0.0 0.0 0.0\nh  1.8 0.0 0.0\nh  -0.4 1.7 0.0\n")
+        f.close()
+        seq = PunchIO().GetObjects(filepath=filepath,otype='trajectories',lazy=1)[0]
+        self.assertEqual(len(seq.frames),3)
+        frame = seq.frames[2]
+        self.assertTrue(frame.is_deferred('atom'))
+        self.assertEqual([a.symbol for a in frame.atom],['O','H','H'])
+        self.assertAlmostEqual(frame.atom[1].coord[0],1.8*au_to_angstrom)
+        self.assertEqual(len(frame.bond),2)
+
+class testPunchFollow(unittest.TestCase):
+    """Following a punchfile as it is written"""
+
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir,"follow.pun")
+        self.write("block = fragment.sequence records = 0\n",'w')
+        self.write(self.frame('coordinates'))
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def write(self,txt,mode='a'):
+        f = open(self.filepath,mode)
+        f.write(txt)
+        f.close()
+
+    def frame(self,name,x=0.0):
+        return ("block = %s records = 3 unit = au\n" % name +
+                "o  %f 0.0 0.0\nh  1.8 0.0 0.0\nh  -0.4 1.7 0.0\n" % x)
+
+    def testAppend(self):
+        p = PunchIO()
+        p.follow(self.filepath)
+        seq = p.GetObjects(filepath=self.filepath,otype='trajectories')[0]
+        self.assertEqual(len(seq.frames),1)
+        self.assertEqual(p.update(),0)
+
+        # Two complete frames and one that is still being written
+        txt = self.frame('update_coordinates',1.0) + self.frame('update_coordinates',2.0)
+        partial = self.frame('update_coordinates',3.0)
+        self.write(txt+partial[:60])
+        self.assertEqual(p.update(),2)
+        self.assertEqual(len(seq.frames),3)
+        self.assertAlmostEqual(seq.frames[2].atom[0].coord[0],2.0*au_to_angstrom)
+
+        self.write(partial[60:])
+        self.assertEqual(p.update(),1)
+        self.assertEqual(len(p.trajectories),1)
+        self.assertEqual(len(seq.frames),4)
+        self.assertAlmostEqual(seq.frames[3].atom[0].coord[0],3.0*au_to_angstrom)
+
+    def testPartialHeader(self):
+        p = PunchIO()
+        p.follow(self.filepath)
+        self.write("block = update_coordinates records")
+        self.assertEqual(p.update(),0)
+        self.write(" = 3 unit = au\no 0.0 0.0 0.0\nh 1.8 0.0 0.0\nh -0.4 1.7 0.0\n")
+        self.assertEqual(p.update(),1)
+        self.assertEqual(len(p.trajectories[0].frames),2)
+
+    def testRewrite(self):
+        p = PunchIO()
+        p.follow(self.filepath)
+        self.write("block = fragment records = 0\n",'w')
+        self.write(self.frame('coordinates',0.5))
+        p.update()
+        self.assertEqual(len(p.trajectories),0)
+        self.assertEqual(len(p.molecules),1)
+        self.assertAlmostEqual(p.molecules[0].atom[0].coord[0],0.5*au_to_angstrom)
+
 def testMe():
     """Return a unittest test suite with all the testcases that should be run by the main 
     gui testing framework."""
 
-    return  unittest.TestLoader().loadTestsFromTestCase(testPunchIO)
+    suite = unittest.TestLoader().loadTestsFromTestCase(testPunchIO)
+    suite.addTests( unittest.TestLoader().loadTestsFromTestCase(testPunchIndex) )
+    suite.addTests( unittest.TestLoader().loadTestsFromTestCase(testPunchFollow) )
+    return suite
 
 if __name__ == "__main__":
 
@@ -629,6 +629,37 @@ or use the existing file (No)?" % inputfile )
         if code:
             raise jobmanager.job.JobError("No molecular structure in Punchfile - check output")
 
+    def get_energy(self):
+        """Return the final total energy from the GAMESS-UK output"""
+        directory = self.get_parameter("directory")
+        fname = directory+os.sep+self.get_name()+'.out'
+        if not os.access( fname, os.R_OK ):
+            return None
+        output = GUKOutputIO()
+        try:
+            output.ReadFile(filepath=fname)
+        except Exception,e:
+            print "Error reading energy from %s: %s" % (fname,e)
+            return None
+        if not output.totalEnergies:
+            return None
+        return output.finalTotalEnergy
+
+    def get_result_files(self):
+        """The listing and punchfile are all endjob needs"""
+        root = self.get_parameter("directory")+os.sep+self.get_name()
+        return [root+'.out',root+'.pun']
+
+    def get_version_files(self):
+        """With rungamess the binary is the one in the bin directory next
+        to the script, unless GAMESS_EXE says otherwise"""
+        if not getattr(self,'rungamess',None):
+            return []
+        files = [os.path.join(os.path.dirname(os.path.dirname(self.rungamess)),'bin','gamess')]
+        if os.environ.has_key('GAMESS_EXE'):
+            files.append(os.environ['GAMESS_EXE'])
+        return files
+
     def get_executable_from_job(self,job):
         """
         See if the job has an excutable and set things up depending on
@@ -43,6 +43,7 @@ import unittest
 
 # import internal modules
 from fileio import FileIO
+from linedispatch import LineDispatcher, BUFSIZE
 import objects.zmatrix
 import objects.vibfreq
 from objects.periodic import name_to_element
@@ -281,6 +282,29 @@ class GUKOutputIO( FileIO ):
 
     def _ReadFile(self):
         """ Read a GAMESS-UK Output file"""
+        self.manage = self._define_patterns()
+        dispatcher = LineDispatcher(self.manage)
+
+        # Attempt opening the file. Any exception should be trapped in the methods in the base
+        # class that call this
+        self.fd = open(self.filepath,'r',BUFSIZE)
+        
+        # Loop through the contents of the file a line at a time and parse the contents
+        # (all the patterns are matched against a line in one go)
+        line = self.fd.readline()
+        while line != '' :
+            #jk print line
+            name = dispatcher.dispatch(line)
+            if self.debug and name:
+                print 'Match found %s' % name
+            line = self.fd.readline()
+        #end while
+        self.fd.close()
+        return 
+    #end def
+
+    def _define_patterns(self):
+        """Return the dictionary of the patterns to look for in the output"""
         self.manage  = {}      # Manage holds a tuple with a matching string, and function to handle
         # Define a phrase to search for and the routine to read the data
         self.manage['molsym'] = ( re.compile('^ *molecular point group'), self._read_molecular_symmetry)
@@ -288,7 +312,7 @@ class GUKOutputIO( FileIO ):
 #       The three methods below are redundant now
 #        self.manage['nuclear_coords'] = ( re.compile('^ *nuclear coordinates') , self._read_nuclear_coordinates )
 #        self.manage['atomic_coords'] = ( re.compile('^ *\* *atom  *atomic  *coord') , self._read_molecular_geometry )
-        self.manage['input_zmatrix'] = ( re.compile(' >>>>> zmat',re.IGNORECASE) , self._read_input_zmatrix )
+        self.manage['input_zmatrix'] = ( re.compile(' >>>>> [zZ][mM][aA][tT]') , self._read_input_zmatrix )
         self.manage['variables'] = ( re.compile('^ *variable *value *hessian') , self._read_variables )
         self.manage['zmatrix_auto'] = ( re.compile('^ *automatic z-matrix generation') , self._read_zmatrix_auto )
         self.manage['zmatrix2'] = ( re.compile('^ *z-matrix \(angstroms and degrees\)') , self._read_zmatrix2 )
@@ -316,27 +340,7 @@ class GUKOutputIO( FileIO ):
         self.manage['freq_force'] = ( re.compile('^  *harmonic frequencies ') , self._read_frequencies_force )
         self.manage['drf_area'] = ( re.compile('^  *contact area:') , self._read_DRF_area )
         self.manage['drf'] = ( re.compile('^  *--- quantum system ---') , self._read_DRF )
-        
-        # Attempt opening the file. Any exception should be trapped in the methods in the base
-        # class that call this
-        self.fd = open(self.filepath,'r')
-        
-        # Loop through the contents of the file a line at a time and parse the contents
-        line = self.fd.readline()
-        while line != '' :
-            #jk print line
-            for k in self.manage.keys():
-                if self.manage[k][0].match(line):
-                    if self.debug:
-                        print 'Match found %s' % k
-                    self.manage[k][1](line)
-                    break
-                #end if
-            #end for
-            line = self.fd.readline()
-        #end while
-        self.fd.close()
-        return 
+        return self.manage
     #end def
     
     def _read_optimization_converged(self, line):
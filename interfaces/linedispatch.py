@@ -0,0 +1,214 @@
+#
+#    This file is part of the CCP1 Graphical User Interface (ccp1gui)
+#
+#   (C) 2002-2007 CCLRC Daresbury Laboratory
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+"""Match the lines of program output files against all the patterns
+an output reader is looking for in a single regular expression match.
+
+The output readers (GUKOutputIO, DaltonIO) keep a dictionary, manage,
+holding a (compiled regexp, handler) tuple for each item of data they
+read. Rather than trying each regexp in turn on every line,
+LineDispatcher joins them into one alternation with a named group for
+each pattern, so a line is only matched once:
+
+    dispatcher = LineDispatcher(self.manage)
+    line = fd.readline()
+    while line:
+        dispatcher.dispatch(line)
+        line = fd.readline()
+
+The patterns are tried in the order of manage.keys(), as the loops
+they replace did. Patterns can't use numbered back references. Ones
+compiled with different flags have to go into separate expressions,
+so it is best to avoid flags (eg use [zZ] rather than re.IGNORECASE).
+
+Run "python linedispatch.py benchmark" to compare the speed with
+matching each pattern in turn on the bundled GAMESS-UK outputs.
+"""
+import os,sys
+if __name__ == "__main__":
+    # Need to add the gui directory to the python path so
+    # that all the modules can be imported
+    gui_path = os.path.split(os.path.dirname( os.path.realpath( __file__ ) ))[0]
+    sys.path.append(gui_path)
+else:
+    from viewer.paths import gui_path
+
+import re
+import unittest
+
+# Buffer size to use when opening output files for reading
+BUFSIZE = 1024*1024
+
+class LineDispatcher:
+    """Find which of a dictionary of patterns matches a line and call its handler"""
+
+    def __init__(self,manage):
+        """manage maps a name to a (compiled regexp, handler) tuple"""
+        self.names = {}
+        self.handlers = {}
+        self.order = {}
+        byflags = {}
+        flags = []
+        i = 0
+        for name in manage.keys():
+            regexp,handler = manage[name]
+            group = 'p%d' % i
+            self.names[group] = name
+            self.handlers[group] = handler
+            self.order[group] = i
+            if not byflags.has_key(regexp.flags):
+                byflags[regexp.flags] = []
+                flags.append(regexp.flags)
+            byflags[regexp.flags].append('(?P<%s>%s)' % (group,regexp.pattern))
+            i = i + 1
+
+        self.regexps = []
+        for f in flags:
+            self.regexps.append(re.compile('|'.join(byflags[f]),f))
+
+    def match(self,line):
+        """Return the name of the first pattern that matches line (or None)"""
+        group = self._match(line)
+        if group:
+            return self.names[group]
+        return None
+
+    def dispatch(self,line):
+        """Call the handler for the first pattern that matches line.
+        Returns the name of the pattern or None if none of them match"""
+        group = self._match(line)
+        if group:
+            self.handlers[group](line)
+            return self.names[group]
+        return None
+
+    def _match(self,line):
+        if len(self.regexps) == 1:
+            m = self.regexps[0].match(line)
+            if m:
+                return m.lastgroup
+            return None
+        # Take the earliest of the patterns that match
+        group = None
+        for regexp in self.regexps:
+            m = regexp.match(line)
+            if m and (group is None or self.order[m.lastgroup] < self.order[group]):
+                group = m.lastgroup
+        return group
+
+
+def match_each(manage,line):
+    """Try each of the patterns in turn, the way the readers used to"""
+    for k in manage.keys():
+        if manage[k][0].match(line):
+            return k
+    return None
+
+
+def benchmark(copies=20):
+    """Time the matching of the lines of the GAMESS-UK example outputs
+    (repeated copies times) and the reading of the whole file"""
+    import time
+    import tempfile
+    import glob
+    import gamessukio
+
+    lines = []
+    for filepath in glob.glob(os.path.join(gui_path,'examples','*.out')):
+        f = open(filepath)
+        lines = lines + f.readlines()
+        f.close()
+    lines = lines * copies
+
+    reader = gamessukio.GUKOutputIO()
+    manage = reader._define_patterns()
+    print '%d lines, %d patterns' % (len(lines),len(manage))
+
+    t = time.time()
+    for line in lines:
+        match_each(manage,line)
+    print 'each pattern in turn: %.2fs' % (time.time()-t)
+
+    dispatcher = LineDispatcher(manage)
+    t = time.time()
+    for line in lines:
+        dispatcher.match(line)
+    print 'LineDispatcher:       %.2fs' % (time.time()-t)
+
+    fd,filepath = tempfile.mkstemp(suffix='.out')
+    f = os.fdopen(fd,'w')
+    f.writelines(lines)
+    f.close()
+    try:
+        t = time.time()
+        gamessukio.GUKOutputIO().ReadFile(filepath)
+        print 'GUKOutputIO.ReadFile: %.2fs (%.1f MB)' % (time.time()-t,
+                                                      os.path.getsize(filepath)/1.0e6)
+    finally:
+        os.remove(filepath)
+
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+class testLineDispatcher(unittest.TestCase):
+
+    def testOrder(self):
+        """The first pattern that matches wins"""
+        manage = {}
+        found = []
+        manage['energy'] = ( re.compile('^ *total energy'), found.append )
+        manage['total'] = ( re.compile('^ *total'), found.append )
+        manage['zmat'] = ( re.compile(' >>>>> zmat',re.IGNORECASE), found.append )
+        d = LineDispatcher(manage)
+        for line in [ ' total energy = 1.0', '  total charge', ' >>>>> ZMAT', 'nothing' ]:
+            self.assertEqual(d.dispatch(line),match_each(manage,line))
+        self.assertEqual(len(found),3)
+
+    def testGAMESSUK(self):
+        """Same matches as trying each pattern in turn on a GAMESS-UK output"""
+        import gamessukio
+        manage = gamessukio.GUKOutputIO()._define_patterns()
+        d = LineDispatcher(manage)
+        f = open(os.path.join(gui_path,'examples','SECD_opt.pyridine.6-31G-dp.8x4.out'))
+        matched = 0
+        for line in f.readlines():
+            name = d.match(line)
+            self.assertEqual(name,match_each(manage,line))
+            if name:
+                matched = matched + 1
+        f.close()
+        self.assertTrue(matched > 0)
+
+def testMe():
+    """Return a unittest test suite with all the testcases that should be run by the main
+    gui testing framework."""
+
+    return  unittest.TestLoader().loadTestsFromTestCase(testLineDispatcher)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        benchmark()
+    else:
+        unittest.main()
@@ -523,6 +523,29 @@ class MOLPROCalc(qm.QMCalc):
         if code:
             raise JobError, "No molecular structure in Punchfile - check output"
 
+    def get_energy(self):
+        """Return the last energy printed on a '!' summary line of the
+        Molpro output (e.g. "!RHF STATE 1.1 Energy  -76.0267")"""
+        fname = self.get_parameter("directory")+os.sep+self.get_name()+'.out'
+        if not os.access( fname, os.R_OK ):
+            return None
+        energy = None
+        fp = open(fname,'r')
+        for a in fp.readlines():
+            a = string.strip(a)
+            if a[:1] == '!' and string.find(string.lower(a),'energy') != -1:
+                try:
+                    energy = float(string.split(a)[-1])
+                except ValueError:
+                    pass
+        fp.close()
+        return energy
+
+    def get_result_files(self):
+        """The listing, XML and Molden files written by the job"""
+        root = self.get_parameter("directory")+os.sep+self.get_name()
+        return [root+'.out',root+'.xml',root+'.molden']
+
     def get_executable(self,job):
         """Return the path to the Molpro Executable"""
         global find_exe
@@ -176,6 +176,23 @@ class MopacCalc(qm.QMCalc):
         self.results = [ self.ReadMopacOutput(self.outfile,mol) ]
         self.store_results_to_gui()
 
+    def get_energy(self):
+        """Return the final heat of formation (kcal/mol) from the MOPAC output"""
+        fname = self.get_name()+'.out'
+        if not os.access( fname, os.R_OK ):
+            return None
+        energy = None
+        fp = open(fname,'r')
+        for a in fp.readlines():
+            a = string.strip(a)
+            if a[0:10] == 'FINAL HEAT':
+                try:
+                    energy = float(string.split(string.split(a,'=')[1])[0])
+                except (IndexError,ValueError):
+                    pass
+        fp.close()
+        return energy
+
     def ReadMopacOutput(self,file,oldmol):
         """Loading of results from Mopac output file
 
@@ -24,6 +24,7 @@ import jobmanager.job
 import jobmanager.ccp1gui_subprocess
 import jobmanager.jobeditor
 import jobmanager.jobthread
+import jobmanager.scheduler
 
 if sys.platform[:3] == 'win':
     import jobmanager.winprocess
@@ -41,12 +42,27 @@ if sys.platform[:3] == 'win':
 
 class JobManager:
 
-    def __init__(self):
+    def __init__(self,ncores=None):
         self.registered_jobs = []
+        # Queue for jobs that run on this machine
+        self.scheduler = jobmanager.scheduler.Scheduler(ncores=ncores)
 
     def RegisterJob(self,job):
         if job not in self.registered_jobs:
             self.registered_jobs.append(job)
+
+    def SubmitJob(self,job,ncores=None,priority=None):
+        """Register a job and queue it to run when enough cores are free"""
+        self.RegisterJob(job)
+        return self.scheduler.submit(job,ncores=ncores,priority=priority)
+
+    def StartJob(self,job):
+        """Start a job: local jobs are queued, others get a thread straight away"""
+        if isinstance(job,jobmanager.job.LocalJob):
+            self.SubmitJob(job)
+        else:
+            self.RegisterJob(job)
+            jobmanager.jobthread.JobThread(job).start()
         
     def RemoveJob(self,job):
         self.registered_jobs.remove(job)
@@ -29,7 +29,7 @@ allocate_scratch, delete_file, execute_shell etc
 Subclasses for real jobs:
 
 LocalJob(Job)
-   based on subprocess.Spawn for the main step
+   based on subprocess.Spawn (processloop.LoopSpawn on UNIX) for the main step
             subprocess.Pipe for file operations
 
 LocalJobNoSpawn(Job)
@@ -56,6 +56,7 @@ if __name__ == "__main__":
     sys.path.append(gui_path)
 
 import ccp1gui_subprocess
+import processloop
 import re
 import time
 import copy
@@ -86,6 +87,7 @@ CLEAN_SCRATCH='clean-scratch'
 PYTHON_CMD='python-code'
 #
 JOBSTATUS_IDLE    = 'Idle'
+JOBSTATUS_QUEUED  = 'Queued'
 JOBSTATUS_RUNNING = 'Running'
 JOBSTATUS_KILLPEND= 'Kill Pending'
 JOBSTATUS_KILLED  = 'Killed'
@@ -804,9 +806,11 @@ class LocalJob(Job):
 
         else:
             # Unix code
-            self.process = ccp1gui_subprocess.Spawn(step.local_command,
-                                            args=step.local_command_args,
-                                            debug=self.debug)
+            # The child is followed by the shared process loop, so wait returns
+            # as soon as it exits and only the tail of stderr is kept
+            self.process = processloop.LoopSpawn(step.local_command,
+                                                 args=step.local_command_args,
+                                                 debug=self.debug)
             if self.debug:
                 print "Background job: run_app cmd: ",self.process.cmd_as_string()
 
@@ -826,6 +830,10 @@ class LocalJob(Job):
             self.process.run(stdin=stdin, stdout=stdout)
             
             code = self.process.wait()
+            if stdin:
+                stdin.close()
+            if stdout:
+                stdout.close()
             if code != 0: 
                 msg = ""
                 for tt in self.process.error:
@@ -38,6 +38,7 @@ import Tkinter
 import Pmw
 
 import jobmanager
+import jobmanager.resultcache
 # jmht - looks like not needed
 #import jobmanager.ccp1gui_subprocess
 #from jobmanager.job import *
@@ -148,6 +149,11 @@ class JobEditor(Pmw.MegaToplevel):
                                                command=self.__kill_job)
         self.kill.pack(side='left') 
 
+        self.cachelabel = self.createcomponent('cachelabel', (), None,
+                                               Tkinter.Label,(self.line,),
+                                               text='')
+        self.cachelabel.pack(side='left',padx=10)
+
 #         self.suspendbutton =       self.createcomponent('suspendbutton', (), None,
 #                                                Tkinter.Button,(self.line,),
 #                                                text="Suspend",
@@ -188,6 +194,10 @@ class JobEditor(Pmw.MegaToplevel):
             return
         
         for job in jobs:
+            if job.status == jobmanager.job.JOBSTATUS_QUEUED:
+                # Not started yet, so just take it out of the queue
+                self.manager.scheduler.cancel( job )
+                continue
             try:
                 job.kill()
                 #self.manager.RemoveJob( job )
@@ -236,6 +246,11 @@ class JobEditor(Pmw.MegaToplevel):
             else:
                 yyy = ''
 
+            record = self.manager.scheduler.get_record(job)
+            if record and job.status == jobmanager.job.JOBSTATUS_QUEUED:
+                yyy = 'waiting %ds, %d job(s) queued' % (record.wait_time(),
+                                                         self.manager.scheduler.queue_depth())
+
             txt = '%-7d : %-20s : %-8s : %-10s : %s' % (i+1,job.host,job.name,job.status,yyy)
             items.append(txt)
 
@@ -319,6 +334,14 @@ class JobEditor(Pmw.MegaToplevel):
             # Increment the job counter
             i = i + 1
 
+        cache = jobmanager.resultcache.get_cache()
+        if cache:
+            stats = cache.statistics()
+            txt = 'Result cache: %d hits, %d misses, %d entries (%.1f MB)' % \
+                  (stats['hits'],stats['misses'],stats['entries'],stats['bytes']/1048576.0)
+            if txt != self.cachelabel.cget('text'):
+                self.cachelabel.configure(text=txt)
+
         if items != self.old_items:
             old_sel = self.sel.curselection()
             self.sel.setlist(items)
@@ -387,10 +410,8 @@ class JobEditor(Pmw.MegaToplevel):
             if job.thread.isAlive():
                 raise JobError,"This calculation is running already!"
 
-        jobmanager.jobthread.JobThread(job).start()
-        
-        if job not in self.manager.registered_jobs:
-            self.manager.RegisterJob(job)
+        # Local jobs wait in the queue until there are enough free cores
+        self.manager.StartJob(job)
 
     def suspend(self):
         """
@@ -0,0 +1,520 @@
+#
+#    This file is part of the CCP1 Graphical User Interface (ccp1gui)
+#
+#   (C) 2002-2005 CCLRC Daresbury Laboratory
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+"""Event driven management of child processes (UNIX only)
+
+A single ProcessLoop thread sits in poll() on the stdout and stderr
+pipes of every running child, so no thread ever sleeps and retries.
+The loop also has one extra pipe per child, which the child holds
+open until it exits. This means the end of a job is noticed as soon
+as it happens, even when its output goes to files.
+
+With no children running the loop thread blocks indefinitely and
+causes no wakeups.
+
+Output is kept in a RingBuffer that holds only the last maxlines
+lines. An on_output callback can be given to watch the output as it
+arrives.
+"""
+import os
+import sys
+import errno
+import select
+import signal
+import threading
+import time
+import traceback
+import collections
+import unittest
+
+import ccp1gui_subprocess
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Code returned by wait() if the process is still running when it times out
+# (as for Spawn on windows)
+STILL_RUNNING = 999
+
+def set_cloexec(fd):
+    """Don't let children started with exec inherit this descriptor"""
+    flags = fcntl.fcntl(fd,fcntl.F_GETFD)
+    fcntl.fcntl(fd,fcntl.F_SETFD,flags | fcntl.FD_CLOEXEC)
+
+def set_nonblocking(fd):
+    flags = fcntl.fcntl(fd,fcntl.F_GETFL)
+    fcntl.fcntl(fd,fcntl.F_SETFL,flags | os.O_NONBLOCK)
+
+class RingBuffer:
+    """Keep the last maxlines lines written to a stream
+
+    Data is fed in arbitrary chunks; lines are split on newlines and an
+    unterminated last line is held until more data (or the end of the
+    stream) arrives. dropped counts the lines that have been discarded.
+    """
+
+    def __init__(self,maxlines=1000):
+        self.lines = collections.deque(maxlen=maxlines)
+        self.partial = ''
+        self.dropped = 0
+
+    def feed(self,data):
+        """Add a chunk of data and return the complete lines it finished"""
+        new = (self.partial + data).split('\n')
+        self.partial = new.pop()
+        new = [line + '\n' for line in new]
+        self.append(new)
+        return new
+
+    def flush(self):
+        """Complete any unterminated last line; returns it as a list"""
+        if not self.partial:
+            return []
+        new = [self.partial]
+        self.partial = ''
+        self.append(new)
+        return new
+
+    def append(self,lines):
+        overflow = len(self.lines) + len(lines) - self.lines.maxlen
+        if overflow > 0:
+            self.dropped = self.dropped + overflow
+        self.lines.extend(lines)
+
+    def __iter__(self):
+        return iter(list(self.lines))
+
+    def __len__(self):
+        return len(self.lines)
+
+    def get_lines(self):
+        return list(self.lines)
+
+    def get_text(self):
+        return ''.join(self.lines)
+
+class ProcessLoop:
+    """One thread that multiplexes the pipes of all running children
+
+    Children are added with watch(); the thread is started the first
+    time it has something to do.
+    """
+
+    def __init__(self,debug=0):
+        self.debug = debug
+        self.lock = threading.Lock()
+        self.thread = None
+        # Descriptors waiting to be handed to the loop thread
+        self.pending = []
+        # fd -> (process, stream name) for the descriptors being polled
+        self.streams = {}
+        # Processes whose pipes have all closed but that haven't been reaped
+        self.reaping = []
+
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        for fd in self.wakeup_read, self.wakeup_write:
+            set_cloexec(fd)
+            set_nonblocking(fd)
+        self.poller = select.poll()
+        self.poller.register(self.wakeup_read,select.POLLIN)
+
+    def watch(self,process,fds):
+        """Poll the given {name : fd} pipes of a running process"""
+        self.lock.acquire()
+        try:
+            for name,fd in fds.items():
+                self.pending.append((fd,process,name))
+            if not self.thread:
+                self.thread = threading.Thread(None,self.run,"ProcessLoop")
+                self.thread.setDaemon(1)
+                self.thread.start()
+        finally:
+            self.lock.release()
+        self.wakeup()
+
+    def wakeup(self):
+        try:
+            os.write(self.wakeup_write,'x')
+        except OSError,e:
+            # The pipe is full so there is a wakeup pending anyway
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def run(self):
+        """The loop thread"""
+        delay = 0.01
+        while 1:
+            if self.reaping:
+                # Rare; a child that closed its pipes without exiting
+                timeout = int(delay * 1000)
+                delay = min(2 * delay,1.0)
+            else:
+                timeout = -1
+                delay = 0.01
+            try:
+                events = self.poller.poll(timeout)
+            except select.error,e:
+                if e[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd,event in events:
+                if fd == self.wakeup_read:
+                    self.add_pending()
+                else:
+                    self.read(fd)
+            self.reap()
+
+    def add_pending(self):
+        try:
+            while os.read(self.wakeup_read,4096):
+                pass
+        except OSError,e:
+            if e.errno != errno.EAGAIN:
+                raise
+        self.lock.acquire()
+        try:
+            pending = self.pending
+            self.pending = []
+        finally:
+            self.lock.release()
+        for fd,process,name in pending:
+            set_nonblocking(fd)
+            self.streams[fd] = (process,name)
+            self.poller.register(fd,select.POLLIN)
+
+    def read(self,fd):
+        process,name = self.streams[fd]
+        try:
+            data = os.read(fd,65536)
+        except OSError,e:
+            if e.errno in (errno.EAGAIN,errno.EINTR):
+                return
+            data = ''
+        if data:
+            self.call(process.stream_data,name,data)
+            return
+        # End of file
+        self.poller.unregister(fd)
+        del self.streams[fd]
+        os.close(fd)
+        if self.call(process.stream_closed,name):
+            self.reaping.append(process)
+
+    def reap(self):
+        for process in self.reaping[:]:
+            try:
+                pid,status = os.waitpid(process.pid,os.WNOHANG)
+            except OSError,e:
+                if e.errno != errno.ECHILD:
+                    raise
+                # Somebody else collected it
+                pid,status = process.pid,-1
+            if pid:
+                self.reaping.remove(process)
+                self.call(process.exited,status)
+
+    def call(self,method,*args):
+        """Call back to a process without letting errors stop the loop"""
+        try:
+            return method(*args)
+        except Exception:
+            traceback.print_exc()
+
+# The loop shared by all LoopSpawn processes
+_loop = None
+_loop_lock = threading.Lock()
+
+def get_loop():
+    """Return the process loop, creating it the first time"""
+    global _loop
+    _loop_lock.acquire()
+    try:
+        if not _loop:
+            _loop = ProcessLoop()
+        return _loop
+    finally:
+        _loop_lock.release()
+
+class LoopSpawn(ccp1gui_subprocess.SubProcess):
+    """fork a command and follow it from the ProcessLoop
+
+    Used in the same way as ccp1gui_subprocess.Spawn: run() takes open
+    files for stdin/stdout/stderr, wait() returns the exit status from
+    waitpid and kill() kills the child's process group. Output that
+    isn't sent to a file is kept in the RingBuffers self.output and
+    self.error; on_output(name,line) is called from the loop thread for
+    each line as it arrives.
+    """
+
+    def __init__(self,cmd,args=None,maxlines=1000,on_output=None,loop=None,**kw):
+        ccp1gui_subprocess.SubProcess.__init__(self,cmd,args=args,**kw)
+        self.output = RingBuffer(maxlines)
+        self.error = RingBuffer(maxlines)
+        self.on_output = on_output
+        self.loop = loop
+        self.pid = None
+        self.code = None
+        self.open_streams = 0
+        self.finished = threading.Event()
+
+    def run(self,stdin=None,stdout=None,stderr=None):
+        """fork/exec the command; returns SPAWNED or FAILED"""
+        if not self.loop:
+            self.loop = get_loop()
+
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+
+        # The child keeps the write end of this open until it exits
+        parent_fds = {}
+        child_fds = []
+        sentinel_read, sentinel_write = os.pipe()
+        parent_fds['exit'] = sentinel_read
+        child_fds.append(sentinel_write)
+        if stdout:
+            child_stdout = stdout.fileno()
+        else:
+            parent_fds['stdout'], child_stdout = os.pipe()
+            child_fds.append(child_stdout)
+        if stderr:
+            child_stderr = stderr.fileno()
+        else:
+            parent_fds['stderr'], child_stderr = os.pipe()
+            child_fds.append(child_stderr)
+        for fd in parent_fds.values():
+            set_cloexec(fd)
+
+        if self.args:
+            argv = [self.cmd] + self.args
+        else:
+            argv = [self.cmd]
+        if self.debug:
+            print 'LoopSpawn: os.execvp(%s,%s)' % (self.cmd,argv)
+
+        try:
+            self.pid = os.fork()
+        except OSError,e:
+            print 'LoopSpawn: fork failed',e
+            for fd in parent_fds.values() + child_fds:
+                os.close(fd)
+            self.status = ccp1gui_subprocess.FAILED
+            return self.status
+
+        if not self.pid:
+            # Child code; nothing here may return to the caller
+            try:
+                if stdin:
+                    os.dup2(stdin.fileno(),0)
+                else:
+                    null = os.open(os.devnull,os.O_RDONLY)
+                    os.dup2(null,0)
+                os.dup2(child_stdout,1)
+                os.dup2(child_stderr,2)
+                os.dup2(sentinel_write,3)
+                try:
+                    maxfd = os.sysconf('SC_OPEN_MAX')
+                except (AttributeError,ValueError):
+                    maxfd = 256
+                os.closerange(4,maxfd)
+                # Make the child a process group leader so kill() gets its children too
+                os.setsid()
+                os.nice(19)
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                os.execvp(self.cmd,argv)
+            except Exception,e:
+                os.write(2,"Error trying to execute: os.execvp(%s,%s)\n%s\n" % (self.cmd,argv,e))
+            os._exit(127)
+
+        # Parent
+        for fd in child_fds:
+            os.close(fd)
+        self.open_streams = len(parent_fds)
+        self.status = ccp1gui_subprocess.SPAWNED
+        self.loop.watch(self,parent_fds)
+        return self.status
+
+    def stream_data(self,name,data):
+        """Called from the loop thread with a chunk of output"""
+        if name == 'stdout':
+            lines = self.output.feed(data)
+        elif name == 'stderr':
+            lines = self.error.feed(data)
+        else:
+            return
+        if self.on_output:
+            for line in lines:
+                self.on_output(name,line)
+
+    def stream_closed(self,name):
+        """Called from the loop thread; returns 1 once all the pipes are closed"""
+        if name == 'stdout':
+            lines = self.output.flush()
+        elif name == 'stderr':
+            lines = self.error.flush()
+        else:
+            lines = []
+        if self.on_output:
+            for line in lines:
+                self.on_output(name,line)
+        self.open_streams = self.open_streams - 1
+        return self.open_streams == 0
+
+    def exited(self,code):
+        """Called from the loop thread once the child has been reaped"""
+        self.code = code
+        if self.status != ccp1gui_subprocess.KILLED:
+            self.status = ccp1gui_subprocess.EXITED
+        if self.debug:
+            print 'LoopSpawn: pid %d exited with status %d' % (self.pid,code)
+        self.finished.set()
+        if self.on_end:
+            self.on_end()
+
+    def wait(self,timeout=None):
+        """Wait for the child to finish and return its status
+
+        timeout is in seconds; STILL_RUNNING is returned if it expires first.
+        """
+        if self.status == ccp1gui_subprocess.FAILED:
+            return -1
+        if not self.pid:
+            return -2
+        if timeout is None:
+            # an untimed wait blocks rather than polling
+            self.finished.wait()
+        else:
+            self.finished.wait(timeout)
+        if not self.finished.isSet():
+            return STILL_RUNNING
+        return self.code
+
+    def poll(self):
+        """Return the exit status, or None if the child is still running"""
+        return self.code
+
+    def kill(self):
+        if not self.pid or self.finished.isSet():
+            return -1
+        if self.debug:
+            print 'LoopSpawn: killing process group',self.pid
+        try:
+            os.kill(-self.pid,signal.SIGKILL)
+        except OSError,e:
+            print "kill of process %d failed" % self.pid
+            print e
+            return -1
+        self.status = ccp1gui_subprocess.KILLED
+        # The exit status is returned by wait
+        return 0
+
+    def get_output(self):
+        return self.output.get_lines()
+
+    def get_error(self):
+        return self.error.get_lines()
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+class LoopSpawnTestCases(unittest.TestCase):
+
+    def testEcho(self):
+        p = LoopSpawn('echo',['a','b'])
+        self.assertEqual(p.run(),ccp1gui_subprocess.SPAWNED)
+        self.assertEqual(p.wait(),0)
+        self.assertEqual(p.get_output(),['a b\n'])
+        self.assertEqual(p.get_error(),[])
+
+    def testStderrAndCode(self):
+        lines = []
+        def on_output(name,line):
+            lines.append((name,line))
+        p = LoopSpawn('sh',['-c','echo out; echo err >&2; printf tail; exit 3'],
+                      on_output=on_output)
+        p.run()
+        self.assertEqual(p.wait(),3 << 8)
+        self.assertEqual(p.get_output(),['out\n','tail'])
+        self.assertEqual(p.get_error(),['err\n'])
+        lines.sort()
+        self.assertEqual(lines,[('stderr','err\n'),('stdout','out\n'),('stdout','tail')])
+
+    def testRingBuffer(self):
+        """Only the last maxlines lines are kept"""
+        p = LoopSpawn('seq',['1','5000'],maxlines=100)
+        p.run()
+        self.assertEqual(p.wait(),0)
+        self.assertEqual(len(p.output),100)
+        self.assertEqual(p.output.dropped,4900)
+        self.assertEqual(p.get_output()[0],'4901\n')
+        self.assertEqual(p.get_output()[-1],'5000\n')
+
+    def testFileOutput(self):
+        """The end of the job is seen with no pipes to read"""
+        o = open('test.out','w')
+        e = open('test.err','w')
+        p = LoopSpawn('echo',['a','b'])
+        p.run(stdout=o,stderr=e)
+        self.assertEqual(p.wait(timeout=30),0)
+        o.close()
+        e.close()
+        self.assertEqual(open('test.out').readlines(),['a b\n'])
+        os.remove('test.out')
+        os.remove('test.err')
+
+    def testKill(self):
+        p = LoopSpawn('sleep',['30'])
+        p.run()
+        self.assertEqual(p.wait(timeout=0.1),STILL_RUNNING)
+        t = time.time()
+        self.assertEqual(p.kill(),0)
+        self.assertEqual(p.wait(timeout=30),signal.SIGKILL)
+        self.assert_(time.time() - t < 1.0)
+
+    def testLatency(self):
+        """Many children finish in one loop and are noticed promptly"""
+        procs = [LoopSpawn('sleep',['0.2']) for i in range(20)]
+        t = time.time()
+        for p in procs:
+            p.run()
+        for p in procs:
+            self.assertEqual(p.wait(timeout=30),0)
+        self.assert_(time.time() - t < 1.0)
+
+    def testBadCommand(self):
+        p = LoopSpawn('no-such-command-ccp1gui')
+        p.run()
+        self.assertEqual(p.wait(timeout=30),127 << 8)
+        self.assert_(p.get_error())
+
+def testMe():
+    """Return a unittest test suite with all the testcases that should be run by the main
+    gui testing framework."""
+    return unittest.TestLoader().loadTestsFromTestCase(LoopSpawnTestCases)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,476 @@
+#
+#    This file is part of the CCP1 Graphical User Interface (ccp1gui)
+#
+#   (C) 2002-2007 CCLRC Daresbury Laboratory
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+"""A disk cache of calculation results keyed by their input
+
+The key is a SHA1 hash of the program name, the command that runs it
+and the text of the input file. The command is looked up on the PATH
+and the size and date of the executable are included, along with
+those of any files named by the calculation's get_version_files (eg
+the binary that a run script starts), so a rebuilt program misses.
+Each entry is a directory
+
+  <cache directory>/<first 2 characters of key>/<key>/
+
+holding the output files of the job (named by what follows the job
+name, e.g. '.out' and '.pun', so they can be restored under another
+job name) and a 'used' file whose date is the time the entry was last
+used. The result objects are not stored, the tidy function of the job
+makes them from the restored files as it has to run anyway to load
+them into the GUI. The index of entries
+is rebuilt from the directory when the GUI starts. The least recently
+used entries are removed when the total size goes over the budget.
+
+cache_job wraps a job made by a calculation's makejob: on a hit the
+job steps are replaced with one that copies the cached files into
+place, so the tidy function reads them as if the program had run; on
+a miss the tidy function is wrapped to store the files afterwards.
+Calculations take part by returning the paths of their output files
+from get_result_files.
+"""
+import os
+import sys
+import stat
+import time
+import shutil
+import tempfile
+import threading
+import hashlib
+import unittest
+
+import jobmanager.job
+from viewer.defaults import defaults
+
+USED_FILE = 'used'
+
+class CacheEntry:
+    """The files stored for one key"""
+
+    def __init__(self,key,path):
+        self.key = key
+        self.path = path
+
+    def get_files(self):
+        """Return the names (suffixes) of the stored output files"""
+        files = os.listdir(self.path)
+        files.sort()
+        return [f for f in files if f != USED_FILE]
+
+    def restore(self,directory,name):
+        """Copy the output files into directory as name+suffix; returns 0"""
+        for suffix in self.get_files():
+            shutil.copyfile(os.path.join(self.path,suffix),
+                            os.path.join(directory,name+suffix))
+        return 0
+
+class ResultCache:
+    """Content addressed store of calculation outputs with LRU eviction
+
+    budget is the maximum total size in bytes.
+    """
+
+    def __init__(self,directory,budget=500*1024*1024,debug=None):
+        self.directory = directory
+        self.budget = budget
+        self.debug = debug
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        # key -> [size in bytes, time last used]
+        self.index = {}
+        self.nbytes = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.scan()
+
+    def scan(self):
+        """Rebuild the index from the entries on disk"""
+        self.index = {}
+        self.nbytes = 0
+        for prefix in os.listdir(self.directory):
+            subdir = os.path.join(self.directory,prefix)
+            if prefix[:3] == 'tmp':
+                # left over from an interrupted store
+                shutil.rmtree(subdir,ignore_errors=1)
+                continue
+            if len(prefix) != 2 or not os.path.isdir(subdir):
+                continue
+            for key in os.listdir(subdir):
+                path = os.path.join(subdir,key)
+                size = 0
+                for f in os.listdir(path):
+                    size = size + os.path.getsize(os.path.join(path,f))
+                try:
+                    used = os.path.getmtime(os.path.join(path,USED_FILE))
+                except OSError:
+                    used = os.path.getmtime(path)
+                self.index[key] = [size,used]
+                self.nbytes = self.nbytes + size
+
+    def make_key(self,program,command,text):
+        """Return the key for a run of command on the input text"""
+        h = hashlib.sha1()
+        h.update(str(program))
+        h.update('\0')
+        h.update(str(command))
+        h.update('\0')
+        h.update(text)
+        return h.hexdigest()
+
+    def entry_path(self,key):
+        return os.path.join(self.directory,key[:2],key)
+
+    def lookup(self,key):
+        """Return the CacheEntry for key (counting a hit) or None (a miss)"""
+        self.lock.acquire()
+        try:
+            path = self.entry_path(key)
+            if self.index.has_key(key) and os.path.isdir(path):
+                self.hits = self.hits + 1
+                now = time.time()
+                self.index[key][1] = now
+                os.utime(os.path.join(path,USED_FILE),(now,now))
+                return CacheEntry(key,path)
+            self.misses = self.misses + 1
+            return None
+        finally:
+            self.lock.release()
+
+    def store(self,key,name,files):
+        """Store the output files of job name (a list of paths) under key
+
+        Files are stored by what follows name in their filename.
+        """
+        self.lock.acquire()
+        try:
+            path = self.entry_path(key)
+            if os.path.isdir(path):
+                return CacheEntry(key,path)
+
+            # Build the entry to one side and rename it into place so a
+            # half written entry is never seen
+            tmp = tempfile.mkdtemp(prefix='tmp',dir=self.directory)
+            size = 0
+            for fname in files:
+                if not os.access(fname,os.R_OK):
+                    continue
+                base = os.path.basename(fname)
+                if base[:len(name)] == name:
+                    base = base[len(name):]
+                shutil.copyfile(fname,os.path.join(tmp,base))
+                size = size + os.path.getsize(fname)
+            open(os.path.join(tmp,USED_FILE),'w').close()
+
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            os.rename(tmp,path)
+            self.index[key] = [size,time.time()]
+            self.nbytes = self.nbytes + size
+            if self.debug:
+                print 'ResultCache: stored %s (%d bytes)' % (key,size)
+            self.evict()
+            return CacheEntry(key,path)
+        finally:
+            self.lock.release()
+
+    def evict(self):
+        """Remove least recently used entries until we are within budget"""
+        if self.nbytes <= self.budget:
+            return
+        order = [(used,key) for key,(size,used) in self.index.items()]
+        order.sort()
+        # keep at least the newest entry
+        for used,key in order[:-1]:
+            if self.nbytes <= self.budget:
+                break
+            self.remove(key)
+
+    def remove(self,key):
+        self.lock.acquire()
+        try:
+            size,used = self.index[key]
+            del self.index[key]
+            self.nbytes = self.nbytes - size
+            path = self.entry_path(key)
+            shutil.rmtree(path,ignore_errors=1)
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        for key in self.index.keys():
+            self.remove(key)
+
+    def statistics(self):
+        """Return a dictionary with the hit and miss counts and the size"""
+        return { 'hits'   : self.hits,
+                 'misses' : self.misses,
+                 'entries': len(self.index),
+                 'bytes'  : self.nbytes }
+
+# The cache used by the GUI, made when first asked for
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Return the result cache or None if it has been switched off"""
+    global _cache
+    if not defaults.get_value('result_cache'):
+        return None
+    _cache_lock.acquire()
+    try:
+        if not _cache:
+            directory = defaults.get_value('result_cache_dir')
+            if not directory:
+                directory = os.path.join(os.path.expanduser('~'),'.ccp1gui_cache')
+            budget = defaults.get_value('result_cache_size') * 1024 * 1024
+            try:
+                _cache = ResultCache(directory,budget=budget)
+            except (IOError,OSError),e:
+                print 'Cannot use result cache directory %s: %s' % (directory,e)
+                return None
+        return _cache
+    finally:
+        _cache_lock.release()
+
+def job_key(calc,job,cache):
+    """Return the cache key for the job made by calc, or None
+
+    The input is read from the stdin file of the job if there is one,
+    otherwise from the "input_file" input of the calculation.
+    """
+    step = None
+    for s in job.steps:
+        if s.type in [jobmanager.job.RUN_APP,jobmanager.job.RUN_APP_BASH]:
+            step = s
+    if not step:
+        return None
+
+    text = None
+    stdin_file = step.stdin_file
+    if stdin_file and not os.path.isabs(stdin_file):
+        stdin_file = os.path.join(calc.get_parameter("directory"),stdin_file)
+    if stdin_file and os.access(stdin_file,os.R_OK):
+        f = open(stdin_file,'r')
+        text = f.read()
+        f.close()
+    else:
+        inputf = calc.get_input("input_file")
+        if inputf:
+            text = ''.join(inputf)
+    if not text:
+        return None
+
+    command = [step.local_command] + (step.local_command_args or [])
+    # Include the size and date of the executables so a new build doesn't hit
+    files = [find_command(step.local_command)] + calc.get_version_files()
+    for path in files:
+        if path and os.path.isfile(path):
+            st = os.stat(path)
+            command = command + [path,st[stat.ST_SIZE],st[stat.ST_MTIME]]
+    return cache.make_key(calc.get_program(),command,text)
+
+def find_command(command):
+    """Return the path of the file that command runs, looking along the
+    PATH for a bare name, or None"""
+    if not command:
+        return None
+    if os.path.dirname(command):
+        return os.path.abspath(command)
+    for dir in os.environ.get('PATH','').split(os.pathsep):
+        path = os.path.join(dir,command)
+        if os.path.isfile(path) and os.access(path,os.X_OK):
+            return path
+    return None
+
+def cache_job(calc,job,cache=None,key=None):
+    """Make a job use cached results, or store its results when done
+
+    Returns the job, which is changed in place.
+    """
+    if not cache:
+        cache = get_cache()
+    if not cache:
+        return job
+    files = calc.get_result_files()
+    if not files:
+        return job
+    if not key:
+        key = job_key(calc,job,cache)
+    if not key:
+        return job
+
+    name = calc.get_name()
+    directory = calc.get_parameter("directory")
+    entry = cache.lookup(key)
+    if entry:
+        print 'Using cached results for %s' % name
+        job.clear_steps()
+        job.add_step(jobmanager.job.PYTHON_CMD,'restore cached results',
+                     proc=lambda e=entry,d=directory,n=name: e.restore(d,n))
+        return job
+
+    tidy = job.tidy
+    def store_results(code,tidy=tidy):
+        if tidy:
+            tidy(code)
+        if not code:
+            cache.store(key,name,calc.get_result_files())
+    job.add_tidy(store_results)
+    return job
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+class FakeCalc:
+    """Just what cache_job needs from a calculation"""
+
+    def __init__(self,directory,name,text):
+        self.directory = directory
+        self.name = name
+        self.text = text
+        self.version_files = []
+
+    def get_program(self):
+        return 'Fake'
+
+    def get_name(self):
+        return self.name
+
+    def get_parameter(self,name):
+        return self.directory
+
+    def get_input(self,name):
+        return [self.text]
+
+    def get_result_files(self):
+        return [os.path.join(self.directory,self.name+'.out')]
+
+    def get_version_files(self):
+        return self.version_files
+
+    def makejob(self):
+        """The 'program' copies the input to the output"""
+        base = os.path.join(self.directory,self.name)
+        f = open(base+'.in','w')
+        f.write(self.text+'\n')
+        f.close()
+        job = jobmanager.job.LocalJob()
+        job.add_step(jobmanager.job.RUN_APP,'run',local_command='cat',
+                     stdin_file=base+'.in',stdout_file=base+'.out')
+        job.add_tidy(self.endjob)
+        self.tidied = 0
+        return job
+
+    def endjob(self,code):
+        self.tidied = self.tidied + 1
+
+class ResultCacheTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.directory,'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_calc(self,cache,name,text):
+        calc = FakeCalc(self.directory,name,text)
+        job = cache_job(calc,calc.makejob(),cache)
+        self.assertEqual(job.run(),0)
+        job.tidy(0)
+        self.assertEqual(calc.tidied,1)
+        return calc,job
+
+    def testHitAndMiss(self):
+        cache = ResultCache(self.cachedir)
+        calc,job = self.run_calc(cache,'a','water')
+        self.assertEqual(job.steps[0].type,jobmanager.job.RUN_APP)
+        self.assertEqual(cache.statistics()['misses'],1)
+
+        # Same input under another name is restored, not run
+        calc,job = self.run_calc(cache,'b','water')
+        self.assertEqual(len(job.steps),1)
+        self.assertEqual(job.steps[0].type,jobmanager.job.PYTHON_CMD)
+        self.assertEqual(open(os.path.join(self.directory,'b.out')).read(),'water\n')
+        stats = cache.statistics()
+        self.assertEqual((stats['hits'],stats['misses'],stats['entries']),(1,1,1))
+
+        key = job_key(calc,calc.makejob(),cache)
+        self.assertEqual(cache.lookup(key).get_files(),['.out'])
+
+        # A different input misses
+        calc,job = self.run_calc(cache,'c','ammonia')
+        self.assertEqual(job.steps[0].type,jobmanager.job.RUN_APP)
+
+    def testVersion(self):
+        """A rebuilt program gives a new key"""
+        cache = ResultCache(self.cachedir)
+        self.assertEqual(os.path.basename(find_command('cat')),'cat')
+        self.assert_(os.path.isabs(find_command('cat')))
+        calc = FakeCalc(self.directory,'a','water')
+        binary = os.path.join(self.directory,'binary')
+        open(binary,'w').write('version 1')
+        calc.version_files = [binary]
+        key = job_key(calc,calc.makejob(),cache)
+        self.assertEqual(job_key(calc,calc.makejob(),cache),key)
+        open(binary,'w').write('version 1.1')
+        self.assertNotEqual(job_key(calc,calc.makejob(),cache),key)
+
+    def testRestart(self):
+        cache = ResultCache(self.cachedir)
+        self.run_calc(cache,'a','water')
+        nbytes = cache.nbytes
+
+        cache = ResultCache(self.cachedir)
+        self.assertEqual(cache.nbytes,nbytes)
+        calc,job = self.run_calc(cache,'b','water')
+        self.assertEqual(cache.hits,1)
+
+    def testEviction(self):
+        cache = ResultCache(self.cachedir)
+        self.run_calc(cache,'a','water')
+        self.run_calc(cache,'b','ammonia')
+        # Make 'a' the most recently used, then shrink the budget
+        time.sleep(0.01)
+        self.run_calc(cache,'a2','water')
+        cache.budget = max(cache.index.values())[0]
+        cache.evict()
+        self.assertEqual(len(cache.index),1)
+        calc = FakeCalc(self.directory,'x','water')
+        self.assert_(cache.lookup(job_key(calc,calc.makejob(),cache)))
+        calc = FakeCalc(self.directory,'x','ammonia')
+        self.failIf(cache.lookup(job_key(calc,calc.makejob(),cache)))
+        self.assertEqual(len(os.listdir(self.cachedir)),1)
+
+def testMe():
+    """Return a unittest test suite with all the testcases that should be run by the main
+    gui testing framework."""
+    return unittest.TestLoader().loadTestsFromTestCase(ResultCacheTestCases)
+
+if __name__ == "__main__":
+    unittest.main()
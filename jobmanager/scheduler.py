@@ -0,0 +1,392 @@
+#
+#    This file is part of the CCP1 Graphical User Interface (ccp1gui)
+#
+#   (C) 2002-2005 CCLRC Daresbury Laboratory
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+"""Queue for jobs running on the local machine
+
+Each job asks for a number of cores (the 'count' job parameter, 1 if
+unset) and the scheduler only starts a job when that many cores are
+free, so that a batch of GAMESS-UK, Dalton or MOPAC runs submitted at
+once share the machine rather than oversubscribing it.
+
+Waiting jobs are ordered by their 'priority' parameter (higher first)
+and then by submission time. If the job at the head of the queue does
+not fit into the free cores, smaller jobs behind it are started instead
+(backfill), until the head has been waiting for longer than max_wait
+seconds; after that the cores are left to drain for it.
+"""
+import sys
+import time
+import threading
+
+import jobmanager.job
+import jobmanager.jobthread
+from jobmanager.job import JobError
+
+import unittest
+
+def cpu_count():
+    """Return the number of cores on this machine (1 if we can't tell)"""
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError,NotImplementedError):
+        return 1
+
+class JobRecord:
+    """The book-keeping for a job that has been submitted to a Scheduler"""
+
+    def __init__(self,job,ncores,priority,serial):
+        self.job = job
+        self.ncores = ncores
+        self.priority = priority
+        self.serial = serial
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self.code = None
+
+    def sort_key(self):
+        return (-self.priority,self.serial)
+
+    def wait_time(self):
+        """Seconds spent in the queue (so far, if the job hasn't started)"""
+        if self.start_time is None:
+            return time.time() - self.submit_time
+        return self.start_time - self.submit_time
+
+    def run_time(self):
+        """Seconds spent running (so far, if the job hasn't finished)"""
+        if self.start_time is None:
+            return 0.0
+        if self.end_time is None:
+            return time.time() - self.start_time
+        return self.end_time - self.start_time
+
+class ScheduledJobThread(jobmanager.jobthread.JobThread):
+    """A JobThread that hands its cores back to the scheduler when the job ends"""
+
+    def __init__(self,scheduler,record):
+        jobmanager.jobthread.JobThread.__init__(self,record.job)
+        self.scheduler = scheduler
+        self.record = record
+        self.debug = scheduler.debug
+
+    def run(self):
+        try:
+            self.record.code = self.job.run()
+        finally:
+            self.scheduler.finished(self.record)
+
+class Scheduler:
+    """Run jobs on a fixed budget of local cores
+
+    submit() queues a job and returns straight away; the job is run on
+    its own thread as soon as enough cores are free.
+    """
+
+    def __init__(self,ncores=None,backfill=1,max_wait=300.0,debug=None):
+        if not ncores:
+            ncores = cpu_count()
+        self.ncores = ncores
+        self.free_cores = ncores
+        self.backfill = backfill
+        self.max_wait = max_wait
+        self.debug = debug
+
+        self.queue = []
+        self.running = []
+        self.done = []
+        self.records = {}
+        self.serial = 0
+        # Largest number of cores that have been in use at once
+        self.peak_cores = 0
+        self.condition = threading.Condition()
+
+    def submit(self,job,ncores=None,priority=None):
+        """Queue a job, optionally overriding its core count and priority"""
+        if ncores is None:
+            ncores = job.get_parameter('count')
+        try:
+            ncores = int(ncores)
+        except (TypeError,ValueError):
+            ncores = 1
+        # A job that asks for more than we have gets the whole machine
+        ncores = max(1,min(ncores,self.ncores))
+
+        if priority is None:
+            priority = job.get_parameter('priority')
+        try:
+            priority = int(priority)
+        except (TypeError,ValueError):
+            priority = 0
+
+        self.condition.acquire()
+        try:
+            record = self.records.get(job)
+            if record and record in self.queue + self.running:
+                raise JobError,"This calculation is queued or running already!"
+            self.serial = self.serial + 1
+            record = JobRecord(job,ncores,priority,self.serial)
+            self.records[job] = record
+            self.queue.append(record)
+            self.queue.sort(key=JobRecord.sort_key)
+            job.status = jobmanager.job.JOBSTATUS_QUEUED
+            if self.debug:
+                print 'Scheduler: queued %s for %d core(s) at priority %d' % (job.name,ncores,priority)
+            self.dispatch()
+        finally:
+            self.condition.release()
+        return record
+
+    def cancel(self,job):
+        """Remove a job that hasn't started yet from the queue
+
+        Returns 1 if the job was removed, 0 if it was not waiting.
+        """
+        self.condition.acquire()
+        try:
+            record = self.records.get(job)
+            if not record or record not in self.queue:
+                return 0
+            self.queue.remove(record)
+            job.status = jobmanager.job.JOBSTATUS_KILLED
+            self.dispatch()
+            self.condition.notifyAll()
+            return 1
+        finally:
+            self.condition.release()
+
+    def dispatch(self):
+        """Start as many queued jobs as will fit; call with the lock held"""
+        for record in self.queue[:]:
+            if record.ncores <= self.free_cores:
+                self.start(record)
+            elif not self.backfill or record.wait_time() >= self.max_wait:
+                # nothing behind this job may overtake it
+                break
+
+    def start(self,record):
+        self.queue.remove(record)
+        self.running.append(record)
+        self.free_cores = self.free_cores - record.ncores
+        self.peak_cores = max(self.peak_cores,self.ncores - self.free_cores)
+        record.start_time = time.time()
+        if self.debug:
+            print 'Scheduler: starting %s after %.2fs' % (record.job.name,record.wait_time())
+        ScheduledJobThread(self,record).start()
+
+    def finished(self,record):
+        """Called from the job thread when the job has ended"""
+        self.condition.acquire()
+        try:
+            record.end_time = time.time()
+            self.running.remove(record)
+            self.done.append(record)
+            self.free_cores = self.free_cores + record.ncores
+            if self.debug:
+                print 'Scheduler: %s finished after %.2fs' % (record.job.name,record.run_time())
+            self.dispatch()
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def wait(self,timeout=None,jobs=None):
+        """Block until nothing is queued or running
+
+        If a list of jobs is given only wait for those to finish.
+        Returns 1 if the queue drained, 0 if the timeout expired first.
+        """
+        if timeout is not None:
+            end = time.time() + timeout
+        self.condition.acquire()
+        try:
+            while self.active(jobs):
+                if timeout is None:
+                    # a bare wait() can't be interrupted by Ctrl-C
+                    self.condition.wait(1.0)
+                else:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        return 0
+                    self.condition.wait(remaining)
+            return 1
+        finally:
+            self.condition.release()
+
+    def active(self,jobs=None):
+        """Return the records still queued or running; call with the lock held"""
+        active = self.queue + self.running
+        if jobs is not None:
+            records = [self.records.get(job) for job in jobs]
+            active = [r for r in active if r in records]
+        return active
+
+    def queue_depth(self):
+        """Number of jobs waiting to start"""
+        return len(self.queue)
+
+    def get_record(self,job):
+        """Return the JobRecord (with wait and run times) for a job"""
+        return self.records.get(job)
+
+    def statistics(self):
+        """Return a dictionary summarising the jobs seen so far"""
+        self.condition.acquire()
+        try:
+            waits = [r.wait_time() for r in self.running + self.done]
+            runs = [r.run_time() for r in self.done]
+            stats = {
+                'ncores'    : self.ncores,
+                'free_cores': self.free_cores,
+                'peak_cores': self.peak_cores,
+                'queued'    : len(self.queue),
+                'running'   : len(self.running),
+                'done'      : len(self.done),
+                'mean_wait' : 0.0,
+                'max_wait'  : 0.0,
+                'mean_run'  : 0.0,
+                }
+            if waits:
+                stats['mean_wait'] = sum(waits) / len(waits)
+                stats['max_wait'] = max(waits)
+            if runs:
+                stats['mean_run'] = sum(runs) / len(runs)
+            return stats
+        finally:
+            self.condition.release()
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+def sleep_job(name,seconds,log=None,ncores=None,priority=None):
+    """A DummyJob with a single step that sleeps for a while"""
+
+    def sleep():
+        if log is not None:
+            log.append(name)
+        time.sleep(seconds)
+        return 0
+
+    job = jobmanager.job.DummyJob()
+    job.name = name
+    job.add_step(jobmanager.job.PYTHON_CMD,'sleep',proc=sleep)
+    if ncores is not None:
+        job.set_parameter('count',str(ncores))
+    if priority is not None:
+        job.set_parameter('priority',priority)
+    return job
+
+def benchmark(njobs=100,seconds=0.05,ncores=None):
+    """Time a batch of short jobs through the scheduler"""
+    scheduler = Scheduler(ncores=ncores)
+    t = time.time()
+    for i in range(njobs):
+        scheduler.submit(sleep_job('job%d' % i,seconds))
+    submitted = time.time() - t
+    scheduler.wait()
+    elapsed = time.time() - t
+    stats = scheduler.statistics()
+    print '%d jobs of %.3fs on %d cores' % (njobs,seconds,stats['ncores'])
+    print 'submit %.3fs  wall %.3fs  serial %.3fs  peak cores %d' % \
+          (submitted,elapsed,njobs*seconds,stats['peak_cores'])
+    print 'wait mean %.3fs max %.3fs  run mean %.3fs' % \
+          (stats['mean_wait'],stats['max_wait'],stats['mean_run'])
+
+class SchedulerTestCases(unittest.TestCase):
+
+    def testNoOversubscription(self):
+        scheduler = Scheduler(ncores=2)
+        jobs = [sleep_job('job%d' % i,0.1) for i in range(6)]
+        for job in jobs:
+            scheduler.submit(job)
+        self.assertEqual(scheduler.queue_depth(),4)
+        self.assert_(scheduler.wait(30))
+        stats = scheduler.statistics()
+        self.assertEqual(stats['done'],6)
+        self.assertEqual(stats['peak_cores'],2)
+        for job in jobs:
+            self.assertEqual(job.status,jobmanager.job.JOBSTATUS_DONE)
+            record = scheduler.get_record(job)
+            self.assertEqual(record.code,0)
+            self.assert_(record.run_time() >= 0.09)
+        # the last pair had to wait for two jobs ahead of them
+        self.assert_(scheduler.get_record(jobs[-1]).wait_time() >= 0.19)
+
+    def testPriority(self):
+        scheduler = Scheduler(ncores=1)
+        log = []
+        scheduler.submit(sleep_job('first',0.1,log))
+        scheduler.submit(sleep_job('low',0.0,log,priority=-1))
+        scheduler.submit(sleep_job('normal',0.0,log))
+        scheduler.submit(sleep_job('high',0.0,log,priority=5))
+        self.assert_(scheduler.wait(30))
+        self.assertEqual(log,['first','high','normal','low'])
+
+    def testBackfill(self):
+        scheduler = Scheduler(ncores=2)
+        log = []
+        scheduler.submit(sleep_job('small',0.2,log))
+        wide = scheduler.submit(sleep_job('wide',0.0,log,ncores=2))
+        scheduler.submit(sleep_job('backfill',0.0,log))
+        self.assert_(scheduler.wait(30))
+        self.assertEqual(log,['small','backfill','wide'])
+        self.assertEqual(scheduler.peak_cores,2)
+
+        # Once the wide job has waited too long nothing may overtake it
+        scheduler = Scheduler(ncores=2,max_wait=0.0)
+        log = []
+        scheduler.submit(sleep_job('small',0.2,log))
+        scheduler.submit(sleep_job('wide',0.0,log,ncores=2))
+        scheduler.submit(sleep_job('blocked',0.0,log))
+        self.assert_(scheduler.wait(30))
+        self.assertEqual(log,['small','wide','blocked'])
+
+    def testCancel(self):
+        scheduler = Scheduler(ncores=1)
+        first = sleep_job('first',0.2)
+        second = sleep_job('second',0.0)
+        scheduler.submit(first)
+        scheduler.submit(second)
+        self.assertRaises(JobError,scheduler.submit,second)
+        self.assertEqual(scheduler.cancel(first),0)
+        self.assertEqual(scheduler.cancel(second),1)
+        self.assertEqual(second.status,jobmanager.job.JOBSTATUS_KILLED)
+        self.assert_(scheduler.wait(30))
+        self.assertEqual(scheduler.statistics()['done'],1)
+
+def testMe():
+    """Return a unittest test suite with all the testcases that should be run by the main
+    gui testing framework."""
+    return unittest.TestLoader().loadTestsFromTestCase(SchedulerTestCases)
+
+if __name__ == "__main__":
+
+    if sys.argv[1:2] == ['benchmark']:
+        # optionally followed by the number of cores to schedule on
+        if sys.argv[2:]:
+            benchmark(ncores=int(sys.argv[2]))
+        else:
+            benchmark()
+    else:
+        unittest.main()
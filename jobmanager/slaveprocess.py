@@ -22,6 +22,7 @@ import Queue
 import unittest
 
 import ccp1gui_subprocess
+from processloop import RingBuffer
 
 class SlavePipe(ccp1gui_subprocess.SubProcess):
 
@@ -32,11 +33,14 @@ class SlavePipe(ccp1gui_subprocess.SubProcess):
     ... maybe there is a way to destroy the thread together with the child??
 
     for consistency with spawn it would be ideal if stdin,out,err could
-    be provided to route these streams, at the moment they are echoed and saved in.
+    be provided to route these streams, at the moment they are echoed and
+    the last maxlines lines are saved in the RingBuffers output and err.
 
     """
-    def __init__(self,cmd,**kw):
+    def __init__(self,cmd,maxlines=1000,**kw):
         ccp1gui_subprocess.SubProcess.__init__(self,cmd,**kw)
+        self.output = RingBuffer(maxlines)
+        self.err = RingBuffer(maxlines)
 
     def run(self):
 
@@ -70,29 +74,34 @@ class SlavePipe(ccp1gui_subprocess.SubProcess):
                 count = count + incr
 
             try:
-                tt = self.queue.get(0)
+                # Block until the slave sends something rather than polling;
+                # a timeout counts in steps of 0.1s as before
+                if timeout:
+                    tt = self.queue.get(1,0.1)
+                else:
+                    tt = self.queue.get()
+                # The slave always puts the data right after its tag
                 if tt == ccp1gui_subprocess.CHILD_STDOUT:
-                    tt2 = self.queue.get(0)
+                    tt2 = self.queue.get()
+                    self.output.append(tt2)
                     for x in tt2:
-                        self.output.append(x)
                         print  'stdout>',x,
 
                 elif tt == ccp1gui_subprocess.CHILD_STDERR:
-                    tt2 = self.queue.get(0)
+                    tt2 = self.queue.get()
+                    self.err.append(tt2)
                     for x in tt2:
-                        self.err.append(x)
                         print  'stderr>',x,
 
                 elif tt == ccp1gui_subprocess.CHILD_EXITS:
-                    code = self.queue.get(0)
+                    code = self.queue.get()
                     if self.debug:
                         print t.time(),'done'
                     return code
 
             except Queue.Empty:
                 if self.debug:
-                    print t.time(), 'queue from slave empty, sleep .1'
-                time.sleep(0.1)
+                    print t.time(), 'queue from slave empty'
         #print t.time(),'wait timed out'
 
     def kill(self):
@@ -109,14 +118,14 @@ class SlavePipe(ccp1gui_subprocess.SubProcess):
                 tt = self.queue.get(0)
                 if tt == ccp1gui_subprocess.CHILD_STDOUT:
                     tt2 = self.queue.get(0)
+                    self.output.append(tt2)
                     for x in tt2:
-                        self.output.append(x)
                         print  'stdout>',x,
 
                 elif tt == ccp1gui_subprocess.CHILD_STDERR:
                     tt2 = self.queue.get(0)
+                    self.err.append(tt2)
                     for x in tt2:
-                        self.err.append(x)
                         print  'stderr>',x,
 
                 elif tt == ccp1gui_subprocess.CHILD_EXITS:
@@ -128,7 +137,7 @@ class SlavePipe(ccp1gui_subprocess.SubProcess):
             except Queue.Empty:
                 break
 
-        return self.output
+        return self.output.get_lines()
 
     def __slave_pipe_proc(self,lock,queue,queue1):
 
@@ -171,7 +180,7 @@ class SlavePipe(ccp1gui_subprocess.SubProcess):
             if txt2:
                 if self.debug:
                     print t.time(),'read err returns', txt2[0],' etc'
-                queue.put(CHILD_STDERR)
+                queue.put(ccp1gui_subprocess.CHILD_STDERR)
                 queue.put(txt2)
             else:
                 if self.debug:
@@ -207,10 +216,15 @@ class SlaveSpawn(ccp1gui_subprocess.SubProcess):
 
     issues ...
     spawn will need its streams, part
+
+    Any output is echoed, and the last maxlines lines are kept in the
+    RingBuffers output and err as for SlavePipe.
     """
 
-    def __init__(self,cmd,**kw):
+    def __init__(self,cmd,maxlines=1000,**kw):
         ccp1gui_subprocess.SubProcess.__init__(self,cmd,**kw)        
+        self.output = RingBuffer(maxlines)
+        self.err = RingBuffer(maxlines)
 
     def run(self,stdin=None,stdout=None,stderr=None):
 
@@ -314,27 +328,31 @@ class SlaveSpawn(ccp1gui_subprocess.SubProcess):
                 count = count + incr
 
             try:
-                tt = self.queue.get(0)
+                if timeout:
+                    tt = self.queue.get(1,0.1)
+                else:
+                    tt = self.queue.get()
                 if tt == ccp1gui_subprocess.CHILD_STDOUT:
-                    tt2 = self.queue.get(0)
+                    tt2 = self.queue.get()
+                    self.output.append(tt2)
                     for x in tt2:
                         print  'stdout>',x,
 
                 elif tt == ccp1gui_subprocess.CHILD_STDERR:
-                    tt2 = self.queue.get(0)
+                    tt2 = self.queue.get()
+                    self.err.append(tt2)
                     for x in tt2:
                         print  'stderr>',x,
 
                 elif tt == ccp1gui_subprocess.CHILD_EXITS:
-                    code = self.queue.get(0)
+                    code = self.queue.get()
                     if self.debug:
                         print t.time(),'done'
                     return code
 
             except Queue.Empty:
                 if self.debug:
-                    print t.time(), 'queue from slave empty, sleep .1'
-                time.sleep(0.1)
+                    print t.time(), 'queue from slave empty'
 
         #print t.time(),'wait timed out'
 
@@ -388,6 +406,17 @@ class testSlaveSpawn(unittest.TestCase):
         print 'output=',output
         self.assertEqual(output,['a b\n'])
 
+class testSlavePipe(unittest.TestCase):
+    """pipe to a command run from a slave thread"""
+
+    def testOutputBuffer(self):
+        """only the last maxlines lines of output are kept"""
+        self.proc = SlavePipe('seq',args=['1','20'],maxlines=5)
+        self.proc.run()
+        self.proc.wait()
+        self.assertEqual(self.proc.get_output(),['16\n','17\n','18\n','19\n','20\n'])
+        self.assertEqual(self.proc.output.dropped,15)
+
 if __name__ == "__main__":
     # Run all tests automatically
     unittest.main()
@@ -9,10 +9,15 @@ if __name__ == "__main__":
 
 # Import python modules
 import math
+import time
 import unittest
 
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
 # Import our modules
-import objects.numeric
 import objects.linalg
 
 # Evaluation variables
@@ -29,6 +34,13 @@ derivative_step = 0.001         # Step size (h) when calculating derivatives
 linesearch_initial_step = 0.1  # Step size used at the beginning of a line-search
 goldenratio_precision = 0.001 # Precision of the golden ratio optimization
 
+# SCF parameters
+scf_maxiter = 50            # Maximum number of SCF iterations
+scf_convergence = 1e-4      # Largest change of the density matrix at convergence
+diis_size = 8               # Number of Fock matrices kept for DIIS
+diis_start = 1.0            # Start DIIS once the largest error (eV) is below this
+extrapolate_distance = 0.5  # Only reuse densities if no atom moved further (Angstrom)
+
 # Effective nuclear charge 
 Z = {'H':1, 'C':4,'N':5,'O':6, 'F':7}
 number_of_orbitals = {'H':1, 'C':4, 'N':4, 'O':4, 'F':4}
@@ -148,7 +160,7 @@ def dot(a,b):
 
 # Prints matrix a
 def printmat(a,d=3):
-  print array2string(a,precision=d)
+  print numpy.array2string(a,precision=d)
 
 # Returns a string with the orbital type ('s' or 'p')
 def orbital_type(n):
@@ -195,12 +207,416 @@ class Orbital:
     self.beta = beta
     self.zeta = zeta
 
+##
+# Overlaps of Slater orbitals in the diatomic frame.
+#
+# Each overlap is written as C*p**-m*(a(pa)*exp(-pa) + b(pb)*exp(-pb)),
+# where a and b are polynomials (coefficients lowest order first),
+# p = (zA+zB)/2*R, t = (zA-zB)/(zA+zB), pa = (1+t)*p and pb = (1-t)*p,
+# so that the derivative with respect to R can be taken analytically.
+##
+def overlap_terms(nA,lA,nB,lB,sigma,t):
+  """Return (C,m,a,b) for the overlap of orbitals (nA,lA) and (nB,lB),
+  nA <= nB. sigma is 1 for s and p-sigma orbitals and 0 for p-pi.
+  If the exponents are equal (t == 0) b is empty and pa == p."""
+  if t == 0.0:
+    # 1s|1s
+    if nA == 1 and nB == 1:
+      return 1.0, 0, [1.0, 1.0, 1.0/3], []
+    # 2s|2s
+    if (nA,lA,nB,lB) == (2,0,2,0):
+      return 1.0, 0, [1.0, 1.0, 4.0/9, 1.0/9, 1.0/45], []
+    # 2s|pz
+    if (nA,lA,nB,lB,sigma) == (2,0,2,1,1):
+      return 1.0/(2*math.sqrt(3)), 0, [0.0, 1.0, 1.0, 7.0/15, 2.0/15], []
+    # pz|pz
+    if (nA,lA,nB,lB,sigma) == (2,1,2,1,1):
+      return 1.0, 0, [1.0, 1.0, 1.0/5, -2.0/15, -1.0/15], []
+    # px|px // py|py
+    if (nA,lA,nB,lB,sigma) == (2,1,2,1,0):
+      return 1.0, 0, [1.0, 1.0, 2.0/5, 1.0/15], []
+    raise ValueError("no overlap formula for equal exponents %s" % str((nA,lA,nB,lB,sigma)))
+
+  k = 0.5*(t+1.0/t)
+  # 1s|2s
+  if (nA,lA,nB,lB) == (1,0,2,0):
+    return (math.sqrt(1-t**2)/(math.sqrt(3)*t), 1,
+            [-(1-k)*2*(1+k)*(2-3*k), -(1-k)*(1-2*k)],
+            [(1+k)*2*(1-k)*(2-3*k), (1+k)*4*(1-k), (1+k)])
+  # 1s|2pz
+  if (nA,lA,nB,lB,sigma) == (1,0,2,1,1):
+    a = 6*(1+k)
+    b = 6*(1-k)**2
+    return (math.sqrt((1+t)/(1-t))/t, 2,
+            [-(1-k)**2*a, -(1-k)**2*a, -(1-k)**2*2],
+            [(1+k)*b, (1+k)*b, (1+k)*4*(1-k), (1+k)])
+  # 2s|2pz
+  if (nA,lA,nB,lB,sigma) == (2,0,2,1,1):
+    a = 6*(1+k)*(3+4*k)
+    b = 6*(1-k)**2*(3+4*k)
+    return (math.sqrt((1+t)/(1-t))/(math.sqrt(3)*t), 2,
+            [-(1-k)**2*a, -(1-k)**2*a, -(1-k)**2*2*(5+6*k), -(1-k)**2*2],
+            [(1+k)*b, (1+k)*b, (1+k)*4*(1-k)*(2+3*k), (1+k)*(1+2*k)])
+  # 2pz|2pz
+  if (nA,lA,nB,lB,sigma) == (2,1,2,1,1):
+    a = 48*(1+k)**2
+    b = 48*(1-k)**2
+    return (-1.0/(math.sqrt(1-t**2)*t), 3,
+            [-(1-k)**2*a, -(1-k)**2*a, -(1-k)**2*0.5*a, -(1-k)**2*2*(5+6*k), -(1-k)**2*2],
+            [(1+k)**2*b, (1+k)**2*b, (1+k)**2*0.5*b, (1+k)**2*2*(5-6*k), (1+k)**2*2])
+  # 2px|2px
+  if (nA,lA,nB,lB,sigma) == (2,1,2,1,0):
+    a = 24*(1+k)**2
+    b = 24*(1-k)**2
+    return (1.0/(math.sqrt(1-t**2)*t), 3,
+            [-(1-k)**2*a, -(1-k)**2*a, -(1-k)**2*12*(1+k), -(1-k)**2*2],
+            [(1+k)**2*b, (1+k)**2*b, (1+k)**2*12*(1-k), (1+k)**2*2])
+  # 2s|2s
+  if (nA,lA,nB,lB) == (2,0,2,0):
+    return (math.sqrt(1-t**2)/(3.0*t), 1,
+            [-(1-k)*2*(1+k)*(7-12*k**2), -(1-k)*4*(1+k)*(2-3*k), -(1-k)*(1-2*k)],
+            [(1+k)*2*(1-k)*(7-12*k**2), (1+k)*4*(1-k)*(2+3*k), (1+k)*(1+2*k)])
+  raise ValueError("no overlap formula for %s" % str((nA,lA,nB,lB,sigma)))
+
+def polyval(c,x):
+  """Evaluate the polynomial c (coefficients lowest order first) at x"""
+  v = 0.0
+  for a in c[::-1]:
+    v = v*x + a
+  return v
+
+def polyder(c):
+  return [ i*c[i] for i in range(1,len(c)) ]
+
+def radial_overlap(nA,lA,zA,nB,lB,zB,sigma,R):
+  """Return the overlap of orbitals (nA,lA,zA) and (nB,lB,zB) on two
+  atoms R Angstrom apart (R may be an array), and its derivative
+  with respect to R"""
+  if nA > nB:
+    nA,lA,zA,nB,lB,zB = nB,lB,zB,nA,lA,zA
+  if zA == zB:
+    t = 0.0
+  else:
+    t = (zA-zB)/(zA+zB)
+  C,m,a,b = overlap_terms(nA,lA,nB,lB,sigma,t)
+  dpdR = 0.5*(zA+zB)/Au2Angstrom
+  p = dpdR*R
+  pa = (1+t)*p
+  ea = numpy.exp(-pa)
+  f = polyval(a,pa)*ea
+  df = (1+t)*(polyval(polyder(a),pa) - polyval(a,pa))*ea
+  if b:
+    pb = (1-t)*p
+    eb = numpy.exp(-pb)
+    f = f + polyval(b,pb)*eb
+    df = df + (1-t)*(polyval(polyder(b),pb) - polyval(b,pb))*eb
+  S = C*f/p**m
+  dS = C*(df - m*f/p)/p**m*dpdR
+  return S,dS
+
+##
+# The point charges representing the multipoles of each orbital pair
+# of an atom, as arrays. charges['O'] gives (pos,rho,q,T), see
+# charge_distribution.
+##
+charges = {}
+
+def charge_distribution(symbol):
+  """Return (pos,rho,q,T) for atom symbol, where pos, rho and q are the
+  positions (au), widths and sizes of the point charges of
+  multipoles[symbol], and T[n*a+b,i] is 1 if charge i belongs to the
+  distribution of the orbital pair (a,b) or (b,a), n being the number
+  of orbitals on the atom"""
+  if not charges.has_key(symbol):
+    if not multipoles.has_key(symbol):
+      multipoles[symbol] = atom_multipoles(symbol)
+    n = number_of_orbitals[symbol]
+    pos = []
+    rho = []
+    q = []
+    T = []
+    for (a,b),distribution in multipoles[symbol]:
+      for x,y,z,r,c in distribution:
+        pos.append((x,y,z))
+        rho.append(r)
+        q.append(c)
+        row = [0.0]*(n*n)
+        row[n*a+b] = 1.0
+        row[n*b+a] = 1.0
+        T.append(row)
+    charges[symbol] = (numpy.array(pos), numpy.array(rho), numpy.array(q),
+                       numpy.transpose(numpy.array(T)))
+  return charges[symbol]
+
+def rotate(A,B,X):
+  """Return Y[p,i,j,k,l] = A[p,i,a] A[p,j,b] B[p,k,c] B[p,l,d] X[p,a,b,c,d]
+  (summed over a,b,c,d), for a stack of two-electron integral blocks X"""
+  Y = numpy.einsum('pld,pabcd->pabcl',B,X)
+  Y = numpy.einsum('pkc,pabcl->pabkl',B,Y)
+  Y = numpy.einsum('pjb,pabkl->pajkl',A,Y)
+  return numpy.einsum('pia,pajkl->pijkl',A,Y)
+
+def scatter(M,index,values):
+  """Add values to M at the positions index (which may repeat)"""
+  n = M.size
+  flat = numpy.ravel_multi_index(index,M.shape)
+  flat = numpy.broadcast_to(flat,values.shape)
+  M += numpy.bincount(flat.ravel(),weights=values.ravel(),minlength=n).reshape(M.shape)
+
+def diis(focks,errors):
+  """Return the combination of the Fock matrices focks that minimises
+  the same combination of their error matrices (Pulay's DIIS)"""
+  n = len(focks)
+  if n < 2:
+    return focks[-1]
+  B = -numpy.ones((n+1,n+1))
+  B[n,n] = 0.0
+  for i in range(n):
+    for j in range(i+1):
+      B[i,j] = B[j,i] = (errors[i]*errors[j]).sum()
+  scale = abs(B[:n,:n]).max()
+  if scale == 0.0:
+    return focks[-1]
+  B[:n,:n] /= scale
+  rhs = numpy.zeros(n+1)
+  rhs[n] = -1.0
+  try:
+    c = numpy.linalg.solve(B,rhs)
+  except numpy.linalg.LinAlgError:
+    return focks[-1]
+  F = c[0]*focks[0]
+  for i in range(1,n):
+    F = F + c[i]*focks[i]
+  return F
+
+def principal_quantum_number(symbol):
+  if symbol == 'H':
+    return 1
+  return 2
+
+# generators[k] rotates the p orbitals (1,2,3) about axis k:
+# generators[k] v = e_k x v
+if numpy is not None:
+  generators = numpy.zeros((3,4,4))
+  for k in range(3):
+    for m in range(3):
+      e_k = [0.0,0.0,0.0]
+      e_m = [0.0,0.0,0.0]
+      e_k[k] = 1.0
+      e_m[m] = 1.0
+      generators[k,1:,1+m] = cross(e_k,e_m)
+
+##
+# PairGroup class
+# The integrals of all the atom pairs in a molecule made up of the same
+# two elements, calculated at once in arrays indexed by pair first.
+# The atom with fewer orbitals (hydrogen) always comes first in a pair.
+##
+class PairGroup:
+  def __init__(self, molecule, symbol1, symbol2, pairs):
+    self.symbol1 = symbol1
+    self.symbol2 = symbol2
+    self.atom1 = numpy.array([ a for a,b in pairs ])
+    self.atom2 = numpy.array([ b for a,b in pairs ])
+    self.n1 = n1 = number_of_orbitals[symbol1]
+    self.n2 = n2 = number_of_orbitals[symbol2]
+    o1 = numpy.array([ molecule.atoms[a].orbitals for a,b in pairs ])
+    o2 = numpy.array([ molecule.atoms[b].orbitals for a,b in pairs ])
+    self.index11 = (o1[:,:,None], o1[:,None,:])
+    self.index22 = (o2[:,:,None], o2[:,None,:])
+    self.index12 = (o1[:,:,None], o2[:,None,:])
+    self.index21 = (o2[:,:,None], o1[:,None,:])
+
+    self.Z1 = Z[symbol1]
+    self.Z2 = Z[symbol2]
+    b1 = numpy.array(([betas[symbol1]] + [betap.get(symbol1)]*3)[:n1])
+    b2 = numpy.array(([betas[symbol2]] + [betap.get(symbol2)]*3)[:n2])
+    self.beta = 0.5*(b1[:,None] + b2[None,:])
+
+    pos1,rho1,q1,self.T1 = charge_distribution(symbol1)
+    pos2,rho2,q2,self.T2 = charge_distribution(symbol2)
+    self.dx = pos2[None,:,0] - pos1[:,None,0]
+    self.dy = pos2[None,:,1] - pos1[:,None,1]
+    self.dz = pos2[None,:,2] - pos1[:,None,2]
+    self.rho2 = (rho1[:,None] + rho2[None,:])**2
+    self.qq = q1[:,None]*q2[None,:]
+
+  def calculate(self, coordinates):
+    """Calculate the overlap, two-electron integral and core repulsion
+    blocks for the current geometry, and their derivatives with respect
+    to the distance between the atoms"""
+    R = coordinates[self.atom2] - coordinates[self.atom1]
+    r = numpy.sqrt((R*R).sum(axis=1))
+    self.R = R
+    self.r = r
+    self.frame = self.get_frame(R/r[:,None])
+    F1 = self.frame[:,:self.n1,:self.n1]
+    F2 = self.frame[:,:self.n2,:self.n2]
+
+    self.calc_tc_te(r)
+    self.W = rotate(F1.transpose(0,2,1),F2.transpose(0,2,1),self.Wl)
+    self.calc_S(r)
+    self.S = numpy.einsum('pai,pab,pbj->pij',F1,self.Sl,F2)
+    self.calc_core(r)
+
+  def get_frame(self, z):
+    """Return the diatomic frames for the unit vectors z.
+    frame[p,a,i] is how local axis a (s,x,y,z) looks in global
+    coordinates (i)"""
+    np = len(z)
+    # Obtain any two vectors x and y orthogonal to z
+    x = numpy.where((abs(z[:,2]) < 0.7)[:,None],
+                    numpy.transpose([z[:,1],-z[:,0],z[:,2]]),
+                    numpy.transpose([z[:,2],z[:,1],-z[:,0]]))
+    x = x - (x*z).sum(axis=1)[:,None]*z
+    x = x/numpy.sqrt((x*x).sum(axis=1))[:,None]
+    y = numpy.cross(z,x)
+    frame = numpy.zeros((np,4,4))
+    frame[:,0,0] = 1.0
+    frame[:,1,1:] = x
+    frame[:,2,1:] = y
+    frame[:,3,1:] = z
+    return frame
+
+  def calc_tc_te(self, r):
+    """Two-center two-electron integrals (ij|kl) in the diatomic frame,
+    and their derivatives with respect to r. These are the MNDO
+    multipole interactions of the point charge distributions."""
+    Rz = r[:,None,None]/Au2Angstrom
+    dz = self.dz[None,:,:] + Rz
+    d2 = self.dx[None,:,:]**2 + self.dy[None,:,:]**2 + dz**2 + self.rho2[None,:,:]
+    K = self.qq[None,:,:]/numpy.sqrt(d2)
+    dK = -K*dz/d2
+    W = numpy.matmul(numpy.matmul(self.T1,K),self.T2.T)*Hartree2eV
+    dW = numpy.matmul(numpy.matmul(self.T1,dK),self.T2.T)*(Hartree2eV/Au2Angstrom)
+    if self.n1 == 4 and self.n2 == 4:
+      # Mopac uses (xy|xy) = 1/2*[(xx|xx) - (xx|yy)], so we use that as well.
+      for X in W,dW:
+        Jxyxy = 0.5*(X[:,5,5] - X[:,5,10])
+        for a in 6,9:
+          for b in 6,9:
+            X[:,a,b] = Jxyxy
+    np = len(r)
+    shape = (np,self.n1,self.n1,self.n2,self.n2)
+    self.Wl = W.reshape(shape)
+    self.dWl = dW.reshape(shape)
+
+  def calc_S(self, r):
+    """Overlaps in the diatomic frame, with local z pointing from atom1
+    to atom2, and their derivatives with respect to r"""
+    n1 = principal_quantum_number(self.symbol1)
+    n2 = principal_quantum_number(self.symbol2)
+    zs1 = zetas[self.symbol1]
+    zs2 = zetas[self.symbol2]
+    S = numpy.zeros((len(r),self.n1,self.n2))
+    dS = numpy.zeros((len(r),self.n1,self.n2))
+    S[:,0,0],dS[:,0,0] = radial_overlap(n1,0,zs1,n2,0,zs2,1,r)
+    if self.n2 == 4:
+      s,ds = radial_overlap(n1,0,zs1,n2,1,zetap[self.symbol2],1,r)
+      S[:,0,3] = -s
+      dS[:,0,3] = -ds
+    if self.n1 == 4:
+      S[:,3,0],dS[:,3,0] = radial_overlap(n2,0,zs2,n1,1,zetap[self.symbol1],1,r)
+    if self.n1 == 4 and self.n2 == 4:
+      zp1 = zetap[self.symbol1]
+      zp2 = zetap[self.symbol2]
+      S[:,3,3],dS[:,3,3] = radial_overlap(n1,1,zp1,n2,1,zp2,1,r)
+      s,ds = radial_overlap(n1,1,zp1,n2,1,zp2,0,r)
+      S[:,1,1] = S[:,2,2] = s
+      dS[:,1,1] = dS[:,2,2] = ds
+    self.Sl = S
+    self.dSl = dS
+
+  def calc_core(self, r):
+    """Core-core repulsion of each pair, and its derivative"""
+    def gaussians(symbol):
+      f = 0.0
+      df = 0.0
+      for K,L,M in ((K1,L1,M1),(K2,L2,M2),(K3,L3,M3),(K4,L4,M4)):
+        e = K[symbol]*numpy.exp(-L[symbol]*(r-M[symbol])**2)
+        f = f + e
+        df = df - 2*L[symbol]*(r-M[symbol])*e
+      return f,df
+    Q = self.Z1*self.Z2
+    enuc = Q*self.Wl[:,0,0,0,0]
+    denuc = Q*self.dWl[:,0,0,0,0]
+    a1 = alpha[self.symbol1]
+    a2 = alpha[self.symbol2]
+    scale = numpy.exp(-a1*r) + numpy.exp(-a2*r)
+    dscale = -a1*numpy.exp(-a1*r) - a2*numpy.exp(-a2*r)
+    f1,df1 = gaussians(self.symbol1)
+    f2,df2 = gaussians(self.symbol2)
+    self.Ec = enuc + abs(scale*enuc) + Q/r*(f1 + f2)
+    self.dEc = (denuc + numpy.sign(scale*enuc)*(dscale*enuc + scale*denuc)
+                - Q/r**2*(f1 + f2) + Q/r*(df1 + df2))
+
+  def add_S(self, S):
+    S[self.index12] = self.S
+    S[self.index21] = self.S.transpose(0,2,1)
+
+  def add_V(self, V):
+    """Add the attraction of the electrons on each atom to the core of the other"""
+    scatter(V,self.index11,-self.Z2*self.W[:,:,:,0,0])
+    scatter(V,self.index22,-self.Z1*self.W[:,0,0,:,:])
+
+  def add_H(self, H):
+    """Add the resonance integrals"""
+    B = self.beta[None,:,:]*self.S
+    H[self.index12] = B
+    H[self.index21] = B.transpose(0,2,1)
+
+  def add_twofock(self, P, F):
+    """Add the two-center part of the two-electron Fock matrix"""
+    W = self.W
+    scatter(F,self.index11,numpy.einsum('pijkl,pkl->pij',W,P[self.index22]))
+    scatter(F,self.index22,numpy.einsum('pijkl,pij->pkl',W,P[self.index11]))
+    X = -0.5*numpy.einsum('pikjl,pkl->pij',W,P[self.index12])
+    F[self.index12] += X
+    F[self.index21] += X.transpose(0,2,1)
+
+  def add_gradient(self, P, grad):
+    """Add the derivatives of the pair energies, with the density P held
+    fixed, to grad (an array of shape (natoms,3))"""
+    P11 = P[self.index11]
+    P22 = P[self.index22]
+    P12 = P[self.index12]
+    # D = dE/dW and DS = dE/dS, for the integrals in the global frame
+    D = (P11[:,:,:,None,None]*P22[:,None,None,:,:]
+         - 0.5*P12[:,:,None,:,None]*P12[:,None,:,None,:])
+    D[:,:,:,0,0] -= self.Z2*P11
+    D[:,0,0,:,:] -= self.Z1*P22
+    DS = 2*self.beta[None,:,:]*P12
+
+    # Derivative with respect to the distance, in the diatomic frame
+    F1 = self.frame[:,:self.n1,:self.n1]
+    F2 = self.frame[:,:self.n2,:self.n2]
+    dEdr = (rotate(F1,F2,D)*self.dWl).sum(axis=4).sum(axis=3).sum(axis=2).sum(axis=1)
+    dEdr += (numpy.einsum('pai,pij,pbj->pab',F1,DS,F2)*self.dSl).sum(axis=2).sum(axis=1)
+    dEdr += self.dEc
+
+    # Derivative with respect to rotating the pair, from the change of
+    # the integrals in the global frame as the orbitals are rotated
+    W = self.W
+    M1 = (numpy.einsum('pijkl,pmjkl->pim',D,W) + numpy.einsum('pijkl,pimkl->pjm',D,W)
+          + numpy.einsum('pij,pmj->pim',DS,self.S))
+    M2 = (numpy.einsum('pijkl,pijml->pkm',D,W) + numpy.einsum('pijkl,pijkm->plm',D,W)
+          + numpy.einsum('pij,pim->pjm',DS,self.S))
+    torque = (numpy.einsum('kim,pim->pk',generators[:,:self.n1,:self.n1],M1)
+              + numpy.einsum('kim,pim->pk',generators[:,:self.n2,:self.n2],M2))
+
+    R = self.R
+    r = self.r
+    g = dEdr[:,None]*R/r[:,None] + numpy.cross(torque,R)/(r*r)[:,None]
+    for i in range(3):
+      grad[:,i] += numpy.bincount(self.atom2,weights=g[:,i],minlength=len(grad))
+      grad[:,i] -= numpy.bincount(self.atom1,weights=g[:,i],minlength=len(grad))
+
 ##
 # Molecule class
 # Properties:
 #  atoms[] - a list of the IDs of the atoms in the molecule
 #  orbitals[] - a list of the IDs of the orbitals in the molecule
-#  tc_te{} - a list of the two-center two-electron integrals needed
+#  groups[] - the atom pairs, as PairGroups, holding the two-center integrals
 #  Eeval - Countes number of calls to get_E(), i.e. the number of energy calculations
 # Member functions:
 #  add() - adds an atom to the molecule. The belonging orbitals are created automaticly
@@ -209,8 +625,14 @@ class Molecule:
   def __init__(self, symbol = ''):
     self.atoms = []
     self.orbitals = []
-    self.tc_te = {}
+    self.groups = None
+    self.P = None
+    self.geometry = None # coordinates of the last SCF
+    self.history = [] # (coordinates,density) of the last two SCFs
+    self.diis = 1 # use DIIS in the SCF
+    self.extrapolate = 1 # extrapolate the starting density between SCFs
     self.Eeval = 0 # Debug: counts number of energy calculations
+    self.Eiter = 0 # counts the total number of SCF iterations
   def add(self, name='',symbol = '', x = 0.0, y = 0.0, z = 0.0):
     self.atoms.append(Atom( name, symbol, x, y, z, len(self.orbitals)))
     for i in range(number_of_orbitals[symbol]):
@@ -224,539 +646,146 @@ class Molecule:
       else:
         b = betap[symbol]
         U = Up[symbol]
-        zeta = zetap[symbol]			
+        zeta = zetap[symbol]
       self.orbitals.append(Orbital(len(self.atoms)-1, i, x, y, z, U, b, alpha[symbol],zeta))
     if not multipoles.has_key(symbol):
       multipoles[symbol] = atom_multipoles(symbol)
+    self.groups = None
+    self.P = None
+    self.geometry = None
+    self.history = []
   def number_of_electrons(self):
     n = 0
     for i in range(len(self.atoms)):
       n = n + Z[self.atoms[i].symbol]
-    return n	
+    return n
+
+  def coordinates(self):
+    return numpy.array([ (a.x,a.y,a.z) for a in self.atoms ])
+
+    ##
+    # Sort the atom pairs into groups of the same two elements
+    ##
+  def get_groups(self):
+    if self.groups is None:
+      pairs = {}
+      for a in range(len(self.atoms)):
+        for b in range(a+1,len(self.atoms)):
+          s1 = self.atoms[a].symbol
+          s2 = self.atoms[b].symbol
+          # make sure H comes as atom1
+          if (number_of_orbitals[s1],s1) > (number_of_orbitals[s2],s2):
+            pairs.setdefault((s2,s1),[]).append((b,a))
+          else:
+            pairs.setdefault((s1,s2),[]).append((a,b))
+      keys = pairs.keys()
+      keys.sort()
+      self.groups = [ PairGroup(self,s1,s2,pairs[(s1,s2)]) for s1,s2 in keys ]
+    return self.groups
+
+    ##
+    # Calculates all the two-center integrals for the current geometry
+    ##
+  def calc_tc_te(self):
+    coordinates = self.coordinates()
+    for group in self.get_groups():
+      group.calculate(coordinates)
 
     ##
-    # Calculates the overlap (S) matrix. WORKS!
-    ##	
+    # Assembles the overlap (S) matrix from the pair blocks
+    ##
   def get_S(self,part=-1):
-    def overlap_quantum(nA,lA,zA,nB,lB,zB,tA,R):
-      z = 0.5*(zA+zB)
-      t = (zA-zB)/(zA+zB)
-      p = 0.5*(zA+zB)*R
-      if(zB == zA):
-        # 1s|1s
-        if((nA == 1) and (nB == 1)):
-          return (1+p+1.0/3*p**2)*math.exp(-p)
-        # 2s|2s
-        if((nA == 2) and (lA == 0) and (nB == 2) and (lB == 0)):
-          return (1+p+4.0/9*p**2+1.0/9*p**3+1.0/45*p**4)*math.exp(-p)
-        # 2s|pz
-        if((nA == 2) and (lA == 0) and (nB == 2) and (lB == 1) and (tA == 0)):
-          return 1.0/(2*math.sqrt(3))*p*(1+p+7.0/15*p**2+2.0/15*p**3)*math.exp(-p)
-        # pz|pz
-        if((nA == 2) and (lA == 1) and (nB == 2) and (lB == 1) and (tA == 0)):
-          return -(-1-p-1.0/5*p**2+2.0/15*p**3+1.0/15*p**4)*math.exp(-p)
-        # px|px // py|py
-        if((nA == 2) and (lA == 1) and (nB == 2) and (lB == 1) and (tA == 1)):
-          return (1+p+2.0/5*p**2+1.0/15*p**3)*math.exp(-p)
-      k = 0.5*(t+1.0/t)
-      pa = (1+t)*p
-      pb = (1-t)*p
-      # 1s|2s
-      if nA == 1 and lA == 0 and nB == 2 and lB == 0:
-        #jmht return ((math.sqrt(1-t**2)/(sqrt(3)*t*p))
-        return ((math.sqrt(1-t**2)/(math.sqrt(3)*t*p))
-          *(-(1-k)*(2*(1+k)*(2-3*k)+(1-2*k)*pa)
-          *math.exp(-pa)+(1+k)*(2*(1-k)*(2-3*k)+4*(1-k)*pb+pb**2)
-          *math.exp(-pb)))
-      # 1s|2pz
-      elif nA == 1 and lA == 0 and nB == 2 and lB == 1 and tA == 0:
-        return (math.sqrt((1+t)/(1-t))/(t*p**2)
-          *(-(1-k)**2*(6*(1+k)*(1+pa)+2*pa**2)
-          *math.exp(-pa)+(1+k)
-          *(6*(1-k)**2*(1+pb)+4*(1-k)*pb**2+pb**3)*math.exp(-pb)))
-      # 2s|2pz
-      elif nA == 2 and lA == 0 and nB == 2 and lB == 1 and tA == 0:
-        return (math.sqrt((1+t)/(1-t))*1.0/(math.sqrt(3)*t*p**2)
-          *(-(1-k)**2*(6*(1+k)*(3+4*k)*(1+pa)+2*(5+6*k)*pa**2+2*pa**3)*math.exp(-pa)
-          +(1+k)*(6*(1-k)**2*(3+4*k)*(1+pb)+4*(1-k)*(2+3*k)*pb**2+(1+2*k)*pb**3)
-          *math.exp(-pb)))			
-      # 2pz|2pz
-      elif nA == 2 and lA == 1 and nB == 2 and lB == 1 and tA == 0:
-        return -((1.0/(math.sqrt(1-t**2)*t*p**3)) # negative sign added - ulfek
-          *(-(1-k)**2*(48*(1+k)**2*(1+pa+0.5*pa**2)
-          +2*(5+6*k)*pa**3+2*pa**4)*math.exp(-pa)
-          +(1+k)**2*(48*(1-k)**2*(1+pb+0.5*pb**2)
-          +2*(5-6*k)*pb**3+2*pb**4)*math.exp(-pb)))
-      # 2px|2px
-      elif nA == 2 and lA == 1 and nB == 2 and lB == 1 and tA == 1:
-        return ((1.0/(math.sqrt(1-t**2)*t*p**3))
-          *(-(1-k)**2*(24*(1+k)**2*(1+pa)+12*(1+k)*pa**2+2*pa**3)*math.exp(-pa)
-          +(1+k)**2*(24*(1-k)**2*(1+pb)+12*(1-k)*pb**2+2*pb**3)*math.exp(-pb)))
-      # 2s|2s
-      elif nA == 2 and lA == 0 and nB == 2 and lB == 0 and tA == 0:
-        return ((math.sqrt(1-t**2)/(3.0*t*p))
-          *(-(1-k)*(2*(1+k)*(7-12*k**2)+4*(1+k)*(2-3*k)*pa+(1-2*k)*pa**2)
-          *math.exp(-pa)+(1+k)
-          *(2*(1-k)*(7-12*k**2)+4*(1-k)*(2+3*k)*pb+(1+2*k)*pb**2)
-          *math.exp(-pb)))
-      else:
-        raise Exception
-    def overlap_prime(nA,lA,tA,zA,nB,lB,tB,zB,R):
-      if((tA == 's') or (tA == 'pz')):
-        tA = 0
-      else:
-        tA = 1
-      if((tB == 's') or (tB == 'pz')):
-        tB = 0
-      else:
-        tB = 1
-      if(tB == tA):
-        if(nA>nB):
-          return overlap_quantum(nB,lB,zB,nA,lA,zA,tA,R/Au2Angstrom)
-        else:
-          return overlap_quantum(nA,lA,zA,nB,lB,zB,tA,R/Au2Angstrom)
-      else:
-        return 0.0
-      ##
-      # Calculates the overlap of orbitals a and b
-      ##
-    def overlap(a,b):
-      ##
-      # orbital_type returns the type of orbital associated with integer n.
-      #  0 is s; 1,2,3 is px,py,pz respectively
-      ##
-      def orbital_type_detail(n):
-        if(n==0):
-          return 's'
-        elif(n==1):
-          return 'px'
-        elif(n==2):
-          return 'py'
-        elif(n==3):
-          return 'pz'
-        
-      # First, take care of the elementary case of the two
-      #  orbitals residing on the same atom
-      if(self.orbitals[a].atom == self.orbitals[b].atom):
-        if(a == b):
-          return 1.0
-        else:
-          return 0.0
-      # For convenience, make sure l(A)<=l(B)
-      if(self.orbitals[a].ot > self.orbitals[b].ot):
-        # If so, swap them
-        tmp = b
-        b = a
-        a = tmp
-      # Get some molecular properties
-      # We need the zeta value (exponential) for the orbitals
-      zA = self.orbitals[a].zeta
-      zB = self.orbitals[b].zeta
-      # quantum number n
-      if (self.atoms[self.orbitals[a].atom].symbol == 'H'):
-        nA = 1
-      else:
-        nA = 2
-      if (self.atoms[self.orbitals[b].atom].symbol == 'H'):
-        nB = 1
-      else:
-        nB = 2
-      # orbital type (x,px,py,px)
-      otA = orbital_type_detail(self.orbitals[a].ot)
-      otB = orbital_type_detail(self.orbitals[b].ot)
-      # separation distance R
-      posA = (self.atoms[self.orbitals[a].atom].x,self.atoms[self.orbitals[a].atom].y,self.atoms[self.orbitals[a].atom].z)
-      posB = (self.atoms[self.orbitals[b].atom].x,self.atoms[self.orbitals[b].atom].y,self.atoms[self.orbitals[b].atom].z)
-      Rvec = (posA[0]-posB[0],posA[1]-posB[1],posA[2]-posB[2])
-      R = math.sqrt(Rvec[0]**2+Rvec[1]**2+Rvec[2]**2)
-      # If two 's' orbitals, calculate them directly
-      if(otA == 's'):
-        orbA = ('s',nA,zA)
-      if(otB == 's'):
-        orbB = ('s',nB,zB)
-      if((otA == otB) and (otA == 's')):
-        I = overlap_prime(nA,0,'s',zA,nB,0,'s',zB,R)
-        return I
-      # If one 's' and one 'p' orbital, it's also simple (if so, orbital A is the 's' orbital
-      if(otA == 's'):
-        normR = (1.0/R*Rvec[0],1.0/R*Rvec[1],1.0/R*Rvec[2])
-        if(otB == 'px'):
-          I = normR[0]*overlap_prime(nA,0,'s',zA,nB,1,'pz',zB,R)
-        elif(otB == 'py'):
-          I = normR[1]*overlap_prime(nA,0,'s',zA,nB,1,'pz',zB,R)
-        elif(otB == 'pz'):
-          I = normR[2]*overlap_prime(nA,0,'s',zA,nB,1,'pz',zB,R)
-        return I
-      # The case of two p-orbitals are a little more complicated.
-      # First, move the two atoms so:
-      #  r(A) = (0,0,0)
-      #  r(B) = (0,0,R)
-      # Also, rotate coordinate systems to align
-      #  pz with the vector R
-      # This is necessary in order to evaluate the integral
-      # Old basis vectors
-      e1 = (1.0,0.0,0.0)
-      e2 = (0.0,1.0,0.0)
-      e3 = (0.0,0.0,1.0)
-      # Calculate the new basis vectors, f1, f2 and f3
-      # f3 will simply be in the R direction
-      f3 = (1.0/R*Rvec[0],1.0/R*Rvec[1],1.0/R*Rvec[2])
-      # f1 will be the cross product (f3 x e3)
-      if(abs(f3[0]*e3[0]+f3[1]*e3[1]+f3[2]*e3[2]) < 0.999):
-        f1 = cross(f3,e3)
-      else:
-        f1 = cross(f3,e2)
-      f1l = math.sqrt(f1[0]**2+f1[1]**2+f1[2]**2)
-      f1 = (1/f1l*f1[0],1/f1l*f1[1],1/f1l*f1[2])
-      # and f2 = (f3 x f1)
-      f2 = cross(f3,f1)
-      if otA == 'px':
-        orbA = ('px',nA,zA,f1[0],f2[0],f3[0])
-      elif otA == 'py':
-        orbA = ('py',nA,zA,f1[1],f2[1],f3[1])
-      elif otA == 'pz':
-        orbA = ('pz',nA,zA,f1[2],f2[2],f3[2])
-      else:
-        raise Exception
-      if otB == 'px':
-        orbB = ('px',nB,zB,f1[0],f2[0],f3[0])
-      elif otB == 'py':
-        orbB = ('py',nB,zB,f1[1],f2[1],f3[1])
-      elif otB == 'pz':
-        orbB = ('pz',nB,zB,f1[2],f2[2],f3[2])
-      else:
-        raise Exception
-      xx = overlap_prime(nA,1,'px',zA,nB,1,'px',zB,R)
-      I = orbA[3]*orbB[3]*xx
-      I = I + orbA[4]*orbB[4]*xx # yy overlap == xx overlap
-      I = I + orbA[5]*orbB[5]*overlap_prime(nA,1,'pz',zA,nB,1,'pz',zB,R)			
-      return I
     n = len(self.orbitals)
-    S = objects.numeric.array((((0.0,)*n,)*n))
-    # Calculate overlap for atom 'part' only
-    if part != -1:
-      for orb in self.atoms[part].orbitals:
-        for i in range(n):
-          S[i][orb]=overlap(i,orb)
-          S[orb][i]=S[i][orb]
-      self.S = S
-      return S
-    # Else, calculate for all atoms
-    n = len(self.orbitals)
-    S = objects.numeric.array((((0.0,)*n,)*n))
-    for i in range(n):
-      S[i][i] = 1.0
-      for j in range(n)[(i+1):]:
-        S[i][j] = overlap(i,j)
-        S[j][i] = S[i][j]
-      self.S = S
+    S = numpy.identity(n)
+    for group in self.get_groups():
+      group.add_S(S)
+    self.S = S
     return S
-  def tc_te_diatom(self, atom1, atom2, noscreen = 0):
-    """Return a list of the two electron integrals between
-    atom1 and atom2, on the form [[(i,j,k,l),int_ijkl],..].
-    Only nonzero integrals are returned. The integrals
-    are calculated in a diatomic frame, with z as the
-    direction between atoms, and then transformed to
-    global coordinates."""		
-    def normalize(a):
-      #jmhtl = sqrt(a[0]**2 + a[1]**2 + a[2]**2)
-      l = math.sqrt(a[0]**2 + a[1]**2 + a[2]**2)
-      a[0] /= l
-      a[1] /= l
-      a[2] /= l
-    def multipole_interaction(P1,P2,Rz,printr=0):
-      """Return the MNDO approximation to (i,j|k,l),
-      in the diatomic frame. P1 and P2 are lists of
-      point charges from the multipoles table. Rz is
-      the separation in the z direction."""
-      def f1(r,rhoA,rhoB):
-        return 1.0/math.sqrt(r**2 + (rhoA+rhoB)**2)
-      def dist(a,b,Rz):
-        r = math.sqrt((b[0]-a[0])**2 + (b[1]-a[1])**2 + (b[2]-a[2]+Rz)**2)
-        if printr:
-          print 'r:',r
-        return r
-      Rz /= Au2Angstrom
-      J = 0
-      for q1 in P1:
-        for q2 in P2:
-          J += q1[4]*q2[4]*f1(dist(q1,q2,Rz),q1[3],q2[3])
-      return J*Hartree2eV
-    
-    if atom2.symbol == 'H' and atom1.symbol != 'H':
-      return self.tc_te_diatom(atom2,atom1) # make sure H comes as atom1 below
-    
-    # Set up a diatomic coordinate system, as much as needed
-    z = [atom2.x - atom1.x, atom2.y - atom1.y, atom2.z - atom1.z]
-    #jmht R = sqrt(z[0]**2 + z[1]**2 + z[2]**2)
-    R = math.sqrt(z[0]**2 + z[1]**2 + z[2]**2)
-  
-    idx1 = atom1.orbitals[0] # index of s orbital on this atom. Assume px = idx1 + 1 etc.
-    idx2 = atom2.orbitals[0]
-    # Calculate the integrals in the diatomic coordinate system Jijkl
-    # Calculate ALL integrals now, even those which are zero or identical
-    P1 = multipoles[atom1.symbol]
-    P2 = multipoles[atom2.symbol]
-    # TODO: don't calculate integrals which has an odd number of x's or y's
-    # TODO: don't calculate both x and y integrals when possible
-    diints = []
-    for p1 in P1:
-      for p2 in P2:
-        Jdi = multipole_interaction(p1[1],p2[1],R)
-        if abs(Jdi) > 1e-14:
-          diints.append([(p1[0][0],p1[0][1],p2[0][0],p2[0][1]),Jdi])
-          # Add the other possible integral combinations.
-          # TODO: do this in a more efficient way
-          if p1[0][0] != p1[0][1]:
-            diints.append([(p1[0][1],p1[0][0],p2[0][0],p2[0][1]),Jdi])
-            if p2[0][0] != p2[0][1]:
-              diints.append([(p1[0][1],p1[0][0],p2[0][1],p2[0][0]),Jdi])
-          if p2[0][0] != p2[0][1]:
-            diints.append([(p1[0][0],p1[0][1],p2[0][1],p2[0][0]),Jdi])
-    if atom1.symbol == 'H' and atom2.symbol == 'H':
-      return [[(idx1,idx1,idx2,idx2),diints[0][1]]]
-    #Mopac uses (xy|xy) = 1/2*[(xx|xx) - (xx|yy)], so we use that as well.
-    Jxyxy = 0
-    for J in diints:
-      if J[0] == (1,1,1,1):
-        Jxyxy += J[1]
-      if J[0] == (1,1,2,2):
-        Jxyxy -= J[1]
-    diints.append([(1,2,1,2),0.5*Jxyxy])
-    diints.append([(2,1,1,2),0.5*Jxyxy])
-    diints.append([(1,2,2,1),0.5*Jxyxy])
-    diints.append([(2,1,2,1),0.5*Jxyxy])
-    # Need (ss|sp) and (ss|pp) etc, so set up coordinate system
-    z[0] /= R
-    z[1] /= R
-    z[2] /= R
-    # Obtain any two vectors x and y orthogonal to z
-    if abs(z[2]) < 0.7:
-      x = [z[1],-z[0],z[2]]
-    else:
-      x = [z[2],z[1],-z[0]]
-    c = dot(x,z)
-    x[0] -= c*z[0]
-    x[1] -= c*z[1]
-    x[2] -= c*z[2]
-    normalize(x)
-    y = cross(z,x)
-    # frame[i][j] is how i looks in global coordinates (j)
-    frame = [[1.0, 0   , 0   , 0],
-       [0 , x[0], x[1], x[2]],
-       [0 , y[0], y[1], y[2]],
-       [0 , z[0], z[1], z[2]]]
-  
-    # transform integrals to global coordinate system
-    # Calculate (ij|kl), i <= j, k <=l 
-    ints = []
-    n1 = len(atom1.orbitals)
-    n2 = len(atom2.orbitals)
-    for i in range(n1):
-      for j in range(i,n1):
-        for k in range(n2):
-          for l in range(k,n2):
-            J = 0
-            for Jdi in diints:
-              J += (Jdi[1]
-                    *frame[Jdi[0][0]][i]
-                    *frame[Jdi[0][1]][j]
-                    *frame[Jdi[0][2]][k]
-                    *frame[Jdi[0][3]][l])
-            if noscreen or abs(J) > 1e-14:
-              ints.append([(idx1+i,idx1+j,idx2+k,idx2+l),J])
-    return ints
-  
-    ##
-    # two-center two-electron integrals of orbitals a, b, c, d
-    ##
-  def tc_te_int(self,a,b,c,d,printint=False):
-    raise Exception("vad ska vara har?")
 
     ##
-    # coulumb integrals of orbitals a and b
+    # one-center coulomb (g) and exchange (h) integrals
     ##
   def get_g_and_h(self):
     n = len(self.orbitals)
-    g = objects.numeric.array((((0.0,)*n,)*n))
-    h = objects.numeric.array((((0.0,)*n,)*n))
-    for i in range(n):
-      for j in range(n):
-        ## a and b must reside on the same atom
-        if(self.orbitals[i].atom == self.orbitals[j].atom):
-          symbol = self.atoms[self.orbitals[i].atom].symbol
-          t1 = orbital_type(self.orbitals[i].ot)
-          t2 = orbital_type(self.orbitals[j].ot)
-          
-          ## make difference between |px,px> and |px,py>
-          if((t1 == 'p') and (t2 == 'p')):
-            if(self.orbitals[i].ot != self.orbitals[j].ot):
-              t2 = 'pp'
-          t = t1+t2
-          
-          if(t == 'ss'):
-            g[i][j] = gss[symbol]
-            h[i][j] = hss[symbol]
-          elif((t == 'sp') or (t == 'ps')):
-            g[i][j] = gsp[symbol]
-            h[i][j] = hsp[symbol]
-          elif(t == 'pp'):
-            g[i][j] = gpp[symbol]
-            h[i][j] = hpp[symbol]
-          elif(t == 'ppp'):
-            g[i][j] = gppp[symbol]
-            h[i][j] = hppp[symbol]
-        else:
-          g[i][j] = 0.0
-          h[i][j] = 0.0
+    g = numpy.zeros((n,n))
+    h = numpy.zeros((n,n))
+    for atom in self.atoms:
+      symbol = atom.symbol
+      s = atom.orbitals[0]
+      g[s,s] = gss[symbol]
+      h[s,s] = hss[symbol]
+      for i in atom.orbitals[1:]:
+        g[s,i] = g[i,s] = gsp[symbol]
+        h[s,i] = h[i,s] = hsp[symbol]
+        for j in atom.orbitals[1:]:
+          if i == j:
+            g[i,j] = gpp[symbol]
+            h[i,j] = hpp[symbol]
+          else:
+            g[i,j] = gppp[symbol]
+            h[i,j] = hppp[symbol]
     self.h = h
     self.g = g
     return g
-		
+
     ##
     # one-center one-electron energy integral of orbitals a and b (on the same atom)
     ##
   def get_V(self):
-    def f2(R):
-      return 0.0
     n = len(self.orbitals)
-    V = objects.numeric.array((((0.0,)*n,)*n))
-    for i in range(n):
-      for j in range(n):
-        for B in range(len(self.atoms)):
-          if(self.orbitals[i].atom != B):
-            R = vdist(self.atoms[B],self.atoms[self.orbitals[i].atom])
-            c = self.atoms[B].orbitals[0]
-            if self.tc_te.has_key((i,j,c,c)):
-              V[i][j] = V[i][j] + (-1)*Z[self.atoms[B].symbol]*self.tc_te[(i,j,c,c)] + f2(R)
+    V = numpy.zeros((n,n))
+    for group in self.get_groups():
+      group.add_V(V)
     self.V = V
     return V
 
     ##
     # Performs Extended Huckel calculation to obtain initial guess for the fock matrix, F.
-    ##		
+    ##
   def EH(self):
-    n = len(self.orbitals)
-    F = objects.numeric.array((((0.0,)*n,)*n))
-    for i in range(n):
-      U = Us[self.atoms[self.orbitals[i].atom].symbol]
-      if(self.orbitals[i].ot != 0):
-        U = Up[self.atoms[self.orbitals[i].atom].symbol]
-      F[i][i] = U
-      for j in range(n)[(i+1):]:
-        Ui = Us[self.atoms[self.orbitals[i].atom].symbol]
-        if(self.orbitals[i].ot != 0):
-          Ui = Up[self.atoms[self.orbitals[i].atom].symbol]
-        Uj = Us[self.atoms[self.orbitals[j].atom].symbol]
-        if(self.orbitals[j].ot != 0):
-          Uj = Up[self.atoms[self.orbitals[j].atom].symbol]
-          
-        F[i][j] = (1.75 / 2) * (Ui+Uj)*self.S[i][j]
-        F[j][i] = F[i][j]
+    U = numpy.array([ o.U for o in self.orbitals ])
+    F = (1.75 / 2) * (U[:,None]+U[None,:])*self.S
+    F[numpy.diag_indices(len(U))] = U
     self.F = F
-        
     return F
-			
 
     ##
     # Calculate two-electron part of the Fock matrix, given P and overlap matrices
     ##
   def twofock(self,P):
-    ##
-    # orbital_type returns the type of orbital associated with integer n. 0 is s; 1,2,3 is px,py,pz respectively
-    ##
-    def orbital_type(n):
-      if(n == 0):
-        return 's'
-      else:
-        return 'p'
-      
-    def f(i,j):
-      if(i==j):
-        S = 0
-        for n in self.atoms[self.orbitals[i].atom].orbitals:
-          S += P[n][n]*(self.g[i][n] - 0.5*self.h[i][n])
-        for B in range(len(self.atoms)):
-          if(self.orbitals[i].atom != B):
-            for l in self.atoms[B].orbitals:
-              for s in self.atoms[B].orbitals:
-                if self.tc_te.has_key((i,i,l,s)):
-                  S += P[l][s]*self.tc_te[(i,i,l,s)]
-        return S
-      elif(self.orbitals[i].atom == self.orbitals[j].atom):				
-        S = 0.5*P[i][j]*(3.0*self.h[i][j] - self.g[i][j])
-        for B in range(len(self.atoms)):
-          if(self.orbitals[i].atom != B):
-            for l in self.atoms[B].orbitals:
-              for s in self.atoms[B].orbitals:
-                if self.tc_te.has_key((i,j,l,s)):
-                  S += P[l][s]*self.tc_te[(i,j,l,s)]
-        return S
-      else:
-        S = 0.0
-        for n in self.atoms[self.orbitals[i].atom].orbitals:
-          for s in self.atoms[self.orbitals[j].atom].orbitals:
-            if self.tc_te.has_key((i,n,j,s)):
-              S -= 0.5*P[n][s]*self.tc_te[(i,n,j,s)]
-        return S
-  
-    # Calculate the two electron part of the fock matrix F
-    n = len(self.orbitals)
-    F = objects.numeric.array((((0.0,)*n,)*n))
-  
-    for i in range(n):
-      for j in range(i,n):
-        F[i][j] = f(i,j)
-        F[j][i] = F[i][j]
+    # One-center part
+    d = numpy.diag(P)
+    F = 0.5*P*(3.0*self.h - self.g)
+    F[numpy.diag_indices(len(d))] = numpy.dot(self.g - 0.5*self.h,d)
+    # Two-center part
+    for group in self.get_groups():
+      group.add_twofock(P,F)
     self.F=F
     return F
-  
+
     # Core energy. WORKS!
   def Ecore(self):
-    def F(a,R):
-      symbol = self.atoms[a].symbol
-      S  = K1[symbol]*math.exp(-L1[symbol]*(R-M1[symbol])**2)
-      S += K2[symbol]*math.exp(-L2[symbol]*(R-M2[symbol])**2)
-      S += K3[symbol]*math.exp(-L3[symbol]*(R-M3[symbol])**2)
-      S += K4[symbol]*math.exp(-L4[symbol]*(R-M4[symbol])**2)
-      return S
-    
     Ec = 0.0
-    for A in range(len(self.atoms)):
-      for B in range(A+1,len(self.atoms)):
-        R = vdist(self.atoms[A],self.atoms[B])				
-        Q = Z[self.atoms[A].symbol]*Z[self.atoms[B].symbol]
-        orbital1 = self.atoms[A].orbitals[0]
-        orbital2 = self.atoms[B].orbitals[0]
-        if self.tc_te.has_key((orbital1,orbital1,orbital2,orbital2)):
-          repuls = self.tc_te[(orbital1,orbital1,orbital2,orbital2)]
-        enuc = Q*repuls
-        scale = (math.exp(-self.orbitals[self.atoms[A].orbitals[0]].alpha*R) +
-           math.exp(-self.orbitals[self.atoms[B].orbitals[0]].alpha*R))
-        scale = abs(scale*enuc) + Q/R*(F(A,R) + F(B,R))
-        Ec += enuc + scale
+    for group in self.get_groups():
+      Ec += group.Ec.sum()
     self.Ec = Ec
     return Ec
   def Energy(self,F,P):
     # Calculate Eel
-    Eel = 0.0
-    n = len(self.orbitals)
     if debug:
       print 'In Energy(): F, H, P:'
       print F
       print self.H
       print P
-    for i in range(n):
-      for j in range(n):
-        Eel += 0.5*P[i][j]*(self.H[i][j] + F[i][j])
-    
+    Eel = 0.5*(P*(self.H + F)).sum()
+
     # Total energy = electric energy + core repulsion energy
     if debug:
       print 'Electronic energy:',Eel
       print 'Nuclear repulsion energy:',self.Ec
     E = Eel + self.Ec
     return E
-	
+
 
   def get_P(self,F):
     Fp = F+self.H
@@ -769,139 +798,88 @@ class Molecule:
       print C
     self.eig = Energy
     self.mo = C
-    n = len(self.orbitals)
-    P = objects.numeric.zeros((n,n)) * 0.0
-    for i in range(n):
-      for j in range(n):
-        P[i][j] = 0.0
-        for k in range(self.number_of_electrons()/2):
-          P[i][j] += 2*C[i][k]*C[j][k]
+    occ = numpy.asarray(C)[:,:self.number_of_electrons()/2]
+    P = 2*numpy.dot(occ,numpy.transpose(occ))
     self.P = P
     return P
 
   def calc_H(self,part=-1):
-    def b(a,b):
-      return 0.5*(self.orbitals[a].beta+self.orbitals[b].beta)*self.S[a][b]
-    n = len(self.orbitals)
-    
-    if part != -1:
-      H = self.H
-      for j in self.atoms[part].orbitals:
-        for i in range(n):
-          S = 0.0
-          if(i==j):
-            if(self.orbitals[i].ot != 0):
-              S = Up[self.atoms[self.orbitals[i].atom].symbol]
-            else:
-              S = Us[self.atoms[self.orbitals[i].atom].symbol]
-            H[i][j] = S + self.V[i][j]
-          else:
-            H[i][j] = b(i,j)
-          H[j][i]=H[i][j]
-      self.H = H
-      return
-    H = objects.numeric.zeros((n,n)) * 0.0
-    for j in range(n):
-      for i in range(j,n):
-        S = 0.0
-        if(i==j):
-          if(self.orbitals[i].ot != 0):
-            S = Up[self.atoms[self.orbitals[i].atom].symbol]
-          else:
-            S = Us[self.atoms[self.orbitals[i].atom].symbol]
-        if self.orbitals[i].atom == self.orbitals[j].atom:
-          H[i][j] = S + self.V[i][j]
-        else:
-          H[i][j] += b(i,j)
-        H[j][i]=H[i][j]    # BUG, this line was missing!!!
+    U = numpy.array([ o.U for o in self.orbitals ])
+    H = self.V.copy()
+    H[numpy.diag_indices(len(U))] += U
+    for group in self.get_groups():
+      group.add_H(H)
     self.H=H
     if debug:
       print 'H:'
       print self.H
 
-  def calc_tc_te(self,atom=-1):
-    "Calculates the two-center two-electron integrals for the molecule."
-    "if optional parameter 'atom' is passed, only integrals involving the atom # 'atom' is recalculated"
-    # Only for orbitals on 'atom'?
-    if atom!=-1:
-      a = atom
-      for b in range(len(self.atoms))[a+1:]:
-        x = self.tc_te_diatom(self.atoms[a],self.atoms[b],noscreen = 1)
-        for i in range(len(x)):
-          self.tc_te[x[i][0]] = x[i][1]
-          self.tc_te[(x[i][0][2],x[i][0][3],x[i][0][0],x[i][0][1])] = self.tc_te[x[i][0]]
-    else:
-      self.tc_te = {} # Clear the integral dict to get rid of old values
-      for a in range(len(self.atoms)):
-        for b in range(a+1,len(self.atoms)):
-          x = self.tc_te_diatom(self.atoms[a],self.atoms[b])
-          for i in range(len(x)):
-            integral = x[i][1]
-            self.tc_te[x[i][0]] = integral
-            self.tc_te[(x[i][0][2],x[i][0][3],x[i][0][0],x[i][0][1])] = integral
-            self.tc_te[(x[i][0][2],x[i][0][3],x[i][0][1],x[i][0][0])] = integral
-            self.tc_te[(x[i][0][3],x[i][0][2],x[i][0][0],x[i][0][1])] = integral
-            self.tc_te[(x[i][0][3],x[i][0][2],x[i][0][1],x[i][0][0])] = integral
-            self.tc_te[(x[i][0][0],x[i][0][1],x[i][0][3],x[i][0][2])] = integral
-            self.tc_te[(x[i][0][1],x[i][0][0],x[i][0][2],x[i][0][3])] = integral
-            self.tc_te[(x[i][0][1],x[i][0][0],x[i][0][3],x[i][0][2])] = integral
-      #print 'integrals:'
-      #for k in self.tc_te.keys():
-      #	print k,self.tc_te[k]
+    ##
+    # Returns the starting density for an SCF at the current geometry
+    ##
+  def guess_density(self,part=-1):
+    "If part is given start from the density of the last SCF, as before."
+    "Otherwise extrapolate from the densities of the last two SCFs along"
+    "the line between their geometries, or fall back to extended Huckel."
+    if part != -1 and self.P is not None:
+      return self.P
+    if self.extrapolate and self.history:
+      x = numpy.ravel(self.coordinates())
+      x1,P1 = self.history[-1]
+      if abs(x-x1).max() < extrapolate_distance:
+        if len(self.history) > 1:
+          x0,P0 = self.history[-2]
+          dx = x1 - x0
+          dd = numpy.dot(dx,dx)
+          if dd > 0.0:
+            c = min(max(numpy.dot(x-x1,dx)/dd,-1.0),1.0)
+            return P1 + c*(P1 - P0)
+        return P1
+    F0 = self.EH()
+    return self.get_P(F0)
 
     ##
     # Calculates the energy by doing a full SCF
     ##
   def get_E(self,part=-1,partb=-1):
-    def mx(a): #Returns maximum value in matrix a
-      m = 0.0
-      for i in range(len(a)):
-        for j in range(len(a)):
-          if abs(a[i][j])>m:
-            m = abs(a[i][j])
-      return m
-          
     self.get_g_and_h()
-    # Default, calculate all properties from scratch
-    if part == -1:
-      self.get_S() 
-      self.calc_tc_te()
-      self.get_V()
-      self.calc_H()
-      F0 = self.EH()
-      P = self.get_P(F0)
-  
-    # If only one particle 'part' has moved, reuse as many values as possible
-    else:
-      self.get_S(part)
-      if partb != -1:
-        self.get_S(partb)
-      self.calc_tc_te()
-      self.get_V()
-      self.calc_H()
-      P = self.P
-      
+    self.calc_tc_te()
+    self.get_S()
+    self.get_V()
+    self.calc_H()
+    P = self.guess_density(part)
+
     E1 = 0.0
-  
+
     self.Ecore()
     G = self.twofock(P)
     niter = 0
     E2 = self.Energy(G+self.H,P)
-    ##
-    # TODO: Find a good convergence condition
-    ##
     damp = 0.0
     E_down = 0 #Increase when energy is going down, zero when going up
-    maxiter = 50
-    mindiff = 1e-4
-    while niter<1 or (niter < maxiter and mx(P-Po)>mindiff):
+    focks = []
+    errors = []
+    while niter<1 or (niter < scf_maxiter and abs(P-Po).max()>scf_convergence):
       niter += 1
       Po = P
-      P = self.get_P(G)
-      P = (1 - damp)*P + damp*Po
+      F = G + self.H
+      error = numpy.dot(F,P) - numpy.dot(P,F)
+      if self.diis and abs(error).max() < diis_start:
+        # Extrapolate the Fock matrix from the previous ones, using the
+        # commutator FP - PF (the basis is orthogonal) as the error
+        focks.append(F)
+        errors.append(error)
+        if len(focks) > diis_size:
+          del focks[0]
+          del errors[0]
+        P = self.get_P(diis(focks,errors) - self.H)
+      else:
+        P = self.get_P(G)
+        P = (1 - damp)*P + damp*Po
       G = self.twofock(P)
       E1 = E2
       E2 = self.Energy(G+self.H,P)
+      if debug: print niter,E2,abs(error).max(),abs(P-Po).max()
       if E2 > E1:
         damp = 0.5*(1 + damp)
         E_down = 0
@@ -913,9 +891,12 @@ class Molecule:
 #          print 'Energy going down fine, setting damping to ',damp
     self.G = G
     self.P = P
+    self.geometry = self.coordinates()
+    self.history = self.history[-1:] + [ (numpy.ravel(self.geometry),P) ]
     self.Eeval += 1
-    if niter >= maxiter:
-      print 'WARNING: SCF not converged in %i iterations, last energy difference:' % maxiter,E2-E1
+    self.Eiter += niter
+    if niter >= scf_maxiter:
+      print 'WARNING: SCF not converged in %i iterations, last energy difference:' % scf_maxiter,E2-E1
     return E2
 
     ##
@@ -923,114 +904,100 @@ class Molecule:
     ##
   def get_fd_E(self,P,part=-1,partb=-1):
     self.get_g_and_h()
-    # Default, calculate all properties from scratch
-    if part == -1:
-      self.get_S() 
-      self.calc_tc_te()
-    # If only one particle 'part' has moved, reuse as many values as possible
-    else:
-      self.get_S(part)
-      if partb != -1:
-        self.get_S(partb)
-      self.calc_tc_te()
-      P = self.P    
+    self.calc_tc_te()
+    self.get_S()
     self.get_V()
     self.calc_H()
     self.Ecore()
     G = self.twofock(P)
     E = self.Energy(G+self.H,P)
     return E
-  
+
+    ##
+    # Analytic gradient. The SCF density is variational and the
+    # one-center terms do not depend on the geometry, so the gradient
+    # is the sum of the derivatives of the pair energies with the
+    # density held fixed.
+    ##
   def gradient(self,fixed = -1):
-    self.get_E()
+    # Reuse the SCF if the atoms have not moved since
+    if self.geometry is None or (self.coordinates() != self.geometry).any():
+      self.get_E()
     n = len(self.atoms)
-    grad = objects.numeric.array(((0.0,)*3*n,))
-    grad = objects.numeric.reshape(grad,(3*n,1))
-    for a in range(n):
-      if fixed != -1 and fixed[a] == 1:
-        grad[3*a:3*a+3] = 0.0
-        continue
-      for i in ['x','y','z']:
-        self.atoms[a].__dict__[i] += derivative_step
-        E1 = self.get_E(a)
-        self.atoms[a].__dict__[i] -= 2*derivative_step
-        E2 = self.get_E(a)
-        self.atoms[a].__dict__[i] += derivative_step
-        grad[3*a+['x','y','z'].index(i)] = (E1-E2)/(2*derivative_step)
-    return grad
-  
-    # Frozen density gradient
+    grad = numpy.zeros((n,3))
+    for group in self.get_groups():
+      group.add_gradient(self.P,grad)
+    if fixed != -1:
+      for a in range(n):
+        if fixed[a] == 1:
+          grad[a] = 0.0
+    return numpy.reshape(grad,(3*n,1))
+
+    # Frozen density gradient by finite differences
   def fd_gradient(self,fixed = -1,fourpoint = 0):
     self.get_E()
+    P = self.P
     n = len(self.atoms)
-    grad = objects.numeric.array(((0.0,)*3*n,))
-    grad = objects.numeric.reshape(grad,(3*n,1))
+    grad = numpy.zeros((3*n,1))
     for a in range(n):
-#      if a==0:
-#        grad[3*a:3*a+3] = 0.0
-#        continue
+      if fixed != -1 and fixed[a] == 1:
+        continue
       for i in ['x','y','z']:
         orig = self.atoms[a].__dict__[i]
         if fourpoint == 0:
           self.atoms[a].__dict__[i] = orig + derivative_step
-          E1 = self.get_fd_E(self.P,a)
+          E1 = self.get_fd_E(P,a)
           self.atoms[a].__dict__[i] = orig - derivative_step
-          E2 = self.get_fd_E(self.P,a)
+          E2 = self.get_fd_E(P,a)
           self.atoms[a].__dict__[i] = orig
           grad[3*a+['x','y','z'].index(i)] = (E1-E2)/(2*derivative_step)
         else:
           self.atoms[a].__dict__[i] = orig + 2*derivative_step
-          E1 = self.get_fd_E(self.P,a)
+          E1 = self.get_fd_E(P,a)
           self.atoms[a].__dict__[i] = orig + derivative_step
-          E2 = self.get_fd_E(self.P,a)
+          E2 = self.get_fd_E(P,a)
           self.atoms[a].__dict__[i] = orig - derivative_step
-          E3 = self.get_fd_E(self.P,a)
+          E3 = self.get_fd_E(P,a)
           self.atoms[a].__dict__[i] = orig - 2*derivative_step
-          E4 = self.get_fd_E(self.P,a)
+          E4 = self.get_fd_E(P,a)
           self.atoms[a].__dict__[i] = orig
           grad[3*a+['x','y','z'].index(i)] = (E4-8*(E3-E2)-E1)/(12*derivative_step)
+    # leave the integrals as they were for the original geometry
+    self.get_fd_E(P)
     return grad
-  
+
+    # Hessian by finite differences of the analytic gradient
   def fd_hessian(self,fixed=-1):
-    self.get_E()
     n = len(self.atoms)
-    hess = objects.numeric.array(((0.0,)*(3*n)**2,))
-    hess = objects.numeric.reshape(hess,(3*n,3*n))
+    hess = numpy.zeros((3*n,3*n))
     for a in range(n):
       if fixed != -1 and fixed[a] == 1:
-        hess[3*a:3*a+3][1:3*n] = 0.0
-        hess[3*a,3*a] = 1.0
-        hess[3*a+1,3*a+1] = 1.0
-        hess[3*a+2,3*a+2] = 1.0
+        hess[3*a:3*a+3,3*a:3*a+3] = numpy.identity(3)
         continue
-      
-    for i in ['x','y','z']:
-      self.atoms[a].__dict__[i] += derivative_step
-      g1 = self.fd_gradient(fixed)
-      self.atoms[a].__dict__[i] -= 2*derivative_step
-      g2 = self.fd_gradient(fixed)
-      self.atoms[a].__dict__[i] += derivative_step
-      for j in range(3*n):
-        g1[j]=1/(2*derivative_step)*float(g1[j])
-        g2[j]=1/(2*derivative_step)*float(g2[j])
-        hess[j][3*a+['x','y','z'].index(i)]+=1*0.5*(g1[j]-g2[j])
-        hess[3*a+['x','y','z'].index(i)][j]+=1*0.5*(g1[j]-g2[j])
-          
+      for i in ['x','y','z']:
+        self.atoms[a].__dict__[i] += derivative_step
+        g1 = self.gradient(fixed)
+        self.atoms[a].__dict__[i] -= 2*derivative_step
+        g2 = self.gradient(fixed)
+        self.atoms[a].__dict__[i] += derivative_step
+        k = 3*a+['x','y','z'].index(i)
+        dg = (g1-g2)[:,0]/(2*derivative_step)
+        hess[:,k] += 0.5*dg
+        hess[k,:] += 0.5*dg
     return hess
-  
+
   def hessian(self,fixed=-1):
     E = self.get_E()
     P = self.P
     n = len(self.atoms)
-    hess = objects.numeric.array(((0.0,)*(3*n)**2,))
-    hess = objects.numeric.reshape(hess,(3*n,3*n))
+    hess = numpy.zeros((3*n,3*n))
     for a in range(3*n):
       atoma=a/3
       if fixed != -1 and fixed[atoma] == 1:
         hess[a][1:3*n] = 0.0
         hess[a][a] = 1.0
         continue
-      
+
       keya = 'x'
       if a%3 == 1:
         keya = 'y'
@@ -1050,7 +1017,7 @@ class Molecule:
       self.P = P
       self.atoms[atoma].__dict__[keya] += 2*derivative_step
       hess[a][a] = (-E1+16*E2-30*E+16*E3-E4)/(12*derivative_step**2)
-  
+
       for b in range(3*n)[a+1:]:
         keyb = 'x'
         if a%3 == 1:
@@ -1058,7 +1025,7 @@ class Molecule:
         if a%3 == 2:
           keyb = 'z'
         atomb=b/3
-        
+
         self.atoms[atoma].__dict__[keya] += derivative_step
         self.atoms[atomb].__dict__[keyb] += derivative_step
         E1 = self.get_E(atoma,atomb)
@@ -1082,15 +1049,13 @@ class Molecule:
     return hess
 
   def pos(self):
-    n = len(self.atoms)
-    r = objects.numeric.array(((0.0,)*3*n,))
-    r = objects.numeric.reshape(r,(3*n,1))
-    for i in range(n):
-      r[3*i] = self.atoms[i].x
-      r[3*i+1] = self.atoms[i].y
-      r[3*i+2] = self.atoms[i].z
-    return r
+    return numpy.reshape(self.coordinates(),(3*len(self.atoms),1))
 
+    ##
+    # Line search along d from the current geometry, whose energy is E.
+    # Returns the energy at the geometry it ends at, so the caller
+    # need not do another SCF there.
+    ##
   def linesearch_quadratic(self,E,d,backward_search_ok=0):
     def move(d,h):
       for i in range(len(self.atoms)):
@@ -1147,19 +1112,19 @@ class Molecule:
 #    print 'Epredicted, Eactual',E0+hopt*p + hopt**2*q/2,Eopt
     if Eopt > E:
       print 'WARNING: Energy increasing at end of linesearch: E,Eopt',E,Eopt
+    return Eopt
 
   def steepestdescent(self, max_iter = 50, conv_res = 0.00001):
       E0 = self.get_E()
-      g = self.fd_gradient()
-      self.linesearch_quadratic(E0,-g)
+      g = self.gradient()
+      E0 = self.linesearch_quadratic(E0,-g)
       E1 = E0 + 2*conv_res
       niter = 0
       r0 = self.pos()
       while niter < 1 or niter < max_iter and abs(E0-E1) > conv_res:
-          g = self.fd_gradient()
-          self.linesearch_quadratic(E0,-g)
+          g = self.gradient()
           E1 = E0
-          E0 = self.get_E()
+          E0 = self.linesearch_quadratic(E0,-g)
           r1 = self.pos()
           yield self.atoms, E0
           niter += 1
@@ -1169,10 +1134,9 @@ class Molecule:
       E0 = self.get_E()
       yield self.atoms, E0
       r0 = self.pos()
-      g = self.fd_gradient(fourpoint=0)
+      g = self.gradient()
       do = -g
-      self.linesearch_quadratic(E0,-g)
-      E1 = self.get_E()
+      E1 = self.linesearch_quadratic(E0,-g)
       minE = E0
       if E1<minE:
           minE = E1
@@ -1185,16 +1149,15 @@ class Molecule:
       while niter < max_iter and norm(g)/(1+abs(E1))>gradient_threshold and abs((E0-E1)/E1) > energy_threshold:
           r1 = self.pos()
           go = g
-          g = self.fd_gradient(fourpoint=0)
+          g = self.gradient()
           a = self.atoms[1]
-          n = float(objects.numeric.matrixmultiply(objects.numeric.transpose(g),g)) - float(objects.numeric.matrixmultiply(objects.numeric.transpose(g),go)) 
-          d = float(objects.numeric.matrixmultiply(objects.numeric.transpose(go),go))
+          n = float(numpy.dot(numpy.transpose(g),g)) - float(numpy.dot(numpy.transpose(g),go)) 
+          d = float(numpy.dot(numpy.transpose(go),go))
           beta=n/d
           dn = -g + beta*do
           do = dn
-          self.linesearch_quadratic(E1,dn,backward_search_ok=1)
           E0 = E1
-          E1 = self.get_E()
+          E1 = self.linesearch_quadratic(E0,dn,backward_search_ok=1)
           yield self.atoms, E1
           if E1<minE:
               minE = E1
@@ -1211,41 +1174,39 @@ class Molecule:
     E0 = self.get_E()
     yield self.atoms, E0
     rc = self.pos()                                                                                              
-    gc = self.fd_gradient(fixed,fourpoint=1)                                                                     
-    self.linesearch_quadratic(E0,-gc)                                                                            
+    gc = self.gradient(fixed)                                                                     
+    E1 = self.linesearch_quadratic(E0,-gc)                                                                            
     N = 0                                                                                                       
                                                                                                                   
     n = len(self.atoms)*3                                                                                        
-    Bc = objects.numeric.array(((0.0,)*(n)**2,))                                                                            
-    Bc = objects.numeric.reshape(Bc,(n,n))                                                                                      
+    Bc = numpy.array(((0.0,)*(n)**2,))                                                                            
+    Bc = numpy.reshape(Bc,(n,n))                                                                                      
     for i in range(n):                                                                                          
       Bc[i][i] = 10.0                                                                                           
-    E1 = self.get_E()                                                                                            
                                                                                                                   
     rp = self.pos()                                                                                              
                                                                                                                   
     while N<1 or N < 50 and abs(E0-E1) > 0.1*conv_res: # and norm(rp-rc)/len(rp-rc) > 0.0001:                   
-      gp = self.fd_gradient(fixed,fourpoint=1)                                                                   
+      gp = self.gradient(fixed)                                                                   
       rp = self.pos()                                                                                            
       sc = rp - rc # geometry difference                                                                        
       yc = gp - gc # gradient difference                                                                        
-      t1 = 1.0/float(objects.numeric.matrixmultiply(objects.numeric.transpose(yc),sc))*objects.numeric.matrixmultiply(yc,objects.numeric.transpose(yc))                         
-      n2 = objects.numeric.matrixmultiply(objects.numeric.matrixmultiply(Bc,sc),objects.numeric.matrixmultiply(objects.numeric.transpose(sc),Bc))                               
-      d2 = float(objects.numeric.matrixmultiply(objects.numeric.transpose(sc),objects.numeric.matrixmultiply(Bc,sc)))                                           
+      t1 = 1.0/float(numpy.dot(numpy.transpose(yc),sc))*numpy.dot(yc,numpy.transpose(yc))                         
+      n2 = numpy.dot(numpy.dot(Bc,sc),numpy.dot(numpy.transpose(sc),Bc))                               
+      d2 = float(numpy.dot(numpy.transpose(sc),numpy.dot(Bc,sc)))                                           
       Bp = Bc + t1 - n2/d2                # Update the Hessian                                                  
       # Now we have the gradient and the estimated Hessian.                                                     
-      sN = -objects.numeric.matrixmultiply(inverse(Bp),gp) # The quasi-Newton step                                              
+      sN = -numpy.dot(numpy.linalg.inv(Bp),gp) # The quasi-Newton step                                              
       steplen = min(0.2+0.25*N,1.0)        # This make the step larger as the number of iterations              
                                            #  and thus the precision of the estimation increases                
                                            # After a few cycles, a full step is taken                           
       #    move(steplen*sN)                                                                                     
-      self.linesearch_quadratic(E1,sN,backward_search_ok=1)                                                      
+      E0 = E1
+      E1 = self.linesearch_quadratic(E0,sN,backward_search_ok=1)                                                      
       N += 1                                                                                                    
       rc = rp                                                                                                   
       gc = gp                                                                                                   
       Bc = Bp                                                                                                   
-      E0 = E1                                                                                                   
-      E1 = self.get_E()
       yield self.atoms, E1
     if N >= 50:                                                                                                 
       print "Maximum number of iterations reached"                                                              
@@ -1253,10 +1214,9 @@ class Molecule:
       print "Convergence resolution reached"                                                                    
 #    if norm(rp-rc)/len(rp-rc) <= 0.0001:                                                                        
 #      print "Displacement limit reached"                                                                        
-    if abs(float(objects.numeric.matrixmultiply(objects.numeric.transpose(yc),yc))) < 0.01:                                                     
+    if abs(float(numpy.dot(numpy.transpose(yc),yc))) < 0.01:                                                     
       print "Gradient change too small"                                                                         
-    self.linesearch_quadratic(E0,-gp)                                                                            
-    E1 = self.get_E()                                                                                            
+    E1 = self.linesearch_quadratic(E1,-gp)
 
 
 
@@ -1317,8 +1277,112 @@ def norm(g):
 # 
 ##########################################
 
+def alkane(n):
+  """Return a Molecule for a staggered chain of n CH2 groups, capped with H"""
+  # C-C 1.54 and C-H 1.09 Angstrom, tetrahedral angles
+  s = math.sin(math.radians(54.75))
+  c = math.cos(math.radians(54.75))
+  mol = Molecule()
+  for i in range(n):
+    side = 1 - 2*(i%2)
+    y = 1.54*c*(i%2)
+    mol.add('C','C',1.54*s*i,y,0.0)
+    mol.add('H','H',1.54*s*i,y - side*1.09*c,1.09*s)
+    mol.add('H','H',1.54*s*i,y - side*1.09*c,-1.09*s)
+  mol.add('H','H',-1.09*s,-1.09*c,0.0)
+  side = 1 - 2*((n-1)%2)
+  mol.add('H','H',1.54*s*(n-1) + 1.09*s,1.54*c*((n-1)%2) - side*1.09*c,0.0)
+  return mol
+
+def benchmark(sizes=(6,12,24,48)):
+  """Print the time taken by an SCF and a gradient for alkane chains"""
+  for n in sizes:
+    mol = alkane(n)
+    t = time.time()
+    E = mol.get_E()
+    tE = time.time() - t
+    t = time.time()
+    mol.gradient()
+    tg = time.time() - t
+    print '%4d atoms  E = %16.8f eV  SCF %8.3fs  gradient %8.3fs' % (len(mol.atoms),E,tE,tg)
+
+# Geometries and energies calculated with the original (loop based)
+# implementation, with its frozen density finite difference gradient
+# for water.
+reference = {
+  'H2' : ([('H',0.1,0.2,0.3),('H',0.5,0.9,0.1)], -27.195610199474977),
+  'HF' : ([('F',0.0,0.0,0.0),('H',0.3,0.4,0.75)], -499.5403296025054),
+  'H2O' : ([('O',0.0,0.0,0.0),('H',0.0,0.0,1.05),('H',0.934609,0.0,-0.224954)],
+           -348.40642501570676),
+  'NH3' : ([('N',0.0,0.0,0.1),('H',0.95,0.0,-0.25),('H',-0.47,0.82,-0.28),
+            ('H',-0.49,-0.80,-0.22)], -248.6378180372729),
+  'HCN' : ([('H',-1.06,0.02,0.01),('C',0.0,0.0,0.0),('N',1.16,0.03,-0.02)],
+           -347.9007231318097),
+  'H2CO' : ([('C',0.0,0.0,0.0),('O',0.0,0.0,1.22),('H',0.94,0.0,-0.55),
+             ('H',-0.92,0.1,-0.56)], -475.55042265638895),
+  'CH3F' : ([('C',0.1,-0.05,0.0),('F',0.3,0.2,1.35),('H',1.02,0.0,-0.33),
+             ('H',-0.5,0.9,-0.35),('H',-0.45,-0.88,-0.3)], -653.9010591292295),
+  'C2H4' : ([('C',0.0,0.0,0.0),('C',1.34,0.05,0.02),('H',-0.55,0.93,0.0),
+             ('H',-0.56,-0.92,0.03),('H',1.9,0.97,-0.02),('H',1.88,-0.9,0.05)],
+            -310.3006622713874),
+  }
+reference_gradient_H2O = [0.98886, 0.0, -2.83922, -0.11666, 0.0, 2.76041, -0.8722, 0.0, 0.07881]
+
 class AM1TestCases(unittest.TestCase):
 
+    def makeMolecule(self,name):
+        mol = Molecule()
+        for symbol,x,y,z in reference[name][0]:
+            mol.add(symbol,symbol,x,y,z)
+        return mol
+
+    def testReferenceEnergies(self):
+        """Single point energies are those of the original implementation"""
+        for name in reference.keys():
+            mol = self.makeMolecule(name)
+            self.assertAlmostEqual(mol.get_E(),reference[name][1],6)
+
+    def testAlkane(self):
+        self.assertAlmostEqual(alkane(6).get_E(),-954.804272556974,6)
+
+    def testGradient(self):
+        """The analytic gradient agrees with finite differences"""
+        mol = self.makeMolecule('H2O')
+        g = mol.gradient()
+        # the densities are only converged to scf_convergence
+        for i in range(len(g)):
+            self.assertAlmostEqual(float(g[i]),reference_gradient_H2O[i],2)
+        for name in 'NH3','H2CO','CH3F':
+            mol = self.makeMolecule(name)
+            # fd_gradient does an SCF which gradient() reuses
+            fd = mol.fd_gradient(fourpoint=1)
+            g = mol.gradient()
+            self.assertTrue(abs(g-fd).max() < 1e-5)
+            # no net force
+            self.assertTrue(abs(numpy.reshape(g,(-1,3)).sum(axis=0)).max() < 1e-8)
+
+    def testOneSCF(self):
+        """The gradient reuses the SCF for the current geometry"""
+        mol = self.makeMolecule('H2CO')
+        mol.get_E()
+        mol.gradient()
+        self.assertEqual(mol.Eeval,1)
+        mol.atoms[0].x += 0.01
+        mol.gradient()
+        self.assertEqual(mol.Eeval,2)
+
+    def testLineSearchEnergy(self):
+        """The line search returns the energy where it ends"""
+        mol = self.makeMolecule('H2O')
+        E = mol.get_E()
+        E1 = mol.linesearch_quadratic(E,-mol.gradient())
+        self.assertTrue(E1 < E)
+        # the SCF at the final geometry is the one the gradient uses
+        n = mol.Eeval
+        mol.gradient()
+        self.assertEqual(mol.Eeval,n)
+        self.assertAlmostEqual(mol.get_E(),E1,6)
+
     def testCH2(self):
         
         # Create the molecule
@@ -1343,7 +1407,9 @@ class AM1TestCases(unittest.TestCase):
                 done=1
                 break
         
-        self.assertAlmostEqual(energy,-150.72230108)
+        # The analytic gradient and reused densities take a slightly
+        # different path from the old finite difference one
+        self.assertAlmostEqual(energy,-150.72230108,4)
             
 
 
@@ -1382,4 +1448,7 @@ def testMe():
 
 if __name__ == "__main__":
 
-    unittest.main()
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        unittest.main()
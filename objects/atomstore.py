@@ -0,0 +1,542 @@
+#
+#    This file is part of the CCP1 Graphical User Interface (ccp1gui)
+#
+#   (C) 2002-2007 CCLRC Daresbury Laboratory
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+"""Compact (structure of arrays) storage for the atoms of a molecule.
+
+An AtomStore holds the coordinates, atomic numbers, charges and flags
+of all the atoms of a molecule in numpy arrays, and the commonly set
+text fields in lists. The atoms themselves are AtomView objects, which
+only hold a reference to the store, the row number and the connectivity,
+and look up everything else in the store, so mol.atom[i].coord,
+mol.atom[i].symbol etc. work as for ZAtom.
+
+Any other attribute (the z-matrix fields i1, r_var, zorc ..., PDB
+fields and so on) is only stored for an atom if it is set to something
+other than the ZAtom default, so these are only allocated for atoms
+that actually use them.
+
+Note that the coord attribute of an AtomView is a numpy view onto the
+row of the coordinate array, so a.coord[0] = x updates the store.
+
+A molecule is switched over with Indexed.use_array_atoms, after which
+its new atoms should come from Indexed.new_atom. The rows of deleted
+atoms are reused for the next new atoms.
+
+Run this file with the argument "benchmark" to compare the memory used
+by the two kinds of storage for a large PDB structure.
+"""
+
+import os,sys
+if __name__ == "__main__":
+    # Need to add the gui directory to the python path so
+    # that all the modules can be imported
+    gui_path = os.path.split(os.path.dirname( os.path.realpath( __file__ ) ))[0]
+    sys.path.append(gui_path)
+else:
+    from viewer.paths import gui_path
+
+import copy
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import objects.zmatrix
+from objects.periodic import sym2no
+
+def isAvailable():
+    """Return True if we have numpy and so can use array storage"""
+    if numpy: return True
+    return False
+
+# Columns held in numpy arrays, with their types
+ARRAY_FIELDS = {
+    'formal_charge'  : 'float64',
+    'partial_charge' : 'float64',
+    'b'              : 'float32',
+    'q'              : 'float32',
+    'flags'          : 'int32',
+    'selected'       : 'int8',
+    }
+
+# Text columns held in lists
+LIST_FIELDS = [ 'symbol', 'name', 'resn', 'resi', 'chain' ]
+
+# The values of everything else for a freshly created ZAtom
+DEFAULTS = objects.zmatrix.ZAtom().__dict__
+for _k in [ 'coord', 'conn', 'seqno' ] + ARRAY_FIELDS.keys() + LIST_FIELDS:
+    del DEFAULTS[_k]
+
+def _is_default(name,value):
+    try:
+        default = DEFAULTS[name]
+    except KeyError:
+        return 0
+    if value is default:
+        return 1
+    if type(value) == type(default) and isinstance(value,(int,float,str)):
+        return value == default
+    return 0
+
+
+class AtomStore:
+    """Arrays holding the per-atom data for a molecule"""
+
+    def __init__(self,size=0):
+        # rows in use or freed (see release)
+        self.natoms = 0
+        self.free = []
+        self.coord = numpy.zeros((max(size,16),3),dtype='float64')
+        self.number = numpy.zeros(max(size,16),dtype='int16')
+        self.arrays = {}
+        for name, type in ARRAY_FIELDS.items():
+            self.arrays[name] = numpy.zeros(max(size,16),dtype=type)
+        self.lists = {}
+        for name in LIST_FIELDS:
+            self.lists[name] = []
+        # Sparse storage of everything else, keyed on row
+        self.extra = {}
+
+    def _grow(self):
+        size = 2*len(self.number)
+        self.coord = numpy.resize(self.coord,(size,3))
+        self.number = numpy.resize(self.number,size)
+        for name in self.arrays.keys():
+            self.arrays[name] = numpy.resize(self.arrays[name],size)
+
+    def new_row(self):
+        """Allocate a row holding the ZAtom defaults and return its index,
+        reusing the row of a deleted atom if there is one"""
+        template = Atom_defaults
+        if self.free:
+            i = self.free.pop()
+            for name in LIST_FIELDS:
+                self.lists[name][i] = template[name]
+        else:
+            if self.natoms == len(self.number):
+                self._grow()
+            i = self.natoms
+            self.natoms = i + 1
+            for name in LIST_FIELDS:
+                self.lists[name].append(template[name])
+        self.coord[i] = 0.0
+        self.number[i] = 0
+        for name in self.arrays.keys():
+            self.arrays[name][i] = template[name]
+        return i
+
+    def new_atom(self):
+        """Return a new atom (an AtomView) in this store"""
+        return AtomView(self,self.new_row())
+
+    def copy_row(self,i,store=None):
+        """Duplicate row i into a new row of store (default this one),
+        returning the new index"""
+        if store is None:
+            store = self
+        j = store.new_row()
+        store.coord[j] = self.coord[i]
+        store.number[j] = self.number[i]
+        for name in self.arrays.keys():
+            store.arrays[name][j] = self.arrays[name][i]
+        for name in LIST_FIELDS:
+            store.lists[name][j] = self.lists[name][i]
+        if self.extra.has_key(i):
+            store.extra[j] = copy.copy(self.extra[i])
+        return j
+
+    def release(self,view):
+        """Free the row of an atom that has been deleted from the molecule
+        so it can be reused. The view is moved to a store of its own so
+        that any remaining references to it still see its data."""
+        i = view._i
+        store = AtomStore(1)
+        view._i = self.copy_row(i,store)
+        view._store = store
+        if self.extra.has_key(i):
+            del self.extra[i]
+        self.free.append(i)
+
+    def add_atom(self,atom):
+        """Copy the data of an ordinary (ZAtom) atom into the store and
+        return the view that replaces it. The conn list is not copied."""
+        view = self.new_atom()
+        i = view._i
+        d = atom.__dict__
+        view.coord = atom.coord
+        view.symbol = d.get('symbol','X')
+        for name in self.arrays.keys():
+            if d.has_key(name):
+                self.arrays[name][i] = d[name]
+        for name in LIST_FIELDS:
+            if d.has_key(name):
+                self.lists[name][i] = d[name]
+        for name, value in d.items():
+            if name in AtomView._direct or name in ('coord','conn'):
+                continue
+            if not _is_default(name,value):
+                self.extra.setdefault(i,{})[name] = value
+        view.seqno = d.get('seqno',-1)
+        return view
+
+    def get_extra(self,i,name):
+        try:
+            return self.extra[i][name]
+        except KeyError:
+            try:
+                return DEFAULTS[name]
+            except KeyError:
+                raise AttributeError(name)
+
+    def set_extra(self,i,name,value):
+        if _is_default(name,value):
+            try:
+                del self.extra[i][name]
+                if not self.extra[i]:
+                    del self.extra[i]
+            except KeyError:
+                pass
+        else:
+            self.extra.setdefault(i,{})[name] = value
+
+    def del_extra(self,i,name):
+        try:
+            del self.extra[i][name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+Atom_defaults = objects.zmatrix.ZAtom().__dict__
+
+
+def _array_property(name):
+    def get(self):
+        return self._store.arrays[name][self._i]
+    def set(self,value):
+        self._store.arrays[name][self._i] = value
+    return property(get,set)
+
+def _list_property(name):
+    def get(self):
+        return self._store.lists[name][self._i]
+    def set(self,value):
+        self._store.lists[name][self._i] = value
+    return property(get,set)
+
+
+class AtomView(object):
+    """An atom whose data is held in an AtomStore
+
+    This provides the same attributes and methods as ZAtom
+    """
+
+    __slots__ = ( '_store', '_i', 'conn', 'seqno', 'seqno2' )
+
+    def __init__(self,store,i):
+        self._store = store
+        self._i = i
+        self.conn = []
+        self.seqno = -1
+
+    def _get_coord(self):
+        return self._store.coord[self._i]
+    def _set_coord(self,value):
+        self._store.coord[self._i] = value
+    coord = property(_get_coord,_set_coord)
+
+    def _get_symbol(self):
+        return self._store.lists['symbol'][self._i]
+    def _set_symbol(self,value):
+        self._store.lists['symbol'][self._i] = value
+        self._store.number[self._i] = sym2no.get(value,0)
+    symbol = property(_get_symbol,_set_symbol)
+
+    for _name in ARRAY_FIELDS.keys():
+        locals()[_name] = _array_property(_name)
+    for _name in LIST_FIELDS[1:]:
+        locals()[_name] = _list_property(_name)
+    del _name
+
+    def __getattr__(self,name):
+        # only called for attributes not found in the slots or properties
+        if name[:2] == '__' or name[:1] == '_':
+            raise AttributeError(name)
+        return self._store.get_extra(self._i,name)
+
+    def __setattr__(self,name,value):
+        if name in AtomView._direct:
+            object.__setattr__(self,name,value)
+        else:
+            self._store.set_extra(self._i,name,value)
+
+    def __delattr__(self,name):
+        if name in AtomView._direct:
+            object.__delattr__(self,name)
+        else:
+            self._store.del_extra(self._i,name)
+
+    def __copy__(self):
+        """A copy is a new row of the same store"""
+        new = AtomView(self._store,self._store.copy_row(self._i))
+        new.conn = list(self.conn)
+        new.seqno = self.seqno
+        return new
+
+    def get_number(self):
+        return int(self._store.number[self._i])
+
+    # Everything else is the same as for ZAtom
+    get_mass = objects.zmatrix.Atom.__dict__['get_mass']
+    get_index = objects.zmatrix.Atom.__dict__['get_index']
+    get_index2 = objects.zmatrix.Atom.__dict__['get_index2']
+    get_connected = objects.zmatrix.Atom.__dict__['get_connected']
+    rotate = objects.zmatrix.Atom.__dict__['rotate']
+    __repr__ = objects.zmatrix.ZAtom.__dict__['__repr__']
+    __str__ = objects.zmatrix.ZAtom.__dict__['__str__']
+    set_symbol = objects.zmatrix.ZAtom.__dict__['set_symbol']
+    set_name = objects.zmatrix.ZAtom.__dict__['set_name']
+
+AtomView._direct = {}
+for _name in AtomView.__slots__ + ('coord','symbol') + \
+        tuple(ARRAY_FIELDS.keys()) + tuple(LIST_FIELDS):
+    AtomView._direct[_name] = 1
+
+
+def compact_atoms(atoms,size=0):
+    """Return a new AtomStore and a list of views replacing the atoms
+    (ZAtom or other) in atoms, with the connectivity and any references
+    between the atoms (conn, i1, i2, i3, linked_core) mapped onto the views
+    The store is made with room for size atoms if that is more.
+    """
+    store = AtomStore(max(len(atoms),size))
+    views = []
+    new = {}
+    for a in atoms:
+        v = store.add_atom(a)
+        views.append(v)
+        new[id(a)] = v
+
+    for a, v in zip(atoms,views):
+        v.conn = [ new.get(id(c),c) for c in getattr(a,'conn',[]) ]
+
+    for i, d in store.extra.items():
+        for k, value in d.items():
+            if new.has_key(id(value)):
+                d[k] = new[id(value)]
+    return store, views
+
+
+def repeat_atoms(atoms,ncopies):
+    """Return a new AtomStore and a list of views holding ncopies copies of
+    atoms one after another, as for the cells of a periodic block (see
+    Zmatrix.extend). The caller sets the coordinates.
+    References between the atoms are mapped onto the atoms of the same
+    copy, any other mutable attributes are copied for each view, and the
+    connectivity is left empty.
+    """
+    template, tviews = compact_atoms(atoms)
+    nat = len(atoms)
+    n = nat*ncopies
+    store = AtomStore(n)
+    store.natoms = n
+    store.coord[:n] = numpy.tile(template.coord[:nat],(ncopies,1))
+    store.number[:n] = numpy.tile(template.number[:nat],ncopies)
+    for name in template.arrays.keys():
+        store.arrays[name][:n] = numpy.tile(template.arrays[name][:nat],ncopies)
+    for name in LIST_FIELDS:
+        store.lists[name] = template.lists[name]*ncopies
+    views = [ AtomView(store,i) for i in range(n) ]
+
+    for i, d in template.extra.items():
+        for k in range(ncopies):
+            new = {}
+            for name, value in d.items():
+                if isinstance(value,AtomView) and value._store is template:
+                    new[name] = views[k*nat+value._i]
+                else:
+                    new[name] = copy.deepcopy(value)
+            store.extra[k*nat+i] = new
+    return store, views
+
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+class testAtomStore(unittest.TestCase):
+    """Check that the compact atoms behave as ZAtoms"""
+
+    def testCompact(self):
+        """Z-matrix survives conversion to compact storage"""
+        model = objects.zmatrix.Zmatrix(file=gui_path+os.sep+'examples'+os.sep+'feco5.zmt')
+        model.calculate_coordinates()
+        before = [ list(a.coord) for a in model.atom ]
+        ref = model.output_zmat()
+        model.use_array_atoms()
+        for a in model.atom:
+            self.assertTrue(a._store is model.store)
+        self.assertEqual(ref,model.output_zmat())
+        model.calculate_coordinates()
+        for a,c in zip(model.atom,before):
+            for x,y in zip(a.coord,c):
+                self.assertAlmostEqual(x,y)
+
+    def testSparse(self):
+        """Only non-default attributes are stored"""
+        store = AtomStore()
+        a = store.new_atom()
+        a.symbol = 'C'
+        a.r_var = None
+        a.zorc = 'c'
+        self.assertEqual(store.extra,{})
+        self.assertEqual(a.get_number(),6)
+        a.zorc = 'z'
+        a.coord[1] = 2.0
+        self.assertEqual(store.extra,{0:{'zorc':'z'}})
+        self.assertEqual(store.coord[0,1],2.0)
+        self.assertRaises(AttributeError,getattr,a,'visible')
+
+    def testCopy(self):
+        """Copies are independent"""
+        store = AtomStore()
+        a = store.new_atom()
+        b = copy.copy(a)
+        b.coord = [1.0,1.0,1.0]
+        self.assertEqual(list(a.coord),[0.0,0.0,0.0])
+        m = objects.zmatrix.Zmatrix(file=gui_path+os.sep+'examples'+os.sep+'water.zmt')
+        m.use_array_atoms()
+        m2 = copy.deepcopy(m)
+        m2.atom[0].coord[0] = 99.0
+        self.assertNotEqual(m.atom[0].coord[0],99.0)
+
+    def testRepeat(self):
+        """Repeated atoms have their own data and references"""
+        m = objects.zmatrix.Zmatrix(file=gui_path+os.sep+'examples'+os.sep+'water.zmt')
+        m.calculate_coordinates()
+        m.atom[1].visible = [1]
+        store, views = repeat_atoms(m.atom,2)
+        self.assertEqual([a.symbol for a in views],['O','H','H','O','H','H'])
+        self.assertTrue(views[5].i1 is views[3])
+        self.assertTrue(views[2].i1 is views[0])
+        self.assertEqual(views[4].visible,[1])
+        views[4].visible.append(0)
+        self.assertEqual(views[1].visible,[1])
+        self.assertEqual(m.atom[1].visible,[1])
+        views[3].coord[0] = 99.0
+        self.assertNotEqual(views[0].coord[0],99.0)
+
+    def testDelete(self):
+        """Rows of deleted atoms are reused"""
+        m = objects.zmatrix.Zmatrix(file=gui_path+os.sep+'examples'+os.sep+'water.zmt')
+        m.calculate_coordinates()
+        m.use_array_atoms()
+        rows = m.store.natoms
+        dead = m.atom[1]
+        coord = list(dead.coord)
+        m.delete_atom(1)
+        # the deleted atom keeps its data
+        self.assertEqual(list(dead.coord),coord)
+        self.assertEqual(dead.symbol,'H')
+        a = m.new_atom()
+        a.symbol = 'F'
+        a.coord = [1.0,2.0,3.0]
+        m.add_atom(a)
+        m.reindex()
+        self.assertEqual(m.store.natoms,rows)
+        self.assertTrue(a._store is m.store)
+        self.assertEqual(dead.symbol,'H')
+        self.assertEqual(list(dead.coord),coord)
+        self.assertEqual([b.symbol for b in m.atom],['O','H','F'])
+
+
+def read_pdb_atoms(filename,natoms,compact):
+    """Read the ATOM records of a PDB file, replicating them along x
+    until there are natoms atoms. Used for the benchmark."""
+    recs = []
+    for line in open(filename).readlines():
+        if line[:4] == 'ATOM' or line[:6] == 'HETATM':
+            recs.append((line[12:16].strip(),line[17:20].strip(),line[22:26].strip(),
+                         float(line[30:38]),float(line[38:46]),float(line[46:54]),
+                         line[76:78].strip().capitalize()))
+
+    mol = objects.zmatrix.Zmatrix()
+    if compact:
+        mol.use_array_atoms(natoms)
+    shift = 0.0
+    while len(mol.atom) < natoms:
+        for name,resn,resi,x,y,z,sym in recs:
+            a = mol.new_atom()
+            a.name = name
+            a.resn = resn
+            a.resi = resi
+            a.symbol = sym
+            a.coord = [x+shift,y,z]
+            mol.atom.append(a)
+            if len(mol.atom) == natoms:
+                break
+        shift = shift + 100.0
+    mol.reindex()
+    return mol
+
+def benchmark(natoms=100000):
+    """Compare the memory used by the ZAtom and array storage of a Zmatrix for
+    examples/pg_kaptein1.pdb replicated to natoms atoms, and the time taken
+    to build and connect it and to loop over the atoms reading the coordinates
+    and symbols (as the viewer does).
+    Each backend is run in a child process so the peak resident sizes
+    can be compared."""
+    import resource,time
+    filename = gui_path+os.sep+'examples'+os.sep+'pg_kaptein1.pdb'
+    for compact in (0,1):
+        pid = os.fork()
+        if pid == 0:
+            base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            t = time.time()
+            mol = read_pdb_atoms(filename,natoms,compact)
+            mol.connect()
+            t = time.time() - t
+            used = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base
+            t2 = time.time()
+            for a in mol.atom:
+                x = a.coord[0], a.symbol
+            t2 = time.time() - t2
+            print '%-6s %6d atoms, %6d bonds: %8.1f MB  build %6.2f s  loop %6.3f s' % \
+                  (('ZAtom','array')[compact],len(mol.atom),len(mol.bond),used/1024.0,t,t2)
+            os._exit(0)
+        os.waitpid(pid,0)
+
+
+def testMe():
+    """Return a unittest test suite with all the testcases that should be run by the main
+    gui testing framework."""
+
+    return  unittest.TestLoader().loadTestsFromTestCase(testAtomStore)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        for n in sys.argv[2:] or [100000]:
+            benchmark(int(n))
+    else:
+        unittest.main()
@@ -22,30 +22,34 @@
 A python object to represent numerical data at points in 3D space.
 
 This is a simple implementation for molecular graphics.
-To get started we have not yet used numerical python, although that
-is the long-term plan.
+The data may be held either as a list of floats or, when numpy is
+available, as a contiguous 1D numpy array (see set_data), which can
+be handed to VTK without copying.
 
 Axis ordering conventions:
 GAMESS-UK punchfile ordering has the first index varying fastest
 VTK                 ordering has the first index varying fastest
 Numeric has         the opposite convention!
 
-It is not yet clear what is the best way to resolve this
-   - later versions of vtk provide conversion functions but
-     these do not reorder
-   - it would be a shame to use Numeric and not be able to 
-     to use it to manipulate the fields, which implies a
-     fairly intuitive mapping
-   - we can choose the orientation of axes in the gamess input
-     such that the data (for 3D orthogonal grids) is in the
-     required order
+The order attribute records the ordering of the data: 'F' (the
+default) for the first index varying fastest, as in the punchfile and
+VTK, and 'C' for the last index varying fastest. get_array returns the
+data reshaped to the grid dimensions honouring this, so
+field.get_array()[i,j,k] is always the value at point (i,j,k).
 """
 
 #from math import *
 import math
+import unittest
 from viewer.debug import deb
 import objects.vector
 import objects.object
+import objects.isocache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 #Note that it is not possible to add Scientific vectors and 3 element
 #Numeric arrays using +, but they can be easily interconverted and can be
@@ -94,6 +98,76 @@ class Field(objects.object.CCP1GUI_Data):
         self.data_min = None
         self.data_max = None
 
+        # Storage order of the data (see module docstring)
+        self.order = 'F'
+
+        # Renewed by set_data, so that anything derived from the data
+        # (eg cached isosurfaces) can tell it has changed. The numbers
+        # are unique within the process (see objects.isocache.field_key)
+        objects.isocache.new_version(self)
+
+    def has_data(self):
+        """Return True if the field holds any data values
+        (the data may be a list or a numpy array, so we can't just
+        test self.data)"""
+        if self.data is None:
+            return 0
+        return len(self.data) > 0
+
+    def set_data(self,values,dtype=None,order='F'):
+        """Store the data values as a contiguous 1D numpy array
+
+        values - a list or array of the values, flattened in the given order
+        dtype  - numpy.float32 or numpy.float64 (default is float64,
+                 or the type of values if this is already an array)
+        order  - 'F' if the first index varies fastest (punchfile and VTK order),
+                 'C' if the last one does
+
+        If numpy is not available the values are kept as a list.
+        """
+        if numpy is None:
+            self.data = list(values)
+        else:
+            if dtype is None:
+                if isinstance(values,numpy.ndarray) and values.dtype in (numpy.float32,numpy.float64):
+                    dtype = values.dtype
+                else:
+                    dtype = numpy.float64
+            self.data = numpy.ascontiguousarray(numpy.ravel(values),dtype=dtype)
+        self.order = order
+        self.data_min = None
+        self.data_max = None
+        self.vtkdata = None
+        objects.isocache.new_version(self)
+
+    def get_array(self):
+        """Return the data as a numpy array indexed [i,j,k] (plus a final
+        index for the component if ndd > 1). This is a view of self.data
+        where possible, the data is converted to an array if needed."""
+        if not isinstance(self.data,numpy.ndarray):
+            self.set_data(self.data,order=self.order)
+        shape = list(self.dim)
+        if self.ndd > 1:
+            # components always vary fastest
+            if self.order == 'F':
+                shape = [self.ndd] + shape
+                return numpy.rollaxis(self.data.reshape(shape,order='F'),0,len(shape))
+            shape = shape + [self.ndd]
+        return self.data.reshape(shape,order=self.order)
+
+    def get_vtk_ordered_data(self):
+        """Return the data as a 1D numpy array with the first grid index
+        varying fastest (as required by vtk), without copying if the data
+        is already stored that way"""
+        if not isinstance(self.data,numpy.ndarray):
+            self.set_data(self.data,order=self.order)
+        if self.order == 'F' or len(self.dim) < 2:
+            return self.data
+        a = self.get_array()
+        if self.ndd > 1:
+            return numpy.ascontiguousarray(numpy.transpose(a,range(len(self.dim)-1,-1,-1)+[len(self.dim)])).ravel()
+        return numpy.ravel(a,order='F')
+
     def dimensions(self):
         try:
             return len(self.dim)
@@ -328,55 +402,41 @@ class Field(objects.object.CCP1GUI_Data):
         return 1
     
     def get_grid(self):
-        """ Generate a grid array containing the positions of
-        all the points. This version does not attempt to use Numeric Python.
-        It is stored as a list of vectors, one per point
+        """ Return the positions of all the points, first index
+        varying fastest. The points are not stored, but computed as
+        they are accessed (see GridPoints), use get_grid_array for
+        an array holding all of them.
         """
         if self.points:
             return self.points
+        return GridPoints(self)
+
+    def get_grid_vectors(self):
+        """Return the corner of the grid and the step vectors between points"""
+        o = self.get_origin_corner()
+        steps = []
+        for i in range(len(self.dim)):
+            steps.append(self.axis[i] * (1.0 / (self.dim[i] - 1)))
+        return o, steps
+
+    def get_grid_array(self,dtype=None):
+        """Return the positions of all the points as an (npoints,3) numpy
+        array with the first index varying fastest, computed from the
+        origin and axis vectors"""
+        if self.points:
+            return numpy.array([ [p[0],p[1],p[2]] for p in self.points ],dtype=dtype or numpy.float64)
+        o, steps = self.get_grid_vectors()
+        pts = numpy.zeros(tuple(self.dim[::-1])+(3,),dtype=dtype or numpy.float64)
+        pts[...] = [ o[0],o[1],o[2] ]
+        nd = len(self.dim)
+        for i in range(nd):
+            # axis i is dimension nd-1-i of the C ordered array
+            shape = [1]*nd + [3]
+            shape[nd-1-i] = self.dim[i]
+            step = numpy.array([ steps[i][0],steps[i][1],steps[i][2] ])
+            pts += (numpy.arange(self.dim[i])[:,numpy.newaxis]*step).reshape(shape)
+        return pts.reshape((-1,3))
 
-        self.tgrid = []
-        if len(self.dim) == 1: 
-            fac = 1.0 / (self.dim[0] - 1)
-            #jmht
-            #o = self.origin - 0.5*self.axis[0]
-            o = self.get_origin_corner()
-            for i in range(self.dim[0]):
-                p = o + i*fac*self.axis[0]
-                self.tgrid.append(p)
-
-        if len(self.dim) == 2: 
-            xfac = 1.0 / (self.dim[0] - 1)
-            yfac = 1.0 / (self.dim[1] - 1)
-            #jmht
-            #o = self.origin - 0.5*self.axis[0] - 0.5*self.axis[1]
-            o = self.get_origin_corner()
-            for j in range(self.dim[1]):
-                t = o + j*yfac*self.axis[1]
-                for i in range(self.dim[0]):
-                    p = t + i*xfac*self.axis[0] 
-                    self.tgrid.append(p)
-
-        if len(self.dim) == 3: 
-            xfac = 1.0 / (self.dim[0] - 1)
-            yfac = 1.0 / (self.dim[1] - 1)
-            zfac = 1.0 / (self.dim[2] - 1)
-            #jmht
-            #o = self.origin - 0.5*self.axis[0] - 0.5*self.axis[1] - 0.5*self.axis[2]
-            o = self.get_origin_corner()
-            xvec = self.axis[0]
-            yvec = self.axis[1]
-            zvec = self.axis[2]
-            for k in range(self.dim[2]):
-                t1 = o + k*zfac*zvec
-                for j in range(self.dim[1]):
-                    t2 = t1 + j*yfac*yvec
-                    for i in range(self.dim[0]):
-                        p = t2 + i*xfac*xvec
-                        self.tgrid.append(p)
-
-        return self.tgrid
-        
     def get_grid0(self):
         """ Generate a grid array containing the positions of
         all the points
@@ -583,6 +643,13 @@ class Field(objects.object.CCP1GUI_Data):
                 else:
                     print "field minmax error getting vtk min max!"
 
+        elif numpy is not None and isinstance(self.data,numpy.ndarray):
+            if len(self.data):
+                mini = float(self.data.min())
+                maxi = float(self.data.max())
+                self.data_min = mini
+                self.data_max = maxi
+
         # Brute force - trundle through and try and work it out
         else:
             if self.data:
@@ -623,9 +690,12 @@ class Field(objects.object.CCP1GUI_Data):
         vel = v / (nx*ny*nz)
         fac3 = 1.0 / ( fac*fac*fac)
 
-        tot = 0
-        for i in range(len(self.data)):
-            tot = tot + self.data[i]
+        if numpy is not None and isinstance(self.data,numpy.ndarray):
+            tot = float(self.data.sum(dtype=numpy.float64))
+        else:
+            tot = 0
+            for i in range(len(self.data)):
+                tot = tot + self.data[i]
         tot = tot * fac3
         print 'volume', v, ' cubic angstroms'
         print 'volume element', vel, ' cubic angstroms'
@@ -730,6 +800,83 @@ class Field(objects.object.CCP1GUI_Data):
         if self.debug:
             self.list()
 
+class GridPoints:
+    """The points of a regular grid, computed on demand
+
+    This behaves as the list of Vectors get_grid used to build, one
+    per point with the first index varying fastest, but only holds
+    the corner of the grid and the step vectors.
+    """
+
+    def __init__(self,field):
+        self.dim = list(field.dim)
+        self.origin, self.steps = field.get_grid_vectors()
+        self.npoints = 1
+        for n in self.dim:
+            self.npoints = self.npoints * n
+
+    def __len__(self):
+        return self.npoints
+
+    def __getitem__(self,offset):
+        if offset < 0:
+            offset = offset + self.npoints
+        if offset < 0 or offset >= self.npoints:
+            raise IndexError("grid point index out of range")
+        p = self.origin
+        for n, step in zip(self.dim,self.steps):
+            p = p + (offset % n) * step
+            offset = offset / n
+        return p
+
+    def __iter__(self):
+        for i in xrange(self.npoints):
+            yield self[i]
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+class testField(unittest.TestCase):
+    """Check the array storage and grid generation"""
+
+    def setUp(self):
+        self.f = Field(nd=3)
+        self.f.dim = [ 3,4,5 ]
+        self.f.axis[0] = objects.vector.Vector(2., 0., 0.)
+        self.f.axis[1] = objects.vector.Vector(0., 3., 1.)
+        self.f.axis[2] = objects.vector.Vector(0., 0., 4.)
+
+    def testGridArray(self):
+        """get_grid_array matches the points of get_grid"""
+        pts = self.f.get_grid_array()
+        grid = self.f.get_grid()
+        self.assertEqual(len(grid),60)
+        for i in (0,1,7,59):
+            for x in range(3):
+                self.assertAlmostEqual(pts[i,x],grid[i][x])
+
+    def testOrder(self):
+        """get_array indexes [i,j,k] whatever the storage order"""
+        values = range(60)
+        self.f.set_data(values,order='F')
+        self.assertEqual(self.f.get_array()[1,2,3],1 + 3*(2 + 4*3))
+        self.assertTrue(self.f.get_vtk_ordered_data() is self.f.data)
+        self.f.set_data(values,order='C')
+        self.assertEqual(self.f.get_array()[1,2,3],3 + 5*(2 + 4*1))
+        self.assertEqual(self.f.get_vtk_ordered_data()[1 + 3*(2 + 4*3)],3 + 5*(2 + 4*1))
+        self.assertEqual(self.f.minmax(),(0.0,59.0))
+
+def testMe():
+    """Return a unittest test suite with all the testcases that should be run by the main 
+    gui testing framework."""
+
+    return  unittest.TestLoader().loadTestsFromTestCase(testField)
+
 if __name__ == "__main__":
     f = Field(nd=3)
     #f.wrt_punch()
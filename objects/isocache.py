@@ -0,0 +1,261 @@
+#
+#    This file is part of the CCP1 Graphical User Interface (ccp1gui)
+#
+#   (C) 2002-2007 CCLRC Daresbury Laboratory
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+"""Support for drawing isosurfaces of large grids interactively.
+
+BlockRange divides the cells of a 3D field into blocks and holds the
+minimum and maximum value over each block, so that only the parts of
+the grid that straddle a contour value need to be contoured
+(BlockRange.regions). LRUCache keeps the surfaces that have been made,
+keyed by field_key(field) and the contour value, up to a memory budget.
+
+See VtkIsoSurf in viewer/vtkgraph.py for how these are used.
+"""
+
+import os,sys
+if __name__ == "__main__":
+    # Need to add the gui directory to the python path so
+    # that all the modules can be imported
+    gui_path = os.path.split(os.path.dirname( os.path.realpath( __file__ ) ))[0]
+    sys.path.append(gui_path)
+
+import unittest
+import itertools
+import weakref
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def isAvailable():
+    """Return True if we have numpy and so can use a BlockRange"""
+    if numpy: return True
+    return False
+
+# Version numbers are never reused within the process, so a key can't
+# match a field that has since been deleted. _owners records which
+# field each number was given to, so copies and unpickled fields that
+# arrive with a number of their own get a new one.
+_serial = itertools.count(1)
+_owners = weakref.WeakValueDictionary()
+
+def new_version(field):
+    """Give field a version number that no other field has had"""
+    field.version = _serial.next()
+    _owners[field.version] = field
+    return field.version
+
+def field_key(field):
+    """Return a key that changes if the data of the field is replaced"""
+    version = getattr(field,'version',0)
+    if _owners.get(version) is not field:
+        version = new_version(field)
+    return (version, id(field.data))
+
+
+def _block_reduce(a,axis,block,func):
+    """Apply func (numpy.minimum or numpy.maximum) over the points of
+    each block of cells along axis. Block b covers points b*block to
+    (b+1)*block inclusive, so neighbouring blocks share a plane."""
+    n = a.shape[axis]
+    nblocks = max((n - 2) / block + 1, 1)
+    out = []
+    for b in range(nblocks):
+        index = [ slice(None) ] * a.ndim
+        index[axis] = slice(b*block, min((b+1)*block, n-1) + 1)
+        out.append(numpy.expand_dims(func.reduce(a[tuple(index)],axis=axis),axis))
+    return numpy.concatenate(out,axis)
+
+
+class BlockRange:
+    """The range of values over blocks of cells of a 3D array
+
+    The array is indexed [i,j,k], as returned by Field.get_array.
+    """
+
+    def __init__(self,array,block=16):
+        self.shape = array.shape
+        self.block = block
+        lo = array
+        hi = array
+        for axis in range(3):
+            lo = _block_reduce(lo,axis,block,numpy.minimum)
+            hi = _block_reduce(hi,axis,block,numpy.maximum)
+        self.min = lo
+        self.max = hi
+
+    def active(self,value):
+        """Return a boolean array marking the blocks that straddle value"""
+        return (self.min <= value) & (self.max >= value)
+
+    def regions(self,value):
+        """Return the point extents (i0,i1,j0,j1,k0,k1), inclusive, of
+        the parts of the grid that need to be contoured for value.
+        Neighbouring blocks along i are merged into a single region."""
+        active = self.active(value)
+        b = self.block
+        ni,nj,nk = [ n - 1 for n in self.shape ]
+        regions = []
+        for bk in range(active.shape[2]):
+            for bj in range(active.shape[1]):
+                row = active[:,bj,bk]
+                if not row.any():
+                    continue
+                # the starts and ends of the runs of active blocks
+                edges = numpy.diff(numpy.concatenate(([0],row.astype(numpy.int8),[0])))
+                starts = numpy.nonzero(edges == 1)[0]
+                ends = numpy.nonzero(edges == -1)[0]
+                for s,e in zip(starts,ends):
+                    regions.append((s*b, min(e*b,ni),
+                                    bj*b, min((bj+1)*b,nj),
+                                    bk*b, min((bk+1)*b,nk)))
+        return regions
+
+    def fraction(self,value):
+        """Return the fraction of the blocks that straddle value"""
+        return float(self.active(value).sum()) / self.min.size
+
+
+class LRUCache:
+    """A dictionary that forgets the least recently used entries
+    when the total size of the values goes over budget (bytes)"""
+
+    def __init__(self,budget):
+        self.budget = budget
+        self.nbytes = 0
+        # key -> (value,size)
+        self.entries = {}
+        # keys, least recently used first
+        self.order = []
+
+    def get(self,key):
+        """Return the value for key, or None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.order.remove(key)
+        self.order.append(key)
+        return entry[0]
+
+    def put(self,key,value,size):
+        if self.entries.has_key(key):
+            self.remove(key)
+        self.entries[key] = (value,size)
+        self.order.append(key)
+        self.nbytes = self.nbytes + size
+        # keep at least the one just added
+        while self.nbytes > self.budget and len(self.order) > 1:
+            self.remove(self.order[0])
+
+    def remove(self,key):
+        value,size = self.entries[key]
+        del self.entries[key]
+        self.order.remove(key)
+        self.nbytes = self.nbytes - size
+
+    def clear(self):
+        self.entries = {}
+        self.order = []
+        self.nbytes = 0
+
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+class testIsoCache(unittest.TestCase):
+
+    def makeArray(self,shape):
+        x,y,z = numpy.indices(shape)
+        return numpy.sqrt((x-12.3)**2 + (y-7.1)**2 + (z-20.0)**2)
+
+    def testBlockRange(self):
+        """Every cell that straddles the value lies in one of the regions"""
+        a = self.makeArray((37,30,45))
+        r = BlockRange(a,block=8)
+        self.assertEqual(r.min.shape,(5,4,6))
+        for value in [ 5.0, 11.5, 30.0 ]:
+            inside = numpy.zeros([ n-1 for n in a.shape ],dtype=bool)
+            for i0,i1,j0,j1,k0,k1 in r.regions(value):
+                inside[i0:i1,j0:j1,k0:k1] = True
+            corners = [ a[di:a.shape[0]-1+di,dj:a.shape[1]-1+dj,dk:a.shape[2]-1+dk]
+                        for di in (0,1) for dj in (0,1) for dk in (0,1) ]
+            lo = reduce(numpy.minimum,corners)
+            hi = reduce(numpy.maximum,corners)
+            straddle = (lo <= value) & (hi >= value)
+            self.assertTrue(straddle.any())
+            self.assertFalse((straddle & ~inside).any())
+            self.assertTrue(r.fraction(value) < 1.0)
+        self.assertEqual(r.regions(100.0),[])
+
+    def testLRU(self):
+        c = LRUCache(100)
+        c.put('a',1,40)
+        c.put('b',2,40)
+        self.assertEqual(c.get('a'),1)
+        c.put('c',3,40)
+        self.assertEqual(c.get('b'),None)
+        self.assertEqual(c.get('a'),1)
+        self.assertEqual(c.nbytes,80)
+        c.put('d',4,200)
+        self.assertEqual(c.entries.keys(),['d'])
+        self.assertEqual(c.nbytes,200)
+
+    def testFieldKey(self):
+        import objects.field
+        f = objects.field.Field()
+        f.dim = [2,2,2]
+        f.set_data(range(8))
+        k = field_key(f)
+        self.assertEqual(field_key(f),k)
+        f.set_data(range(8))
+        self.assertNotEqual(field_key(f),k)
+
+    def testFieldKeyReuse(self):
+        """A new field never has the key of a deleted one, even if
+        it gets the same id"""
+        import copy
+        import objects.field
+        keys = []
+        for i in range(20):
+            f = objects.field.Field()
+            f.dim = [2,2,2]
+            f.set_data(range(8))
+            keys.append(field_key(f))
+            del f
+        self.assertEqual(len(dict.fromkeys(keys)),20)
+
+        f = objects.field.Field()
+        f.set_data(range(8))
+        g = copy.deepcopy(f)
+        self.assertNotEqual(field_key(f)[0],field_key(g)[0])
+
+def testMe():
+    """Return a unittest test suite with all the testcases that should be run by the main
+    gui testing framework."""
+
+    return  unittest.TestLoader().loadTestsFromTestCase(testIsoCache)
+
+if __name__ == "__main__":
+    unittest.main()
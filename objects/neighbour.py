@@ -0,0 +1,556 @@
+#
+#    This file is part of the CCP1 Graphical User Interface (ccp1gui)
+#
+#   (C) 2002-2007 CCLRC Daresbury Laboratory
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+"""Cell-list neighbour searching for bond and contact perception.
+
+The atoms are binned into cubic cells at least as large as the longest
+interaction that is being searched for, the cells are sorted so that
+the atoms of each cell are contiguous, and the candidate pairs between
+each cell and its neighbours are generated and screened a whole batch
+at a time with numpy rather than one cpv.distance call per pair.
+
+The results are returned as (npairs,2) integer arrays, which the
+Zmatrix class keeps in a BondTable.
+"""
+
+import os,sys
+if __name__ == "__main__":
+    # Need to add the gui directory to the python path so
+    # that all the modules can be imported
+    gui_path = os.path.split(os.path.dirname( os.path.realpath( __file__ ) ))[0]
+    sys.path.append(gui_path)
+
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from objects.periodic import rcov
+
+# Conversion of the rcov table (bohr) to angstrom
+BOHR_TO_ANGSTROM = 0.529177
+
+# Upper bound on the number of candidate pairs screened at once,
+# this just limits the size of the temporary arrays
+CHUNK = 2000000
+
+# The 13 neighbouring cells that follow the home cell in (x,y,z) order,
+# searching these and the home cell finds every pair exactly once
+HALF_SHELL = [ (i,j,k) for i in (-1,0,1) for j in (-1,0,1) for k in (-1,0,1)
+               if (i,j,k) > (0,0,0) ]
+
+def isAvailable():
+    """Return True if we have numpy and so can use the cell-list engine"""
+    if numpy: return True
+    return False
+
+def covalent_radii(numbers):
+    """Return an array of the covalent radii (angstrom) for a list of atomic numbers"""
+    table = numpy.array(rcov,dtype=numpy.float64) * BOHR_TO_ANGSTROM
+    return table[numpy.asarray(numbers,dtype=numpy.intc)]
+
+
+class Bond:
+    """View onto a single row of a BondTable
+
+    This has the same index attribute as objects.zmatrix.Bond so it
+    can be used by all the code that walks the bond list. For bonds
+    between periodic images, image is the cell offset of the second atom.
+    """
+    def __init__(self,index,image=None):
+        self.index = index
+        self.image = image
+
+
+class BondTable:
+    """Array-based bond list
+
+    The atom index pairs are held in an (nbonds,2) integer array
+    (self.pairs). Iteration and indexing return lightweight Bond
+    objects so that code that expects a list of zmatrix.Bond objects
+    with an index attribute keeps working.
+
+    For bonds in a periodic system an (nbonds,3) array of cell offsets
+    (self.images) gives the image of the cell holding the second atom.
+    """
+
+    def __init__(self,pairs=None,images=None):
+        if pairs is None:
+            pairs = numpy.zeros((0,2),dtype=numpy.intc)
+        self.pairs = numpy.asarray(pairs,dtype=numpy.intc).reshape((-1,2))
+        if images is not None:
+            images = numpy.asarray(images,dtype=numpy.intc).reshape((-1,3))
+        self.images = images
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __getitem__(self,i):
+        i1, i2 = self.pairs[i]
+        if self.images is None:
+            return Bond([int(i1),int(i2)])
+        return Bond([int(i1),int(i2)],tuple(self.images[i].tolist()))
+
+    def __iter__(self):
+        if self.images is None:
+            for i1, i2 in self.pairs.tolist():
+                yield Bond([i1,i2])
+        else:
+            for (i1, i2), image in zip(self.pairs.tolist(),self.images.tolist()):
+                yield Bond([i1,i2],tuple(image))
+
+    def append(self,bond):
+        """Add a bond, given as an object with an index attribute"""
+        row = numpy.array([bond.index[:2]],dtype=numpy.intc)
+        self.pairs = numpy.concatenate((self.pairs,row))
+        if self.images is not None:
+            image = getattr(bond,'image',None) or (0,0,0)
+            self.images = numpy.concatenate((self.images,
+                                             numpy.array([image],dtype=numpy.intc)))
+
+    def remove(self,bond):
+        """Remove the first bond between the two atoms (in either order)"""
+        i1, i2 = bond.index[:2]
+        hit = numpy.nonzero( ( (self.pairs[:,0] == i1) & (self.pairs[:,1] == i2) ) |
+                             ( (self.pairs[:,0] == i2) & (self.pairs[:,1] == i1) ) )[0]
+        if not len(hit):
+            raise ValueError("BondTable.remove(b): bond not in table")
+        self.pairs = numpy.delete(self.pairs,hit[0],axis=0)
+        if self.images is not None:
+            self.images = numpy.delete(self.images,hit[0],axis=0)
+
+def bond_pairs(bonds):
+    """Return an (nbonds,2) array for a BondTable or a list of Bond objects"""
+    if isinstance(bonds,BondTable):
+        return bonds.pairs
+    return numpy.array([ b.index[:2] for b in bonds ],dtype=numpy.intc).reshape((-1,2))
+
+
+class CellList:
+    """Sorted cell list of a set of coordinates
+
+    coords - (natoms,3) array or sequence of coordinates
+    size   - the edge length of the cubic cells
+    """
+
+    def __init__(self,coords,size):
+
+        self.coords = numpy.asarray(coords,dtype=numpy.float64).reshape((-1,3))
+        self.size = float(size)
+        natoms = len(self.coords)
+
+        cell = numpy.floor(self.coords / self.size).astype(numpy.int64)
+        if natoms:
+            cell = cell - cell.min(axis=0) + 1
+            # Leave an empty layer on each side so neighbour keys never wrap
+            self.dims = cell.max(axis=0) + 2
+        else:
+            self.dims = numpy.ones(3,dtype=numpy.int64)
+
+        key = self._key(cell)
+        # Atoms sorted by cell, with the start/end of each occupied cell
+        self.order = numpy.argsort(key,kind='mergesort')
+        sorted_key = key[self.order]
+        self.cells, self.start, self.count = numpy.unique(sorted_key,
+                                                          return_index=True,
+                                                          return_counts=True)
+        self.cell_of_atom = numpy.searchsorted(self.cells,key)
+
+    def _key(self,cell):
+        return (cell[...,0] * self.dims[1] + cell[...,1]) * self.dims[2] + cell[...,2]
+
+    def _offset_key(self,offset):
+        return (offset[0] * self.dims[1] + offset[1]) * self.dims[2] + offset[2]
+
+    def candidates(self):
+        """Generate (i,j) index arrays of all candidate pairs
+
+        Each pair of atoms in the same or in adjacent cells is returned
+        once. The arrays are yielded in chunks of at most about CHUNK
+        pairs.
+        """
+        ncell = len(self.cells)
+        if not ncell:
+            return
+
+        # pairs within the home cell, taking j after i in the sorted order
+        for i, j in self._pairs(numpy.arange(ncell), numpy.arange(ncell), same=1):
+            yield i, j
+
+        for offset in HALF_SHELL:
+            target = self.cells + self._offset_key(offset)
+            where = numpy.searchsorted(self.cells,target)
+            where = numpy.minimum(where,ncell-1)
+            hit = numpy.nonzero(self.cells[where] == target)[0]
+            if len(hit):
+                for i, j in self._pairs(hit, where[hit]):
+                    yield i, j
+
+    def _pairs(self,ci,cj,same=0):
+        """Expand pairs of cells (ci,cj) into pairs of atoms"""
+
+        # One row per atom of the first cell of each cell pair
+        na = self.count[ci]
+        first = numpy.repeat(ci,na)
+        partner = numpy.repeat(cj,na)
+        pos = numpy.arange(na.sum()) - numpy.repeat(numpy.cumsum(na) - na,na)
+        atom_i = self.start[first] + pos
+
+        # and the number of atoms of the second cell each one pairs with
+        if same:
+            nb = self.count[partner] - pos - 1
+            jstart = atom_i + 1
+        else:
+            nb = self.count[partner]
+            jstart = self.start[partner]
+
+        # Work through the rows in slices that keep the expansion to ~CHUNK pairs
+        total = numpy.cumsum(nb)
+        lo = 0
+        nrow = len(nb)
+        while lo < nrow:
+            base = 0
+            if lo:
+                base = total[lo-1]
+            hi = numpy.searchsorted(total,base + CHUNK,side='right')
+            hi = max(hi,lo+1)
+            n = nb[lo:hi]
+            rows = numpy.repeat(numpy.arange(lo,hi),n)
+            within = numpy.arange(n.sum()) - numpy.repeat(numpy.cumsum(n) - n,n)
+            yield self.order[atom_i[rows]], self.order[jstart[rows] + within]
+            lo = hi
+
+
+def find_pairs(coords,radii,scale=1.0,toler=0.5):
+    """Find all pairs of atoms closer than scale*(r_i+r_j)+toler
+
+    Returns an (npairs,2) integer array, the larger index first in
+    each row, sorted on the first and then the second index.
+    """
+    coords = numpy.asarray(coords,dtype=numpy.float64).reshape((-1,3))
+    radii = numpy.asarray(radii,dtype=numpy.float64)
+
+    if len(coords) < 2:
+        return numpy.zeros((0,2),dtype=numpy.intc)
+
+    size = 2*radii.max()*scale + toler + 0.1
+    cells = CellList(coords,size)
+
+    found = []
+    for i, j in cells.candidates():
+        d = coords[i] - coords[j]
+        r2 = (d*d).sum(axis=1)
+        cut = scale*(radii[i] + radii[j]) + toler
+        keep = r2 <= cut*cut
+        if keep.any():
+            found.append(numpy.column_stack((i[keep],j[keep])))
+
+    if not found:
+        return numpy.zeros((0,2),dtype=numpy.intc)
+
+    pairs = numpy.concatenate(found)
+    pairs = numpy.column_stack((pairs.max(axis=1),pairs.min(axis=1)))
+    pairs = pairs[numpy.lexsort((pairs[:,1],pairs[:,0]))]
+    return pairs.astype(numpy.intc)
+
+def find_cross_pairs(coords1,radii1,coords2,radii2,scale=1.0,toler=0.5):
+    """Find all pairs (i,j), i from the first set of atoms and j from
+    the second, closer than scale*(r_i+r_j)+toler
+
+    Returns two index arrays (i,j).
+    """
+    coords1 = numpy.asarray(coords1,dtype=numpy.float64).reshape((-1,3))
+    coords2 = numpy.asarray(coords2,dtype=numpy.float64).reshape((-1,3))
+    empty = numpy.zeros(0,dtype=numpy.intc)
+    if not len(coords1) or not len(coords2):
+        return empty, empty
+
+    # Only atoms within reach of the other set need to be considered
+    reach = 2*max(radii1.max(),radii2.max())*scale + toler
+    inside2 = numpy.nonzero( numpy.all( (coords2 >= coords1.min(axis=0) - reach) &
+                                        (coords2 <= coords1.max(axis=0) + reach), axis=1) )[0]
+    if not len(inside2):
+        return empty, empty
+    c2 = coords2[inside2]
+    inside1 = numpy.nonzero( numpy.all( (coords1 >= c2.min(axis=0) - reach) &
+                                        (coords1 <= c2.max(axis=0) + reach), axis=1) )[0]
+
+    n1 = len(inside1)
+    pairs = find_pairs(numpy.concatenate((coords1[inside1],c2)),
+                       numpy.concatenate((radii1[inside1],radii2[inside2])),
+                       scale=scale,toler=toler)
+    # find_pairs puts the larger index first
+    cross = pairs[(pairs[:,0] >= n1) & (pairs[:,1] < n1)]
+    return inside1[cross[:,1]].astype(numpy.intc), inside2[cross[:,0]-n1].astype(numpy.intc)
+
+def cell_matrix(cell):
+    """Return the cell vectors as the rows of a 3x3 array together with
+    the number of periodic directions. For slabs (2 vectors) the third
+    row is the unit normal to the surface.
+    """
+    m = numpy.zeros((3,3),dtype=numpy.float64)
+    nper = len(cell)
+    for i in range(nper):
+        m[i] = [ cell[i][0], cell[i][1], cell[i][2] ]
+    if nper == 2:
+        normal = numpy.cross(m[0],m[1])
+        m[2] = normal / numpy.sqrt((normal*normal).sum())
+    return m, nper
+
+def image_range(coords,cell,cutoff):
+    """Return the number of cells that need to be searched in each
+    direction to find all contacts up to cutoff between the atoms
+    """
+    m, nper = cell_matrix(cell)
+    recip = numpy.linalg.inv(m)
+    # perpendicular width of the cell in each direction
+    width = 1.0 / numpy.sqrt((recip*recip).sum(axis=0))
+    frac = numpy.dot(numpy.asarray(coords,dtype=numpy.float64).reshape((-1,3)),recip)
+    spread = frac.max(axis=0) - frac.min(axis=0)
+    nimage = numpy.ceil(spread + cutoff/width).astype(int)
+    nimage[nper:] = 0
+    return nimage
+
+def find_periodic_pairs(coords,radii,cell,scale=1.0,toler=0.5):
+    """Find bonds in a periodic system from the contents of one cell
+
+    coords - the coordinates of the atoms of the primitive cell
+    cell   - the 2 or 3 cell vectors
+
+    Returns (pairs,images). Each row of pairs holds two atom indices
+    in the primitive cell, and the corresponding row of images the
+    offset (in cell vectors) of the cell holding the second atom.
+    Each bond is found once: bonds within the cell have a zero offset
+    and have the larger index first, bonds to the other cells only
+    appear with the offset that comes first in (x,y,z) order.
+    """
+    coords = numpy.asarray(coords,dtype=numpy.float64).reshape((-1,3))
+    radii = numpy.asarray(radii,dtype=numpy.float64)
+
+    pairs = [ find_pairs(coords,radii,scale=scale,toler=toler) ]
+    images = [ numpy.zeros((len(pairs[0]),3),dtype=numpy.intc) ]
+    if not len(coords):
+        return pairs[0], images[0]
+
+    m, nper = cell_matrix(cell)
+    cutoff = 2*radii.max()*scale + toler
+    nx,ny,nz = image_range(coords,cell,cutoff)
+
+    for ix in range(-nx,nx+1):
+        for iy in range(-ny,ny+1):
+            for iz in range(-nz,nz+1):
+                if (ix,iy,iz) <= (0,0,0):
+                    continue
+                shift = numpy.dot([ix,iy,iz],m)
+                i,j = find_cross_pairs(coords,radii,coords+shift,radii,
+                                       scale=scale,toler=toler)
+                if len(i):
+                    pairs.append(numpy.column_stack((i,j)))
+                    images.append(numpy.repeat([[ix,iy,iz]],len(i),axis=0))
+
+    return (numpy.concatenate(pairs).astype(numpy.intc),
+            numpy.concatenate(images).astype(numpy.intc))
+
+def expand_periodic_pairs(pairs,images,natoms,minc,maxc):
+    """Generate the bonds between the atoms of a block of cells
+
+    The atoms of the block are numbered cell by cell, with the cells
+    running from minc to maxc (inclusive, 3 ints each) and the last
+    index varying fastest, as in Zmatrix.extend
+
+    Returns an (nbonds,2) array of atom indices into the block.
+    """
+    pairs = numpy.asarray(pairs,dtype=numpy.int64).reshape((-1,2))
+    images = numpy.asarray(images,dtype=numpy.int64).reshape((-1,3))
+    minc = numpy.asarray(minc,dtype=numpy.int64)
+    maxc = numpy.asarray(maxc,dtype=numpy.int64)
+    dims = maxc - minc + 1
+
+    grid = numpy.indices(dims).reshape((3,-1)).T
+    ncell = len(grid)
+    if not len(pairs) or not ncell:
+        return numpy.zeros((0,2),dtype=numpy.intc)
+
+    # every bond in every cell
+    home = numpy.repeat(grid,len(pairs),axis=0)
+    other = home + numpy.tile(images,(ncell,1))
+    bond = numpy.tile(pairs,(ncell,1))
+
+    keep = numpy.all((other >= 0) & (other < dims),axis=1)
+    home = home[keep]
+    other = other[keep]
+    bond = bond[keep]
+
+    def offset(c):
+        return ((c[:,0]*dims[1] + c[:,1])*dims[2] + c[:,2]) * natoms
+
+    i = offset(home) + bond[:,0]
+    j = offset(other) + bond[:,1]
+    return numpy.column_stack((numpy.maximum(i,j),numpy.minimum(i,j))).astype(numpy.intc)
+
+def _walk(paths,bonds,natoms):
+    """Extend each path (an array of atom indices, one row per path)
+    by one bond, without stepping back onto an atom already in the path.
+    """
+    # Directed bond list sorted on the source atom
+    src = numpy.concatenate((bonds[:,0],bonds[:,1]))
+    dst = numpy.concatenate((bonds[:,1],bonds[:,0]))
+    order = numpy.argsort(src,kind='mergesort')
+    dst = dst[order]
+    first = numpy.searchsorted(src[order],numpy.arange(natoms))
+    degree = numpy.bincount(src,minlength=natoms)
+
+    last = paths[:,-1]
+    n = degree[last]
+    rows = numpy.repeat(numpy.arange(len(paths)),n)
+    within = numpy.arange(n.sum()) - numpy.repeat(numpy.cumsum(n) - n,n)
+    step = dst[first[last[rows]] + within]
+    new = numpy.column_stack((paths[rows],step))
+    ok = numpy.ones(len(new),dtype=bool)
+    for col in range(new.shape[1]-1):
+        ok &= new[:,col] != step
+    return new[ok]
+
+def exclusion_keys(bonds,natoms,depth=3):
+    """Return a sorted array of keys i*natoms+j for all pairs of atoms
+    separated by up to depth bonds (i.e. 1-2, 1-3 and 1-4 by default).
+    """
+    bonds = numpy.asarray(bonds,dtype=numpy.int64).reshape((-1,2))
+    if not len(bonds):
+        return numpy.zeros(0,dtype=numpy.int64)
+    paths = numpy.arange(natoms,dtype=numpy.int64).reshape((-1,1))
+    keys = []
+    for i in range(depth):
+        paths = _walk(paths,bonds,natoms)
+        keys.append(paths[:,0]*natoms + paths[:,-1])
+    return numpy.unique(numpy.concatenate(keys))
+
+def find_contacts(coords,radii,bonds,scale=1.0,toler=2.5,atoms=None):
+    """Find nonbonded contacts, excluding 1-2, 1-3 and 1-4 pairs
+
+    atoms - if given, only contacts from these atoms are returned
+
+    Returns an (ncontacts,2) integer array holding the pairs in both
+    directions, i.e. [i,j] for each atom i in atoms.
+    """
+    natoms = len(coords)
+    pairs = find_pairs(coords,radii,scale=scale,toler=toler).astype(numpy.int64)
+
+    excl = exclusion_keys(bonds,natoms)
+    if len(excl) and len(pairs):
+        keys = pairs[:,0]*natoms + pairs[:,1]
+        where = numpy.minimum(numpy.searchsorted(excl,keys),len(excl)-1)
+        pairs = pairs[excl[where] != keys]
+
+    both = numpy.concatenate((pairs,pairs[:,::-1]))
+    if atoms is not None:
+        wanted = numpy.zeros(natoms,dtype=bool)
+        wanted[numpy.asarray(atoms,dtype=numpy.int64)] = True
+        both = both[wanted[both[:,0]]]
+    both = both[numpy.lexsort((both[:,1],both[:,0]))]
+    return both.astype(numpy.intc)
+
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+class testNeighbour(unittest.TestCase):
+    """Check the cell-list search against a brute force one"""
+
+    def brute(self,coords,radii,scale,toler):
+        pairs = []
+        for i in range(len(coords)):
+            for j in range(i):
+                d = coords[i]-coords[j]
+                if numpy.sqrt((d*d).sum()) <= scale*(radii[i]+radii[j])+toler:
+                    pairs.append([i,j])
+        return pairs
+
+    def testRandom(self):
+        """cell list and brute force find the same pairs"""
+        numpy.random.seed(7)
+        coords = numpy.random.uniform(-6.0,6.0,(300,3))
+        radii = covalent_radii(numpy.random.randint(1,20,300))
+        pairs = find_pairs(coords,radii,scale=1.0,toler=0.5)
+        self.assertEqual(pairs.tolist(),self.brute(coords,radii,1.0,0.5))
+
+    def testChunked(self):
+        """results do not depend on the chunk size"""
+        global CHUNK
+        numpy.random.seed(3)
+        coords = numpy.random.uniform(-4.0,4.0,(200,3))
+        radii = covalent_radii([6]*200)
+        ref = find_pairs(coords,radii)
+        save = CHUNK
+        CHUNK = 17
+        try:
+            pairs = find_pairs(coords,radii)
+        finally:
+            CHUNK = save
+        self.assertEqual(pairs.tolist(),ref.tolist())
+
+    def testExclusions(self):
+        """1-2, 1-3 and 1-4 pairs along a chain"""
+        bonds = numpy.array([[1,0],[2,1],[3,2],[4,3]])
+        keys = exclusion_keys(bonds,5).tolist()
+        self.assertTrue(0*5+3 in keys)
+        self.assertFalse(0*5+4 in keys)
+
+    def testBondTable(self):
+        """BondTable behaves like a list of Bond objects"""
+        t = BondTable([[1,0],[2,1]])
+        self.assertEqual([b.index for b in t],[[1,0],[2,1]])
+        t.append(Bond([3,2]))
+        t.remove(Bond([0,1]))
+        self.assertEqual(len(t),2)
+        self.assertEqual(t[0].index,[2,1])
+
+    def testPeriodic(self):
+        """periodic bonds reproduce the bonds of an explicitly extended block"""
+        cell = [[2.1,0.0,0.0],[0.0,2.1,0.0],[0.0,0.0,2.1]]
+        coords = numpy.array([[0.0,0.0,0.0],[1.05,1.05,1.05]])
+        radii = covalent_radii([12,8])
+        pairs,images = find_periodic_pairs(coords,radii,cell,toler=0.0)
+
+        block = []
+        for ix in range(2):
+            for iy in range(2):
+                for iz in range(2):
+                    block.extend(coords + numpy.dot([ix,iy,iz],cell))
+        ref = find_pairs(block,numpy.tile(radii,8),toler=0.0)
+
+        ext = expand_periodic_pairs(pairs,images,2,[0,0,0],[1,1,1])
+        ext = ext[numpy.lexsort((ext[:,1],ext[:,0]))]
+        self.assertEqual(ext.tolist(),ref.tolist())
+
+def testMe():
+    """Return a unittest test suite with all the testcases that should be run by the main
+    gui testing framework."""
+
+    return  unittest.TestLoader().loadTestsFromTestCase(testNeighbour)
+
+if __name__ == "__main__":
+    unittest.main()
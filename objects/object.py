@@ -2,7 +2,7 @@
 # Base class to hold any methods used by all CCP1GUI Data objects
 #
 class CCP1GUI_Data:
-    
+
     def __init__(self):
         pass
 
@@ -10,3 +10,35 @@ class CCP1GUI_Data:
         """Return the last bit of the class decription as the objects class"""
         myclass = str(self.__class__).split('.')[-1]
         return myclass
+
+    def defer(self,names,loader):
+        """Arrange for the attributes in names to be set by calling
+        loader(self) the first time any of them is used.
+
+        This lets file readers hand back objects whose bulky data
+        (grids, coordinates etc) is only read when it is needed.
+        """
+        if not self.__dict__.has_key('_deferred'):
+            self._deferred = {}
+        for name in names:
+            if self.__dict__.has_key(name):
+                del self.__dict__[name]
+            self._deferred[name] = loader
+
+    def is_deferred(self,name):
+        """Return True if attribute name has not been loaded yet"""
+        return self.__dict__.get('_deferred',{}).has_key(name)
+
+    def __getattr__(self,name):
+        # Only called for attributes that aren't there, so this
+        # costs nothing for ordinary objects
+        try:
+            deferred = self.__dict__['_deferred']
+            loader = deferred[name]
+        except KeyError:
+            raise AttributeError, name
+        for key,value in deferred.items():
+            if value is loader:
+                del deferred[key]
+        loader(self)
+        return getattr(self,name)
@@ -8,11 +8,17 @@ else:
     from viewer.paths import gui_path
 
 # Import external modules
-import copy,math
+import copy,math,time
 import unittest
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 #,sys,quaternion
 import objects.vector
+import objects.neighbour
 
 global thresh
 thresh = 0.1
@@ -27,6 +33,56 @@ def tightCartesian(atom1,atom2):
         if atom1.dist2(atom2) < thresh:
             print atom1,'and',atom2,'are too far apart (', atom1.dist2(atom2),')'
 
+def useArrays(testSame):
+    """Return true if point matching for testSame can be done with numpy
+
+    This is only possible for tightCartesian, as the array code works
+    with its definition of "the same": dist2 < thresh.
+    """
+    return numpy is not None and testSame is tightCartesian
+
+def pairMap(i, j, n):
+    """Given the pairs (i[k],j[k]) of points of two sets of n points that
+    are within thresh of each other, return the mapping of the first set
+    onto the second as an array if it is one-to-one, otherwise None.
+
+    When each point has exactly one partner within thresh, and no two
+    share a partner, the partner is also the nearest remaining point in
+    the greedy search of PointSet.mapNearest, so the mapping is the same.
+    """
+    if len(i) != n:
+        return None
+    if len(numpy.unique(i)) != n or len(numpy.unique(j)) != n:
+        return None
+    themap = numpy.zeros(n,dtype=numpy.intp)
+    themap[i] = j
+    return themap
+
+def greedyMap(r1, r2):
+    """Array version of PointSet.mapNearest(quick=1): map each point of r1
+    in turn to the nearest point of r2 not already taken (the first on a tie)."""
+    n = len(r1)
+    taken = numpy.zeros(n,dtype=bool)
+    themap = numpy.zeros(n,dtype=numpy.intp)
+    for i in range(n):
+        d = r2 - r1[i]
+        d2 = (d*d).sum(axis=1)
+        d2[taken] = numpy.inf
+        j = d2.argmin()
+        themap[i] = j
+        taken[j] = True
+    return themap
+
+def closePairs(r1, r2):
+    """Return the index arrays (i,j) of pairs of points of r1 and r2 with
+    dist2 < thresh, found with a cell list."""
+    zero1 = numpy.zeros(len(r1))
+    zero2 = numpy.zeros(len(r2))
+    i,j = objects.neighbour.find_cross_pairs(r1,zero1,r2,zero2,toler=math.sqrt(thresh))
+    d = r1[i] - r2[j]
+    keep = (d*d).sum(axis=1) < thresh
+    return i[keep], j[keep]
+
 class SymOp:    
     def __init__(self, n, axis, parity = 1):
         """Defines a symmetry operation, as a possible
@@ -55,6 +111,13 @@ class SymOp:
     def transform(self, r):
         return objects.vector.Vector(self.q.rotate(self.parity*r))
 
+    def matrix(self):
+        """Return the operation as a 3x3 numpy array acting on column vectors"""
+        p = self.parity
+        return numpy.transpose(numpy.array([self.q.rotate([p,0,0]),
+                                            self.q.rotate([0,p,0]),
+                                            self.q.rotate([0,0,p])]))
+
     def getOrder(self):
         """Calculate the order of the operation by brute force, if
         neccessary."""
@@ -270,6 +333,11 @@ class PointSet:
     def nrPoints(self):
         return len(self.pset)
 
+    def coords(self):
+        "Return the points as an (n,3) numpy array"
+        return numpy.array([[p[0],p[1],p[2]] for p in self.pset],
+                           dtype=numpy.float64).reshape((-1,3))
+
     def scale(self,c):
         for i in range(len(self.pset)):
             self.pset[i] = c*self.pset[i]
@@ -290,6 +358,16 @@ class PointSet:
         of the distances. Not guaranteed to find the optimal fit!"""
         if len(self.pset) != len(set2.pset):
             return None
+        if quick and numpy:
+            r1 = self.coords()
+            r2 = set2.coords()
+            themap = None
+            if len(r1):
+                i,j = closePairs(r1,r2)
+                themap = pairMap(i,j,len(r1))
+            if themap is None:
+                themap = greedyMap(r1,r2)
+            return themap.tolist()
         # first do an intial guess
         remain = range(len(self.pset))
         themap = []
@@ -352,9 +430,11 @@ class PointSet:
             ps.addPoint(op.transform(p))
         return ps
             
-    def hasSymmetry(self, op, testSame): # 75% time of testcase spent here
+    def hasSymmetry(self, op, testSame):
         """Test if op (a SymOp) is a symmetry of the pointset,
         with the maximum deviation^2 = maxdev2."""
+        if useArrays(testSame):
+            return int(self.symmetryMask([op])[0])
         newpoints = []
         # do an optimistic test first
         for p in self.pset:
@@ -365,6 +445,40 @@ class PointSet:
         # do a complete test
         return self.matches(PointSet(newpoints),testSame) # slow
 
+    def symmetryMask(self, ops):
+        """Test a list of SymOps at once, with tightCartesian as the test
+        for the same point. Returns a numpy array of flags.
+
+        The points moved by all the operations are matched to the set in
+        one cell list search. An operation is a symmetry if every moved
+        point has a partner within thresh and the greedy nearest point
+        mapping (as in hasSymmetry) pairs every point with one of them.
+        """
+        n = len(self.pset)
+        nops = len(ops)
+        ok = numpy.ones(nops,dtype=bool)
+        if not n or not nops:
+            return ok
+        r = self.coords()
+        mats = numpy.array([op.matrix() for op in ops])
+        # moved[k*n+i] is point i after operation k
+        moved = numpy.dot(mats,r.T).transpose((0,2,1)).reshape((-1,3))
+        i,j = closePairs(moved,r)
+        nhit = numpy.bincount(i,minlength=nops*n).reshape((nops,n))
+        # the optimistic test: every moved point is near a point of the set
+        ok = (nhit > 0).all(axis=1)
+        opof = i // n
+        for k in numpy.nonzero(ok)[0]:
+            mine = opof == k
+            # the mapping runs from the set to the moved points
+            themap = pairMap(j[mine],i[mine] - k*n,n)
+            if themap is None:
+                mk = moved[k*n:(k+1)*n]
+                themap = greedyMap(r,mk)
+                d = r - mk[themap]
+                ok[k] = ((d*d).sum(axis=1) < thresh).all()
+        return ok
+
     def deleteRedundant(self,op,testSame):
         """Delete those points which can be recovered by applying op
         multiple times to the remaining points. Return number of
@@ -423,17 +537,34 @@ class Molecule:
         self.atomsets[label].addPoint(objects.vector.Vector(pos),index)
 
     def hasSymmetry(self,op,testSame):
-        print 'Testing',op,
-        failed = 0
-        for s in self.atomsets.items():
-            if not s[1].hasSymmetry(op,testSame):
-                print s[0],'no'
-                failed = 1
-        if failed:
-            return 0
-        else:
-            print 'yes'
-            return 1
+        return self.testSymmetries([op],testSame)[0]
+
+    def testSymmetries(self,ops,testSame):
+        """Return a list of flags, 1 for each op that is a symmetry of
+        all the atom sets. With numpy all the ops are tested together."""
+        if useArrays(testSame):
+            flags = {}
+            for label,set in self.atomsets.items():
+                flags[label] = set.symmetryMask(ops)
+        result = []
+        for k in range(len(ops)):
+            op = ops[k]
+            print 'Testing',op,
+            failed = 0
+            for s in self.atomsets.items():
+                if useArrays(testSame):
+                    has = flags[s[0]][k]
+                else:
+                    has = s[1].hasSymmetry(op,testSame)
+                if not has:
+                    print s[0],'no'
+                    failed = 1
+            if failed:
+                result.append(0)
+            else:
+                print 'yes'
+                result.append(1)
+        return result
 
     def export(self):
         """Return a list of atom coordinates and indices."""
@@ -455,15 +586,14 @@ class Molecule:
         threedeg = None
         invop = SymOp(1,objects.vector.Vector([1,0,0]),-1)
         inv = 0
-        if self.hasSymmetry(invop,testSame):
-            G.addElement(invop)
-            inv = 1
         mom = [[eigvals[0],objects.vector.Vector(1,0,0)],
                [eigvals[1],objects.vector.Vector(0,1,0)],
                [eigvals[2],objects.vector.Vector(0,0,1)]]
         # Do we have two zero eigenvalues?
         if abs(mom[0][0]) < eigrelthres and abs(mom[1][0]) < eigrelthres:
             print "Case 1"
+            if self.hasSymmetry(invop,testSame):
+                G.addElement(invop)
             G.setCinf(0.5*(mom[0][1]+mom[1][1]))
             #jmht - check with Ulf
             #cm = self.centerOfMass()
@@ -492,32 +622,43 @@ class Molecule:
         # TODO: handle threedeg case better
         if threedeg or axis:
             print "Non Abelian"
-            for n in [6,5,3,2]:
-                Cn = SymOp(n,axis,1)
-                if not G.hasElement(Cn) and self.hasSymmetry(Cn,testSame):
-                    G.addElement(Cn)
-            if not inv:
-                for n in [6,5,3,2]:
-                    S2n = SymOp(n,axis,-1)
-                    if not G.hasElement(S2n) and self.hasSymmetry(S2n,testSame):
-                        G.addElement(S2n)
-            for on in other:
-                C2 = SymOp(2,on,1)
-                if not G.hasElement(C2) and self.hasSymmetry(C2,testSame):
-                    G.addElement(C2)
-                sigma = SymOp(2,on,-1)
-                if not G.hasElement(sigma) and self.hasSymmetry(sigma,testSame):
-                    G.addElement(sigma)
+            rotations = [SymOp(n,axis,1) for n in [6,5,3,2]]
+            improper = [SymOp(n,axis,-1) for n in [6,5,3,2]]
         # Easiest case, nondegenerate, abelian group
         else:
             print "Abelian"
-            for on in [mom[0][1],mom[1][1],mom[2][1]]:
-                C2 = SymOp(2,on,1)
-                if not G.hasElement(C2) and self.hasSymmetry(C2,testSame):
-                    G.addElement(C2)
-                sigma = SymOp(2,on,-1)
-                if not G.hasElement(sigma) and self.hasSymmetry(sigma,testSame):
-                    G.addElement(sigma)
+            rotations = []
+            improper = []
+            other = [mom[0][1],mom[1][1],mom[2][1]]
+        planes = []
+        for on in other:
+            planes.append((SymOp(2,on,1),SymOp(2,on,-1)))
+
+        # Test all the candidates in one go, then build the group from
+        # them in the same order as they would be tried one at a time
+        candidates = [invop] + rotations + improper
+        for C2,sigma in planes:
+            candidates.extend([C2,sigma])
+        flags = self.testSymmetries(candidates,testSame)
+        found = {}
+        for k in range(len(candidates)):
+            found[id(candidates[k])] = flags[k]
+
+        if found[id(invop)]:
+            G.addElement(invop)
+            inv = 1
+        for Cn in rotations:
+            if not G.hasElement(Cn) and found[id(Cn)]:
+                G.addElement(Cn)
+        if not inv:
+            for S2n in improper:
+                if not G.hasElement(S2n) and found[id(S2n)]:
+                    G.addElement(S2n)
+        for C2,sigma in planes:
+            if not G.hasElement(C2) and found[id(C2)]:
+                G.addElement(C2)
+            if not G.hasElement(sigma) and found[id(sigma)]:
+                G.addElement(sigma)
         return G
 
     def deleteRedundant(self, testSame, group = None):
@@ -622,27 +763,129 @@ def rotor(axis,angle):
     c = math.sin(angle/2)/math.sqrt(axis[0]**2 + axis[1]**2 + axis[2]**2)
     return Quaternion([math.cos(angle/2),c*axis[0],c*axis[1],c*axis[2]])
 
+def pythonTest(atom1,atom2):
+    """tightCartesian, but not recognised by useArrays so the original
+    point by point code is used"""
+    return tightCartesian(atom1,atom2)
+
+def findGroup(mol,testSame,tolerance=0.001):
+    """As Zmatrix.getSymmetry but with a choice of testSame; returns the
+    label and the generators as strings"""
+    global thresh
+    thresh = tolerance
+    mol.toStandardOrientation()
+    eigval = mol.getMomentsOfInertia()
+    group = mol.createSymMol().getGroup(testSame,eigval)
+    generators = group.generators()
+    return group.label(gen=generators),[str(g) for g in generators]
+
+def ringCluster(nrings,noise=0.0,seed=1):
+    """Return a Zmatrix of nrings pairs of hexagons, one above and one
+    below the xy plane, each with a random radius, height, twist and
+    element (point group C6h). noise is the standard deviation of a
+    random displacement of each atom."""
+    import random
+    import objects.zmatrix
+    rand = random.Random(seed)
+    mol = objects.zmatrix.Zmatrix()
+    for n in range(nrings):
+        radius = rand.uniform(1.0,9.0)
+        height = rand.uniform(0.5,6.0)
+        twist = rand.uniform(0.0,1.0)
+        symbol = rand.choice(['C','H','N'])
+        for z in height,-height:
+            for k in range(6):
+                t = 2*math.pi*k/6 + twist
+                atom = objects.zmatrix.ZAtom()
+                atom.symbol = atom.name = symbol
+                atom.coord = [radius*math.cos(t) + rand.gauss(0,noise),
+                              radius*math.sin(t) + rand.gauss(0,noise),
+                              z + rand.gauss(0,noise)]
+                mol.atom.append(atom)
+    return mol
+
+def benchmark(natoms=[120,480,1200]):
+    """Time getGroup and symmetrize for clusters of increasing size,
+    with and without the numpy point matching"""
+    global thresh
+    import StringIO
+    for n in natoms:
+        for testSame,name in (tightCartesian,'numpy'),(pythonTest,'python'):
+            if name == 'python' and (not numpy or n > 500):
+                continue
+            mol = ringCluster(n/12,noise=0.005)
+            stdout = sys.stdout
+            sys.stdout = StringIO.StringIO()
+            try:
+                t = time.time()
+                label,generators = findGroup(mol,testSame,tolerance=0.01)
+                t1 = time.time()
+                mol.createSymMol().symmetrize(testSame,mol.getMomentsOfInertia())
+                t2 = time.time()
+            finally:
+                sys.stdout = stdout
+            print '%5d atoms %-6s %-4s getGroup %8.3fs  symmetrize %8.3fs' % \
+                  (len(mol.atom),name,label,t1-t,t2-t1)
+
 class SymdetTests(unittest.TestCase):
 
     egdir=gui_path+os.sep+'examples'+os.sep
 
-    def XtestFeCO5(self):
+    def load(self,file):
+        import objects.zmatrix
+        mol = objects.zmatrix.Zmatrix()
+        mol.load_from_file(self.egdir+file)
+        return mol
+
+    def testFeCO5(self):
         """Test FeCO5"""
-        mol = zmatrix.Zmatrix()
-        mol.load_from_file(self.egdir+'feco5.zmt')
+        mol = self.load('feco5.zmt')
         label,generators = mol.getSymmetry(thresh = 0.001)
         print "Label is: %s" % label
         print "Generators are is: %s" % generators[0]
+        self.assertEqual(findGroup(self.load('feco5.zmt'),pythonTest),
+                         (label,[str(g) for g in generators]))
 
     def testH2O(self):
         """Test H2O"""
-        mol = zmatrix.Zmatrix()
-        mol.load_from_file(self.egdir+'water.zmt')
+        mol = self.load('water.zmt')
         label,generators = mol.getSymmetry(thresh = 0.001)
         print "Label is: %s" % label
         print "Generators are is: %s" % generators[0]
-
-
+        self.assertEqual(findGroup(self.load('water.zmt'),pythonTest),
+                         (label,[str(g) for g in generators]))
+
+    def testCluster(self):
+        """Test a C6h cluster, exactly and slightly distorted"""
+        for noise in 0.0,0.005:
+            fast = findGroup(ringCluster(10,noise),tightCartesian,tolerance=0.01)
+            slow = findGroup(ringCluster(10,noise),pythonTest,tolerance=0.01)
+            self.assertEqual(fast,slow)
+            self.assertEqual(fast[0],'C6h')
+        # too distorted for the tolerance
+        self.assertEqual(findGroup(ringCluster(10,0.2),tightCartesian,tolerance=0.01)[0],'C1')
+
+    def testMapNearest(self):
+        """The numpy mapNearest gives the same map as the loop"""
+        global thresh
+        import random
+        rand = random.Random(2)
+        thresh = 0.01
+        for spread in 0.01,1.0:
+            set1 = PointSet()
+            set2 = PointSet()
+            for i in range(60):
+                r = objects.vector.Vector([rand.uniform(-5,5) for x in range(3)])
+                set1.addPoint(r)
+                set2.addPoint(r + objects.vector.Vector([rand.gauss(0,spread) for x in range(3)]))
+            rand.shuffle(set2.pset)
+            themap = set1.mapNearest(set2)
+            save = globals()['numpy']
+            globals()['numpy'] = None
+            try:
+                self.assertEqual(themap,set1.mapNearest(set2))
+            finally:
+                globals()['numpy'] = save
 
 def testMe():
     """Return a unittest test suite with all the testcases that should be run by the main 
@@ -652,8 +895,17 @@ def testMe():
 
 
 if __name__ == "__main__":
-    import zmatrix
-    unittest.main()
+    # Zmatrix uses this file as objects.symdet, so run that copy to
+    # share the module globals (thresh)
+    import objects.symdet
+    if sys.argv[1:2] == ['benchmark']:
+        # optionally followed by the cluster sizes
+        if sys.argv[2:]:
+            objects.symdet.benchmark([int(n) for n in sys.argv[2:]])
+        else:
+            objects.symdet.benchmark()
+    else:
+        unittest.main(module=objects.symdet)
 
 
 # M = Molecule()
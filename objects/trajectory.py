@@ -0,0 +1,224 @@
+#
+#    This file is part of the CCP1 Graphical User Interface (ccp1gui)
+#
+#   (C) 2002-2007 CCLRC Daresbury Laboratory
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+"""Compact storage for the frames of a structure sequence.
+
+A ZmatrixSequence normally holds a complete Zmatrix for every frame.
+With compact storage (ZmatrixSequence.use_compact_storage) the atoms
+of the sequence are the topology for all the frames and the
+coordinates of the frames are kept in a FrameArray, a single
+(nframes,natoms,3) float32 array that can optionally live in a file
+mapped with numpy.memmap. The frames attribute of the sequence is then
+a FrameList, which builds a Zmatrix for a frame only when one is asked
+for.
+"""
+
+import os,sys
+if __name__ == "__main__":
+    # Need to add the gui directory to the python path so
+    # that all the modules can be imported
+    gui_path = os.path.split(os.path.dirname( os.path.realpath( __file__ ) ))[0]
+    sys.path.append(gui_path)
+
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def isAvailable():
+    """Return True if we have numpy and so can use compact storage"""
+    if numpy: return True
+    return False
+
+
+class FrameArray:
+    """The coordinates of a sequence of frames as an (nframes,natoms,3) array
+
+    If filename is given the coordinates are appended to that file
+    and accessed through a numpy.memmap, otherwise they are held in
+    memory in an array that grows as frames are added.
+    """
+
+    dtype = numpy and numpy.float32
+
+    def __init__(self,natoms,filename=None):
+        self.natoms = natoms
+        self.nframes = 0
+        self.filename = filename
+        if filename:
+            # Start with an empty file
+            open(filename,'wb').close()
+            self.array = None
+        else:
+            self.array = numpy.zeros((16,natoms,3),dtype=self.dtype)
+
+    def __len__(self):
+        return self.nframes
+
+    def append(self,coords):
+        """Add a frame, coords is an (natoms,3) array or list of coordinates"""
+        coords = numpy.asarray(coords,dtype=self.dtype)
+        if coords.shape != (self.natoms,3):
+            raise ValueError("Frame has %d atoms, the sequence has %d" %
+                             (len(coords),self.natoms))
+        if self.filename:
+            f = open(self.filename,'ab')
+            try:
+                f.write(coords.tostring())
+            finally:
+                f.close()
+            # Remapped the next time it is needed
+            self.array = None
+        else:
+            if self.nframes == len(self.array):
+                grown = numpy.zeros((2*len(self.array),self.natoms,3),dtype=self.dtype)
+                grown[:self.nframes] = self.array
+                self.array = grown
+            self.array[self.nframes] = coords
+        self.nframes = self.nframes + 1
+
+    def get_array(self):
+        """Return the coordinates of all the frames as an (nframes,natoms,3) array"""
+        if self.filename:
+            if self.array is None and self.nframes:
+                self.array = numpy.memmap(self.filename,dtype=self.dtype,mode='r',
+                                          shape=(self.nframes,self.natoms,3))
+            if self.array is None:
+                return numpy.zeros((0,self.natoms,3),dtype=self.dtype)
+            return self.array
+        return self.array[:self.nframes]
+
+    def __getitem__(self,i):
+        """Return the (natoms,3) coordinates of frame i"""
+        if i < 0:
+            i = i + self.nframes
+        if i < 0 or i >= self.nframes:
+            raise IndexError("frame index out of range")
+        return self.get_array()[i]
+
+    def __getstate__(self):
+        # Copies (eg by copy.deepcopy) hold the coordinates in memory
+        d = self.__dict__.copy()
+        d['array'] = numpy.array(self.get_array())
+        d['filename'] = None
+        return d
+
+
+class FrameList:
+    """Stands in for the frames list of a ZmatrixSequence with compact storage
+
+    Indexing gives a new Zmatrix for the frame (made by
+    sequence.make_frame) and appending a molecule just stores its
+    coordinates.
+    """
+    def __init__(self,sequence):
+        self.sequence = sequence
+
+    def __len__(self):
+        return len(self.sequence.frame_coords)
+
+    def __getitem__(self,i):
+        if i < 0:
+            i = i + len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("frame index out of range")
+        return self.sequence.make_frame(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.sequence.make_frame(i)
+
+    def append(self,molecule):
+        self.sequence.frame_coords.append([a.coord for a in molecule.atom])
+
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+class testTrajectory(unittest.TestCase):
+
+    def makeSequence(self,nframes):
+        import objects.zmatrix
+        seq = objects.zmatrix.ZmatrixSequence()
+        for i in range(nframes):
+            z = objects.zmatrix.Zmatrix()
+            for j,sym in enumerate(['O','H','H']):
+                a = objects.zmatrix.ZAtom()
+                a.symbol = sym
+                a.name = sym + str(j+1)
+                a.coord = [ float(i), float(j), 0.5 ]
+                z.add_atom(a)
+            seq.add_molecule(z)
+        return seq
+
+    def check(self,seq,nframes):
+        self.assertEqual(len(seq.frames),nframes)
+        self.assertEqual(seq.frame_coords.get_array().shape,(nframes,3,3))
+        frame = seq.frames[-1]
+        self.assertEqual([a.name for a in frame.atom],['O1','H2','H3'])
+        self.assertEqual(frame.atom[2].coord,[nframes-1.0,2.0,0.5])
+        for i in range(nframes):
+            self.assertEqual(seq.frame_coordinates(i)[1][0],float(i))
+
+    def testConvert(self):
+        seq = self.makeSequence(40)
+        seq.use_compact_storage()
+        self.check(seq,40)
+
+    def testAppend(self):
+        seq = self.makeSequence(1)
+        seq.use_compact_storage()
+        other = self.makeSequence(20)
+        for i in range(1,20):
+            seq.add_molecule(other.frames[i])
+        self.check(seq,20)
+
+    def testMemmap(self):
+        import tempfile
+        import copy
+        fd,filename = tempfile.mkstemp(suffix='.traj')
+        os.close(fd)
+        try:
+            seq = self.makeSequence(5)
+            seq.use_compact_storage(filename=filename)
+            self.assertTrue(isinstance(seq.frame_coords.get_array(),numpy.memmap))
+            self.assertEqual(os.path.getsize(filename),5*3*3*4)
+            self.check(seq,5)
+            new = copy.deepcopy(seq)
+            self.check(new,5)
+            z = seq.extract_frame()
+            self.assertFalse(z.__dict__.has_key('frame_coords'))
+        finally:
+            os.remove(filename)
+
+def testMe():
+    """Return a unittest test suite with all the testcases that should be run by the main
+    gui testing framework."""
+
+    return  unittest.TestLoader().loadTestsFromTestCase(testTrajectory)
+
+if __name__ == "__main__":
+    unittest.main()
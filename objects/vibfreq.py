@@ -19,9 +19,19 @@
 #
 """A container class for normal modes and associated the vibrational
 frequencies.
+
+VibFrameCache holds the displaced coordinates used to animate the
+modes, computed for all the frames of a mode at once.
 """
+import math
+import unittest
 import objects.object
 
+try:
+   import numpy
+except ImportError:
+   numpy = None
+
 class VibFreqSet(objects.object.CCP1GUI_Data):
    def __init__(self):
       self.vibs = []
@@ -83,6 +93,125 @@ class VibFreq(objects.object.CCP1GUI_Data):
    def get_name(self):
       return self.title
 
+
+def isAvailable():
+   """Return True if we have numpy and so can use a VibFrameCache"""
+   if numpy: return True
+   return False
+
+def displaced_frames(reference,displacement,frames,scale):
+   """Return the coordinates of the atoms over a cycle of a vibration
+   as a (frames,natoms,3) array, frame k (counting from 1) being
+   reference + scale*sin(2*pi*k/frames)*displacement.
+   Only the first len(reference) displacements are used."""
+   ref = numpy.asarray(reference,dtype=numpy.float64).reshape((-1,3))
+   disp = numpy.array([ [d[0],d[1],d[2]] for d in displacement[:len(ref)] ],
+                      dtype=numpy.float64).reshape((-1,3))
+   fac = scale * numpy.sin(2.0*math.pi*numpy.arange(1,frames+1)/frames)
+   return ref[numpy.newaxis,:,:] + fac[:,numpy.newaxis,numpy.newaxis]*disp[numpy.newaxis,:,:]
+
+class VibFrameCache:
+   """Animation frames (see displaced_frames) for a number of modes
+
+   Frames are kept for the modes most recently asked for, as long as
+   they fit in budget bytes. Requires numpy (see isAvailable).
+   """
+   def __init__(self,reference,budget=64*1024*1024):
+      self.reference = reference
+      self.budget = budget
+      self.nbytes = 0
+      # (id(vib),frames,scale) -> (vib,array)
+      self.entries = {}
+      # keys, least recently used first
+      self.order = []
+
+   def get(self,vib,frames,scale):
+      """Return the (frames,natoms,3) array of coordinates for mode vib"""
+      key = (id(vib),frames,scale)
+      entry = self.entries.get(key)
+      if entry and entry[0] is vib:
+         self.order.remove(key)
+         self.order.append(key)
+         return entry[1]
+      if entry:
+         # a mode that has gone has been replaced by one with the same id
+         self.remove(key)
+
+      array = displaced_frames(self.reference,vib.displacement,frames,scale)
+      self.entries[key] = (vib,array)
+      self.order.append(key)
+      self.nbytes = self.nbytes + array.nbytes
+      # keep at least the one just made
+      while self.nbytes > self.budget and len(self.order) > 1:
+         self.remove(self.order[0])
+      return array
+
+   def remove(self,key):
+      vib,array = self.entries[key]
+      del self.entries[key]
+      self.order.remove(key)
+      self.nbytes = self.nbytes - array.nbytes
+
+   def clear(self):
+      self.entries = {}
+      self.order = []
+      self.nbytes = 0
+
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+class testVibFrameCache(unittest.TestCase):
+
+   def makeSet(self,nmodes,natoms):
+      vs = VibFreqSet()
+      for m in range(nmodes):
+         vs.add_vib([ [0.1*m, 0.2, -0.1*i] for i in range(natoms) ], freq=100*(m+1))
+      return vs
+
+   def testFrames(self):
+      reference = [ [float(i),0.0,1.0] for i in range(4) ]
+      vib = self.makeSet(1,5).vibs[0]
+      frames = displaced_frames(reference,vib.displacement,12,0.3)
+      self.assertEqual(frames.shape,(12,4,3))
+      for k in range(12):
+         fac = 0.3*math.sin(2.0*math.pi*(k+1)/12)
+         for i in range(4):
+            for x in range(3):
+               self.assertAlmostEqual(frames[k,i,x],reference[i][x]+fac*vib.displacement[i][x])
+
+   def testLRU(self):
+      reference = [ [0.0,0.0,0.0] ] * 10
+      vs = self.makeSet(4,10)
+      # room for the frames of three modes
+      cache = VibFrameCache(reference,budget=3*36*10*3*8)
+      a = cache.get(vs.vibs[0],36,0.3)
+      self.assertTrue(cache.get(vs.vibs[0],36,0.3) is a)
+      cache.get(vs.vibs[1],36,0.3)
+      cache.get(vs.vibs[2],36,0.3)
+      # uses mode 0 so mode 1 is the one to go
+      cache.get(vs.vibs[0],36,0.3)
+      cache.get(vs.vibs[3],36,0.3)
+      self.assertEqual(len(cache.entries),3)
+      self.assertTrue(cache.get(vs.vibs[0],36,0.3) is a)
+      self.assertFalse(cache.entries.has_key((id(vs.vibs[1]),36,0.3)))
+      self.assertEqual(cache.nbytes,3*36*10*3*8)
+      # changing the amplitude makes new frames
+      b = cache.get(vs.vibs[0],36,0.5)
+      self.assertFalse(b is a)
+      self.assertEqual(len(cache.entries),3)
+
+def testMe():
+   """Return a unittest test suite with all the testcases that should be run by the main
+   gui testing framework."""
+
+   return  unittest.TestLoader().loadTestsFromTestCase(testVibFrameCache)
+
 if __name__ == "__main__":
    v = VibFreqSet()
    v1 = v.add_vib([],100)
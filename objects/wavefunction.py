@@ -0,0 +1,452 @@
+#
+#    This file is part of the CCP1 Graphical User Interface (ccp1gui)
+#
+#   (C) 2002-2007 CCLRC Daresbury Laboratory
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+"""Gaussian basis sets and molecular orbitals, evaluated on grids.
+
+A Wavefunction holds a BasisSet (a list of contracted Gaussian
+Shells) and the molecular orbital coefficients, as read from the
+[GTO] and [MO] sections of a Molden file (see interfaces/filemolden.py).
+OrbitalEvaluator computes the value of an orbital, or the total
+density, at the points of a Field without running an external
+program:
+
+  - the basis functions of a shell are computed together, from one
+    radial part,
+  - a shell is only evaluated at points within reach of its most
+    diffuse primitive, and primitives that have died away over a
+    whole chunk of points are skipped,
+  - the grid is processed in chunks, so the memory used is bounded
+    (chunk_bytes), and the chunks can be shared over several processes,
+  - the fields are kept, keyed by orbital and grid, so going back to
+    an orbital is immediate.
+
+The basis follows the Molden conventions: Cartesian functions each
+normalised and in Molden order, or real spherical harmonics ordered
+0,+1,-1,+2,-2,... Coordinates are in bohr, apart from the Field
+grids, which are in angstrom as for the rest of the GUI.
+"""
+
+import os,sys
+if __name__ == "__main__":
+    # Need to add the gui directory to the python path so
+    # that all the modules can be imported
+    gui_path = os.path.split(os.path.dirname( os.path.realpath( __file__ ) ))[0]
+    sys.path.append(gui_path)
+
+import math
+import unittest
+
+import objects.field
+import objects.vector
+import objects.isocache
+import objects.object
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def isAvailable():
+    """Return True if we have numpy and so can evaluate orbitals"""
+    if numpy: return True
+    return False
+
+BOHR_TO_ANGSTROM = 0.529177249
+
+SHELL_TYPES = 'spdfg'
+
+# The powers of x, y and z of the Cartesian functions of each shell,
+# in the order used by Molden
+CARTESIAN = [
+    [ (0,0,0) ],
+    [ (1,0,0), (0,1,0), (0,0,1) ],
+    [ (2,0,0), (0,2,0), (0,0,2), (1,1,0), (1,0,1), (0,1,1) ],
+    [ (3,0,0), (0,3,0), (0,0,3), (1,2,0), (2,1,0), (2,0,1),
+      (1,0,2), (0,1,2), (0,2,1), (1,1,1) ],
+    [ (4,0,0), (0,4,0), (0,0,4), (3,1,0), (3,0,1), (1,3,0),
+      (0,3,1), (1,0,3), (0,1,3), (2,2,0), (2,0,2), (0,2,2),
+      (2,1,1), (1,2,1), (1,1,2) ],
+    ]
+
+# The real solid harmonics (unnormalised) as polynomials in x, y and z,
+# in the order 0,+1,-1,+2,-2,... used by Molden
+SPHERICAL = {
+    2 : [ { (0,0,2) : 2, (2,0,0) : -1, (0,2,0) : -1 },
+          { (1,0,1) : 1 },
+          { (0,1,1) : 1 },
+          { (2,0,0) : 1, (0,2,0) : -1 },
+          { (1,1,0) : 1 } ],
+    3 : [ { (0,0,3) : 2, (2,0,1) : -3, (0,2,1) : -3 },
+          { (1,0,2) : 4, (3,0,0) : -1, (1,2,0) : -1 },
+          { (0,1,2) : 4, (2,1,0) : -1, (0,3,0) : -1 },
+          { (2,0,1) : 1, (0,2,1) : -1 },
+          { (1,1,1) : 1 },
+          { (3,0,0) : 1, (1,2,0) : -3 },
+          { (2,1,0) : 3, (0,3,0) : -1 } ],
+    }
+
+def _dfact(n):
+    """Double factorial, with (-1)!! = 1"""
+    r = 1
+    while n > 1:
+        r = r * n
+        n = n - 2
+    return r
+
+def _moment(powers):
+    """The angular integral of a monomial (relative to that of x^2 y^2 z^2...
+    of the same degree), zero unless all the powers are even"""
+    r = 1
+    for p in powers:
+        if p % 2:
+            return 0
+        r = r * _dfact(p-1)
+    return r
+
+def spherical_transform(l):
+    """Return the (2l+1,ncart) matrix giving the normalised spherical
+    functions of a shell from the normalised Cartesian ones"""
+    cart = CARTESIAN[l]
+    rows = []
+    for poly in SPHERICAL[l]:
+        norm = 0.0
+        for m,cm in poly.items():
+            for n,cn in poly.items():
+                norm = norm + cm * cn * _moment([ m[i]+n[i] for i in range(3) ])
+        row = [ 0.0 ] * len(cart)
+        for m,cm in poly.items():
+            row[cart.index(m)] = cm * math.sqrt(_moment([ 2*p for p in m ]) / norm)
+        rows.append(row)
+    return numpy.array(rows)
+
+
+class Shell:
+    """A contracted shell of Gaussian functions
+
+    centre is in bohr, coefficients refer to normalised primitives.
+    """
+
+    def __init__(self,l,centre,exponents,coefficients,spherical=0):
+        if l > 1 and spherical and not SPHERICAL.has_key(l):
+            raise NotImplementedError("Spherical %s functions are not supported" % SHELL_TYPES[l])
+        self.l = l
+        self.centre = numpy.array(centre,dtype=numpy.float64)
+        self.exponents = numpy.array(exponents,dtype=numpy.float64)
+        self.spherical = spherical and l > 1
+        self.powers = numpy.array(CARTESIAN[l],dtype=numpy.int32)
+        if self.spherical:
+            self.transform = spherical_transform(l)
+        else:
+            self.transform = None
+
+        # Fold the normalisation of the primitives, and of the contraction
+        # as a whole, into the coefficients
+        a = self.exponents
+        c = numpy.array(coefficients,dtype=numpy.float64)
+        overlap = (2.0*numpy.sqrt(numpy.outer(a,a))/numpy.add.outer(a,a))**(l+1.5)
+        c = c / math.sqrt(numpy.dot(c,numpy.dot(overlap,c)))
+        self.coefficients = c * (2.0*a/math.pi)**0.75 * (4.0*a)**(0.5*l)
+        # the normalisation of each Cartesian function
+        self.cart_norm = numpy.array([ 1.0/math.sqrt(_moment([ 2*p for p in m ]))
+                                       for m in CARTESIAN[l] ])
+
+    def nbf(self):
+        if self.spherical:
+            return 2*self.l + 1
+        return len(CARTESIAN[self.l])
+
+    def evaluate(self,points,out,cutoff=40.0):
+        """Put the values of the functions of the shell at points (npts,3)
+        into out (nbf,npts), which should be zero on entry.
+        Points where exp(-alpha r^2) < exp(-cutoff) for the most diffuse
+        primitive are skipped."""
+        d = points - self.centre
+        r2 = (d*d).sum(axis=1)
+        reach = cutoff / self.exponents.min()
+        index = numpy.nonzero(r2 < reach)[0]
+        if not len(index):
+            return
+        if len(index) < len(r2):
+            d = d[index]
+            r2 = r2[index]
+
+        radial = numpy.zeros(len(r2))
+        r2min = r2.min()
+        for a,c in zip(self.exponents,self.coefficients):
+            if a * r2min < cutoff:
+                radial += c * numpy.exp(-a * r2)
+
+        if self.l == 0:
+            values = radial[numpy.newaxis,:]
+        else:
+            values = numpy.empty((len(self.powers),len(r2)))
+            for i in range(len(self.powers)):
+                v = radial * self.cart_norm[i]
+                for x in range(3):
+                    p = self.powers[i,x]
+                    if p:
+                        v = v * d[:,x]**p
+                values[i] = v
+            if self.spherical:
+                values = numpy.dot(self.transform,values)
+
+        if len(index) < out.shape[1]:
+            out[:,index] = values
+        else:
+            out[:,:] = values
+
+
+class BasisSet:
+    """A list of Shells"""
+
+    def __init__(self):
+        self.shells = []
+
+    def add_shell(self,shell):
+        self.shells.append(shell)
+
+    def nbf(self):
+        return sum([ s.nbf() for s in self.shells ])
+
+    def evaluate(self,points):
+        """Return the values of all the basis functions at points (npts,3),
+        as an (nbf,npts) array"""
+        values = numpy.zeros((self.nbf(),len(points)))
+        i = 0
+        for s in self.shells:
+            n = s.nbf()
+            s.evaluate(points,values[i:i+n])
+            i = i + n
+        return values
+
+
+class Wavefunction(objects.object.CCP1GUI_Data):
+    """A basis set and molecular orbitals
+
+    coefficients is an (nmo,nbf) array, occupations and energies
+    have an entry for each orbital. The orbitals may be loaded
+    when first used (see CCP1GUI_Data.defer).
+    """
+
+    def __init__(self,basis,coefficients,occupations,energies=None,symmetries=None):
+        self.basis = basis
+        self.coefficients = numpy.asarray(coefficients,dtype=numpy.float64)
+        self.occupations = numpy.asarray(occupations,dtype=numpy.float64)
+        self.energies = energies
+        self.symmetries = symmetries
+        self.title = 'Wavefunction'
+
+    def nmo(self):
+        return len(self.coefficients)
+
+    def evaluate(self,mo,points):
+        """Return the value at points (in bohr) of orbital mo (counting
+        from 1), or the total density if mo is 0"""
+        phi = self.basis.evaluate(points)
+        if mo:
+            return numpy.dot(self.coefficients[mo-1],phi)
+        occupied = numpy.nonzero(self.occupations > 0.0)[0]
+        psi = numpy.dot(self.coefficients[occupied],phi)
+        return numpy.dot(self.occupations[occupied],psi*psi)
+
+    def centres(self):
+        """The centres of the shells (bohr), one per atom"""
+        c = []
+        for s in self.basis.shells:
+            if not c or (s.centre != c[-1]).any():
+                c.append(s.centre)
+        return c
+
+
+# The wavefunction used by _evaluate_chunk in worker processes
+_worker_wavefunction = None
+
+def _init_worker(wavefunction):
+    global _worker_wavefunction
+    _worker_wavefunction = wavefunction
+
+def _evaluate_chunk(args):
+    mo,points = args
+    return _worker_wavefunction.evaluate(mo,points)
+
+
+class OrbitalEvaluator:
+    """Compute orbitals and the density of a Wavefunction on grids
+
+    processes > 1 shares the chunks of each grid over that many
+    processes. Up to cache_bytes of results are kept.
+    """
+
+    def __init__(self,wavefunction,processes=1,chunk_bytes=32*1024*1024,
+                 cache_bytes=256*1024*1024):
+        self.wavefunction = wavefunction
+        self.processes = processes
+        self.chunk_bytes = chunk_bytes
+        self.cache = objects.isocache.LRUCache(cache_bytes)
+        self.pool = None
+        self.debug = 0
+
+    def chunk_size(self):
+        """The number of points in a chunk, so that the values of all
+        the basis functions at the chunk's points fit in chunk_bytes"""
+        return max(self.chunk_bytes / (8 * max(self.wavefunction.basis.nbf(),1)), 1)
+
+    def evaluate(self,mo,points):
+        """Return the value of orbital mo (0 for the density) at points (bohr)"""
+        n = self.chunk_size()
+        chunks = [ (mo,points[i:i+n]) for i in range(0,len(points),n) ]
+        if self.processes > 1 and len(chunks) > 1:
+            if not self.pool:
+                import multiprocessing
+                self.pool = multiprocessing.Pool(self.processes,_init_worker,(self.wavefunction,))
+            results = self.pool.map(_evaluate_chunk,chunks)
+        else:
+            results = [ self.wavefunction.evaluate(mo,p) for mo,p in chunks ]
+        if not results:
+            return numpy.zeros(0)
+        return numpy.concatenate(results)
+
+    def grid_key(self,field):
+        o = field.origin
+        return (tuple(field.dim),(o[0],o[1],o[2]),
+                tuple([ (a[0],a[1],a[2]) for a in field.axis ]))
+
+    def get_field(self,mo,grid):
+        """Return a Field with the values of orbital mo (0 for the
+        density) at the points of grid, a Field (in angstrom)"""
+        key = (mo,self.grid_key(grid))
+        field = self.cache.get(key)
+        if field is not None:
+            return field
+
+        points = grid.get_grid_array() / BOHR_TO_ANGSTROM
+        field = objects.field.Field()
+        field.dim = list(grid.dim)
+        field.origin = grid.origin
+        field.axis = list(grid.axis)
+        if mo:
+            field.title = 'MO %d' % mo
+        else:
+            field.title = 'Total density'
+        # points vary with the first index fastest
+        field.set_data(self.evaluate(mo,points))
+        self.cache.put(key,field,field.data.nbytes)
+        return field
+
+    def molecule_grid(self,npts,edge=0.0,margin=3.0):
+        """Return an empty cubic Field of npts points along each edge,
+        centred on the molecule, with edge length edge (angstrom) or, if
+        that is 0, large enough for the molecule plus margin on each side"""
+        c = numpy.array(self.wavefunction.centres()) * BOHR_TO_ANGSTROM
+        lo = c.min(axis=0)
+        hi = c.max(axis=0)
+        if not edge:
+            edge = (hi - lo).max() + 2*margin
+        mid = 0.5 * (lo + hi)
+        grid = objects.field.Field()
+        grid.dim = [ npts, npts, npts ]
+        grid.origin = objects.vector.Vector(mid[0],mid[1],mid[2])
+        grid.axis = [ edge*grid.x, edge*grid.y, edge*grid.z ]
+        return grid
+
+    def close(self):
+        """Stop the worker processes"""
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+class testWavefunction(unittest.TestCase):
+
+    def grid(self,extent=6.0,n=73):
+        x = numpy.linspace(-extent,extent,n)
+        h = x[1] - x[0]
+        pts = numpy.array(numpy.meshgrid(x,x,x,indexing='ij')).reshape((3,-1)).transpose()
+        return pts, h**3
+
+    def overlap(self,basis):
+        pts,w = self.grid()
+        phi = basis.evaluate(pts)
+        return numpy.dot(phi,phi.transpose()) * w
+
+    def testNormalisation(self):
+        """The functions of each type of shell are normalised, and the
+        spherical ones orthogonal"""
+        for l,spherical in [ (0,0), (1,0), (2,0), (2,1), (3,0), (3,1), (4,0) ]:
+            b = BasisSet()
+            b.add_shell(Shell(l,[0.0,0.0,0.0],[1.2,0.4],[0.6,0.5],spherical=spherical))
+            s = self.overlap(b)
+            for i in range(len(s)):
+                self.assertAlmostEqual(s[i,i],1.0,4)
+            if spherical:
+                self.assertTrue(abs(s - numpy.identity(len(s))).max() < 1.0e-4)
+
+    def makeH2(self):
+        b = BasisSet()
+        for z in (-0.7,0.7):
+            b.add_shell(Shell(0,[0.0,0.0,z],[3.42525091,0.62391373,0.16885540],
+                              [0.15432897,0.53532814,0.44463454]))
+        # sigma_g, normalised with overlap 0.6593
+        cg = 1.0 / math.sqrt(2.0*(1.0+0.6593))
+        cu = 1.0 / math.sqrt(2.0*(1.0-0.6593))
+        return Wavefunction(b,[[cg,cg],[cu,-cu]],[2.0,0.0])
+
+    def testDensity(self):
+        """The density of H2 integrates to two electrons"""
+        wfn = self.makeH2()
+        pts,w = self.grid(extent=7.0)
+        self.assertAlmostEqual(wfn.evaluate(0,pts).sum()*w,2.0,2)
+        # screening the points and primitives makes no real difference
+        s = wfn.basis.shells[0]
+        screened = numpy.zeros((1,len(pts)))
+        s.evaluate(pts,screened,cutoff=20.0)
+        full = numpy.zeros((1,len(pts)))
+        s.evaluate(pts,full,cutoff=1000.0)
+        self.assertTrue((screened == 0.0).any())
+        self.assertTrue(abs(screened - full).max() < 1.0e-8)
+
+    def testEvaluator(self):
+        """Chunked and cached evaluation on a Field grid"""
+        e = OrbitalEvaluator(self.makeH2())
+        grid = e.molecule_grid(11)
+        f = e.get_field(1,grid)
+        self.assertEqual(len(f.data),11*11*11)
+        self.assertTrue(e.get_field(1,grid) is f)
+        e.chunk_bytes = 8*2*100
+        self.assertEqual(e.chunk_size(),100)
+        values = e.evaluate(1,grid.get_grid_array()/BOHR_TO_ANGSTROM)
+        self.assertTrue(abs(values - f.data).max() < 1.0e-12)
+
+def testMe():
+    """Return a unittest test suite with all the testcases that should be run by the main
+    gui testing framework."""
+
+    return  unittest.TestLoader().loadTestsFromTestCase(testWavefunction)
+
+if __name__ == "__main__":
+    unittest.main()
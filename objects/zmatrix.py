@@ -47,6 +47,7 @@ else:
 import math
 import copy
 import exceptions
+import hashlib
 import string
 import re
 import unittest
@@ -56,6 +57,7 @@ import objects.object
 import objects.vector
 import objects.numeric
 import objects.linalg
+import objects.neighbour
 import symdet
 from objects.periodic import rcov, sym2no, atomic_mass, name_to_element, get_bond_length
 from chempy import cpv, atomic_number
@@ -241,6 +243,8 @@ class Bond:
 class Indexed(objects.object.CCP1GUI_Data):
     def __init__(self):
         self.atom = []
+        # AtomStore holding the atoms if use_array_atoms has been called
+        self.store = None
 
 #####    def reset(self):
         self.index = None
@@ -292,6 +296,9 @@ class Indexed(objects.object.CCP1GUI_Data):
         for c in a.conn:
             c.conn.remove(a)
         self.atom.remove(a)
+        store = getattr(self,'store',None)
+        if store and getattr(a,'_store',None) is store:
+            store.release(a)
 
     def reindex(self):
         k = 0
@@ -312,6 +319,35 @@ class Indexed(objects.object.CCP1GUI_Data):
 
         self.nondum = kk 
 
+    def use_array_atoms(self,size=0):
+        """Move the atoms into array-based storage (see objects/atomstore.py)
+
+        The atoms are replaced by AtomView objects that keep their
+        coordinates, atomic numbers, charges and flags in numpy arrays
+        held by self.store, which is made with room for size atoms.
+        Atoms added to the molecule afterwards should be made with new_atom.
+        """
+        import objects.atomstore
+        old = self.atom
+        self.store, self.atom = objects.atomstore.compact_atoms(old,size)
+        new = {}
+        for a, v in zip(old,self.atom):
+            new[id(a)] = v
+        for s in self.shell:
+            try:
+                s.linked_core = new[id(s.linked_core)]
+            except (AttributeError, KeyError):
+                pass
+        self.reindex()
+
+    def new_atom(self):
+        """Return a new atom for the molecule (it is not added to self.atom):
+        a row of self.store if the molecule uses array storage, otherwise a ZAtom"""
+        store = getattr(self,'store',None)
+        if store:
+            return store.new_atom()
+        return ZAtom()
+
     def get_nondum(self):
         """Returns the count of non-dummy atoms"""
         return self.nondum
@@ -1629,13 +1665,14 @@ class Zmatrix(Indexed):
         phi = tor(x--c--b--a)
         """
 
-        assert type(a) == type([]), 'bad type for a'+str(type(a))
-        assert type(b) == type([]), 'bad type for b'+str(type(b))
-        assert type(c) == type([]), 'bad type for c'+str(type(c))
+        # coordinates may be lists or (for compact storage) array rows
+        assert len(a) == 3, 'bad type for a'+str(type(a))
+        assert len(b) == 3, 'bad type for b'+str(type(b))
+        assert len(c) == 3, 'bad type for c'+str(type(c))
 
-        assert type(a[0]) == type(0.0), 'bad type for a[0]'+str(type(a[0]))
-        assert type(b[0]) == type(0.0), 'bad type for b[0]'+str(type(b[0]))
-        assert type(c[0]) == type(0.0), 'bad type for c[0]'+str(type(c[0]))
+        assert isinstance(a[0],float), 'bad type for a[0]'+str(type(a[0]))
+        assert isinstance(b[0],float), 'bad type for b[0]'+str(type(b[0]))
+        assert isinstance(c[0],float), 'bad type for c[0]'+str(type(c[0]))
 
         assert type(r) == type(0.0), 'bad type for r'+str(type(r))
         assert type(theta) == type(0.0), 'bad type for theta'+str(type(theta))
@@ -1728,8 +1765,98 @@ class Zmatrix(Indexed):
 
         if self.debug: print 'connect_old: found ',count,' bonds'
 
+    def coordinate_array(self):
+        """Return the atomic coordinates as an (natoms,3) numpy array"""
+        return objects.neighbour.numpy.array([a.coord for a in self.atom],
+                                             dtype=objects.neighbour.numpy.float64).reshape((-1,3))
+
+    def covalent_radii(self):
+        """Return the covalent radii (angstrom) of the atoms as a numpy array"""
+        return objects.neighbour.covalent_radii([a.get_number() for a in self.atom])
+
     def connect(self,scale=1.0,toler=0.5):
         """ Compute connectivity
+        Connectivity is stored in the bond array, which is a
+        BondTable (see objects/neighbour.py) when numpy is available.
+        """
+        self.reindex()
+        if objects.neighbour.isAvailable() and self.is_primitive_cell():
+            self.connect_periodic(scale=scale,toler=toler)
+        elif objects.neighbour.isAvailable():
+            pairs = objects.neighbour.find_pairs(self.coordinate_array(),
+                                                 self.covalent_radii(),
+                                                 scale=scale,toler=toler)
+            self.bond = objects.neighbour.BondTable(pairs)
+            if self.debug: print 'connect: found ',len(pairs),' bonds'
+            self.update_conn()
+        else:
+            self.connect_boxes(scale=scale,toler=toler)
+
+    def is_primitive_cell(self):
+        """Return True if this is a periodic structure holding just the
+        contents of its cell (i.e. it has not been extended)"""
+        if len(self.cell) != 2 and len(self.cell) != 3:
+            return 0
+        try:
+            return self.atom is self.primitive_atom
+        except AttributeError:
+            return 1
+
+    def connect_periodic(self,scale=1.0,toler=0.5):
+        """Compute connectivity for the contents of a periodic cell
+
+        Bonds within the cell go into the bond array as for connect(),
+        bonds that cross the cell boundary are stored in
+        self.image_bond as a BondTable holding the cell offset of the
+        second atom, rather than as bonds between copies of the atoms.
+        """
+        self.reindex()
+        pairs, images = objects.neighbour.find_periodic_pairs(self.coordinate_array(),
+                                                              self.covalent_radii(),
+                                                              self.cell,
+                                                              scale=scale,toler=toler)
+        incell = (images == 0).all(axis=1)
+        self.bond = objects.neighbour.BondTable(pairs[incell])
+        self.image_bond = objects.neighbour.BondTable(pairs,images)
+        self.image_connect = (scale,toler,self._image_signature(self.atom))
+        if self.debug: print 'connect_periodic: found ',len(pairs),' bonds, ',\
+           len(pairs) - incell.sum(),' across the cell boundary'
+        self.update_conn()
+
+    def _image_signature(self,prim):
+        """A digest of the atoms and cell that image_bond was found for"""
+        h = hashlib.sha1()
+        h.update(str(len(prim)))
+        h.update(str([a.get_number() for a in prim]))
+        h.update(str([[c for c in v] for v in self.cell]))
+        h.update(objects.neighbour.numpy.array([a.coord for a in prim],
+                                               dtype=objects.neighbour.numpy.float64).tostring())
+        return h.hexdigest()
+
+    def image_bonds_current(self,scale=None,toler=None):
+        """Return True if image_bond is still valid for the primitive
+        cell (and was found with scale and toler, if these are given)
+
+        Stale periodic bonds, left from before atoms were added,
+        removed or moved, are thrown away.
+        """
+        if not self.__dict__.has_key('image_bond') or not objects.neighbour.isAvailable():
+            return 0
+        try:
+            prim = self.primitive_atom
+        except AttributeError:
+            prim = self.atom
+        oldscale,oldtoler,signature = self.image_connect
+        if signature != self._image_signature(prim):
+            del self.image_bond
+            del self.image_connect
+            return 0
+        if scale is not None and (scale,toler) != (oldscale,oldtoler):
+            return 0
+        return 1
+
+    def connect_boxes(self,scale=1.0,toler=0.5):
+        """ Compute connectivity without numpy
         Taken from John Kendricks Tcl routine
         Connectivity is stored in the bond array
         """
@@ -1801,6 +1928,30 @@ class Zmatrix(Indexed):
     def find_contacts(self,contact_scale=1.0,contact_toler=2.5,pr=0,list=None):
 
         """Search for nonbonded contacts
+        The contacts are stored in self.contacts, in both directions
+        for each atom in list
+        """
+        self.reindex()
+        if not objects.neighbour.isAvailable():
+            return self.find_contacts_boxes(contact_scale=contact_scale,
+                                            contact_toler=contact_toler,pr=pr,list=list)
+
+        pairs = objects.neighbour.find_contacts(self.coordinate_array(),
+                                                self.covalent_radii(),
+                                                objects.neighbour.bond_pairs(self.bond),
+                                                scale=contact_scale,toler=contact_toler,
+                                                atoms=list)
+        self.contacts = objects.neighbour.BondTable(pairs)
+        if pr:
+            coords = self.coordinate_array()
+            for i,j in pairs.tolist():
+                print i+1,self.atom[i].name,j+1,self.atom[j].name,cpv.distance(coords[i],coords[j])
+
+        if self.debug: print 'connect: found ',len(pairs),' contacts'
+
+    def find_contacts_boxes(self,contact_scale=1.0,contact_toler=2.5,pr=0,list=None):
+
+        """Search for nonbonded contacts without numpy
         Taken from John Kendricks Tcl routine
         """
         self.contacts = []
@@ -1918,6 +2069,17 @@ class Zmatrix(Indexed):
         self.list()
 
     def extend(self,minx,maxx,miny,maxy,minz,maxz):
+        """Replace the atoms by those of a block of cells
+
+        If we have numpy the atoms of the block are held in array
+        storage (see objects/atomstore.py), with the coordinates taken
+        from image_coordinates, otherwise they are copies of the atoms
+        of the primitive cell. If the periodic bonds of the primitive
+        cell are known (see connect_periodic) the bonds of the block
+        are generated from them, otherwise the block should be
+        connected with connect()
+        """
+        import objects.atomstore
 
         try:
             prim = self.primitive_atom
@@ -1927,63 +2089,113 @@ class Zmatrix(Indexed):
             prim = self.atom
             self.primitive_shell = self.shell
             shellprim = self.shell
-        ##vx = Vector(self.cell[0])
-        vx = self.cell[0]
-        ##vy = Vector(self.cell[1])
-        vy = self.cell[1]
-
-        if  len(self.cell) == 3:
-            ###vz = Vector(self.cell[2])
-            vz = self.cell[2]
-        else:
-            vz = objects.vector.Vector(0., 0., 0.)
+
+        if  len(self.cell) != 3:
             minz=0
             maxz=0
 
-        self.atom = []
+        self.image_block = ((minx,miny,minz),(maxx,maxy,maxz))
+
         self.shell = []        
-        offset=0
         nat = len(prim)
+        ncells = (maxx-minx+1)*(maxy-miny+1)*(maxz-minz+1)
+        coords = self.image_coordinates(prim)
+        if objects.atomstore.isAvailable():
+            self.store, self.atom = objects.atomstore.repeat_atoms(prim,ncells)
+            self.store.coord[:len(self.atom)] = coords
+        else:
+            self.store = None
+            self.atom = []
+            k = 0
+            for i in range(ncells):
+                for atom in prim:
+                    new = self._image_copy(atom)
+                    new.coord = list(coords[k])
+                    k = k + 1
+                    self.atom.append(new)
+
+        offset = 0
         for ix in range(minx,maxx+1):
-            tranx = vx * ix
             for iy in range(miny,maxy+1):
-                trany = vy * iy
                 for iz in range(minz,maxz+1):
-                    tranz = vz * iz
-
-                    for atom in prim:
-                        #old_conn = atom.conn
-                        atom.conn = []
-                        new = copy.deepcopy(atom)
-                        self.atom.append(new)
-                        pos = objects.vector.Vector(atom.coord) + tranx + trany + tranz
-                        new.coord[0] = pos[0]
-                        new.coord[1] = pos[1]
-                        new.coord[2] = pos[2]
-
                     for atom in shellprim:
                         ixx = atom.linked_core.get_index()
-                        atom.conn = []
-                        # no need to copy the referenced atom
-                        t= atom.linked_core
-                        atom.linked_core=None
-                        new = copy.deepcopy(atom)
-                        atom.linked_core=t
+                        new = self._image_copy(atom)
+                        pos = objects.vector.Vector(atom.coord) + \
+                              self._cell_translation(ix,iy,iz)
+                        new.coord = [ pos[0], pos[1], pos[2] ]
                         self.shell.append(new)
-                        pos = objects.vector.Vector(atom.coord) + tranx + trany + tranz
-                        new.coord[0] = pos[0]
-                        new.coord[1] = pos[1]
-                        new.coord[2] = pos[2]
                         # link to parent atom
                         new.linked_core = self.atom[ixx+offset]
+                    offset = offset + nat
+
+        if self.image_bonds_current():
+            pairs = objects.neighbour.expand_periodic_pairs(self.image_bond.pairs,
+                                                            self.image_bond.images,
+                                                            nat,
+                                                            self.image_block[0],
+                                                            self.image_block[1])
+            self.bond = objects.neighbour.BondTable(pairs)
+            self.update_conn()
+        else:
+            self.bond = []
+            self.reindex()
+            for a in self.atom:
+                a.conn = []
 
-                    offset=offset+nat
-                        
         if self.debug:
             print 'extend: generated ',len(self.atom),' atoms'
             if len(self.shell):
                 print 'and ',len(self.shell),' shells'
 
+    def _cell_translation(self,ix,iy,iz):
+        """Translation vector to the cell (ix,iy,iz)"""
+        tran = self.cell[0] * ix + self.cell[1] * iy
+        if len(self.cell) == 3:
+            tran = tran + self.cell[2] * iz
+        return tran
+
+    def _image_copy(self,atom):
+        """A copy of an atom (or shell) for a periodic image, with its own
+        copy of the mutable attributes and no connectivity. References to
+        other atoms (linked_core ...) are left to the caller."""
+        new = copy.copy(atom)
+        new.conn = []
+        for name, value in atom.__dict__.items():
+            if name != 'conn' and isinstance(value,(list,dict)):
+                new.__dict__[name] = copy.deepcopy(value)
+        return new
+
+    def image_coordinates(self,prim=None):
+        """Return the coordinates of the atoms of the current block of
+        cells (see extend) as an (ncells*natoms,3) numpy array, without
+        creating any atoms."""
+        if prim is None:
+            try:
+                prim = self.primitive_atom
+            except AttributeError:
+                prim = self.atom
+        (minx,miny,minz),(maxx,maxy,maxz) = self.image_block
+        numpy = objects.neighbour.numpy
+        if numpy is None:
+            coords = []
+            for ix in range(minx,maxx+1):
+                for iy in range(miny,maxy+1):
+                    for iz in range(minz,maxz+1):
+                        tran = self._cell_translation(ix,iy,iz)
+                        for a in prim:
+                            pos = objects.vector.Vector(a.coord) + tran
+                            coords.append([pos[0],pos[1],pos[2]])
+            return coords
+
+        m, nper = objects.neighbour.cell_matrix(self.cell)
+        m[nper:] = 0.0
+        grid = numpy.indices((maxx-minx+1,maxy-miny+1,maxz-minz+1)).reshape((3,-1)).T
+        grid = grid + numpy.array([minx,miny,minz])
+        tran = numpy.dot(grid,m)
+        base = numpy.array([a.coord for a in prim],dtype=numpy.float64).reshape((-1,3))
+        return (tran[:,numpy.newaxis,:] + base[numpy.newaxis,:,:]).reshape((-1,3))
+
     def hybridise(self,atom,hybridisation):
         """ Try and impose a given hybridisation on an atomic centre
         Add x atoms to make up the required number of connections
@@ -2739,9 +2951,15 @@ class Zmatrix(Indexed):
 
         #print 'len of bond',len(self.bond)
 
-        for b in self.bond:
-            self.atom[b.index[0]].conn.append(self.atom[b.index[1]])
-            self.atom[b.index[1]].conn.append(self.atom[b.index[0]])
+        if isinstance(self.bond,objects.neighbour.BondTable):
+            pairs = self.bond.pairs.tolist()
+        else:
+            pairs = [ b.index for b in self.bond ]
+
+        atom = self.atom
+        for i1, i2 in pairs:
+            atom[i1].conn.append(atom[i2])
+            atom[i2].conn.append(atom[i1])
 
     def add_bond(self,a1,a2):
         """Add a bond by updating atom connectivity lists
@@ -4496,6 +4714,9 @@ class ZmatrixSequence(Zmatrix):
         self.title="Sequence of Structures"
         ###self.current_frame=0
         self.name="Unnamed"
+        # A FrameArray holding the coordinates when using compact
+        # storage (see objects/trajectory.py)
+        self.frame_coords = None
 
     def add_molecule(self,molecule):
         """ Add a molecule to the sequence
@@ -4504,10 +4725,55 @@ class ZmatrixSequence(Zmatrix):
             visualised.
         """
 
+        if len(self.atom) == 0:
+            if self.frame_coords is not None:
+                # The first frame provides the topology for all of them
+                self.atom = copy.deepcopy(molecule.atom)
+            else:
+                self.atom = molecule.atom
+
         self.frames.append(molecule)
 
-        if len(self.atom) == 0:
-            self.atom = molecule.atom
+    def use_compact_storage(self,filename=None):
+        """Keep the coordinates of the frames in one (nframes,natoms,3) float32
+        array rather than a Zmatrix for each frame (see objects/trajectory.py).
+        The array is held in filename (using numpy.memmap) if this is given.
+        After this, the atoms of the sequence are the topology for all the
+        frames, and frames builds a Zmatrix for a frame when one is asked for.
+        """
+        import objects.trajectory
+        frames = self.frames
+        if len(frames):
+            natoms = len(frames[0].atom)
+        else:
+            natoms = len(self.atom)
+        if len(frames) and self.atom is frames[0].atom:
+            # Don't let the visualiser change the coordinates of the topology
+            self.atom = copy.deepcopy(self.atom)
+        self.frame_coords = objects.trajectory.FrameArray(natoms,filename=filename)
+        self.frames = objects.trajectory.FrameList(self)
+        for f in frames:
+            self.frames.append(f)
+
+    def frame_coordinates(self,i):
+        """Return the coordinates of the atoms in frame i"""
+        if self.frame_coords is not None:
+            return self.frame_coords[i]
+        return [a.coord for a in self.frames[i].atom]
+
+    def make_frame(self,i):
+        """Return a new Zmatrix holding frame i of a compact sequence"""
+        z = Zmatrix()
+        z.name = self.name
+        z.title = self.title + ' frame ' + str(i+1)
+        coords = self.frame_coords[i]
+        for a,c in zip(self.atom,coords):
+            b = ZAtom()
+            b.symbol = a.symbol
+            b.name = a.name
+            b.coord = [ float(c[0]), float(c[1]), float(c[2]) ]
+            z.add_atom(b)
+        return z
 
     def extract_frame(self):
         """
@@ -4518,7 +4784,7 @@ class ZmatrixSequence(Zmatrix):
         """
         zmat = Zmatrix()
         for x in self.__dict__:
-            if x not in ['frames','nframes','title','name','tidy']:
+            if x not in ['frames','frame_coords','nframes','title','name','tidy']:
                 zmat.__dict__[x] = copy.deepcopy(self.__dict__[x])
         return zmat
 
@@ -4896,6 +5162,74 @@ class testOperations(unittest.TestCase):
         model.extend(1,3,1,3,1,3)
         self.assertEqual(216,len(model.atom))
 
+    def testExtendCopies(self):
+        """Image atoms have their own coordinates and attributes"""
+
+        from interfaces.filepunch import PunchIO
+        r = PunchIO()
+        model = r.GetObjects(filepath=gui_path+os.sep+'examples'+os.sep+'MgO.pun')[0]
+        nat = len(model.atom)
+        model.atom[0].visible = [1]
+        model.extend(0,1,0,0,0,0)
+        coords = model.image_coordinates()
+        for a,c in zip(model.atom,coords):
+            for x,y in zip(a.coord,c):
+                self.assertAlmostEqual(x,y)
+        model.atom[nat].visible.append(0)
+        model.atom[nat].coord[0] = 99.0
+        self.assertEqual(model.atom[0].visible,[1])
+        self.assertEqual(model.primitive_atom[0].visible,[1])
+        self.assertNotEqual(model.atom[0].coord[0],99.0)
+        self.assertNotEqual(model.primitive_atom[0].coord[0],99.0)
+
+    def testExtendBonds(self):
+        """Bonds generated by extend match a search over the extended block"""
+
+        from interfaces.filepunch import PunchIO
+        r = PunchIO()
+        model = r.GetObjects(filepath=gui_path+os.sep+'examples'+os.sep+'sodalite.c')[0]
+        model.connect()
+        self.assertTrue(len(model.image_bond) > len(model.bond))
+        model.extend(0,1,0,1,0,1)
+        new = [ b.index for b in model.bond ]
+        model.connect()
+        old = [ b.index for b in model.bond ]
+        new.sort()
+        old.sort()
+        self.assertEqual(new,old)
+
+    def testExtendStaleBonds(self):
+        """Periodic bonds are not used once the cell contents change"""
+
+        from interfaces.filepunch import PunchIO
+        r = PunchIO()
+        model = r.GetObjects(filepath=gui_path+os.sep+'examples'+os.sep+'sodalite.c')[0]
+        model.connect()
+        self.assertTrue(model.image_bonds_current(1.0,0.5))
+        self.assertFalse(model.image_bonds_current(1.1,0.5))
+        model.atom[0].coord = [ x + 0.5 for x in model.atom[0].coord ]
+        self.assertFalse(model.image_bonds_current())
+        model.connect()
+        model.delete_atom(len(model.atom)-1)
+        model.extend(0,1,0,1,0,1)
+        self.assertFalse(model.__dict__.has_key('image_bond'))
+        self.assertEqual(len(model.bond),0)
+
+    def testConnect(self):
+        """Cell-list connect finds the same bonds as the box search"""
+
+        from interfaces.filepunch import PunchIO
+        r = PunchIO()
+        model = r.GetObjects(filepath=gui_path+os.sep+'examples'+os.sep+'caffeine.pun')[0]
+        model.connect()
+        new = [ b.index for b in model.bond ]
+        model.connect_boxes()
+        old = [ b.index for b in model.bond ]
+        new.sort()
+        old.sort()
+        self.assertEqual(new,old)
+        self.assertEqual(25,len(new))
+
 
 def testMe():
     """Return a unittest test suite with all the testcases that should be run by the main 
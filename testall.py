@@ -56,6 +56,30 @@ import objects.zmatrix
 testsuite.addTests(objects.zmatrix.testMe())
 import objects.am1
 testsuite.addTests(objects.am1.testMe())
+import objects.neighbour
+testsuite.addTests(objects.neighbour.testMe())
+import objects.symdet
+testsuite.addTests(objects.symdet.testMe())
+import objects.atomstore
+testsuite.addTests(objects.atomstore.testMe())
+import objects.field
+testsuite.addTests(objects.field.testMe())
+import objects.trajectory
+testsuite.addTests(objects.trajectory.testMe())
+import objects.vibfreq
+testsuite.addTests(objects.vibfreq.testMe())
+import objects.isocache
+testsuite.addTests(objects.isocache.testMe())
+import objects.wavefunction
+testsuite.addTests(objects.wavefunction.testMe())
+
+#
+# viewer
+#
+import viewer.lod
+testsuite.addTests(viewer.lod.testMe())
+import viewer.offscreen
+testsuite.addTests(viewer.offscreen.testMe())
 
 #
 # jobmanager
@@ -64,6 +88,12 @@ import jobmanager.job
 testsuite.addTests(jobmanager.job.testMe())
 import jobmanager.ccp1gui_subprocess
 testsuite.addTests(jobmanager.ccp1gui_subprocess.testMe())
+import jobmanager.scheduler
+testsuite.addTests(jobmanager.scheduler.testMe())
+import jobmanager.processloop
+testsuite.addTests(jobmanager.processloop.testMe())
+import jobmanager.resultcache
+testsuite.addTests(jobmanager.resultcache.testMe())
 
 #
 # interfaces
@@ -71,6 +101,9 @@ testsuite.addTests(jobmanager.ccp1gui_subprocess.testMe())
 import interfaces.am1calc
 testsuite.addTests(interfaces.am1calc.testMe())
 
+import interfaces.batch
+testsuite.addTests(interfaces.batch.testMe())
+
 import interfaces.charmm
 testsuite.addTests(interfaces.charmm.testMe())
 
@@ -83,15 +116,24 @@ testsuite.addTests(interfaces.chemshell.testMe())
 import interfaces.dalton
 testsuite.addTests(interfaces.dalton.testMe())
 
+import interfaces.dl_poly
+testsuite.addTests(interfaces.dl_poly.testMe())
+
 import interfaces.fileio
 testsuite.addTests(interfaces.fileio.testMe())
 
+import interfaces.filemolden
+testsuite.addTests(interfaces.filemolden.testMe())
+
 import interfaces.filepunch
 testsuite.addTests(interfaces.filepunch.testMe())
 
 import interfaces.gamessukio
 testsuite.addTests(interfaces.gamessukio.testMe())
 
+import interfaces.linedispatch
+testsuite.addTests(interfaces.linedispatch.testMe())
+
 import interfaces.mndo
 # Poke root Tk instance into mndo module
 interfaces.mndo.tkroot=tkroot
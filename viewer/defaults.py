@@ -53,6 +53,12 @@ class Defaults:
         self.defaults['mol_cylinder_specular_power'] = 10
         # Visualiser defaults
         self.defaults['label_type']  =  0
+        self.defaults['glyph_atom_count']  =  10000
+        self.defaults['lod_frame_time']  =  0.05
+        # Molecules read with more atoms than this use array storage (see objects/atomstore.py)
+        self.defaults['array_atom_count']  =  10000
+        # Processes used to compute orbitals on grids (see objects/wavefunction.py)
+        self.defaults['wavefunction_processes']  =  1
         # Executable, script and directory locations
         self.defaults['am1'] = None
         self.defaults['chemsh_script_dir'] = None
@@ -65,6 +71,11 @@ class Defaults:
         # Use Paul's quick images save widget
         self.defaults['save_image_dialog_quick'] = False
         self.defaults['user_path'] = None
+        # Cache of calculation results: directory (None for ~/.ccp1gui_cache)
+        # and size limit in MB
+        self.defaults['result_cache'] = 1
+        self.defaults['result_cache_dir'] = None
+        self.defaults['result_cache_size'] = 500
 
 
     def read_from_file(self):
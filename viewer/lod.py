@@ -0,0 +1,219 @@
+#
+#    This file is part of the CCP1 Graphical User Interface (ccp1gui)
+#
+#   (C) 2002-2007 CCLRC Daresbury Laboratory
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+"""Level of detail control for interactive rendering.
+
+While the user rotates, pans or zooms the view, the render widget
+(vtkTkRenderWidgetCCP1GUI) tells an LODManager when the interaction
+starts and stops and how long each frame took. If a frame at full
+detail takes longer than the target frame time the manager lowers
+the level of detail of all the images for the interaction, and goes
+one level further if that is still too slow. Full detail is restored
+when the interaction stops.
+
+Each visualiser keeps a DetailSettings object (see detail_settings)
+listing what to change at each level, eg:
+
+    d = viewer.lod.detail_settings(self)
+    d.add(sphere.SetThetaResolution, 16, 4)
+    d.add(label_actor.SetVisibility, 1, 0)
+
+Level 0 is full detail, level 1 low resolution glyphs, decimated
+surfaces and no labels, level 2 (where it applies) draws spheres as
+points.
+
+The measured frame times are kept in LODManager.frame_times and
+LODManager.summary() reports them by level, to help with choosing
+the target (lod_frame_time in ccp1guirc, 0 turns the level of detail
+control off).
+"""
+
+import unittest
+
+class DetailSettings:
+    """The changes to make to draw a visualiser's images at lower detail
+
+    Each entry is a function and the argument to call it with at each
+    level of detail, the last one being used for all higher levels.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.level = 0
+
+    def add(self,setter,*values):
+        self.entries.append((setter,values))
+
+    def set_level(self,level):
+        if level == self.level:
+            return
+        for setter,values in self.entries:
+            setter(values[min(level,len(values)-1)])
+        self.level = level
+
+    def clear(self):
+        """Forget the entries (when the images are deleted)"""
+        self.entries = []
+        self.level = 0
+
+def detail_settings(vis):
+    """Return the DetailSettings of a visualiser, creating it if needed"""
+    try:
+        return vis.detail_settings
+    except AttributeError:
+        vis.detail_settings = DetailSettings()
+        return vis.detail_settings
+
+
+class LODManager:
+    """Choose the level of detail during interaction from the frame times
+
+    apply(level) is called to change the level of detail of all the
+    images. target is the frame time (seconds) to aim for.
+    """
+
+    def __init__(self,apply,target=0.05,max_level=2,history=200):
+        self.apply = apply
+        self.target = target
+        self.max_level = max_level
+        self.history = history
+        self.level = 0
+        self.interacting = 0
+        # time for the last frame drawn at full detail
+        self.full_time = None
+        # (level, interacting, seconds) for the most recent frames
+        self.frame_times = []
+        self.debug = 0
+
+    def start(self):
+        """The user has started to interact with the view"""
+        self.interacting = 1
+        if self.full_time is not None and self.full_time > self.target:
+            self.set_level(1)
+
+    def stop(self):
+        """The interaction has stopped, returns 1 if the detail has been
+        restored (so a new frame is needed)"""
+        self.interacting = 0
+        if self.level:
+            self.set_level(0)
+            return 1
+        return 0
+
+    def rendered(self,seconds):
+        """Record the time taken to draw a frame"""
+        self.frame_times.append((self.level,self.interacting,seconds))
+        if len(self.frame_times) > self.history:
+            del self.frame_times[0]
+        if self.debug:
+            print 'frame level %d interacting %d %.4fs' % (self.level,self.interacting,seconds)
+
+        if self.level == 0:
+            self.full_time = seconds
+        if not self.interacting:
+            return
+        if seconds > self.target and self.level < self.max_level:
+            self.set_level(self.level+1)
+        elif seconds < 0.25*self.target and self.level > 1:
+            # well within the target, try the next level up
+            self.set_level(self.level-1)
+
+    def set_level(self,level):
+        if level != self.level:
+            self.level = level
+            self.apply(level)
+
+    def get_frame_times(self,level=None):
+        """Return the recorded frame times (seconds), for one level if given"""
+        return [ t for l,i,t in self.frame_times if level is None or l == level ]
+
+    def summary(self):
+        """Return a string with the mean and maximum frame time at each level"""
+        lines = [ 'target frame time %.4fs' % self.target ]
+        for level in range(self.max_level+1):
+            times = self.get_frame_times(level)
+            if times:
+                lines.append('level %d: %4d frames mean %.4fs max %.4fs' %
+                             (level,len(times),sum(times)/len(times),max(times)))
+        return '\n'.join(lines)
+
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+class testLOD(unittest.TestCase):
+
+    def setUp(self):
+        self.applied = []
+        self.lod = LODManager(self.applied.append,target=0.05)
+
+    def testFastScene(self):
+        """Nothing changes if the frames are within the target"""
+        self.lod.rendered(0.01)
+        self.lod.start()
+        for i in range(5):
+            self.lod.rendered(0.02)
+        self.assertEqual(self.lod.stop(),0)
+        self.assertEqual(self.applied,[])
+
+    def testSlowScene(self):
+        self.lod.rendered(0.2)
+        self.lod.start()
+        self.assertEqual(self.applied,[1])
+        # still too slow so go further
+        self.lod.rendered(0.08)
+        self.assertEqual(self.applied,[1,2])
+        self.lod.rendered(0.03)
+        self.assertEqual(self.lod.level,2)
+        self.assertEqual(self.lod.stop(),1)
+        self.assertEqual(self.applied,[1,2,0])
+        self.lod.rendered(0.2)
+        self.assertEqual(self.lod.get_frame_times(1),[0.08])
+        self.assertEqual(self.lod.get_frame_times(2),[0.03])
+        self.assertEqual(self.lod.get_frame_times(0),[0.2,0.2])
+        self.assertEqual(self.lod.full_time,0.2)
+        self.assertTrue(self.lod.summary().find('level 2:    1 frames') >= 0)
+
+    def testDetailSettings(self):
+        values = []
+        class Vis:
+            pass
+        vis = Vis()
+        d = detail_settings(vis)
+        self.assertTrue(detail_settings(vis) is d)
+        d.add(values.append,16,4)
+        d.add(values.append,'surface','low','points')
+        d.set_level(2)
+        self.assertEqual(values,[4,'points'])
+        d.set_level(0)
+        self.assertEqual(values,[4,'points',16,'surface'])
+
+def testMe():
+    """Return a unittest test suite with all the testcases that should be run by the main
+    gui testing framework."""
+
+    return  unittest.TestLoader().loadTestsFromTestCase(testLOD)
+
+if __name__ == "__main__":
+    unittest.main()
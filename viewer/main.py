@@ -144,6 +144,7 @@ from interfaces.dalton import DALTONCalc
 #from interfaces.charmm import *
 from interfaces.smeagol import SMEAGOLCalc
 import interfaces.am1calc
+import interfaces.filepunch
 
 import viewer.selections2
 
@@ -3357,7 +3358,7 @@ you would like to extract the frame from."""
         for v in visl:
             if self.debug:
                 print 'update vis'
-            v.Build()
+            v.Update()
 
     def delete_callback(self,object,key=None):
         """Helper function to remove a callback from the table
@@ -3660,8 +3661,14 @@ you would like to extract the frame from."""
 
         for model in models:
             model.extend(minx,maxx,miny,maxy,minz,maxz)
-            self.connect_model(model)
-            # update_from_model skipped as there is a call at end of connect_model
+            # The bonds of the block are generated by extend from the periodic
+            # bonds of the primitive cell if these used the current parameters
+            if hasattr(model,'image_bonds_current') and \
+                   model.image_bonds_current(self.conn_scale,self.conn_toler):
+                self.update_from_object(model)
+            else:
+                self.connect_model(model)
+                # update_from_model skipped as there is a call at end of connect_model
 
     def delete_obj(self,model0,all=0):
         """Delete the model and all it representations
@@ -3893,7 +3900,7 @@ you would like to extract the frame from."""
     def edit_grid(self,i):
         """ Open a grid editor """
 
-        if i.data:
+        if i.has_data():
             if not self.query("This will trash the data, Proceed?"):
                 return
 
@@ -4292,10 +4299,10 @@ you would like to extract the frame from."""
         words = string.split(name,'.')
         root = words[0]
 
-        p = PunchReader()
+        p = interfaces.filepunch.PunchIO()
 
-        p.scan(file)
-        for o in p.objects:
+        p.follow(file)
+        for o in p.GetObjects(filepath=file):
 
             myclass=o.GetClass()
             o.name = self.make_unique_name(root,o.title)
@@ -4322,7 +4329,6 @@ you would like to extract the frame from."""
         self.watch_obj = o
         self.watch_reader = p
         self.watch_file=file
-        self.mtime=os.stat(self.watch_file)[stat.ST_MTIME]
 
         try:
             self.watcher.start()
@@ -4349,11 +4355,8 @@ you would like to extract the frame from."""
                 print 'empty'
                 pass
 
-        mtime = os.stat(self.watch_file)[stat.ST_MTIME]
-        #print 'mtime',mtime
-        if mtime != self.mtime:
-            self.watch_reader.rescan(self.watch_file,object=self.watch_obj)
-            self.mtime = mtime
+        # Only the blocks appended since the last call are read
+        if self.watch_reader.update(object=self.watch_obj):
             return 2
         else:
             return 0
@@ -4371,6 +4374,7 @@ you would like to extract the frame from."""
         """
         Handle all the messages currently in the queue (if any).
         """
+        changed = 0
         while self.queue1.qsize():
             try:
                 msg = self.queue1.get(0)
@@ -4385,12 +4389,16 @@ you would like to extract the frame from."""
                     pass
                 elif msg == 2:
                     # The file has changed
-                    self.update_from_object(self.watch_obj)
+                    changed = 1
 
             except Queue.Empty:
                 print 'empty'
                 pass
 
+        # Redraw once however many updates have arrived
+        if changed:
+            self.update_from_object(self.watch_obj)
+
     def atom_info(self,mol,i):
         print 'mol: ',mol.title
         a = mol.atom[i]
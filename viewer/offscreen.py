@@ -0,0 +1,529 @@
+#
+#    This file is part of the CCP1 Graphical User Interface (ccp1gui)
+#
+#   (C) 2002-2007 CCLRC Daresbury Laboratory
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+"""Render images and movies without the GUI or a display.
+
+An OffscreenRenderer draws into an offscreen vtk render window, so
+it can be run in batch on a compute node without X. The frames come
+from a file read with the usual readers (see interfaces/getfileio.py):
+
+  - a structure sequence (eg a DL_POLY HISTORY file or an optimisation)
+    gives a frame for each structure,
+  - a file holding fields (eg a GAMESS-UK punchfile with orbitals) gives
+    a frame for each field, drawn as +/- isosurfaces with the molecule,
+  - otherwise each molecule in the file is a frame.
+
+The pipeline is built for the first frame and only the coordinates
+(trajectories) or the surfaces (fields) change from one frame to the
+next. The frames may be shared out over several processes, each with
+its own render window.
+
+The view is set by a ViewSpec, which can be read from a file of
+"name = value" lines as for the ccp1guirc file, eg:
+
+    width = 800
+    height = 600
+    azimuth = 30
+    elevation = 15
+    zoom = 1.2
+    contour = 0.03
+
+Usage:
+
+    python viewer/offscreen.py [-v viewfile] [-o prefix] [-f png|jpg|tiff]
+                               [-j processes] file
+"""
+
+import os,sys
+if __name__ == "__main__":
+    # Need to add the gui directory to the python path so
+    # that all the modules can be imported
+    gui_path = os.path.split(os.path.dirname( os.path.realpath( __file__ ) ))[0]
+    sys.path.append(gui_path)
+
+import getopt
+import time
+import unittest
+
+try:
+    import vtk
+except ImportError:
+    vtk = None
+
+import objects.neighbour
+from objects.periodic import colours,rvdw,rgb_min,rgb_max
+if vtk:
+    from viewer.vtkgraph import instance_polydata,instance_spheres,instance_sticks, \
+         field_to_vtk_array,field_to_vtk_points,vtk_numpy,numpy
+
+def isAvailable():
+    """Return True if we have vtk and so can render images"""
+    if vtk: return True
+    return False
+
+class ViewSpec:
+    """The size of the images and the view of the scene
+
+    The camera is reset to fit the first frame and then turned by
+    azimuth, elevation and roll (degrees) and zoomed; it stays the
+    same for all the frames of a movie.
+    """
+
+    def __init__(self,**kw):
+        self.width = 640
+        self.height = 480
+        self.background = (0,0,0)
+        self.azimuth = 0.0
+        self.elevation = 0.0
+        self.roll = 0.0
+        self.zoom = 1.0
+        # isosurface values are +contour and -contour
+        self.contour = 0.05
+        self.plus_rgb = (255,0,0)
+        self.minus_rgb = (0,0,255)
+        self.opacity = 1.0
+        self.sphere_scale = 0.4
+        self.sphere_resolution = 16
+        self.stick_radius = 0.1
+        self.format = 'png'
+        self.quality = 95
+        for key,value in kw.items():
+            self.set(key,value)
+
+    def set(self,key,value):
+        if not hasattr(self,key):
+            raise AttributeError("Unknown view setting: " + key)
+        setattr(self,key,value)
+
+    def parse(self,key,text):
+        """Convert text to a value for setting key, of the same type as
+        the default: a number, a string (quotes optional) or an RGB
+        triple such as (255,255,255) or 255,255,255"""
+        if not hasattr(self,key):
+            raise AttributeError("Unknown view setting: " + key)
+        default = getattr(self,key)
+        text = text.strip()
+        try:
+            if isinstance(default,tuple):
+                fields = text.strip('()[]').split(',')
+                value = tuple([ int(x) for x in fields if x.strip() ])
+                if len(value) != len(default):
+                    raise ValueError
+                return value
+            elif isinstance(default,int):
+                return int(text)
+            elif isinstance(default,float):
+                return float(text)
+            else:
+                if len(text) > 1 and text[0] == text[-1] and text[0] in '\'"':
+                    text = text[1:-1]
+                return text
+        except ValueError:
+            raise ValueError("Bad value for view setting %s: %s" % (key,text))
+
+    def read(self,filename):
+        """Read settings from a file of name = value lines"""
+        f = open(filename)
+        try:
+            for line in f.readlines():
+                line = line.split('#')[0].strip()
+                if not line:
+                    continue
+                key,value = line.split('=',1)
+                key = key.strip()
+                self.set(key,self.parse(key,value))
+        finally:
+            f.close()
+
+
+def read_frames(filepath):
+    """Read a file and return a FrameSource for it"""
+    import interfaces.getfileio
+    reader = interfaces.getfileio.GetFileIO().GetReader(filepath=filepath)
+    if not reader:
+        raise IOError("Cannot read file: %s" % filepath)
+    olist = reader.GetObjects(filepath=filepath)
+    return FrameSource(olist)
+
+
+class FrameSource:
+    """The frames of a movie made from the objects read from a file"""
+
+    def __init__(self,olist):
+        self.molecule = None
+        self.sequence = None
+        self.fields = []
+        molecules = []
+        for o in olist:
+            myclass = o.GetClass()
+            if myclass == 'ZmatrixSequence' and not self.sequence:
+                self.sequence = o
+            elif myclass == 'Zmatrix':
+                molecules.append(o)
+            elif myclass == 'Field' and len(o.dim) == 3 and o.ndd == 1:
+                self.fields.append(o)
+        if self.sequence:
+            self.molecule = self.sequence
+            self.molecules = []
+        else:
+            self.molecules = molecules
+            if molecules:
+                self.molecule = molecules[0]
+        if not self.molecule and not self.fields:
+            raise ValueError("No molecules or fields to draw")
+
+    def __len__(self):
+        if self.sequence:
+            return len(self.sequence.frames)
+        if self.fields:
+            return len(self.fields)
+        return len(self.molecules)
+
+    def show(self,renderer,i):
+        """Make renderer show frame i"""
+        if self.sequence:
+            renderer.set_coordinates(self.sequence.frame_coordinates(i))
+        elif self.fields:
+            renderer.set_field(self.fields[i])
+        else:
+            renderer.set_molecule(self.molecules[i])
+
+
+class OffscreenRenderer:
+    """Draw molecules and isosurfaces into an offscreen render window
+    and write images from it"""
+
+    def __init__(self,spec=None):
+        if spec is None:
+            spec = ViewSpec()
+        self.spec = spec
+        self.renderer = vtk.vtkRenderer()
+        r,g,b = spec.background
+        self.renderer.SetBackground(r/255.0,g/255.0,b/255.0)
+        self.window = vtk.vtkRenderWindow()
+        self.window.SetOffScreenRendering(1)
+        self.window.SetSize(spec.width,spec.height)
+        self.window.AddRenderer(self.renderer)
+
+        self.w2i = vtk.vtkWindowToImageFilter()
+        self.w2i.SetInput(self.window)
+        if spec.format == 'jpg':
+            self.writer = vtk.vtkJPEGWriter()
+            self.writer.SetQuality(int(spec.quality))
+        elif spec.format == 'tiff':
+            self.writer = vtk.vtkTIFFWriter()
+            self.writer.SetCompressionToNoCompression()
+        else:
+            self.writer = vtk.vtkPNGWriter()
+        self.writer.SetInput(self.w2i.GetOutput())
+
+        self.colour_table = vtk.vtkLookupTable()
+        self.colour_table.SetNumberOfColors(len(colours) + 1)
+        self.colour_table.Build()
+        for i in range(len(colours)):
+            r,g,b = colours[i]
+            self.colour_table.SetTableValue(i,r,g,b,1)
+
+        self.poly = None
+        self.molecule_actors = []
+        self.surface_actors = []
+        # numpy arrays shared with vtk
+        self.keep = []
+        self.camera_set = 0
+
+    def set_molecule(self,molecule):
+        """Draw molecule as spheres and sticks, replacing any other"""
+        for act in self.molecule_actors:
+            self.renderer.RemoveActor(act)
+        self.molecule_actors = []
+        self.keep = []
+        self.poly = None
+        if not molecule or not len(molecule.atom):
+            return
+
+        coords = []
+        numbers = []
+        for a in molecule.atom:
+            try:
+                z = a.get_number()
+            except Exception:
+                z = 0
+            coords.append(a.coord)
+            numbers.append(z)
+        radii = [ self.spec.sphere_scale * rvdw[z] for z in numbers ]
+        pairs = objects.neighbour.find_pairs(coords,objects.neighbour.covalent_radii(numbers))
+        self.poly = instance_polydata(coords,numbers,radii,pairs,self.keep)
+
+        spheres = instance_spheres(self.poly,self.spec.sphere_resolution)[0]
+        sticks = instance_sticks(self.poly,self.spec.stick_radius,8)
+        for source in [ spheres, sticks ]:
+            m = vtk.vtkPolyDataMapper()
+            m.SetInput(source.GetOutput())
+            m.SetLookupTable(self.colour_table)
+            m.SetScalarRange(rgb_min,rgb_max+1)
+            m.UseLookupTableScalarRangeOff()
+            act = vtk.vtkActor()
+            act.SetMapper(m)
+            self.renderer.AddActor(act)
+            self.molecule_actors.append(act)
+
+    def set_coordinates(self,coords):
+        """Move the atoms of the molecule being drawn to coords"""
+        points = self.poly.GetPoints()
+        if vtk_numpy:
+            xyz = vtk_numpy.vtk_to_numpy(points.GetData())
+            xyz[:] = numpy.asarray(coords).reshape((-1,3))
+        else:
+            for i in range(len(coords)):
+                x,y,z = coords[i]
+                points.SetPoint(i,x,y,z)
+        points.Modified()
+        self.poly.Modified()
+
+    def set_field(self,field):
+        """Draw the +/- contour isosurfaces of field, replacing any others"""
+        for act in self.surface_actors:
+            self.renderer.RemoveActor(act)
+        self.surface_actors = []
+
+        grid = vtk.vtkStructuredGrid()
+        nx,ny,nz = field.dim
+        grid.SetDimensions(nx,ny,nz)
+        self.field_refs = []
+        grid.GetPointData().SetScalars(field_to_vtk_array(field,self.field_refs))
+        grid.SetPoints(field_to_vtk_points(field,self.field_refs))
+
+        for value,rgb in [ (self.spec.contour,self.spec.plus_rgb),
+                           (-self.spec.contour,self.spec.minus_rgb) ]:
+            s = vtk.vtkContourFilter()
+            s.SetInput(grid)
+            s.SetValue(0,value)
+            s.SetComputeNormals(1)
+            n = vtk.vtkPolyDataNormals()
+            n.SetInput(s.GetOutput())
+            n.SetFeatureAngle(89)
+            m = vtk.vtkPolyDataMapper()
+            m.SetInput(n.GetOutput())
+            m.ScalarVisibilityOff()
+            act = vtk.vtkActor()
+            act.SetMapper(m)
+            r,g,b = rgb
+            act.GetProperty().SetColor(r/255.0,g/255.0,b/255.0)
+            act.GetProperty().SetOpacity(self.spec.opacity)
+            self.renderer.AddActor(act)
+            self.surface_actors.append(act)
+
+    def set_camera(self):
+        """Fit the camera to what is drawn and apply the ViewSpec"""
+        self.renderer.ResetCamera()
+        camera = self.renderer.GetActiveCamera()
+        camera.Azimuth(self.spec.azimuth)
+        camera.Elevation(self.spec.elevation)
+        camera.OrthogonalizeViewUp()
+        camera.Roll(self.spec.roll)
+        camera.Zoom(self.spec.zoom)
+        self.renderer.ResetCameraClippingRange()
+        self.camera_set = 1
+
+    def render(self):
+        if not self.camera_set:
+            self.set_camera()
+        self.window.Render()
+
+    def write(self,filename):
+        """Render and save the image to filename"""
+        self.render()
+        self.w2i.Modified()
+        self.writer.SetFileName(filename)
+        self.writer.Write()
+
+
+def frame_filename(prefix,i,format):
+    return '%s.%04d.%s' % (prefix,i,format)
+
+def render_frames(source,spec,prefix,frames=None,debug=0):
+    """Write an image for each of frames (indices, default all) of a
+    FrameSource, returns the list of file names"""
+    if frames is None:
+        frames = range(len(source))
+    r = OffscreenRenderer(spec)
+    r.set_molecule(source.molecule)
+    # The camera is the same whichever frames we are drawing
+    source.show(r,0)
+    r.set_camera()
+
+    files = []
+    start = time.time()
+    for i in frames:
+        source.show(r,i)
+        filename = frame_filename(prefix,i,spec.format)
+        r.write(filename)
+        files.append(filename)
+    if debug and len(frames):
+        print 'offscreen: %d frames %.3fs per frame' % (len(frames),(time.time()-start)/len(frames))
+    return files
+
+def _render_file_frames(args):
+    """Render some of the frames of a file (in a worker process)"""
+    filepath,spec,prefix,frames = args
+    return render_frames(read_frames(filepath),spec,prefix,frames=frames)
+
+def render_file(filepath,spec=None,prefix=None,processes=1,debug=0):
+    """Write the frames of a file as a sequence of images, optionally
+    sharing them out over a number of processes. Each process reads
+    the file and has its own render window. Returns the file names."""
+    if spec is None:
+        spec = ViewSpec()
+    if prefix is None:
+        prefix = os.path.splitext(filepath)[0]
+
+    source = read_frames(filepath)
+    nframes = len(source)
+    if processes <= 1 or nframes < 2:
+        return render_frames(source,spec,prefix,debug=debug)
+
+    import multiprocessing
+    processes = min(processes,nframes)
+    # Interleave the frames so each process gets a similar amount of work
+    jobs = [ (filepath,spec,prefix,range(p,nframes,processes)) for p in range(processes) ]
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_render_file_frames,jobs)
+    finally:
+        pool.close()
+        pool.join()
+    files = []
+    for r in results:
+        files = files + r
+    files.sort()
+    return files
+
+
+##########################################################
+#
+#
+# Unittesting stuff goes here
+#
+#
+##########################################################
+
+class testViewSpec(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def testRead(self):
+        filename = os.path.join(self.dir,'view')
+        f = open(filename,'w')
+        f.write('# a view\nwidth = 200\nbackground = (255,255,255)  # white\n'
+                'zoom = 2\nformat = "jpg"\nminus_rgb = 0, 255, 0\n')
+        f.close()
+        spec = ViewSpec(height=100)
+        spec.read(filename)
+        self.assertEqual((spec.width,spec.height,spec.background),(200,100,(255,255,255)))
+        self.assertEqual((spec.zoom,spec.format,spec.minus_rgb),(2.0,'jpg',(0,255,0)))
+        self.assertRaises(AttributeError,spec.set,'colour',1)
+
+    def testBadValues(self):
+        spec = ViewSpec()
+        self.assertRaises(ValueError,spec.parse,'width','__import__("os")')
+        self.assertRaises(ValueError,spec.parse,'background','(1,2)')
+        self.assertRaises(AttributeError,spec.parse,'colour','1')
+
+
+class testOffscreen(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def makeSequence(self,nframes):
+        from objects.zmatrix import Zmatrix,ZAtom,ZmatrixSequence
+        seq = ZmatrixSequence()
+        for f in range(nframes):
+            z = Zmatrix()
+            for symbol,coord in [ ('O',[0.0,0.0,0.1*f]), ('H',[0.76,0.0,0.6]), ('H',[-0.76,0.0,0.6]) ]:
+                a = ZAtom()
+                a.symbol = symbol
+                a.name = symbol
+                a.coord = coord
+                z.add_atom(a)
+            seq.add_molecule(z)
+        return seq
+
+    def testTrajectory(self):
+        source = FrameSource([self.makeSequence(3)])
+        self.assertEqual(len(source),3)
+        spec = ViewSpec(width=64,height=48)
+        files = render_frames(source,spec,os.path.join(self.dir,'water'))
+        self.assertEqual(len(files),3)
+        for f in files:
+            self.assertTrue(os.path.getsize(f) > 0)
+
+def testMe():
+    """Return a unittest test suite with all the testcases that should be run by the main
+    gui testing framework."""
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(testViewSpec)
+    if isAvailable():
+        suite.addTests(unittest.TestLoader().loadTestsFromTestCase(testOffscreen))
+    return suite
+
+def usage():
+    print __doc__
+
+if __name__ == "__main__":
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hv:o:f:j:", ["help","view=","output=","format=","processes="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(1)
+
+    spec = ViewSpec()
+    prefix = None
+    processes = 1
+    for o, a in opts:
+        if o in ("-h","--help"):
+            usage()
+            sys.exit(0)
+        elif o in ("-v","--view"):
+            spec.read(a)
+        elif o in ("-o","--output"):
+            prefix = a
+        elif o in ("-f","--format"):
+            spec.format = a
+        elif o in ("-j","--processes"):
+            processes = int(a)
+
+    if len(args) != 1:
+        usage()
+        sys.exit(1)
+
+    files = render_file(args[0],spec=spec,prefix=prefix,processes=processes,debug=1)
+    print 'wrote %d images' % len(files)
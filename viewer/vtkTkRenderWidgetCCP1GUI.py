@@ -1,4 +1,5 @@
 import sys
+import time
 import vtk
 import vtk.tk.vtkTkRenderWidget
 
@@ -47,6 +48,10 @@ class vtkTkRenderWidgetCCP1GUI(vtk.tk.vtkTkRenderWidget.vtkTkRenderWidget):
 
         self.debug=0
 
+        # An LODManager (see viewer/lod.py) to be told about interaction
+        # and frame times, set by the graph
+        self.lod = None
+
         # Override the default bindings with some of our own
         self.UpdateBindings()
 
@@ -91,6 +96,8 @@ class vtkTkRenderWidgetCCP1GUI(vtk.tk.vtkTkRenderWidget.vtkTkRenderWidget):
         self.old_y = e.y
         self.picked_mol = None
         self.UpdateRenderer(e.x,e.y)
+        if self.lod:
+            self.lod.start()
 
     def EndMotion(self,e,but):
         
@@ -112,6 +119,10 @@ class vtkTkRenderWidgetCCP1GUI(vtk.tk.vtkTkRenderWidget.vtkTkRenderWidget):
             x=e.x
             y=e.y
             
+        # Back to full detail for the final frame
+        if self.lod:
+            self.lod.stop()
+
         if x == self.old_x and y == self.old_y:
             self.PickActor(x,y,but)
                 
@@ -227,6 +238,13 @@ class vtkTkRenderWidgetCCP1GUI(vtk.tk.vtkTkRenderWidget.vtkTkRenderWidget):
             
         self.Render()
 
+    def Render(self):
+        """Render as the base class, timing the frame for the LODManager"""
+        start = time.time()
+        vtk.tk.vtkTkRenderWidget.vtkTkRenderWidget.Render(self)
+        if self.lod:
+            self.lod.rendered(time.time() - start)
+
     def firstrenderer(self):
         renderers = self._RenderWindow.GetRenderers()
         numRenderers = renderers.GetNumberOfItems()
@@ -32,17 +32,173 @@ import math
 import vtk
 import viewer.vtkTkRenderWidgetCCP1GUI
 import viewer.main
+import viewer.lod
 import generic.visualiser
 import objects.vector
 import objects.numeric
+import objects.isocache
 
 from objects.periodic import colours,rcov,rvdw,rgb_min,rgb_max
 from viewer.debug import deb,trb
 from generic.graph import Graph
 from generic.colourmap import ColourMap
 
+try:
+    import numpy
+    import vtk.util.numpy_support as vtk_numpy
+except ImportError:
+    numpy = None
+    vtk_numpy = None
+
 mol_select_key=1
 
+# Isosurfaces that have been made, keyed by field, contour value and
+# options, so that returning to a contour level is immediate
+isosurface_cache = objects.isocache.LRUCache(128*1024*1024)
+
+
+def field_to_vtk_array(field,keep,vtk_type=None):
+    """Return a vtk array holding the data of a field (first index
+    varying fastest), sharing the memory of the numpy array where
+    possible. The numpy array is appended to keep, which must be held
+    by the caller as long as vtk uses the array.
+    If numpy is not available the values are copied one at a time.
+    """
+    if vtk_numpy:
+        data = field.get_vtk_ordered_data()
+        if field.ndd > 1:
+            data = data.reshape((-1,field.ndd))
+        keep.append(data)
+        if vtk_type is None:
+            return vtk_numpy.numpy_to_vtk(data,deep=0)
+        return vtk_numpy.numpy_to_vtk(data,deep=0,array_type=vtk_type)
+
+    data_array = vtk.vtkFloatArray()
+    data_array.SetNumberOfComponents(field.ndd)
+    n = len(field.data)
+    data_array.SetNumberOfValues(n)
+    for offset in range(n):
+        data_array.SetValue(offset,field.data[offset])
+    return data_array
+
+def field_to_vtk_points(field,keep):
+    """Return a vtkPoints object holding the grid points of a field,
+    generated from the origin and axes (see Field.get_grid_array)"""
+    points = vtk.vtkPoints()
+    if vtk_numpy:
+        pts = field.get_grid_array()
+        keep.append(pts)
+        points.SetData(vtk_numpy.numpy_to_vtk(pts,deep=0))
+        return points
+
+    grid = field.get_grid()
+    bigsize = len(grid)
+    points.SetNumberOfPoints(bigsize)
+    for offset in range(bigsize):
+        points.SetPoint(offset,grid[offset])
+    return points
+
+def instance_polydata(coords,numbers,radii,pairs,keep):
+    """Return vtkPolyData for drawing a whole molecule with glyphs
+    (spheres/sticks type 3). There is a point for each atom with
+    the atomic number as the active scalars (used for colouring
+    through the colour table) and a 'radius' array to scale the
+    spheres, and a line for each bond (pairs of point indices).
+    As for field_to_vtk_array, any numpy arrays shared with vtk are
+    appended to keep.
+    """
+    npts = len(numbers)
+    nbonds = len(pairs)
+    points = vtk.vtkPoints()
+    lines = vtk.vtkCellArray()
+    if vtk_numpy:
+        xyz = numpy.asarray(coords,dtype=numpy.float32).reshape((-1,3))
+        z = numpy.asarray(numbers,dtype=numpy.int32)
+        r = numpy.asarray(radii,dtype=numpy.float32)
+        # vtkIdType is 32 or 64 bit depending on how vtk was built
+        idtype = 'int%d' % (8*vtk.vtkIdTypeArray().GetDataTypeSize())
+        cells = numpy.empty((nbonds,3),dtype=idtype)
+        cells[:,0] = 2
+        cells[:,1:] = numpy.asarray(pairs).reshape((-1,2))
+        cells = cells.ravel()
+        keep.extend([xyz,z,r,cells])
+        points.SetData(vtk_numpy.numpy_to_vtk(xyz,deep=0))
+        zvals = vtk_numpy.numpy_to_vtk(z,deep=0,array_type=vtk.VTK_INT)
+        rvals = vtk_numpy.numpy_to_vtk(r,deep=0)
+        lines.SetCells(nbonds,vtk_numpy.numpy_to_vtkIdTypeArray(cells,deep=0))
+    else:
+        points.SetNumberOfPoints(npts)
+        zvals = vtk.vtkIntArray()
+        zvals.SetNumberOfTuples(npts)
+        rvals = vtk.vtkFloatArray()
+        rvals.SetNumberOfTuples(npts)
+        for i in range(npts):
+            x,y,zz = coords[i]
+            points.SetPoint(i,x,y,zz)
+            zvals.SetTuple1(i,numbers[i])
+            rvals.SetTuple1(i,radii[i])
+        lines.Allocate(nbonds,nbonds)
+        for i,j in pairs:
+            lines.InsertNextCell(2)
+            lines.InsertCellPoint(i)
+            lines.InsertCellPoint(j)
+
+    zvals.SetName('z')
+    rvals.SetName('radius')
+    poly = vtk.vtkPolyData()
+    poly.SetPoints(points)
+    poly.SetLines(lines)
+    poly.GetPointData().SetScalars(zvals)
+    poly.GetPointData().AddArray(rvals)
+    return poly
+
+def update_vtk_points(poly,atoms):
+    """Copy the coordinates of atoms into the points of poly, so that
+    everything drawn from poly moves without the pipeline being rebuilt"""
+    points = poly.GetPoints()
+    if vtk_numpy:
+        xyz = vtk_numpy.vtk_to_numpy(points.GetData())
+        xyz[:] = [ a.coord for a in atoms ]
+    else:
+        for i in range(len(atoms)):
+            c = atoms[i].coord
+            points.SetPoint(i,c[0],c[1],c[2])
+    points.Modified()
+    poly.Modified()
+
+def instance_spheres(poly,resolution):
+    """Return a vtkGlyph3D drawing a sphere for every point of poly
+    (see instance_polydata), scaled by the radius array and coloured
+    by the atomic number, and the vtkSphereSource it uses"""
+    s = vtk.vtkSphereSource()
+    s.SetRadius(1.0)
+    s.SetThetaResolution(resolution)
+    s.SetPhiResolution(resolution)
+    points = vtk.vtkDataObject.FIELD_ASSOCIATION_POINTS
+    g = vtk.vtkGlyph3D()
+    g.SetInput(poly)
+    g.SetSource(s.GetOutput())
+    # array 0 is used for scaling, array 3 for colouring
+    g.SetInputArrayToProcess(0,0,0,points,'radius')
+    g.SetInputArrayToProcess(3,0,0,points,'z')
+    g.SetScaleModeToScaleByScalar()
+    g.SetScaleFactor(1.0)
+    g.ClampingOff()
+    g.SetColorModeToColorByScalar()
+    # So that we can determine which atom was picked
+    g.GeneratePointIdsOn()
+    return g,s
+
+def instance_sticks(poly,radius,sides):
+    """Return a vtkTubeFilter drawing a cylinder for every bond of poly"""
+    t = vtk.vtkTubeFilter()
+    t.SetInput(poly)
+    t.SetNumberOfSides(sides)
+    t.SetCapping(0)
+    t.SetRadius(radius)
+    t.SetVaryRadius(0)
+    return t
+
 
 def truncate_vec(tup,lim):
     len = tup[0]*tup[0] + tup[1]*tup[1] + tup[2]*tup[2]
@@ -77,6 +233,13 @@ class VtkGraph(viewer.main.TkMolView,Graph):
         self.line_type = 2
         self.label_type = 0
         self.stick_type = 2
+        # Above this number of atoms molecules are drawn with spheres
+        # and sticks of type 3 (a single glyph actor for each), 0 = never.
+        # Below it the build times hardly differ from type 2 (see benchmark)
+        self.glyph_atom_count = 10000
+        # Frame time (seconds) to aim for while rotating etc, the detail
+        # is reduced if it takes longer (see viewer/lod.py), 0 = never.
+        self.lod_frame_time = 0.05
         self.show_selection_by_dots = 1
         self.show_selection_by_colour = 1
         # Set stereo visualiser options.
@@ -172,6 +335,8 @@ class VtkGraph(viewer.main.TkMolView,Graph):
             
 
         self.pane.handlepick = self.mypick2
+        if self.lod_frame_time:
+            self.pane.lod = viewer.lod.LODManager(self.set_detail,target=self.lod_frame_time)
         self.picked_atomic_actor = 0
         self.picked_atom = None
         self.picked_mol = None
@@ -212,6 +377,18 @@ class VtkGraph(viewer.main.TkMolView,Graph):
     def fit_to_window(self):
         self.pane.ResetToFit(0,0)
 
+    def set_detail(self,level):
+        """Set the level of detail of all the images (0 = full detail)"""
+        for v in self.vis_list:
+            viewer.lod.detail_settings(v).set_level(level)
+
+    def print_frame_times(self):
+        """Report the frame times recorded by the LODManager"""
+        if self.pane.lod:
+            print self.pane.lod.summary()
+        else:
+            print 'Level of detail control is off (lod_frame_time)'
+
     def update(self):
         """Update the VTK images"""
 
@@ -359,12 +536,14 @@ class VtkGraph(viewer.main.TkMolView,Graph):
             self.picked_atomic_actor = 0
             atom = self.picked_atom
         else:
+            atom = None
             atomid=-1
-            if self.sphere_type==2:
+            picker=self.pane.GetPicker()
+            pointid=picker.GetPointId()
+            if self.sphere_type in (2,3) or \
+                   (self.glyph_atom_count and len(self.picked_mol.atom) > self.glyph_atom_count):
                 # Try and determine the atomid from the InputPointIds of the vtkGlyph3D
-                # currently this is only used with sphere_type=2
-                picker=self.pane.GetPicker()
-                pointid=picker.GetPointId()
+                # currently this is only used with sphere_type=2 and 3
                 p3ds = picker.GetProp3Ds()
                 n = p3ds.GetNumberOfItems()
                 if n> 0:
@@ -374,6 +553,8 @@ class VtkGraph(viewer.main.TkMolView,Graph):
                             polydata=p.GetMapper().GetInput()
                             points=polydata.GetPointData().GetArray("InputPointIds")
                             atomid = points.GetValue(pointid)
+                            if hasattr(p,'pick_atoms'):
+                                atom = p.pick_atoms[atomid]
 
             if atomid<0:
                 # This branch either if a sphere actor wasn't picked with sphere_type2 or
@@ -382,7 +563,8 @@ class VtkGraph(viewer.main.TkMolView,Graph):
 
             if self.debug:deb("mypick2 picked point: %d" % atomid)
 
-            atom = self.picked_mol.atom[atomid]
+            if atom is None:
+                atom = self.picked_mol.atom[atomid]
 
         #print 'Picked atom',atom.get_index()+ 1,'in ',self.picked_mol.title
         if but == 1:
@@ -515,6 +697,7 @@ class VtkVis:
         self._hide()
         self.alist = []
         self.alist2d = []
+        viewer.lod.detail_settings(self).clear()
 
 
 class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
@@ -584,6 +767,7 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
         # might not need to clear this on each pass, as it only needs to be cleared when
         # the molecule changes, but will do so for now
         self.molecule_polydata=None
+        self.instance_polydata=None
 
         self.molecule.reindex()
 
@@ -610,6 +794,8 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
         # 0  spheres with their own actors
         # 1  appendPolyData
         # 2  use glyph method (needs linetype=2)
+        # 3  glyph method with the polydata built from arrays and the
+        #    radius as a scalar (see _get_instance_polydata)
         self.sphere_type = self.graph.sphere_type
 
         # ---- Lines ------
@@ -626,8 +812,17 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
 
         # ---- Sticks ----------
         # 0 = individual vtkCylinderSource
+        # 2 = tube filter on the lines of the polydata
+        # 3 = tube filter (with spheres type 3)
         self.stick_type = self.graph.stick_type
 
+        # Use spheres and sticks of type 3 (a single glyph actor for
+        # all the atoms built directly from arrays) for large molecules
+        if self.graph.glyph_atom_count and \
+               len(self.molecule.atom) > self.graph.glyph_atom_count:
+            self.sphere_type = 3
+            self.stick_type = 3
+
         # ---- Contacts ----------
         # 2 = celldata array
         self.contact_type = 2
@@ -640,6 +835,8 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
                 self._build_sphere_type1()
             elif self.sphere_type == 2:
                 self._build_sphere_type2()
+            elif self.sphere_type == 3:
+                self._build_sphere_type3()
 
         # Labels
         if self.show_labels:
@@ -660,6 +857,8 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
                 self._build_sticks_type0()
             elif self.stick_type == 2:
                 self._build_sticks_type2()
+            elif self.stick_type == 3:
+                self._build_sticks_type3()
 
         # Contacts
         if self.show_contacts:
@@ -703,6 +902,10 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
         if self.debug_selection:
             print 'after build # sel acts=', len(self.selection_actors)
 
+        # what the images depend on apart from the coordinates
+        self.built_style = self._get_style()
+        self.built_topology = self._get_topology()
+
         # these are all zero as we start with no actors in the scene
         self.wire_visible    = 0
         self.sticks_visible  = 0
@@ -716,6 +919,77 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
         self.status = generic.visualiser.BUILT
 
 
+    def _get_style(self):
+        """Return the settings the images depend on"""
+        return (self.show_wire, self.show_spheres, self.show_sticks,
+                self.show_labels, self.show_contacts, self.show_cell,
+                self.sphere_scale, self.sphere_table, self.cyl_width,
+                self.colour_cyl, tuple(self.cyl_rgb), self.selection_key,
+                self.graph.sphere_type, self.graph.stick_type,
+                self.graph.line_type, self.graph.glyph_atom_count,
+                self.graph.mol_sphere_resolution,
+                self.graph.mol_cylinder_resolution,
+                len(self.molecule.atom), len(self.molecule.shell))
+
+    def _get_topology(self):
+        """Return the atomic symbols and the bonds (as pairs of atom
+        indices) of the molecule"""
+        symbols = []
+        bonds = []
+        for a in self.molecule.atom:
+            symbols.append(a.symbol)
+            i = a.get_index()
+            try:
+                c = a.conn
+            except AttributeError:
+                c = []
+            for t in c:
+                j = t.get_index()
+                if j > i:
+                    bonds.append((i,j))
+        return symbols, bonds
+
+    def _update_coords(self,coords_only=0):
+        """Move the existing images to the current atomic positions by
+        updating the points of the polydata they share.
+
+        This is possible for spheres and sticks of types 2 and 3 and
+        wire of type 2, as long as the atoms, bonds and the settings are
+        those the images were built with; if not 0 is returned and the
+        images must be rebuilt. If coords_only is set the caller
+        guarantees the atoms and bonds are the same.
+        """
+        if self.built_style != self._get_style():
+            return 0
+        if self.show_labels or self.show_contacts:
+            return 0
+        if self.show_spheres and self.sphere_type not in (2,3):
+            return 0
+        if self.show_sticks and self.stick_type not in (2,3):
+            return 0
+        if self.show_wire and self.line_type != 2:
+            return 0
+        if not coords_only and self.built_topology != self._get_topology():
+            return 0
+
+        if self.molecule_polydata:
+            update_vtk_points(self.molecule_polydata,self.molecule_atoms)
+        if self.instance_polydata:
+            update_vtk_points(self.instance_polydata,self.instance_atoms)
+
+        # the selection dots are cheap to recreate
+        if self.selection_actors:
+            for act in self.selection_actors:
+                self.graph.ren.RemoveActor(act)
+            self.selection_actors = []
+            for a in self.molecule.atom:
+                if a.selected:
+                    self.create_selection_actor(a)
+            self.selection_visible = 0
+
+        if self.debug: deb('moved images of '+str(self.molecule.title))
+        return 1
+
     def _get_molecule_polydata(self):
         """ Generate vtkPolyData with points corresponding to the atom positions, 
             lines to the bonds and vertices to any orphans.
@@ -770,6 +1044,8 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
             p.SetNumberOfPoints(np)
             bonds = []
             self.molecule.reindex()
+            # the atom (or shell) for each point, see _update_coords
+            self.molecule_atoms = []
 
             i=0
             np = 0
@@ -780,6 +1056,7 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
                     draw = 1
                 if draw:
                     p.SetPoint(np,a.coord[0], a.coord[1], a.coord[2])
+                    self.molecule_atoms.append(a)
                     try:
                         z = a.get_number()
                     except Exception:
@@ -823,6 +1100,7 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
                     draw = 1
                 if draw:
                     p.SetPoint(np,a.coord[0], a.coord[1], a.coord[2])
+                    self.molecule_atoms.append(a)
                     orphans.append(np)
                     zvals.SetTuple1(np,105)
 
@@ -873,6 +1151,8 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
         if not self.show_spheres and self.sphere_type==0:
             return
 
+        lod = viewer.lod.detail_settings(self)
+
         for a in self.molecule.atom:
 
             if self.selection_key:
@@ -894,6 +1174,8 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
 
                 s.SetThetaResolution(self.graph.mol_sphere_resolution)
                 s.SetPhiResolution(self.graph.mol_sphere_resolution)
+                lod.add(s.SetThetaResolution,self.graph.mol_sphere_resolution,4)
+                lod.add(s.SetPhiResolution,self.graph.mol_sphere_resolution,4)
 
                 if self.sphere_table == generic.visualiser.COV_RADII:
                     fac = 0.529177 * rcov[z] * self.sphere_scale
@@ -936,6 +1218,8 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
         if not self.show_spheres and self.sphere_type==1:
             return
 
+        lod = viewer.lod.detail_settings(self)
+
         app = vtk.vtkAppendPolyData()
         for a in self.molecule.atom:
             try:
@@ -949,6 +1233,8 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
 
             s.SetThetaResolution(self.graph.mol_sphere_resolution)
             s.SetPhiResolution(self.graph.mol_sphere_resolution)
+            lod.add(s.SetThetaResolution,self.graph.mol_sphere_resolution,4)
+            lod.add(s.SetPhiResolution,self.graph.mol_sphere_resolution,4)
 
             fac = rcov[z] * self.sphere_scale
             # to show cylinders....
@@ -988,6 +1274,11 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
         s.SetThetaResolution(self.graph.mol_sphere_resolution)
         s.SetPhiResolution(self.graph.mol_sphere_resolution)
 
+        # Low resolution spheres, then points, while rotating etc
+        lod = viewer.lod.detail_settings(self)
+        lod.add(s.SetThetaResolution,self.graph.mol_sphere_resolution,4)
+        lod.add(s.SetPhiResolution,self.graph.mol_sphere_resolution,4)
+
         g = vtk.vtkGlyph3D()
         g.SetInput(poly)
         g.SetSource(s.GetOutput())
@@ -1024,6 +1315,8 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
         b = tmp
         act.GetProperty().SetColor(r,g,b)
 
+        lod.add(act.GetProperty().SetRepresentation,vtk.VTK_SURFACE,vtk.VTK_SURFACE,vtk.VTK_POINTS)
+
         # Set mytype so that we can query this when we are picked (see mypick2)
         act.mytype="molsphere2"
 
@@ -1034,6 +1327,114 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
         self.sphere_actors.append(act)
 
 
+    def _get_instance_polydata(self):
+        """Generate the polydata used by spheres and sticks of type 3
+        (see instance_polydata). The arrays are filled in one go rather
+        than point by point as in _get_molecule_polydata, which makes
+        this the option for very large molecules. The points are the
+        atoms that are drawn followed by their shells."""
+
+        if self.instance_polydata:
+            return self.instance_polydata
+
+        if self.sphere_table == generic.visualiser.COV_RADII:
+            table = [ 0.529177 * r for r in rcov ]
+        else:
+            table = rvdw
+
+        coords = []
+        numbers = []
+        radii = []
+        point = {}
+        # the atom (or shell) for each point, see _update_coords
+        self.instance_atoms = []
+        # and the atom picked through each point, a shell picks its core
+        self.instance_pick_atoms = []
+        for a in self.molecule.atom:
+            if self.selection_key and not a.visible[self.selection_key]:
+                continue
+            point[a.get_index()] = len(coords)
+            self.instance_atoms.append(a)
+            self.instance_pick_atoms.append(a)
+            try:
+                z = a.get_number()
+            except Exception:
+                z = 0
+            coords.append(a.coord)
+            numbers.append(z)
+            radii.append(table[z] * self.sphere_scale)
+
+        pairs = []
+        for a in self.molecule.atom:
+            i = a.get_index()
+            if not point.has_key(i):
+                continue
+            try:
+                c = a.conn
+            except AttributeError:
+                c = []
+            for t in c:
+                j = t.get_index()
+                if j > i and point.has_key(j):
+                    pairs.append((point[i],point[j]))
+
+        for a in self.molecule.shell:
+            if self.selection_key and not a.linked_core.visible[self.selection_key]:
+                continue
+            self.instance_atoms.append(a)
+            self.instance_pick_atoms.append(a.linked_core)
+            coords.append(a.coord)
+            numbers.append(105)
+            # dummy radius for shells
+            radii.append(0.529177 * 0.5 * self.sphere_scale)
+
+        # The numpy arrays shared with vtk
+        self.vtk_numpy_refs = []
+        self.instance_polydata = instance_polydata(coords,numbers,radii,pairs,
+                                                   self.vtk_numpy_refs)
+        if self.debug: deb("made instance polydata with %d points %d lines" % (len(coords),len(pairs)))
+        return self.instance_polydata
+
+    def _build_sphere_type3(self):
+        """Build spheres of type 3, a single glyph actor for all the atoms"""
+
+        if not self.show_spheres and self.sphere_type==3:
+            return
+
+        poly = self._get_instance_polydata()
+        g,s = instance_spheres(poly,self.graph.mol_sphere_resolution)
+
+        m = vtk.vtkPolyDataMapper()
+        m.SetInput(g.GetOutput())
+        m.SetLookupTable(self.colour_table)
+        m.SetScalarRange(rgb_min,rgb_max+1)
+        m.SetScalarVisibility(1)
+        m.UseLookupTableScalarRangeOff()
+
+        act = vtk.vtkActor()
+        act.SetMapper(m)
+        act.GetProperty().SetDiffuse(self.graph.mol_sphere_diffuse)
+        act.GetProperty().SetAmbient(self.graph.mol_sphere_ambient)
+        act.GetProperty().SetSpecular(self.graph.mol_sphere_specular)
+        act.GetProperty().SetSpecularPower(self.graph.mol_sphere_specular_power)
+
+        # Low resolution spheres, then points, while rotating etc
+        lod = viewer.lod.detail_settings(self)
+        lod.add(s.SetThetaResolution,self.graph.mol_sphere_resolution,4)
+        lod.add(s.SetPhiResolution,self.graph.mol_sphere_resolution,4)
+        lod.add(act.GetProperty().SetRepresentation,vtk.VTK_SURFACE,vtk.VTK_SURFACE,vtk.VTK_POINTS)
+
+        # Picking works as for spheres of type 2 (see mypick2), but the
+        # points are only the atoms drawn so look the atom up here
+        act.mytype="molsphere2"
+        act.pick_atoms = self.instance_pick_atoms
+
+        act.AddObserver(
+            'PickEvent', \
+                lambda x,y,s=self,obj=self.molecule: s.graph.mypick1(obj,x,y) )
+
+        self.sphere_actors.append(act)
+
     def _build_labels(self):
         """Build the labels of types 0 and 1"""
 
@@ -1102,6 +1503,7 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
 
                     act = vtk.vtkFollower()
                     self.label_actors.append(act)
+                    viewer.lod.detail_settings(self).add(act.SetVisibility,1,0)
                     act.SetMapper(m)
 
                     red = self.label_rgb[0] / 255.0
@@ -1132,6 +1534,7 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
                     act = vtk.vtkTextActor()
                     act.ScaledTextOn()
                     self.label_actors.append(act)
+                    viewer.lod.detail_settings(self).add(act.SetVisibility,1,0)
                     act.SetMapper(m)
                     act.GetPositionCoordinate().SetCoordinateSystemToWorld();
 
@@ -1480,6 +1883,8 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
                         # of the corresponding actor
                         s.SetRadius(1.0)
                         s.SetResolution(self.graph.mol_cylinder_resolution)
+                        viewer.lod.detail_settings(self).add(s.SetResolution,
+                                                             self.graph.mol_cylinder_resolution,4)
                         m = vtk.vtkPolyDataMapper()
                         m.SetInput(s.GetOutput())
                         act = vtk.vtkActor()
@@ -1514,6 +1919,7 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
         Tube.SetInput(poly)
         Tube.SetNumberOfSides(16)
         Tube.SetCapping(0)
+        viewer.lod.detail_settings(self).add(Tube.SetNumberOfSides,16,4)
 
         fac = self.cyl_width
         Tube.SetRadius(fac)
@@ -1556,6 +1962,43 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
 
         self.stick_actors.append(act)
 
+    def _build_sticks_type3(self):
+        """Build sticks of type 3, a single tube filter for all the bonds"""
+
+        if not self.show_sticks and self.stick_type==3:
+            return
+
+        poly = self._get_instance_polydata()
+        t = instance_sticks(poly,self.cyl_width,self.graph.mol_cylinder_resolution)
+        viewer.lod.detail_settings(self).add(t.SetNumberOfSides,
+                                             self.graph.mol_cylinder_resolution,4)
+
+        m = vtk.vtkPolyDataMapper()
+        m.SetInput(t.GetOutput())
+
+        if self.colour_cyl:
+            m.UseLookupTableScalarRangeOff()
+            m.SetLookupTable(self.colour_table)
+            m.SetScalarRange(rgb_min,rgb_max+1)
+            red = green = blue = 1.0
+        else:
+            m.SetScalarVisibility(0)
+            red = self.cyl_rgb[0] / 255.0
+            green = self.cyl_rgb[1] / 255.0
+            blue = self.cyl_rgb[2] / 255.0
+
+        act = vtk.vtkActor()
+        act.SetMapper(m)
+        act.GetProperty().SetInterpolationToGouraud()
+        act.GetProperty().SetAmbient(self.graph.mol_cylinder_ambient)
+        act.GetProperty().SetDiffuse(self.graph.mol_cylinder_diffuse)
+        act.GetProperty().SetSpecular(self.graph.mol_cylinder_specular)
+        act.GetProperty().SetSpecularPower(self.graph.mol_cylinder_specular_power)
+        act.GetProperty().SetColor(red,green,blue)
+        act.PickableOff()
+
+        self.stick_actors.append(act)
+
     def _build_contacts(self):
         """Build contacts"""
 
@@ -1868,6 +2311,7 @@ class VtkMoleculeVisualiser(generic.visualiser.MoleculeVisualiser):
 
         # Reset dictionary for selection actors
         self.atom_to_selection_actors = {}
+        viewer.lod.detail_settings(self).clear()
 
         self.sphere_actors = []
         self.stick_actors = []
@@ -2330,37 +2774,15 @@ class VtkIsoSurf(VtkCmapVis):
             #
             bigsize = npts[0]*npts[1]*npts[2]
 
-            # Not clear if this test is right!!
-
-            if self.field.data:
-                data_array = vtk.vtkFloatArray()
-                data_array.SetNumberOfValues(bigsize)
-                offset = 0
-                for k in range(npts[2]):
-                    for j in range(npts[1]):
-                        for i in range(npts[0]):
-                            data_array.SetValue(offset,self.field.data[offset])
-                            offset = offset+1
+            # The numpy arrays shared with vtk
+            self.vtk_numpy_refs = []
 
+            if self.field.has_data():
+                data_array = field_to_vtk_array(self.field,self.vtk_numpy_refs)
                 #print 'set scalars'
                 self.data.GetPointData().SetScalars(data_array)
 
-            bigsize = npts[0]*npts[1]*npts[2]
-            points = vtk.vtkPoints()
-            points.SetNumberOfPoints(bigsize)
-            offset = 0
-            #print 'getting grid'
-            grid = self.field.get_grid()
-            #print 'grid done'
-
-            for k in range(npts[2]):
-                for j in range(npts[1]):
-                    for i in range(npts[0]):
-                        points.SetPoint(offset,grid[offset])
-                        offset = offset+1
-
-            #print 'setPoints'
-            self.data.SetPoints(points)
+            self.data.SetPoints(field_to_vtk_points(self.field,self.vtk_numpy_refs))
 
     def add_outline(self):
         #jmht
@@ -2391,32 +2813,29 @@ class VtkIsoSurf(VtkCmapVis):
         if self.colourer.cmap_by_object():
             cmap_obj = self.colourer.get_value('cmap_obj')
             # There is an additional field to colour by
-            data_array2 = vtk.vtkFloatArray()
-            npts = objects.vector.Vector(cmap_obj.dim[0],cmap_obj.dim[1],cmap_obj.dim[2])
-            bigsize = npts[0]*npts[1]*npts[2]
-            data_array2.SetNumberOfValues(bigsize)
-            offset=0
-            for i in range(npts[0]):
-                for j in range(npts[1]):
-                    for k in range(npts[2]):
-                        data_array2.SetValue(offset,cmap_obj.data[offset])
-                        offset = offset+1
+            try:
+                keep = self.vtk_numpy_refs
+            except AttributeError:
+                keep = self.vtk_numpy_refs = []
+            data_array2 = field_to_vtk_array(cmap_obj,keep)
             data_array2.SetName("MapScalar");
             self.data.GetPointData().AddArray(data_array2)
 
-        s = vtk.vtkContourFilter()
-        s.SetInput(self.data)
-        s.SetValue(0,contour)
-        s.SetComputeNormals(1)
-
-        n = vtk.vtkPolyDataNormals()
-        n.SetInput(s.GetOutput())
-        n.SetFeatureAngle(89)
+        surface = self.get_surface(contour)
 
         m = vtk.vtkPolyDataMapper()
         # Need to determine the default lut before it gets changed
         self.default_lut = m.GetLookupTable()
-        m.SetInput(n.GetOutput())
+        m.SetInput(surface)
+
+        # Draw a decimated surface while rotating etc, but not if it is
+        # coloured by another field as vtkQuadricClustering drops the
+        # point data (MapScalar)
+        if self.graph.lod_frame_time and not self.colourer.cmap_by_object():
+            d = vtk.vtkQuadricClustering()
+            d.SetInput(surface)
+            d.SetNumberOfDivisions(32,32,32)
+            viewer.lod.detail_settings(self).add(m.SetInput,surface,d.GetOutput())
 
         if self.colourer.cmap_by_object():
             m.ScalarVisibilityOn()
@@ -2438,6 +2857,87 @@ class VtkIsoSurf(VtkCmapVis):
                     
         self.alist.append(act)
 
+    def surface_key(self,contour):
+        """The key for the isosurface at contour in isosurface_cache"""
+        cmap = None
+        if self.colourer.cmap_by_object():
+            cmap = objects.isocache.field_key(self.colourer.get_value('cmap_obj'))
+        # the feature angle is the only smoothing option for now
+        return (objects.isocache.field_key(self.field),contour,cmap,89)
+
+    def get_surface(self,contour):
+        """Return the isosurface (polydata with normals) at contour,
+        from isosurface_cache if it has been made already"""
+        surface = isosurface_cache.get(self.surface_key(contour))
+        if surface is None:
+            surface = self.make_surface(contour)
+            # GetActualMemorySize is in kilobytes
+            isosurface_cache.put(self.surface_key(contour),surface,
+                                 surface.GetActualMemorySize()*1024)
+        return surface
+
+    def get_block_range(self):
+        """Return the objects.isocache.BlockRange for the field data,
+        or None if the whole grid has to be contoured"""
+        if not objects.isocache.isAvailable() or self.field.vtkdata:
+            return None
+        if len(self.field.dim) != 3 or self.field.ndd != 1 or not self.field.has_data():
+            return None
+        array = self.field.get_array()
+        key = objects.isocache.field_key(self.field)
+        if getattr(self,'block_range_key',None) != key:
+            self.block_range = objects.isocache.BlockRange(array)
+            self.block_range_key = key
+        return self.block_range
+
+    def make_surface(self,contour):
+        """Contour the data, only over the blocks of the grid whose
+        range of values includes contour if the field allows"""
+        block_range = self.get_block_range()
+        if block_range is None:
+            regions = None
+        else:
+            regions = block_range.regions(contour)
+            if not regions:
+                return vtk.vtkPolyData()
+
+        if regions is None:
+            s = vtk.vtkContourFilter()
+            s.SetInput(self.data)
+            s.SetValue(0,contour)
+            s.SetComputeNormals(1)
+            source = s.GetOutput()
+        else:
+            append = vtk.vtkAppendPolyData()
+            for voi in regions:
+                if self.data.IsA('vtkStructuredGrid'):
+                    e = vtk.vtkExtractGrid()
+                else:
+                    e = vtk.vtkExtractVOI()
+                e.SetInput(self.data)
+                e.SetVOI(*voi)
+                s = vtk.vtkContourFilter()
+                s.SetInput(e.GetOutput())
+                s.SetValue(0,contour)
+                s.SetComputeNormals(1)
+                append.AddInput(s.GetOutput())
+            source = append.GetOutput()
+            if len(regions) > 1:
+                # join up the pieces where the regions meet
+                c = vtk.vtkCleanPolyData()
+                c.SetInput(source)
+                source = c.GetOutput()
+
+        n = vtk.vtkPolyDataNormals()
+        n.SetInput(source)
+        n.SetFeatureAngle(89)
+        n.Update()
+
+        # Keep the result without the pipeline that made it
+        surface = vtk.vtkPolyData()
+        surface.ShallowCopy(n.GetOutput())
+        return surface
+
 
 class VtkVolVis:
     """A base class for the 3D volume visualisers, supporting
@@ -2518,12 +3018,22 @@ class VtkVolVis:
 
         bigsize = npts[0]*npts[1]*npts[2]
 
-        data_array = vtk.vtkUnsignedShortArray()
-        data_array.SetNumberOfValues(bigsize)
-
         #This now in a separate routine as also required by vtk
         self.volvis_set_mapping()
 
+        if vtk_numpy:
+            # Scale into the unsigned short range in one go
+            values = self.offset + self.sfac*field.get_vtk_ordered_data()
+            values = numpy.clip(values,0.0,32767.0).astype(numpy.uint16)
+            self.vtk_numpy_refs = [ values ]
+            data_array = vtk_numpy.numpy_to_vtk(values,deep=0,
+                                                array_type=vtk.VTK_UNSIGNED_SHORT)
+            data.GetPointData().SetScalars(data_array)
+            return
+
+        data_array = vtk.vtkUnsignedShortArray()
+        data_array.SetNumberOfValues(bigsize)
+
         ioff=0
         for i in range(npts[2]):
             for j in range(npts[1]):
@@ -2823,11 +3333,9 @@ class VtkIrVis(generic.visualiser.IrregularDataVisualiser,VtkCmapVis):
             poly.SetPoints(p)
             poly.SetVerts(v)
 
-            if self.field.data != None:
-                data_array = vtk.vtkFloatArray()
-                data_array.SetNumberOfValues(n)
-                for i in range(n):
-                    data_array.SetValue(i,self.field.data[i])
+            if self.field.data is not None:
+                self.vtk_numpy_refs = []
+                data_array = field_to_vtk_array(self.field,self.vtk_numpy_refs)
                 poly.GetPointData().SetScalars(data_array)
 
         m = vtk.vtkPolyDataMapper()
@@ -2887,25 +3395,14 @@ class VtkSlice(VtkCmapVis_):
 
         # Pack the data into a float array
         bigsize = npts[0]*npts[1]
-        data_array = vtk.vtkFloatArray()
-        data_array.SetNumberOfValues(bigsize)
-        offset = 0
-        if field.data:
-            for j in range(npts[1]):
-                for i in range(npts[0]):
-                    data_array.SetValue(offset,field.data[offset])
-                    offset = offset+1
+        self.vtk_numpy_refs = []
+        if field.has_data():
+            data_array = field_to_vtk_array(field,self.vtk_numpy_refs)
+        else:
+            data_array = vtk.vtkFloatArray()
+            data_array.SetNumberOfValues(bigsize)
         self.vtkgrid.GetPointData().SetScalars(data_array)
-        bigsize = npts[0]*npts[1]
-        points = vtk.vtkPoints()
-        points.SetNumberOfPoints(bigsize)
-        offset = 0
-        grid = field.get_grid()
-        for j in range(npts[1]):
-            for i in range(npts[0]):
-                points.SetPoint(offset,grid[offset])
-                offset = offset+1
-        self.vtkgrid.SetPoints(points)
+        self.vtkgrid.SetPoints(field_to_vtk_points(field,self.vtk_numpy_refs))
 
         # projected version for 2D window.
         # this is a vtkStructuredPoints (ie image) dataset
@@ -3268,36 +3765,13 @@ class VtkCutSliceVisualiser(generic.visualiser.CutSliceVisualiser,VtkSlice,VtkVi
             #
             # Pack the data into a float arrat
             bigsize = npts[0]*npts[1]*npts[2]
-            # Not clear if this test is right!!
-            if self.field.data:
-                data_array = vtk.vtkFloatArray()
-                data_array.SetNumberOfValues(bigsize)
-                offset = 0
-                for k in range(npts[2]):
-                    for j in range(npts[1]):
-                        for i in range(npts[0]):
-                            data_array.SetValue(offset,self.field.data[offset])
-                            offset = offset+1
-
+            self.vtk_numpy_refs3d = []
+            if self.field.has_data():
+                data_array = field_to_vtk_array(self.field,self.vtk_numpy_refs3d)
                 #print 'set scalars'
                 self.vtkgrid3d.GetPointData().SetScalars(data_array)
 
-            bigsize = npts[0]*npts[1]*npts[2]
-            points = vtk.vtkPoints()
-            points.SetNumberOfPoints(bigsize)
-            offset = 0
-            #print 'getting grid'
-            grid = self.field.get_grid()
-            #print 'grid done'
-
-            for k in range(npts[2]):
-                for j in range(npts[1]):
-                    for i in range(npts[0]):
-                        points.SetPoint(offset,grid[offset])
-                        offset = offset+1
-
-            #print 'setPoints'
-            self.vtkgrid3d.SetPoints(points)
+            self.vtkgrid3d.SetPoints(field_to_vtk_points(self.field,self.vtk_numpy_refs3d))
 
 
     def _build(self,object=None):
@@ -3507,21 +3981,8 @@ class VtkVectorVisualiser(generic.visualiser.VectorVisualiser,VtkSlice,VtkVis):
 
                 # Build points array
                 bigsize = npts[0]*npts[1]*npts[2]
-                points = vtk.vtkPoints()
-                points.SetNumberOfPoints(bigsize)
-                offset = 0
-                #print 'getting grid', field
-                grid = field.get_grid()
-                #    print 'grid done'
-
-                for k in range(npts[2]):
-                    for j in range(npts[1]):
-                        for i in range(npts[0]):
-                            points.SetPoint(offset,grid[offset])
-                            offset = offset+1
-
-                #print 'setPoints'
-                data.SetPoints(points)
+                self.vtk_numpy_refs = []
+                data.SetPoints(field_to_vtk_points(field,self.vtk_numpy_refs))
 
             except AttributeError:
 
@@ -3557,14 +4018,23 @@ class VtkVectorVisualiser(generic.visualiser.VectorVisualiser,VtkSlice,VtkVis):
 ##                 poly.SetPoints(p)
 ##                 poly.SetVerts(v)
                     
-            data_array = vtk.vtkFloatArray()
-            data_array.SetNumberOfComponents(3)
-            data_array.SetNumberOfTuples(bigsize)
+            if vtk_numpy:
+                # Truncate the vectors to unit length in one go
+                vecs = numpy.asarray(field.data,dtype=numpy.float64)[:3*bigsize].reshape((-1,3))
+                norm = numpy.sqrt((vecs*vecs).sum(axis=1))
+                fac = 1.0 / numpy.maximum(norm,1.0)
+                vecs = numpy.ascontiguousarray(vecs * fac[:,numpy.newaxis])
+                self.vtk_vector_refs = [ vecs ]
+                data_array = vtk_numpy.numpy_to_vtk(vecs,deep=0)
+            else:
+                data_array = vtk.vtkFloatArray()
+                data_array.SetNumberOfComponents(3)
+                data_array.SetNumberOfTuples(bigsize)
 
-            for offset in range(bigsize):
-                tup = [ field.data[3*offset],field.data[3*offset+1], field.data[3*offset+2]]
-                tup = truncate_vec(tup,1.0)
-                data_array.SetTuple3(offset,tup[0],tup[1],tup[2])
+                for offset in range(bigsize):
+                    tup = [ field.data[3*offset],field.data[3*offset+1], field.data[3*offset+2]]
+                    tup = truncate_vec(tup,1.0)
+                    data_array.SetTuple3(offset,tup[0],tup[1],tup[2])
 
             data.GetPointData().SetVectors(data_array)
             #data.GetPointData().SetVectors(data_array)
@@ -3684,12 +4154,9 @@ class VtkVectorVisualiser(generic.visualiser.VectorVisualiser,VtkSlice,VtkVis):
         #####print 'sample grid',grid
         bigsize = len(grid)
         offset = 0
-        if field.data:
-            data_array = vtk.vtkFloatArray()
-            data_array.SetNumberOfValues(bigsize)
-            for i in range(bigsize):
-                data_array.SetValue(i,field.data[i])
-
+        if field.has_data():
+            self.vtk_sample_refs = []
+            data_array = field_to_vtk_array(field,self.vtk_sample_refs)
             self.vtk_sample_grid.GetPointData().SetScalars(data_array)
 
         points = vtk.vtkPoints()
@@ -3764,11 +4231,8 @@ class VtkVectorVisualiser(generic.visualiser.VectorVisualiser,VtkSlice,VtkVis):
         #print "set_grid_scalars"
         if obj:
             #bigsize = self.vtkgrid3d.GetPoints().GetNumberOfPoints()
-            bigsize = grid.GetPoints().GetNumberOfPoints()
-            data_array = vtk.vtkFloatArray()
-            data_array.SetNumberOfValues(bigsize)
-            for offset in range(bigsize):
-                data_array.SetValue(offset,obj.data[offset])
+            self.vtk_scalar_refs = []
+            data_array = field_to_vtk_array(obj,self.vtk_scalar_refs)
             grid.GetPointData().SetScalars(data_array)
             #grid.Update()
             #self.vtkgrid3d.GetPointData().SetScalars(data_array)
@@ -4060,6 +4524,7 @@ class VtkVectorVisualiser(generic.visualiser.VectorVisualiser,VtkSlice,VtkVis):
             streamTube.SetInput(sl.GetOutput())
             streamTube.SetRadius(0.02)
             streamTube.SetNumberOfSides(12)
+            viewer.lod.detail_settings(self).add(streamTube.SetNumberOfSides,12,4)
             #streamTube.SetVaryRadiusToVaryRadiusByVector()
             streamlineMapper.SetInput(streamTube.GetOutput())
 
@@ -4128,9 +4593,12 @@ class VtkVectorVisualiser(generic.visualiser.VectorVisualiser,VtkSlice,VtkVis):
             arrow.SetTipRadius(0.2) #0.1
             arrow.SetTipLength(0.7) #0.35
             arrow.SetShaftRadius(0.06) #0.03
+            viewer.lod.detail_settings(self).add(arrow.SetTipResolution,30,6)
+            viewer.lod.detail_settings(self).add(arrow.SetShaftResolution,30,6)
         elif self.streamarrow_type=='Cone':
             arrow = vtk.vtkConeSource()
             arrow.SetResolution(30)
+            viewer.lod.detail_settings(self).add(arrow.SetResolution,30,6)
         else:
             print "STREAMARROW_TYPE UNKNOWN TYPE!: ",self.streamarrow_type
 
@@ -4236,6 +4704,7 @@ class VtkVectorVisualiser(generic.visualiser.VectorVisualiser,VtkSlice,VtkVis):
 
         # Reset dictionary for selection actors
         self.atom_to_selection_actors = {}
+        viewer.lod.detail_settings(self).clear()
 
         self.hedgehog_actors = []
         self.orientedglyphs_actors = []
@@ -4395,6 +4864,11 @@ class VtkTrajectoryVisualiser(generic.visualiser.TrajectoryVisualiser,VtkMolecul
         VtkMoleculeVisualiser.__init__(self,root,graph,self.molecule, **kw)
         self.title = 'trajectory view'
 
+    def _delete(self):
+        # may be called without Delete (eg when all images are destroyed)
+        VtkMoleculeVisualiser._delete(self)
+        self.close_reader()
+
 class VtkMoldenWfnVisualiser(generic.visualiser.MoldenWfnVisualiser,VtkOrbitalVisualiser):
 
     """Visualiser for wavefunction (held as a molden-compatible
@@ -4418,6 +4892,11 @@ class VtkMoldenWfnVisualiser(generic.visualiser.MoldenWfnVisualiser,VtkOrbitalVi
         #print 'plot height', self.height
         VtkOrbitalVisualiser._build(self)
 
+    def _delete(self):
+        # may be called without Delete (eg when all images are destroyed)
+        VtkOrbitalVisualiser._delete(self)
+        self.close_evaluator()
+
     # this group of methods can act on the particular embedded visualiser
     # that we are using eg orbiral visualiser
 
@@ -4437,7 +4916,115 @@ class VtkColourMap(ColourMap):
             ix = ix + 1
         self.lut = t
 
-if __name__ == "__main__":
+def benchmark(sizes=(1000,10000,100000),frames=20,max_actors=10000):
+    """Time the building and rendering (offscreen) of random molecules
+    drawn with instanced glyphs (spheres/sticks type 3), with the glyph
+    polydata built point by point as for spheres of type 2 and, up to
+    max_actors atoms, with an actor for each sphere (spheres type 0)"""
+    global vtk_numpy
+    import time
+    import random
+    import objects.neighbour
+
+    t = vtk.vtkLookupTable()
+    t.SetNumberOfColors(len(colours) + 1)
+    t.Build()
+    for i in range(len(colours)):
+        r,g,b = colours[i]
+        t.SetTableValue(i,r,g,b,1)
+
+    def render(actors):
+        ren = vtk.vtkRenderer()
+        renwin = vtk.vtkRenderWindow()
+        renwin.SetOffScreenRendering(1)
+        renwin.SetSize(600,600)
+        renwin.AddRenderer(ren)
+        for act in actors:
+            ren.AddActor(act)
+        ren.ResetCamera()
+        start = time.time()
+        renwin.Render()
+        first = time.time() - start
+        start = time.time()
+        for i in range(frames):
+            ren.GetActiveCamera().Azimuth(360.0/frames)
+            renwin.Render()
+        return first, (time.time() - start) / frames
+
+    random.seed(1)
+    for n in sizes:
+        # atoms jittered about a cubic lattice so that most are bonded
+        side = int(math.ceil(n ** (1.0/3.0)))
+        coords = []
+        for i in range(n):
+            ix, iy, iz = i % side, (i / side) % side, i / (side*side)
+            coords.append([ 1.5*ix + random.uniform(-0.2,0.2),
+                            1.5*iy + random.uniform(-0.2,0.2),
+                            1.5*iz + random.uniform(-0.2,0.2) ])
+        numbers = [ random.choice([1,6,7,8]) for i in range(n) ]
+        radii = [ 0.4 * rvdw[z] for z in numbers ]
+        pairs = objects.neighbour.find_pairs(coords,
+                                             objects.neighbour.covalent_radii(numbers))
+
+        def glyph_actors(poly):
+            actors = []
+            for source in [ instance_spheres(poly,8)[0], instance_sticks(poly,0.1,8) ]:
+                m = vtk.vtkPolyDataMapper()
+                m.SetInput(source.GetOutput())
+                m.SetLookupTable(t)
+                m.SetScalarRange(rgb_min,rgb_max+1)
+                m.UseLookupTableScalarRangeOff()
+                act = vtk.vtkActor()
+                act.SetMapper(m)
+                actors.append(act)
+            return actors
+
+        start = time.time()
+        keep = []
+        poly = instance_polydata(coords,numbers,radii,pairs,keep)
+        actors = glyph_actors(poly)
+        build = time.time() - start
+        first, frame = render(actors)
+        print '%7d atoms %7d bonds glyphs:    build %6.2fs first frame %6.2fs frame %7.4fs' % \
+              (n,len(pairs),build,first,frame)
+
+        # The same, filling the polydata point by point (as for type 2)
+        saved = vtk_numpy
+        vtk_numpy = None
+        try:
+            start = time.time()
+            poly = instance_polydata(coords,numbers,radii,pairs,[])
+            actors = glyph_actors(poly)
+            build = time.time() - start
+        finally:
+            vtk_numpy = saved
+        print '%7d atoms  point by point glyphs: build %6.2fs' % (n,build)
+
+        if n > max_actors:
+            continue
+        # an actor for each sphere, with the sticks as above
+        start = time.time()
+        actors = glyph_actors(poly)[1:]
+        for i in range(n):
+            s = vtk.vtkSphereSource()
+            s.SetThetaResolution(8)
+            s.SetPhiResolution(8)
+            s.SetRadius(radii[i])
+            m = vtk.vtkPolyDataMapper()
+            m.SetInput(s.GetOutput())
+            act = vtk.vtkActor()
+            act.SetMapper(m)
+            act.GetProperty().SetColor(colours[numbers[i]])
+            act.SetPosition(coords[i])
+            actors.append(act)
+        build = time.time() - start
+        first, frame = render(actors)
+        print '%7d atoms               per atom:  build %6.2fs first frame %6.2fs frame %7.4fs' % \
+              (n,build,first,frame)
+
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+    benchmark()
+elif __name__ == "__main__":
     import sys
     root=Tk()
     root.withdraw()